@@ -6,10 +6,14 @@ mimetypes.add_type("application/javascript", ".js")
 import asyncio
 import uuid
 import logging
+import threading
+import time
 from typing import Dict, Any, Optional
 from datetime import datetime
 import multiprocessing as mp
 
+import httpx
+
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 
@@ -19,6 +23,7 @@ from brain.planner import TaskPlanner
 from brain.analyzer import ConversationAnalyzer
 from brain.computer_use import ComputerUseAdapter
 from brain.deduper import TaskDeduper
+from utils.worker_pool import WorkerPool
 
 
 app = FastAPI(title="Lanlan Tool Server", version="0.1.0")
@@ -34,10 +39,16 @@ class Modules:
     analyzer: ConversationAnalyzer | None = None
     computer_use: ComputerUseAdapter | None = None
     deduper: TaskDeduper | None = None
-    # Task tracking
+    # Task tracking (finished entries are evicted by _prune_task_registry)
     task_registry: Dict[str, Dict[str, Any]] = {}
+    processor_pool: Optional[WorkerPool] = None
     result_queue: Optional[mp.Queue] = None
-    poller_task: Optional[asyncio.Task] = None
+    result_reader: Optional[threading.Thread] = None
+    scheduler_task: Optional[asyncio.Task] = None
+    # Pending task-result notifications for main_server (bounded outbox)
+    notify_outbox: Optional[asyncio.Queue] = None
+    notify_task: Optional[asyncio.Task] = None
+    http_client: Optional[httpx.AsyncClient] = None
     executor_reset_needed: bool = False
     analyzer_enabled: bool = False
     analyzer_profile: Dict[str, Any] = {}
@@ -45,6 +56,8 @@ class Modules:
     computer_use_queue: Optional[asyncio.Queue] = None
     computer_use_running: bool = False
     active_computer_use_task_id: Optional[str] = None
+    # Set whenever no computer-use task is running; the scheduler waits on it
+    computer_use_idle: Optional[asyncio.Event] = None
     # Agent feature flags (controlled by UI)
     agent_flags: Dict[str, Any] = {"mcp_enabled": False, "computer_use_enabled": False}
 def _collect_existing_task_descriptions(lanlan_name: Optional[str] = None) -> list[tuple[str, str]]:
@@ -93,17 +106,28 @@ async def _is_duplicate_task(query: str, lanlan_name: Optional[str] = None) -> t
 
 
 # ============ Workers (run in subprocess) ============
-def _worker_processor(task_id: str, query: str, queue: mp.Queue):
+def _processor_worker_init():
+    """Runs once per pooled worker: pay the heavy imports and Processor setup up front."""
+    # Lazy import to avoid heavy init in parent
+    from brain.processor import Processor as _Proc
+    import asyncio as _aio
+    # Keep one event loop per worker so clients bound to it can be reused across tasks
+    loop = _aio.new_event_loop()
+    _aio.set_event_loop(loop)
+    return loop, _Proc()
+
+
+def _processor_worker_handle(state, payload: Dict[str, Any]) -> Dict[str, Any]:
+    task_id = payload.get("task_id")
+    query = payload.get("query", "")
+    if state is None:
+        state = _processor_worker_init()
+    loop, proc = state
     try:
-        # Lazy import to avoid heavy init in parent
-        from brain.processor import Processor as _Proc
-        import asyncio as _aio
-        proc = _Proc()
-        
         # Log MCP processing start
         print(f"[MCP] Starting processor task {task_id} with query: {query[:100]}...")
         
-        result = _aio.run(proc.process(query))
+        result = loop.run_until_complete(proc.process(query))
         
         # Log MCP processing result
         if result.get('can_execute'):
@@ -133,10 +157,10 @@ def _worker_processor(task_id: str, query: str, queue: mp.Queue):
             reason = result.get('reason', 'no reason provided')
             print(f"[MCP] ❌ Task {task_id} failed to execute: {reason}")
         
-        queue.put({"task_id": task_id, "success": True, "result": result})
+        return result
     except Exception as e:
         print(f"[MCP] 💥 Task {task_id} crashed with error: {str(e)}")
-        queue.put({"task_id": task_id, "success": False, "error": str(e)})
+        raise
 
 
 def _worker_computer_use(task_id: str, instruction: str, screenshot: Optional[bytes], queue: mp.Queue):
@@ -160,6 +184,59 @@ def _now_iso() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
 
+# Processor worker pool sizing
+PROCESSOR_POOL_SIZE = 2
+PROCESSOR_MAX_TASKS_PER_WORKER = 50
+PROCESSOR_TASK_TIMEOUT = 300.0
+# Finished tasks are kept this long (seconds) and at most this many are retained
+TASK_REGISTRY_TTL = 3600.0
+TASK_REGISTRY_MAX_FINISHED = 500
+
+
+def _on_processor_started(task_id: str, pid: int) -> None:
+    info = Modules.task_registry.get(task_id)
+    if info is not None:
+        info["status"] = "running"
+        info["pid"] = pid
+
+
+def _on_processor_failed(task_id: str, error: str) -> None:
+    _handle_result({"task_id": task_id, "success": False, "error": error})
+
+
+def _ensure_processor_pool() -> WorkerPool:
+    _ensure_result_reader()
+    if Modules.processor_pool is None:
+        Modules.processor_pool = WorkerPool(
+            PROCESSOR_POOL_SIZE,
+            _processor_worker_handle,
+            Modules.result_queue,
+            initializer=_processor_worker_init,
+            max_tasks_per_worker=PROCESSOR_MAX_TASKS_PER_WORKER,
+            task_timeout=PROCESSOR_TASK_TIMEOUT,
+            on_start=_on_processor_started,
+            on_failure=_on_processor_failed,
+        )
+        Modules.processor_pool.start()
+    return Modules.processor_pool
+
+
+def _prune_task_registry() -> None:
+    """Evict finished tasks past their TTL, then the oldest finished ones beyond the cap."""
+    now = time.monotonic()
+    finished = [(info["_finished_at"], tid) for tid, info in Modules.task_registry.items()
+                if info.get("_finished_at") is not None]
+    if not finished:
+        return
+    finished.sort()
+    excess = len(finished) - TASK_REGISTRY_MAX_FINISHED
+    for i, (finished_at, tid) in enumerate(finished):
+        if i < excess or now - finished_at > TASK_REGISTRY_TTL:
+            Modules.task_registry.pop(tid, None)
+        else:
+            break
+
+
 def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
     task_id = str(uuid.uuid4())
     info = {
@@ -172,16 +249,14 @@ def _spawn_task(kind: str, args: Dict[str, Any]) -> Dict[str, Any]:
         "error": None,
     }
     # Ensure result queue exists lazily
-    if Modules.result_queue is None:
-        Modules.result_queue = mp.Queue()
+    _ensure_result_reader()
+    _prune_task_registry()
     if kind == "processor":
-        p = mp.Process(target=_worker_processor, args=(task_id, args.get("query", ""), Modules.result_queue))
+        # Queued until the pool hands it to an idle worker
+        info["status"] = "queued"
         info["pid"] = None
         Modules.task_registry[task_id] = info
-        p.daemon = True
-        p.start()
-        info["pid"] = p.pid
-        info["_proc"] = p
+        _ensure_processor_pool().submit(task_id, {"task_id": task_id, "query": args.get("query", "")})
         return info
     elif kind == "computer_use":
         # Queue the task for exclusive execution by the scheduler
@@ -206,8 +281,7 @@ def _start_computer_use_process(task_info: Dict[str, Any]) -> None:
     task_id = task_info.get("task_id")
     instruction = task_info.get("instruction", "")
     screenshot = task_info.get("screenshot")
-    if Modules.result_queue is None:
-        Modules.result_queue = mp.Queue()
+    _ensure_result_reader()
     p = mp.Process(target=_worker_computer_use, args=(task_id, instruction, screenshot, Modules.result_queue))
     p.daemon = True
     p.start()
@@ -219,65 +293,148 @@ def _start_computer_use_process(task_info: Dict[str, Any]) -> None:
     Modules.task_registry[task_id] = info
     Modules.computer_use_running = True
     Modules.active_computer_use_task_id = task_id
+    _computer_use_idle_event().clear()
+
 
+# Maximum pending task-result notifications; the oldest is dropped when full
+NOTIFY_OUTBOX_SIZE = 256
+NOTIFY_RETRIES = 3
 
-async def _poll_results_loop():
+
+def _computer_use_idle_event() -> asyncio.Event:
+    if Modules.computer_use_idle is None:
+        Modules.computer_use_idle = asyncio.Event()
+        if not Modules.computer_use_running:
+            Modules.computer_use_idle.set()
+    return Modules.computer_use_idle
+
+
+def _mark_computer_use_idle() -> None:
+    Modules.computer_use_running = False
+    Modules.active_computer_use_task_id = None
+    _computer_use_idle_event().set()
+
+
+def _result_reader_thread(queue: mp.Queue, loop: asyncio.AbstractEventLoop) -> None:
+    """Block on the worker result queue and hand each message to the event loop."""
     while True:
-        await asyncio.sleep(0.1)
         try:
-            if Modules.result_queue is None:
-                continue
-            while True:
-                try:
-                    msg = Modules.result_queue.get_nowait()
-                except Exception:
-                    break
-                if not isinstance(msg, dict):
-                    continue
-                tid = msg.get("task_id")
-                if not tid or tid not in Modules.task_registry:
-                    continue
-                info = Modules.task_registry[tid]
-                info["status"] = "completed" if msg.get("success") else "failed"
-                if "result" in msg:
-                    info["result"] = msg["result"]
-                if "error" in msg:
-                    info["error"] = msg["error"]
-                # If this was the active computer-use task, allow next to run
-                if Modules.active_computer_use_task_id == tid:
-                    Modules.computer_use_running = False
-                    Modules.active_computer_use_task_id = None
-                # Notify main server about completion so it can insert an extra reply next turn
-                try:
-                    import requests as _rq
-                    summary = "任务已完成"
-                    try:
-                        # Build a compact result summary if possible
-                        r = info.get("result")
-                        if isinstance(r, dict):
-                            detail = r.get("result") or r.get("message") or r.get("reason") or ""
-                        else:
-                            detail = str(r) if r is not None else ""
-                        # Include task description if available
-                        params = info.get("params") or {}
-                        desc = params.get("query") or params.get("instruction") or ""
-                        if detail and desc:
-                            summary = f"你的任务“{desc}”已完成：{detail}"[:240]
-                        elif detail:
-                            summary = f"你的任务已完成：{detail}"[:240]
-                        elif desc:
-                            summary = f"你的任务“{desc}”已完成"[:240]
-                    except Exception:
-                        pass
-                    _rq.post(
-                        f"http://localhost:{MAIN_SERVER_PORT}/api/notify_task_result",
-                        json={"text": summary, "lanlan_name": info.get("lanlan_name")},
-                        timeout=0.5,
-                    )
-                except Exception:
-                    pass
-        except Exception:
+            msg = queue.get()
+        except (EOFError, OSError, ValueError):
+            break
+        if msg is None:
+            # Shutdown sentinel
+            break
+        try:
+            loop.call_soon_threadsafe(_handle_result, msg)
+        except RuntimeError:
+            # Event loop closed
+            break
+
+
+def _ensure_result_reader() -> None:
+    """Create the result queue and its reader thread on first use (must run on the event loop)."""
+    if Modules.result_queue is None:
+        Modules.result_queue = mp.Queue()
+    if Modules.result_reader is None or not Modules.result_reader.is_alive():
+        Modules.result_reader = threading.Thread(
+            target=_result_reader_thread,
+            args=(Modules.result_queue, asyncio.get_running_loop()),
+            name="agent-result-reader",
+            daemon=True,
+        )
+        Modules.result_reader.start()
+
+
+def _build_result_summary(info: Dict[str, Any]) -> str:
+    summary = "任务已完成"
+    try:
+        # Build a compact result summary if possible
+        r = info.get("result")
+        if isinstance(r, dict):
+            detail = r.get("result") or r.get("message") or r.get("reason") or ""
+        else:
+            detail = str(r) if r is not None else ""
+        # Include task description if available
+        params = info.get("params") or {}
+        desc = params.get("query") or params.get("instruction") or ""
+        if detail and desc:
+            summary = f"你的任务“{desc}”已完成：{detail}"[:240]
+        elif detail:
+            summary = f"你的任务已完成：{detail}"[:240]
+        elif desc:
+            summary = f"你的任务“{desc}”已完成"[:240]
+    except Exception:
+        pass
+    return summary
+
+
+def _enqueue_notification(payload: Dict[str, Any]) -> None:
+    if Modules.notify_outbox is None:
+        Modules.notify_outbox = asyncio.Queue(maxsize=NOTIFY_OUTBOX_SIZE)
+    outbox = Modules.notify_outbox
+    if outbox.full():
+        # Keep the freshest results; the oldest one is least useful to the user now
+        try:
+            dropped = outbox.get_nowait()
+            logger.warning(f"Notification outbox full, dropping: {dropped.get('text', '')[:40]}")
+        except asyncio.QueueEmpty:
             pass
+    outbox.put_nowait(payload)
+
+
+def _handle_result(msg: Any) -> None:
+    """Apply a worker result to the registry (runs on the event loop)."""
+    try:
+        if not isinstance(msg, dict):
+            return
+        if "_worker" in msg and Modules.processor_pool is not None:
+            # Late results from a worker that was already killed (timeout/cancel) are ignored
+            if not Modules.processor_pool.on_result(msg):
+                return
+        tid = msg.get("task_id")
+        if not tid or tid not in Modules.task_registry:
+            return
+        info = Modules.task_registry[tid]
+        if info.get("_finished_at") is not None:
+            return
+        info["status"] = "completed" if msg.get("success") else "failed"
+        info["end_time"] = _now_iso()
+        info["_finished_at"] = time.monotonic()
+        if "result" in msg:
+            info["result"] = msg["result"]
+        if "error" in msg:
+            info["error"] = msg["error"]
+        # If this was the active computer-use task, allow next to run
+        if Modules.active_computer_use_task_id == tid:
+            _mark_computer_use_idle()
+        # Notify main server about completion so it can insert an extra reply next turn
+        _enqueue_notification({"text": _build_result_summary(info), "lanlan_name": info.get("lanlan_name")})
+    except Exception as e:
+        logger.error(f"Failed to handle task result: {e}")
+
+
+async def _notify_sender_loop():
+    """Deliver queued task-result notifications to main_server over a pooled HTTP client."""
+    if Modules.notify_outbox is None:
+        Modules.notify_outbox = asyncio.Queue(maxsize=NOTIFY_OUTBOX_SIZE)
+    if Modules.http_client is None:
+        Modules.http_client = httpx.AsyncClient(timeout=2.0)
+    url = f"http://localhost:{MAIN_SERVER_PORT}/api/notify_task_result"
+    while True:
+        payload = await Modules.notify_outbox.get()
+        for attempt in range(NOTIFY_RETRIES):
+            try:
+                resp = await Modules.http_client.post(url, json=payload)
+                if resp.status_code < 500:
+                    break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"notify_task_result attempt {attempt + 1} failed: {e}")
+            await asyncio.sleep(0.2 * (2 ** attempt))
+        else:
+            logger.warning("Giving up on notify_task_result after retries")
 
 
 async def _computer_use_scheduler_loop():
@@ -285,15 +442,11 @@ async def _computer_use_scheduler_loop():
     # Initialize queue if missing
     if Modules.computer_use_queue is None:
         Modules.computer_use_queue = asyncio.Queue()
+    idle = _computer_use_idle_event()
     while True:
         try:
-            await asyncio.sleep(0.05)
-            # If a task is running, check if it finished (poller will clear flags)
-            if Modules.computer_use_running:
-                continue
-            # No active task: try to dequeue next
-            if Modules.computer_use_queue.empty():
-                continue
+            # Wait until the previous task has reported its result
+            await idle.wait()
             next_task = await Modules.computer_use_queue.get()
             # Validate registry presence
             tid = next_task.get("task_id")
@@ -301,6 +454,8 @@ async def _computer_use_scheduler_loop():
                 continue
             # Start the process for this queued task
             _start_computer_use_process(next_task)
+        except asyncio.CancelledError:
+            raise
         except Exception:
             # Never crash the scheduler
             await asyncio.sleep(0.1)
@@ -363,11 +518,31 @@ async def startup():
         await Modules.planner.refresh_capabilities()
     except Exception:
         pass
-    # Start result poller
-    if Modules.poller_task is None:
-        Modules.poller_task = asyncio.create_task(_poll_results_loop())
+    # Start result reader, prefork processor workers and notification sender
+    _ensure_processor_pool()
+    if Modules.notify_task is None:
+        Modules.notify_task = asyncio.create_task(_notify_sender_loop())
     # Start computer-use scheduler
-    asyncio.create_task(_computer_use_scheduler_loop())
+    if Modules.scheduler_task is None:
+        Modules.scheduler_task = asyncio.create_task(_computer_use_scheduler_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in (Modules.scheduler_task, Modules.notify_task):
+        if task is not None:
+            task.cancel()
+    if Modules.processor_pool is not None:
+        Modules.processor_pool.shutdown()
+        Modules.processor_pool = None
+    if Modules.result_queue is not None:
+        try:
+            Modules.result_queue.put_nowait(None)
+        except Exception:
+            pass
+    if Modules.http_client is not None:
+        await Modules.http_client.aclose()
+        Modules.http_client = None
 
 
 @app.get("/health")
@@ -467,7 +642,7 @@ async def get_task(task_id: str):
         return Modules.planner.task_pool[task_id].__dict__
     info = Modules.task_registry.get(task_id)
     if info:
-        out = {k: v for k, v in info.items() if k != "_proc"}
+        out = {k: v for k, v in info.items() if not k.startswith("_")}
         return out
     raise HTTPException(404, "task not found")
 
@@ -638,9 +813,11 @@ async def admin_control(payload: Dict[str, Any]):
             except Exception:
                 pass
         Modules.task_registry.clear()
+        # Registry is already empty, so cancelled pool tasks produce no notifications
+        if Modules.processor_pool is not None:
+            Modules.processor_pool.cancel_all()
         # Clear scheduling state and queue
-        Modules.computer_use_running = False
-        Modules.active_computer_use_task_id = None
+        _mark_computer_use_idle()
         try:
             if Modules.computer_use_queue is not None:
                 while not Modules.computer_use_queue.empty():
@@ -1,5 +1,5 @@
 from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from utils.llm_client import get_chat_llm
 from config import get_core_config, MODELS_WITH_EXTRA_BODY
 
 
@@ -14,7 +14,7 @@ class ConversationAnalyzer:
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_llm(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
 
     def _build_prompt(self, messages: List[Dict[str, str]]) -> str:
         lines = []
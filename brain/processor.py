@@ -1,7 +1,7 @@
 from typing import Dict, Any, Optional
 import asyncio
 import logging
-from langchain_openai import ChatOpenAI
+from utils.llm_client import get_chat_llm
 from config import get_core_config, MODELS_WITH_EXTRA_BODY
 from .mcp_client import McpRouterClient, McpToolCatalog
 
@@ -21,7 +21,7 @@ class Processor:
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_llm(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
 
     async def process(self, query: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         capabilities = await self.catalog.get_capabilities()
@@ -4,6 +4,7 @@ import json
 import os
 import logging
 import os
+import threading
 from pathlib import Path
 from utils.config_manager import get_config_manager
 
@@ -50,9 +51,89 @@ def save_characters(data, character_json_path=None):
     
     with open(character_json_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    invalidate_config_cache()
+
+class _ReadOnlyDict(dict):
+    """
+    只读字典：缓存的配置快照在调用方之间共享，禁止原地修改。
+    仍是 dict 的子类，可直接 json.dumps；copy()/deepcopy/pickle 得到普通可修改的 dict。
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照是只读的，请先 copy() 再修改")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    update = pop = popitem = clear = setdefault = _readonly
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        import copy
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+def _freeze(obj):
+    """递归地把 dict 转换为只读字典"""
+    if isinstance(obj, dict):
+        return _ReadOnlyDict((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, tuple):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+# 进程内配置快照缓存：{key: (文件签名, 快照)}
+# 文件签名为 (inode, mtime_ns, size)，文件被修改（包括其他进程修改）后自动失效，热重载语义不变
+_config_cache = {}
+# 可重入：builder 在持锁期间可能写回配置文件（首次运行创建默认配置），写回时会调用 invalidate_config_cache
+_config_cache_lock = threading.RLock()
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _cached_snapshot(key, path, builder):
+    signature = _file_signature(path)
+    cached = _config_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _config_cache_lock:
+        cached = _config_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        snapshot = _freeze(builder())
+        # builder 可能会写回文件（如自动设置当前猫娘），以写回后的签名为准
+        _config_cache[key] = (_file_signature(path), snapshot)
+        return snapshot
+
+
+def invalidate_config_cache():
+    """手动清空配置快照缓存"""
+    with _config_cache_lock:
+        _config_cache.clear()
+
 
 def get_character_data():
-    """获取角色数据"""
+    """
+    获取角色数据
+    返回进程内缓存的只读快照，characters.json 变化后自动重新解析
+    """
+    return _cached_snapshot('characters', CHARACTER_JSON_PATH, _build_character_data)
+
+
+def _build_character_data():
+    """解析角色配置文件，生成角色数据"""
     character_data = load_characters()
     # MASTER_NAME 必须始终存在，取档案名
     master_name = character_data.get('主人', {}).get('档案名', _default_master['档案名'])
@@ -91,11 +172,19 @@ TIME_COMPRESSED_TABLE_NAME = "time_indexed_compressed"
 
 MODELS_WITH_EXTRA_BODY = ["qwen-flash-2025-07-28"]
 
+# 设定提取需要额外消耗token，但当前版本实用性近乎于0，默认关闭
+SETTINGS_EXTRACTION_ENABLED = False
+
 def get_core_config():
     """
     动态读取核心配置
-    返回一个包含所有核心配置的字典
+    返回一个包含所有核心配置的只读字典（进程内缓存，core_config.json 变化后自动重新解析）
     """
+    return _cached_snapshot('core', CORE_CONFIG_PATH, _build_core_config)
+
+
+def _build_core_config():
+    """解析核心配置文件"""
     # 从 config/api.py 导入默认值
     from config.api import (
         CORE_API_KEY as DEFAULT_CORE_API_KEY,
@@ -264,6 +353,7 @@ __all__ = [
     # 函数
     'get_character_data',
     'get_core_config',
+    'invalidate_config_cache',
     'load_characters',
     'save_characters',
     # 路径
@@ -274,6 +364,7 @@ __all__ = [
     'TIME_ORIGINAL_TABLE_NAME',
     'TIME_COMPRESSED_TABLE_NAME',
     'MODELS_WITH_EXTRA_BODY',
+    'SETTINGS_EXTRACTION_ENABLED',
     'MAIN_SERVER_PORT',
     'MEMORY_SERVER_PORT',
     'MONITOR_SERVER_PORT',
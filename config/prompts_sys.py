@@ -68,6 +68,23 @@ settings_extractor_prompt = f"""从以下对话中提取关于{{LANLAN_NAME}}和
 
 现在，请提取关于{{LANLAN_NAME}}和{MASTER_NAME}的重要个人信息。注意，只允许添加重要、准确的信息。如果没有符合条件的信息，可以返回一个空字典({{}})。"""
 
+settings_incremental_extractor_prompt = f"""从以下新增对话中提取关于{{LANLAN_NAME}}和{MASTER_NAME}的重要个人信息，用于个人备忘录以及未来的角色扮演。
+
+========已记录的相关设定========
+%s
+========以上为已记录的相关设定========
+
+========以下为新增对话========
+%s
+========以上为新增对话========
+
+只返回新增的信息，或需要修改的已记录设定（沿用原来的属性名）。请以JSON格式返回，格式为:
+{{
+    "{{LANLAN_NAME}}": {{"属性1": "值", ...}},
+    "{MASTER_NAME}": {{...}},
+}}
+注意，只允许添加重要、准确的信息。如果没有符合条件的信息，可以返回一个空字典({{}})。"""
+
 settings_verifier_prompt = ''
 
 history_review_prompt = """请审阅%s和%s之间的对话历史记录，识别并修正以下问题：
@@ -9,26 +9,24 @@ import traceback
 import struct  # For packing audio data
 import threading
 import re
-import requests
+import time
 import logging
 from datetime import datetime
 from websockets import exceptions as web_exceptions
 from fastapi import WebSocket, WebSocketDisconnect
 from utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, spell_out_number, \
     is_only_punctuation, split_paragraph
-from utils.audio import make_wav_header
+from utils.audio import make_wav_header, StreamingResampler, BINARY_FRAME_VERSION
 from main_helper.omni_realtime_client import OmniRealtimeClient
 from main_helper.omni_offline_client import OmniOfflineClient
-from main_helper.tts_helper import get_tts_worker
+from main_helper.tts_helper import TTS_READY
+from main_helper.tts_supervisor import TTSWorkerSupervisor
+from main_helper.realtime_pool import RealtimeSessionPool
+from main_helper.renewal import SessionRenewalScheduler
 import inflect
-import base64
-from io import BytesIO
-from PIL import Image
+from utils.frame_filter import FrameChangeDetector, get_frame_pool
 from config import get_character_data, get_core_config, MEMORY_SERVER_PORT
-from multiprocessing import Process, Queue as MPQueue
 from uuid import uuid4
-import numpy as np
-from librosa import resample
 import httpx 
 
 # Setup logger for this module
@@ -38,6 +36,9 @@ logger = logging.getLogger(__name__)
 
 # --- 一个带有定期上下文压缩+在线热切换的语音会话管理器 ---
 class LLMSessionManager:
+    # 记忆提示词、TTS就绪、realtime建连共用的启动截止时间（秒）
+    SESSION_START_TIMEOUT = 15.0
+
     def __init__(self, sync_message_queue, lanlan_name, lanlan_prompt):
         self.websocket = None
         self.sync_message_queue = sync_message_queue
@@ -46,9 +47,13 @@ class LLMSessionManager:
         self.is_active = False
         self.active_session_is_idle = False
         self.current_expression = None
-        self.tts_request_queue = MPQueue() # TTS request (多进程队列)
-        self.tts_response_queue = MPQueue() # TTS response (多进程队列)
-        self.tts_process = None  # TTS子进程
+        # 常驻TTS子进程（跨会话复用），请求队列 / 音频通道 / 进程见下方同名属性
+        self.tts_worker = TTSWorkerSupervisor(lanlan_name)
+        # 预先建立好的 realtime 连接，供新会话和热切换直接取用
+        self.realtime_pool = RealtimeSessionPool(lanlan_name)
+        # 根据上下文增长决定热切换时机
+        self.renewal = SessionRenewalScheduler()
+        self.audio_resampler = StreamingResampler(24000, 48000)  # 原生语音输出 24kHz -> 48kHz
         self.lock = asyncio.Lock()  # 使用异步锁替代同步锁
         self.current_speech_id = None
         self.inflect_parser = inflect.engine()
@@ -86,6 +91,11 @@ class LLMSessionManager:
         self.openrouter_url = core_config['OPENROUTER_URL']
         self.openrouter_api_key = core_config['OPENROUTER_API_KEY']
         self.memory_server_port = MEMORY_SERVER_PORT
+        # 上一次从 /new_dialog 取到的记忆提示词及其 ETag，内容未变时服务端返回 304
+        self._memory_prompt = None
+        self._memory_prompt_etag = None
+        # 访问 memory_server 的 HTTP 客户端（keep-alive），跨会话复用，避免每次启动会话都重新建立 TCP 连接
+        self._memory_http = None
         self.audio_api_key = core_config['AUDIO_API_KEY']
         self.voice_id = self.lanlan_basic_config[self.lanlan_name].get('voice_id', '')
         # 注意：use_tts 会在 start_session 中根据 input_mode 重新设置
@@ -118,6 +128,11 @@ class LLMSessionManager:
         
         # 模式标志: 'audio' 或 'text'
         self.input_mode = 'audio'
+        # 麦克风输入是否使用二进制帧（在start_session时与前端协商）
+        self.binary_audio_input = False
+        self.input_resamplers = {}  # 非16kHz的二进制输入帧 -> 16kHz
+        self.last_audio_seq = None
+        self.frame_detectors = {}  # 屏幕/摄像头帧的变化检测: {input_type: FrameChangeDetector}
         
         # 初始化时创建audio模式的session（默认）
         self.session = None
@@ -133,6 +148,7 @@ class LLMSessionManager:
         
         # TTS缓存机制：确保不丢包
         self.tts_ready = False  # TTS是否完全就绪
+        self.last_session_start_timings = {}  # 最近一次启动各步骤耗时（秒）
         self.tts_pending_chunks = []  # 待处理的TTS文本chunk: [(speech_id, text), ...]
         self.tts_cache_lock = asyncio.Lock()  # 保护缓存的锁
         
@@ -143,13 +159,11 @@ class LLMSessionManager:
 
     async def handle_new_message(self):
         """处理新模型输出：清空TTS队列并通知前端"""
+        self.audio_resampler.reset()
         if self.use_tts and self.tts_process and self.tts_process.is_alive():
-            # 清空响应队列中待发送的音频数据
-            while not self.tts_response_queue.empty():
-                try:
-                    self.tts_response_queue.get_nowait()
-                except:
-                    break
+            # 清空环形缓冲中待发送的音频数据
+            if self.tts_audio:
+                self.tts_audio.clear()
             # 发送终止信号以清空TTS请求队列并停止当前合成
             try:
                 self.tts_request_queue.put((None, None))
@@ -164,18 +178,15 @@ class LLMSessionManager:
 
     async def handle_text_data(self, text: str, is_first_chunk: bool = False):
         """文本回调：处理文本显示和TTS（用于文本模式）"""
+        self.renewal.add_text(text)
         # 如果是新消息的第一个chunk，清空TTS队列和缓存以打断之前的语音
         if is_first_chunk and self.use_tts:
             async with self.tts_cache_lock:
                 self.tts_pending_chunks.clear()
             
-            if self.tts_process and self.tts_process.is_alive():
-                # 清空响应队列中待发送的音频数据
-                while not self.tts_response_queue.empty():
-                    try:
-                        self.tts_response_queue.get_nowait()
-                    except:
-                        break
+            if self.tts_process and self.tts_process.is_alive() and self.tts_audio:
+                # 清空环形缓冲中待发送的音频数据
+                self.tts_audio.clear()
         
         # 文本模式下，无论是否使用TTS，都要发送文本到前端显示
         await self.send_lanlan_response(text, is_first_chunk)
@@ -204,6 +215,11 @@ class LLMSessionManager:
                 self.tts_request_queue.put((None, None))
             except Exception as e:
                 logger.warning(f"⚠️ 发送TTS结束信号失败: {e}")
+        elif not self.use_tts:
+            # 原生语音：推出重采样滤波器中的尾音，避免每句话结尾被截掉
+            tail = self.audio_resampler.flush_int16()
+            if tail.strip(b'\x00') and self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
+                await self.send_speech(tail)
         self.sync_message_queue.put({'type': 'system', 'data': 'turn end'})
         
         # 直接向前端发送turn end消息
@@ -221,25 +237,33 @@ class LLMSessionManager:
         except Exception as e:
             logger.error(f"💥 Extra reply preparation error: {e}")
         
+        self.renewal.end_turn()
+
         # 如果正在热切换过程中，跳过所有热切换逻辑
         if self.is_hot_swap_imminent:
             return
             
-        if hasattr(self, 'is_preparing_new_session') and not self.is_preparing_new_session:
-            if self.session_start_time and \
-                        (datetime.now() - self.session_start_time).total_seconds() >= 40:
-                logger.info("Main Listener: Uptime threshold met. Marking for new session preparation.")
+        # 文本模式的 OmniOfflineClient 自行按 token 预算压缩历史，只有 realtime 会话需要热切换
+        if hasattr(self, 'is_preparing_new_session') and not self.is_preparing_new_session \
+                and isinstance(self.session, OmniRealtimeClient):
+            if self.session_start_time and self.renewal.should_prepare():
+                logger.info(f"Main Listener: Context nearing budget {self.renewal.snapshot()}. Marking for new session preparation.")
                 self.is_preparing_new_session = True  # Mark that we are in prep mode
                 self.summary_triggered_time = datetime.now()
                 self.message_cache_for_new_session = []  # Reset cache for this new cycle
                 self.initial_cache_snapshot_len = 0  # Reset snapshot marker
                 self.sync_message_queue.put({'type': 'system', 'data': 'renew session'}) 
+        elif isinstance(self.session, OmniOfflineClient) and self.renewal.should_renew_memory():
+            # 文本会话不热切换，按轮次/token 定期 renew，记忆服务器照常整理对话
+            logger.info(f"Main Listener: Text session renewing memory {self.renewal.snapshot()}.")
+            self.renewal.mark_memory_renewed()
+            self.sync_message_queue.put({'type': 'system', 'data': 'renew session'})
 
         # If prep mode is active, summary time has passed, and a turn just completed in OLD session:
         # AND background task for initial warmup isn't already running
         if self.is_preparing_new_session and \
                 self.summary_triggered_time and \
-                (datetime.now() - self.summary_triggered_time).total_seconds() >= 10 and \
+                (datetime.now() - self.summary_triggered_time).total_seconds() >= self.renewal.SUMMARY_DELAY and \
                 (not self.background_preparation_task or self.background_preparation_task.done()) and \
                 not (
                         self.pending_session_warmed_up_event and self.pending_session_warmed_up_event.is_set()):  # Don't restart if already warmed up
@@ -269,13 +293,12 @@ class LLMSessionManager:
 
     async def handle_audio_data(self, audio_data: bytes):
         """Qwen音频回调：推送音频到WebSocket前端"""
+        # 原生语音输出为 24kHz PCM16
+        self.renewal.add_audio(len(audio_data) / 48000)
         if not self.use_tts:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
                 # 这里假设audio_data为PCM16字节流，直接推送
-                audio = np.frombuffer(audio_data, dtype=np.int16)
-                audio = (resample(audio.astype(np.float32) / 32768.0, orig_sr=24000, target_sr=48000)*32767.).clip(-32768, 32767).astype(np.int16)
-
-                await self.send_speech(audio.tobytes())
+                await self.send_speech(self.audio_resampler.process_int16(audio_data))
                 # 你可以根据需要加上格式、isNewMessage等标记
                 # await self.websocket.send_json({"type": "cozy_audio", "format": "blob", "isNewMessage": True})
             else:
@@ -313,6 +336,7 @@ class LLMSessionManager:
 
     async def handle_output_transcript(self, text: str, is_first_chunk: bool = False):
         """输出转录回调：处理文本显示和TTS（用于语音模式）"""        
+        self.renewal.add_text(text)
         # 无论是否使用TTS，都要发送文本到前端显示
         await self.send_lanlan_response(text, is_first_chunk)
         
@@ -459,7 +483,7 @@ class LLMSessionManager:
             return ""
         return text
 
-    async def start_session(self, websocket: WebSocket, new=False, input_mode='audio'):
+    async def start_session(self, websocket: WebSocket, new=False, input_mode='audio', binary_audio=None):
         # 检查是否正在启动中
         if self.is_starting_session:
             logger.warning(f"⚠️ Session正在启动中，忽略重复请求")
@@ -471,6 +495,13 @@ class LLMSessionManager:
         logger.info(f"启动新session: input_mode={input_mode}, new={new}")
         self.websocket = websocket
         self.input_mode = input_mode
+        # binary_audio为None时（例如stream_data触发的自动重启）沿用之前协商的结果
+        if binary_audio is not None:
+            self.binary_audio_input = binary_audio
+        self.last_audio_seq = None
+        # 新会话的模型还没见过画面，第一帧必须上传
+        for detector in self.frame_detectors.values():
+            detector.reset()
         
         # 重新读取核心配置以支持热重载
         core_config = get_core_config()
@@ -517,65 +548,7 @@ class LLMSessionManager:
             await asyncio.sleep(0.5)
             logger.info("旧session清理完成")
         
-        # 如果当前不需要TTS但TTS进程仍在运行，关闭它
-        if not self.use_tts and self.tts_process and self.tts_process.is_alive():
-            logger.info("当前模式不需要TTS，关闭TTS进程")
-            try:
-                self.tts_request_queue.put((None, None))
-                self.tts_process.terminate()
-                self.tts_process.join(timeout=2.0)
-                if self.tts_process.is_alive():
-                    self.tts_process.kill()
-            except Exception as e:
-                logger.error(f"关闭TTS进程时出错: {e}")
-            finally:
-                self.tts_process = None
-
-        # new session时重置部分状态
-        if self.use_tts:
-            # 启动TTS子进程（如果配置了自定义语音）
-            # 文本模式和语音模式都需要TTS支持
-            if self.tts_process is None or not self.tts_process.is_alive():
-                # 使用工厂函数获取合适的 TTS worker
-                has_custom_voice = bool(self.voice_id)
-                tts_worker = get_tts_worker(
-                    core_api_type=self.core_api_type,
-                    has_custom_voice=has_custom_voice
-                )
-                
-                self.tts_request_queue = MPQueue() # TTS request (多进程队列)
-                self.tts_response_queue = MPQueue() # TTS response (多进程队列)
-                self.tts_process = Process(
-                    target=tts_worker,
-                    args=(self.tts_request_queue, self.tts_response_queue, self.audio_api_key if has_custom_voice else self.core_api_key, self.voice_id)
-                )
-                self.tts_process.daemon = True
-                self.tts_process.start()
-                
-                # 等待TTS进程完全启动（给进程一点启动时间）
-                await asyncio.sleep(0.1)
-                
-                # 记录使用的 TTS 类型
-                tts_type = "自定义音色(CosyVoice)" if has_custom_voice else f"{self.core_api_type}默认TTS"
-                logger.info(f"TTS进程已启动，使用: {tts_type}")
-            
-            # 确保旧的 TTS handler task 已经停止
-            if self.tts_handler_task and not self.tts_handler_task.done():
-                self.tts_handler_task.cancel()
-                try:
-                    await asyncio.wait_for(self.tts_handler_task, timeout=1.0)
-                except (asyncio.CancelledError, asyncio.TimeoutError):
-                    pass
-            
-            # 启动新的 TTS handler task
-            self.tts_handler_task = asyncio.create_task(self.tts_response_handler())
-            
-            # 标记TTS为就绪状态并处理可能已缓存的chunk
-            async with self.tts_cache_lock:
-                self.tts_ready = True
-            
-            # 处理在TTS启动期间可能已经缓存的文本chunk
-            await self._flush_tts_pending_chunks()
+        # 当前模式不需要TTS时TTS进程保持空闲，切回需要TTS的模式时直接复用
 
         if new:
             self.message_cache_for_new_session = []
@@ -587,14 +560,10 @@ class LLMSessionManager:
             async with self.input_cache_lock:
                 self.pending_input_data.clear()
 
+        timings = {}
+        start_time = time.perf_counter()
         try:
-            # 获取初始 prompt
-            initial_prompt = (f"你是一个角色扮演大师，并且精通电脑操作。请按要求扮演以下角色（{self.lanlan_name}），并在对方请求时、回答'我试试'并尝试操纵电脑。" if self._is_agent_enabled() else f"你是一个角色扮演大师。请按要求扮演以下角色（{self.lanlan_name}）。") + self.lanlan_prompt
-            initial_prompt += requests.get(f"http://localhost:{self.memory_server_port}/new_dialog/{self.lanlan_name}").text
-            # logger.info("====Initial Prompt=====")
-            # logger.info(initial_prompt)
-
-            # 根据input_mode创建不同的session
+            # 根据input_mode创建不同的session（此时尚未连接）
             if input_mode == 'text':
                 # 文本模式：使用 OmniOfflineClient with OpenAI-compatible API
                 self.session = OmniOfflineClient(
@@ -608,27 +577,39 @@ class LLMSessionManager:
                     on_response_done=self.handle_response_complete
                 )
             else:
-                # 语音模式：使用 OmniRealtimeClient
-                self.session = OmniRealtimeClient(
-                    base_url=self.core_url,
-                    api_key=self.core_api_key,
-                    model=self.model,
-                    on_text_delta=self.handle_text_data,
-                    on_audio_delta=self.handle_audio_data,
-                    on_new_message=self.handle_new_message,
-                    on_input_transcript=self.handle_input_transcript,
-                    on_output_transcript=self.handle_output_transcript,
-                    on_connection_error=self.handle_connection_error,
-                    on_response_done=self.handle_response_complete
-                )
+                # 语音模式：使用 OmniRealtimeClient，优先取用预热池中已握手的连接
+                self.session = self.realtime_pool.claim(self._realtime_spec())
+                if self.session is not None:
+                    logger.info("使用预热的realtime连接")
+                else:
+                    self.session = self._new_realtime_client()
+
+            # 获取记忆提示词、等待TTS子进程就绪、建立realtime websocket 三者并行，共用一个截止时间
+            steps = {
+                "memory_prompt": self._fetch_memory_prompt(),
+                "realtime_ws": self.session.open(),
+            }
+            if self.use_tts:
+                # 文本模式和语音模式都需要TTS支持
+                steps["tts"] = self._start_tts_worker()
+            results = await self._run_startup_steps(steps, timings, self.SESSION_START_TIMEOUT)
+
+            # 获取初始 prompt
+            initial_prompt = (f"你是一个角色扮演大师，并且精通电脑操作。请按要求扮演以下角色（{self.lanlan_name}），并在对方请求时、回答'我试试'并尝试操纵电脑。" if self._is_agent_enabled() else f"你是一个角色扮演大师。请按要求扮演以下角色（{self.lanlan_name}）。") + self.lanlan_prompt
+            initial_prompt += results["memory_prompt"]
+            # logger.info("====Initial Prompt=====")
+            # logger.info(initial_prompt)
 
             # 标记 session 激活
             if self.session:
+                step_start = time.perf_counter()
                 await self.session.connect(initial_prompt, native_audio = not self.use_tts)
+                timings["session_config"] = time.perf_counter() - step_start
                 async with self.lock:
                     self.is_active = True
                     
                 self.session_start_time = datetime.now()
+                self.renewal.reset()
                 
                 # 启动消息处理任务
                 self.message_handler_task = asyncio.create_task(self.session.handle_messages())
@@ -646,6 +627,16 @@ class LLMSessionManager:
                 
                 # 处理在session启动期间可能已经缓存的输入数据
                 await self._flush_pending_input_data()
+
+                # 语音模式下为之后的热切换预热下一条连接
+                if isinstance(self.session, OmniRealtimeClient):
+                    self.realtime_pool.keep_warm(self._realtime_spec(), self._new_realtime_client)
+                else:
+                    self.realtime_pool.idle()
+
+                total = time.perf_counter() - start_time
+                self.last_session_start_timings = dict(timings, total=total)
+                logger.info(f"⏱️ Session就绪耗时 {total * 1000:.0f}ms（" + "，".join(f"{k}: {v * 1000:.0f}ms" for k, v in timings.items()) + "）")
             else:
                 raise Exception("Session not initialized")
         
@@ -680,13 +671,99 @@ class LLMSessionManager:
                 await self.send_status("💥 API请求频率过高，请稍后再试。")
             else:
                 await self.send_status(f"💥 连接异常关闭: {error_str}")
-            
+
+            # realtime 连接与其他启动步骤并行建立，可能已经打开；会话未激活时 end_session 不会关闭它
+            if self.session is not None and not self.is_active:
+                try:
+                    await self.session.close()
+                except Exception as close_error:
+                    logger.warning(f"关闭未完成启动的session时出错: {close_error}")
+                self.session = None
             await self.cleanup()
         
         finally:
             # 无论成功还是失败，都重置启动标志
             self.is_starting_session = False
 
+    async def _run_startup_steps(self, steps, timings, timeout):
+        """
+        并行执行会话启动步骤，共用一个截止时间
+
+        Args:
+            steps: {名称: 协程}
+            timings: 输出参数，记录每个步骤的耗时（秒）
+
+        Returns:
+            dict: {名称: 结果}；任一步骤失败或超时时取消其余步骤并抛出异常
+        """
+        async def timed(name, coro):
+            step_start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[name] = time.perf_counter() - step_start
+
+        tasks = {name: asyncio.create_task(timed(name, coro)) for name, coro in steps.items()}
+        try:
+            done, pending = await asyncio.wait(tasks.values(), timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            if pending:
+                unfinished = [name for name, task in tasks.items() if task in pending]
+                raise asyncio.TimeoutError(f"Session启动超时（{timeout}s），未完成: {', '.join(unfinished)}")
+            return {name: task.result() for name, task in tasks.items()}
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+    def _memory_client(self):
+        if self._memory_http is None or self._memory_http.is_closed:
+            self._memory_http = httpx.AsyncClient()
+        return self._memory_http
+
+    async def close_memory_client(self):
+        """关闭复用的 memory_server HTTP 客户端（服务关闭时调用）"""
+        if self._memory_http is not None:
+            await self._memory_http.aclose()
+            self._memory_http = None
+
+    async def _fetch_memory_prompt(self):
+        resp = await self._memory_client().get(
+            f"http://localhost:{self.memory_server_port}/new_dialog/{self.lanlan_name}",
+            headers=self._memory_prompt_headers())
+        return self._accept_memory_prompt(resp)
+
+    async def _start_tts_worker(self):
+        """确保常驻TTS子进程以当前配置运行，等待它发出就绪握手后再放行缓存的TTS文本"""
+        await self.tts_worker.ensure(
+            self.core_api_type,
+            self.voice_id,
+            self.audio_api_key if self.voice_id else self.core_api_key
+        )
+        # 丢弃上一个会话遗留的音频
+        self.tts_audio.clear()
+        
+        # 确保旧的 TTS handler task 已经停止
+        if self.tts_handler_task and not self.tts_handler_task.done():
+            self.tts_handler_task.cancel()
+            try:
+                await asyncio.wait_for(self.tts_handler_task, timeout=1.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+        
+        # 启动新的 TTS handler task，由它接收 worker 的就绪握手
+        self.tts_handler_task = asyncio.create_task(self.tts_response_handler())
+        await self.tts_worker.wait_ready()
+        
+        # 标记TTS为就绪状态并处理可能已缓存的chunk
+        async with self.tts_cache_lock:
+            self.tts_ready = True
+        
+        # 处理在TTS启动期间可能已经缓存的文本chunk
+        await self._flush_tts_pending_chunks()
+
     async def send_user_activity(self):
         try:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
@@ -699,6 +776,35 @@ class LLMSessionManager:
         except Exception as e:
             logger.error(f"💥 WS Send User Activity Error: {e}")
 
+    def _memory_prompt_headers(self):
+        return {"If-None-Match": self._memory_prompt_etag} if self._memory_prompt_etag else {}
+
+    def _accept_memory_prompt(self, resp):
+        """处理 /new_dialog 的响应：304 时沿用缓存的记忆提示词"""
+        if resp.status_code == 304 and self._memory_prompt is not None:
+            return self._memory_prompt
+        self._memory_prompt = resp.text
+        self._memory_prompt_etag = resp.headers.get("ETag")
+        return self._memory_prompt
+
+    def _realtime_spec(self):
+        """决定 realtime 连接能否复用的配置"""
+        return (self.core_url, self.core_api_key, self.model)
+
+    def _new_realtime_client(self):
+        return OmniRealtimeClient(
+            base_url=self.core_url,
+            api_key=self.core_api_key,
+            model=self.model,
+            on_text_delta=self.handle_text_data,
+            on_audio_delta=self.handle_audio_data,
+            on_new_message=self.handle_new_message,
+            on_input_transcript=self.handle_input_transcript,
+            on_output_transcript=self.handle_output_transcript,
+            on_connection_error=self.handle_connection_error,
+            on_response_done=self.handle_response_complete
+        )
+
     def _convert_cache_to_str(self, cache):
         """[热切换相关] 将cache转换为字符串"""
         res = ""
@@ -713,6 +819,7 @@ class LLMSessionManager:
         """[热切换相关] 后台预热pending session"""
 
         # 2. Create PENDING session components (as before, store in self.pending_connector, self.pending_session)
+        prep_start = time.perf_counter()
         try:
             # 重新读取核心配置以支持热重载
             core_config = get_core_config()
@@ -726,27 +833,17 @@ class LLMSessionManager:
             self.audio_api_key = core_config['AUDIO_API_KEY']
             logger.info(f"🔄 热切换准备: 已重新加载配置")
             
-            # 创建新的pending session
-            self.pending_session = OmniRealtimeClient(
-                base_url=self.core_url,
-                api_key=self.core_api_key,
-                model=self.model,
-                on_text_delta=self.handle_text_data,
-                on_audio_delta=self.handle_audio_data,
-                on_new_message=self.on_new_message,
-                on_input_transcript=self.handle_input_transcript,
-                on_output_transcript=self.handle_output_transcript,
-                on_connection_error=self.handle_connection_error,
-                on_response_done=self.handle_response_complete
-            )
+            # 创建新的pending session：优先取用预热连接，并为下一次切换补充一条
+            spec = self._realtime_spec()
+            self.pending_session = self.realtime_pool.claim(spec) or self._new_realtime_client()
+            self.realtime_pool.keep_warm(spec, self._new_realtime_client)
             
             initial_prompt = (f"你是一个角色扮演大师，并且精通电脑操作。请按要求扮演以下角色（{self.lanlan_name}），在对方请求时、回答“我试试”并尝试操纵电脑。" if self._is_agent_enabled() else f"你是一个角色扮演大师。请按要求扮演以下角色（{self.lanlan_name}）。") + self.lanlan_prompt
             self.initial_cache_snapshot_len = len(self.message_cache_for_new_session)
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"http://localhost:{self.memory_server_port}/new_dialog/{self.lanlan_name}")
-                initial_prompt += resp.text + self._convert_cache_to_str(self.message_cache_for_new_session)
+            initial_prompt += await self._fetch_memory_prompt() + self._convert_cache_to_str(self.message_cache_for_new_session)
             # print(initial_prompt)
             await self.pending_session.connect(initial_prompt, native_audio = not self.use_tts)
+            self.renewal.record_prep(time.perf_counter() - prep_start)
 
             # 4. Start temporary listener for PENDING session's *first* ignored response
             #    and wait for it to complete.
@@ -855,6 +952,7 @@ class LLMSessionManager:
             logger.info("Final Swap Sequence: Swapping sessions...")
             self.session = self.pending_session
             self.session_start_time = datetime.now()
+            self.renewal.reset()
 
             # Start the main listener for the NEWLY PROMOTED self.session
             if self.session and hasattr(self.session, 'handle_messages'):
@@ -1026,6 +1124,7 @@ class LLMSessionManager:
                         self.current_speech_id = str(uuid4())
 
                     await self.send_user_activity()
+                    self.renewal.add_text(data)
                     await self.session.stream_text(data)
                 else:
                     logger.error(f"💥 Stream: Invalid text data type: {type(data)}")
@@ -1057,12 +1156,18 @@ class LLMSessionManager:
             
             if input_type == 'audio':
                 try:
-                    if isinstance(data, list):
+                    if isinstance(data, (bytes, bytearray, memoryview)):
+                        # 二进制帧：负载已经是PCM16，无需解析JSON和重新打包
+                        audio_bytes = self._prepare_binary_audio(message)
+                    elif isinstance(data, list):
                         audio_bytes = struct.pack(f'<{len(data)}h', *data)
-                        await self.session.stream_audio(audio_bytes)
                     else:
                         logger.error(f"💥 Stream: Invalid audio data type: {type(data)}")
                         return
+                    await self.session.stream_audio(audio_bytes)
+                    # 只有服务端VAD判定为语音的部分才会进入上下文
+                    if self.session._audio_in_buffer:
+                        self.renewal.add_audio(len(audio_bytes) / 32000)
 
                 except struct.error as se:
                     logger.error(f"💥 Stream: Struct packing error (audio): {se}")
@@ -1077,20 +1182,21 @@ class LLMSessionManager:
             elif input_type in ['screen', 'camera']:
                 try:
                     if isinstance(data, str) and data.startswith('data:image/jpeg;base64,'):
-                        img_data = data.split(',')[1]
-                        img_bytes = base64.b64decode(img_data)
-                        # Resize to 480p (height=480, keep aspect ratio)
-                        image = Image.open(BytesIO(img_bytes))
-                        w, h = image.size
-                        new_h = 480
-                        new_w = int(w * (new_h / h))
-                        image = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                        buffer = BytesIO()
-                        image.save(buffer, format='JPEG')
-                        buffer.seek(0)
-                        resized_bytes = buffer.read()
-                        resized_b64 = base64.b64encode(resized_bytes).decode('utf-8')
+                        detector = self.frame_detectors.get(input_type)
+                        if detector is None:
+                            detector = self.frame_detectors[input_type] = FrameChangeDetector()
+                        # 上一帧还在处理或距上次上传太近时直接丢弃，不做任何解码
+                        if not detector.admit():
+                            return
+                        img_data = data.split(',', 1)[1]
+                        # 变化检测、解码与缩放（480p）在线程池中进行，静止帧返回 None
+                        loop = asyncio.get_running_loop()
+                        resized_b64 = await loop.run_in_executor(get_frame_pool(), detector.process, img_data)
+                        if resized_b64 is None:
+                            return
                         await self.session.stream_image(resized_b64)
+                        if self.session._audio_in_buffer:
+                            self.renewal.add_image()
                     else:
                         logger.error(f"💥 Stream: Invalid screen data format.")
                         return
@@ -1115,6 +1221,22 @@ class LLMSessionManager:
             traceback.print_exc()
             await self.send_status(error_message)
 
+    def _prepare_binary_audio(self, message: dict) -> bytes:
+        """处理二进制音频帧：检查序号连续性，并在采样率不是16kHz时重采样"""
+        seq = message.get("seq")
+        if seq is not None:
+            if self.last_audio_seq is not None and seq != (self.last_audio_seq + 1) & 0xFFFFFFFF:
+                logger.debug(f"二进制音频帧序号不连续: {self.last_audio_seq} -> {seq}")
+            self.last_audio_seq = seq
+        audio_bytes = bytes(message["data"])
+        sample_rate = message.get("sample_rate") or 16000
+        if sample_rate != 16000:
+            resampler = self.input_resamplers.get(sample_rate)
+            if resampler is None:
+                resampler = self.input_resamplers[sample_rate] = StreamingResampler(sample_rate, 16000)
+            audio_bytes = resampler.process_int16(audio_bytes)
+        return audio_bytes
+
     async def end_session(self, by_server=False):  # 与Core API断开连接
         self._init_renew_status()
 
@@ -1149,7 +1271,7 @@ class LLMSessionManager:
             finally:
                 # 清空 session 引用，防止后续使用错误的 session 类型
                 self.session = None
-        # 关闭TTS子进程和相关任务
+        # 停止TTS handler，TTS子进程保持运行供下一个会话复用
         if self.tts_handler_task and not self.tts_handler_task.done():
             self.tts_handler_task.cancel()
             try:
@@ -1158,29 +1280,10 @@ class LLMSessionManager:
                 pass
             self.tts_handler_task = None
             
-        if self.tts_process and self.tts_process.is_alive():
-            try:
-                self.tts_request_queue.put((None, None))  # 通知子进程退出
-                self.tts_process.terminate()
-                self.tts_process.join(timeout=2.0)
-                if self.tts_process.is_alive():
-                    self.tts_process.kill()  # 强制杀死进程
-            except Exception as e:
-                logger.error(f"💥 关闭TTS进程时出错: {e}")
-            finally:
-                self.tts_process = None
-                
-        # 清理TTS队列和缓存状态
-        try:
-            while not self.tts_request_queue.empty():
-                self.tts_request_queue.get_nowait()
-        except:
-            pass
-        try:
-            while not self.tts_response_queue.empty():
-                self.tts_response_queue.get_nowait()
-        except:
-            pass
+        # 清理TTS队列和未发送的音频，打断正在进行的合成
+        self.tts_worker.interrupt()
+        # 不再补充预热连接，已有的连接保留到过期，供紧接着的新会话使用
+        self.realtime_pool.idle()
         
         # 重置TTS缓存状态
         async with self.tts_cache_lock:
@@ -1219,7 +1322,13 @@ class LLMSessionManager:
     async def send_session_started(self, input_mode: str): # 通知前端session已启动
         try:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                data = json.dumps({"type": "session_started", "input_mode": input_mode})
+                data = json.dumps({
+                    "type": "session_started",
+                    "input_mode": input_mode,
+                    # 告知前端麦克风数据使用的帧格式
+                    "audio_protocol": "binary" if self.binary_audio_input else "json",
+                    "audio_frame_version": BINARY_FRAME_VERSION,
+                })
                 await self.websocket.send_text(data)
         except WebSocketDisconnect:
             pass
@@ -1282,10 +1391,30 @@ class LLMSessionManager:
         except Exception as e:
             logger.error(f"💥 WS Send Response Error: {e}")
 
+    @property
+    def tts_process(self):
+        return self.tts_worker.process
+
+    @property
+    def tts_request_queue(self):
+        return self.tts_worker.request_queue
+
+    @property
+    def tts_audio(self):
+        return self.tts_worker.audio
+
+    def tts_health(self):
+        return self.tts_worker.health()
+
     async def tts_response_handler(self):
+        # 由TTS子进程的唤醒信号驱动，没有音频时不占用事件循环
+        tts_audio = self.tts_audio
         while True:
-            while not self.tts_response_queue.empty():
-                data = self.tts_response_queue.get_nowait()
-                await self.send_speech(data)
-            await asyncio.sleep(0.01)
+            for data in await tts_audio.get():
+                if isinstance(data, bytes):
+                    await self.send_speech(data)
+                elif data == TTS_READY:
+                    self.tts_worker.mark_ready()
+                else:
+                    logger.debug(f"收到TTS控制消息: {data}")
 
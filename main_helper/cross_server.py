@@ -9,14 +9,18 @@
 import ssl
 
 import asyncio
+import threading
 import time
 import pickle
 import aiohttp
+from collections import deque
+from queue import Empty
 from config import MONITOR_SERVER_PORT, MEMORY_SERVER_PORT, COMMENTER_SERVER_PORT, TOOL_SERVER_PORT
 from datetime import datetime
 import json
-import requests
 import re
+from utils.config_manager import get_config_manager
+from utils.http_outbox import HttpOutbox
 from utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, spell_out_number, \
     is_only_punctuation, split_paragraph
 emoji_pattern = re.compile(r'[^\w\u4e00-\u9fff\s>][^\w\u4e00-\u9fff\s]{2,}[^\w\u4e00-\u9fff\s<]', flags=re.UNICODE)
@@ -28,6 +32,12 @@ emoji_pattern2 = re.compile("["
                            "]+", flags=re.UNICODE)
 emotion_pattern = re.compile('<(.*?)>')
 
+# memory_server 处理对话时会调用LLM压缩，给足时间；tool_server 分析请求只是投递，不等待结果
+MEMORY_REQUEST_TIMEOUT = 120.0
+ANALYZE_REQUEST_TIMEOUT = 1.0
+# 向monitor发送心跳的间隔（秒）
+HEARTBEAT_INTERVAL = 5.0
+
 
 def normalize_text(text):  # 对文本进行基本预处理
     text = text.strip()
@@ -40,6 +50,21 @@ def normalize_text(text):  # 对文本进行基本预处理
         return ""
     return text
 
+def _coalesce_text_messages(pending):
+    """将积压在队首、属于同一条回复的连续 gemini_response 合并为一条，减少转发帧数"""
+    message = pending.popleft()
+    if message["type"] != "json" or message["data"].get("type") != "gemini_response":
+        return message
+    while pending:
+        nxt = pending[0]
+        if (nxt["type"] != "json" or nxt["data"].get("type") != "gemini_response"
+                or nxt["data"].get("isNewMessage")):
+            break
+        pending.popleft()
+        message["data"]["text"] = message["data"].get("text", "") + nxt["data"].get("text", "")
+    return message
+
+
 async def keep_reader(ws: aiohttp.ClientWebSocketResponse):
     while not ws.closed:
         try:
@@ -62,6 +87,32 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
         config = {}
     config = default_config | config
 
+    # 后台线程阻塞读取多进程队列，通过 call_soon_threadsafe 交给事件循环，空闲时不占用CPU
+    pending = deque()
+    wakeup = asyncio.Event()
+
+    def _on_message(message):
+        pending.append(message)
+        wakeup.set()
+
+    def queue_reader():
+        while not shutdown_event.is_set():
+            try:
+                message = message_queue.get(timeout=0.5)
+            except Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                break
+            try:
+                loop.call_soon_threadsafe(_on_message, message)
+            except RuntimeError:
+                # 事件循环已关闭
+                return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass
+
     async def maintain_connection(chat_history, lanlan_name):
         sync_session = None
         sync_ws = None
@@ -78,6 +129,33 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
         current_turn = 'user'
         last_screen = None
 
+        # 发往memory_server/tool_server的HTTP请求都交给发件箱在后台发送，不阻塞转发循环
+        memory_outbox = HttpOutbox(get_config_manager().memory_dir / f"outbox_{lanlan_name}.jsonl")
+        memory_outbox.start()
+        last_heartbeat = 0.0
+
+        def submit_recent_for_analysis():
+            try:
+                # 构造最近的消息摘要
+                recent = []
+                for item in chat_history[-6:]:
+                    if item.get('role') in ['user', 'assistant']:
+                        try:
+                            txt = item['content'][0]['text'] if item.get('content') else ''
+                        except Exception:
+                            txt = ''
+                        if txt == '':
+                            continue
+                        recent.append({'role': item.get('role'), 'text': txt})
+                if recent:
+                    memory_outbox.post_nowait(
+                        f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
+                        {'messages': recent, 'lanlan_name': lanlan_name},
+                        timeout=ANALYZE_REQUEST_TIMEOUT,
+                    )
+            except Exception:
+                pass
+
         while not shutdown_event.is_set():
             try:
                 # 如果连接不存在或已关闭，重新连接
@@ -115,9 +193,18 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                         )
                         bullet_reader = asyncio.create_task(keep_reader(bullet_ws))
 
-                # 检查消息队列
-                while not message_queue.empty():
-                    message = message_queue.get()
+                # 等待新消息；没有消息时最多等到下一次心跳
+                if not pending:
+                    wakeup.clear()
+                    timeout = max(0.0, last_heartbeat + HEARTBEAT_INTERVAL - time.monotonic())
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+
+                # 处理本轮积压的全部消息（异常时未处理的消息留在队列中，重连后继续）
+                while pending:
+                    message = _coalesce_text_messages(pending)
 
                     if message["type"] == "json":
                         # Forward to monitor if enabled
@@ -190,12 +277,11 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                     chat_history.append(
                                             {'role': 'assistant', 'content': [{'type': 'text', 'text': text_output_cache}]})
                                 text_output_cache = ''
-                                response = requests.post(
+                                memory_outbox.enqueue(
                                     f"http://localhost:{MEMORY_SERVER_PORT}/renew/{lanlan_name}",
-                                    json={'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
+                                    {'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
+                                    timeout=MEMORY_REQUEST_TIMEOUT,
                                 )
-                                if response.json()['status'] == 'error':
-                                    print("💥 Conversation processing error", response.json()['message'])
                                 chat_history.clear()
 
                             if message["data"] == 'turn end': # lanlan的消息结束了
@@ -208,26 +294,7 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                 if config['monitor'] and sync_ws:
                                     await sync_ws.send_json({'type': 'turn end'})
                                 # 非阻塞地向tool_server发送最近对话，供分析器识别潜在任务
-                                try:
-                                    # 构造最近的消息摘要
-                                    recent = []
-                                    for item in chat_history[-6:]:
-                                        if item.get('role') in ['user', 'assistant']:
-                                            try:
-                                                txt = item['content'][0]['text'] if item.get('content') else ''
-                                            except Exception:
-                                                txt = ''
-                                            if txt == '':
-                                                continue
-                                            recent.append({'role': item.get('role'), 'text': txt})
-                                    if recent:
-                                        requests.post(
-                                            f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
-                                            json={'messages': recent, 'lanlan_name': lanlan_name},
-                                            timeout=0.2
-                                        )
-                                except Exception:
-                                    pass
+                                submit_recent_for_analysis()
 
                             elif message["data"] == 'session end': # 当前session结束了
                                 # 先处理未完成的输出缓存（如果有）
@@ -239,49 +306,28 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
                                 text_output_cache = ''
                                 
                                 # 向tool_server发送最近对话，供分析器识别潜在任务（与turn end逻辑相同）
-                                try:
-                                    # 构造最近的消息摘要
-                                    recent = []
-                                    for item in chat_history[-6:]:
-                                        if item.get('role') in ['user', 'assistant']:
-                                            try:
-                                                txt = item['content'][0]['text'] if item.get('content') else ''
-                                            except Exception:
-                                                txt = ''
-                                            if txt == '':
-                                                continue
-                                            recent.append({'role': item.get('role'), 'text': txt})
-                                    if recent:
-                                        requests.post(
-                                            f"http://localhost:{TOOL_SERVER_PORT}/analyze_and_plan",
-                                            json={'messages': recent, 'lanlan_name': lanlan_name},
-                                            timeout=0.2
-                                        )
-                                except Exception:
-                                    pass
+                                submit_recent_for_analysis()
                                 
                                 # 处理聊天历史
                                 print("💗开始处理聊天历史")
-                                response = requests.post(
+                                memory_outbox.enqueue(
                                     f"http://localhost:{MEMORY_SERVER_PORT}/process/{lanlan_name}",
-                                    json={'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
+                                    {'input_history': json.dumps(chat_history, indent=2, ensure_ascii=False)},
+                                    timeout=MEMORY_REQUEST_TIMEOUT,
                                 )
-                                if response.json()['status'] == 'error':
-                                    print("💥 Conversation processing error", response.json()['message'])
                                 chat_history.clear()
                         except Exception as e:
                             print('❗️❗️❗️System message error: ', e)
                             import traceback
                             traceback.print_exc()
-                    await asyncio.sleep(0.01)
-                # 发送心跳
-                if config['monitor'] and sync_ws:
-                    await sync_ws.send_json({"type": "heartbeat", "timestamp": time.time()})
-                if config['monitor'] and binary_ws:
-                    await binary_ws.send_bytes(b'\x00\x01\x02\x03')
 
-                # 短暂休眠避免CPU占用过高
-                await asyncio.sleep(0.1)
+                # 定时发送心跳
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    if config['monitor'] and sync_ws:
+                        await sync_ws.send_json({"type": "heartbeat", "timestamp": time.time()})
+                    if config['monitor'] and binary_ws:
+                        await binary_ws.send_bytes(b'\x00\x01\x02\x03')
 
             except asyncio.CancelledError:
                 break
@@ -326,7 +372,10 @@ def sync_connector_process(message_queue, shutdown_event, lanlan_name, sync_serv
         for rdr in [sync_reader, binary_reader, bullet_reader]:
             if rdr:
                 rdr.cancel()
+        await memory_outbox.close()
 
+    reader = threading.Thread(target=queue_reader, daemon=True)
+    reader.start()
     try:
         loop.run_until_complete(maintain_connection(chat_history, lanlan_name))
     except Exception as e:
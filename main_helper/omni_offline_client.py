@@ -11,6 +11,43 @@ from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 # Setup logger for this module
 logger = logging.getLogger(__name__)
 
+# 发送给模型的对话历史的 token 预算（不含固定的 system 指令）
+HISTORY_TOKEN_BUDGET = 8000
+# 超出预算时把最旧的轮次压缩掉，直到历史降到预算的该比例：一次多压一些，之后很多轮的前缀都保持不变，
+# 服务商的 prompt cache 可以持续命中
+HISTORY_COMPACT_TARGET = 0.6
+# 摘要还没生成好时允许历史超出预算的倍数，超过后直接丢弃最旧的轮次
+HISTORY_HARD_LIMIT = 1.5
+
+HISTORY_SUMMARY_PROMPT = """请把以下对话压缩成一段简洁的备忘录，保留关键事实、双方的约定和情绪变化，不要编造内容。
+如果有之前的备忘录，请把它与新对话合并成一份。
+
+======之前的备忘录======
+%s
+
+======以下为对话======
+%s
+======以上为对话======
+
+只返回备忘录正文。"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    在本地按字符数估算 token 数，预算本身就是近似值
+    不使用 tiktoken：它首次加载编码时会同步下载词表且没有超时，而这里运行在事件循环上
+    """
+    # CJK 字符约 1 token/字，其他字符约 4 字符/token
+    cjk = sum(1 for ch in text if ch >= '\u3040')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def _message_tokens(message) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    # 每条消息另有角色等固定开销
+    return estimate_tokens(content) + 4
+
+
 class OmniOfflineClient:
     """
     A client for text-based chat that mimics the interface of OmniRealtimeClient.
@@ -53,7 +90,8 @@ class OmniOfflineClient:
         on_output_transcript: Optional[Callable[[str, bool], Awaitable[None]]] = None,
         on_connection_error: Optional[Callable[[str], Awaitable[None]]] = None,
         on_response_done: Optional[Callable[[], Awaitable[None]]] = None,
-        extra_event_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]]] = None
+        extra_event_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]]] = None,
+        history_token_budget: int = HISTORY_TOKEN_BUDGET
     ):
         # Use base_url directly without conversion
         self.base_url = base_url
@@ -76,19 +114,102 @@ class OmniOfflineClient:
         
         # State management
         self._is_responding = False
-        self._conversation_history = []
+        # 对话历史 = 固定的 system 指令 + 滚动摘要 + 最近的轮次（_turns）
         self._instructions = ""
+        self._summary = ""
+        self._turns = []
+        self._turn_tokens = []  # 与 _turns 一一对应的 token 估计
+        self.history_token_budget = history_token_budget
+        self._summary_task = None
         self._stream_task = None
+
+    @property
+    def _conversation_history(self):
+        """发送给模型的消息；两次压缩之间只在末尾追加，前缀保持不变以便命中 prompt cache"""
+        messages = [SystemMessage(content=self._instructions)]
+        if self._summary:
+            messages.append(SystemMessage(content=f"先前对话的备忘录: {self._summary}"))
+        return messages + self._turns
+
+    def _append_turn(self, message) -> None:
+        self._turns.append(message)
+        self._turn_tokens.append(_message_tokens(message))
+        self._maybe_compact()
+
+    def _drop_oldest(self, count: int) -> None:
+        del self._turns[:count]
+        del self._turn_tokens[:count]
+
+    def _maybe_compact(self) -> None:
+        """历史超出 token 预算时，把最旧的轮次交给后台任务压缩成摘要"""
+        total = sum(self._turn_tokens)
+        if self._summary_task is not None and not self._summary_task.done():
+            # 摘要进行中：只在超过硬上限时直接丢弃最旧的轮次
+            hard_limit = self.history_token_budget * HISTORY_HARD_LIMIT
+            dropped = 0
+            while total > hard_limit and len(self._turns) - dropped > 1:
+                total -= self._turn_tokens[dropped]
+                dropped += 1
+            if dropped:
+                logger.warning(f"OmniOfflineClient: 历史超出上限，丢弃最旧的 {dropped} 条消息")
+                self._drop_oldest(dropped)
+            return
+        if total <= self.history_token_budget:
+            return
+        target = self.history_token_budget * HISTORY_COMPACT_TARGET
+        count = 0
+        while total > target and count < len(self._turns) - 1:
+            total -= self._turn_tokens[count]
+            count += 1
+        if count:
+            self._summary_task = asyncio.create_task(self._summarize(self._turns[:count]))
+
+    async def _summarize(self, evicted) -> None:
+        """把被移出的轮次并入滚动摘要，再一次性从历史窗口中删除"""
+        lines = []
+        for message in evicted:
+            role = {"human": "用户", "ai": "助手"}.get(message.type, "系统")
+            lines.append(f"{role} | {message.content}")
+        prompt = HISTORY_SUMMARY_PROMPT % (self._summary or "无", "\n".join(lines))
+        summary = None
+        try:
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            summary = response.content.strip() if isinstance(response.content, str) else None
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.error(f"OmniOfflineClient: 历史摘要失败，直接丢弃旧消息: {e}")
+        # 重置历史（close/connect）时本任务已被取消；摘要期间超过硬上限时，部分被压缩的消息可能已被直接丢弃
+        evicted_ids = {id(message) for message in evicted}
+        count = 0
+        while count < len(self._turns) and id(self._turns[count]) in evicted_ids:
+            count += 1
+        if summary:
+            self._summary = summary
+        self._drop_oldest(count)
+        logger.info(f"OmniOfflineClient: 已将 {count} 条旧消息压缩为摘要，当前历史约 {sum(self._turn_tokens)} tokens")
+        # 摘要期间新增的消息可能再次超出预算
+        self._maybe_compact()
+
+    def _reset_history(self) -> None:
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+        self._summary_task = None
+        self._summary = ""
+        self._turns = []
+        self._turn_tokens = []
         
     async def connect(self, instructions: str, native_audio=False) -> None:
         """Initialize the client with system instructions."""
         self._instructions = instructions
-        # Add system message to conversation history using langchain format
-        self._conversation_history = [
-            SystemMessage(content=instructions)
-        ]
+        # system 消息由 _conversation_history 根据 _instructions 生成
+        self._reset_history()
         logger.info("OmniOfflineClient initialized with instructions")
     
+    async def open(self) -> None:
+        """Compatibility method - text mode has no connection to open"""
+        pass
+
     async def send_event(self, event) -> None:
         """Compatibility method - not used in text mode"""
         pass
@@ -97,9 +218,6 @@ class OmniOfflineClient:
         """Compatibility method - update instructions if provided"""
         if "instructions" in config:
             self._instructions = config["instructions"]
-            # Update system message using langchain format
-            if self._conversation_history and isinstance(self._conversation_history[0], SystemMessage):
-                self._conversation_history[0] = SystemMessage(content=self._instructions)
     
     async def stream_text(self, text: str) -> None:
         """
@@ -112,7 +230,7 @@ class OmniOfflineClient:
         
         # Add user message to history
         user_message = HumanMessage(content=text.strip())
-        self._conversation_history.append(user_message)
+        self._append_turn(user_message)
         
         # Callback for user input
         if self.on_input_transcript:
@@ -150,7 +268,7 @@ class OmniOfflineClient:
             
             # Add assistant response to history
             if assistant_message:
-                self._conversation_history.append(AIMessage(content=assistant_message))
+                self._append_turn(AIMessage(content=assistant_message))
                     
         except Exception as e:
             error_msg = f"Error in text streaming: {str(e)}"
@@ -183,7 +301,7 @@ class OmniOfflineClient:
         
         # Add as system message using langchain format
         if instructions.strip():
-            self._conversation_history.append(SystemMessage(content=instructions))
+            self._append_turn(SystemMessage(content=instructions))
     
     async def cancel_response(self) -> None:
         """Cancel the current response if possible"""
@@ -213,6 +331,6 @@ class OmniOfflineClient:
     async def close(self) -> None:
         """Close the client and cleanup resources."""
         self._is_responding = False
-        self._conversation_history = []
+        self._reset_history()
         logger.info("OmniOfflineClient closed")
 
@@ -1,10 +1,10 @@
 # -- coding: utf-8 --
 
 import asyncio
-from re import T
 import websockets
 import json
 import base64
+import binascii
 import time
 import logging
 
@@ -14,6 +14,91 @@ from enum import Enum
 # Setup logger for this module
 logger = logging.getLogger(__name__)
 
+# Max events waiting for the sender task; audio and control events apply backpressure, images are dropped
+SEND_QUEUE_SIZE = 64
+# Audio is coalesced into input_audio_buffer.append events of at least this many bytes
+# (3200 bytes = 100ms of 16kHz 16bit mono pcm); 0 sends every chunk as it arrives
+AUDIO_APPEND_BYTES = 3200
+# Buffered audio is flushed once the oldest pending byte is this old (seconds), whatever its size
+AUDIO_APPEND_MAX_DELAY = 0.1
+# Payloads at least this large are base64-encoded and rendered in a worker thread
+OFFLOAD_ENCODE_BYTES = 64 * 1024
+
+# Pre-rendered JSON for the high-rate events. Base64 never needs JSON escaping, so these
+# skip json.dumps entirely; the first slot is the payload, the second the event id.
+_AUDIO_APPEND_TEMPLATE = '{"type":"input_audio_buffer.append","audio":"%s","event_id":"%s"}'
+_IMAGE_APPEND_TEMPLATES = {
+    "qwen": '{"type":"input_image_buffer.append","image":"%s","event_id":"%s"}',
+    "glm": '{"type":"input_audio_buffer.append_video_frame","video_frame":"%s","event_id":"%s"}',
+    "gpt": '{"type":"conversation.item.create","item":{"type":"message","role":"user","content":'
+           '[{"type":"input_image","image_url":"data:image/jpeg;base64,%s"}]},"event_id":"%s"}',
+}
+
+
+# Server events whose built-in handler only tracks state; extra_event_handlers for them still run
+_STATE_EVENT_TYPES = frozenset({
+    "response.done",
+    "response.created",
+    "response.output_item.added",
+    "input_audio_buffer.speech_started",
+    "input_audio_buffer.speech_stopped",
+})
+_TEXT_DELTA_TYPES = ("response.text.delta", "response.output_text.delta")
+
+# Providers serialize "type" as the first key, so the event type can be read from a fixed prefix
+# ('{"type":"...' or, with json.dumps default separators, '{"type": "...')
+_TYPE_SNIFF_CHARS = 96
+
+
+def _sniff_type(message: str) -> Optional[str]:
+    """Return the event type if the message starts with it, else None (the caller parses the JSON)."""
+    if message.startswith('{"type":"'):
+        start = 9
+    elif message.startswith('{"type": "'):
+        start = 10
+    else:
+        return None
+    end = message.find('"', start, start + _TYPE_SNIFF_CHARS)
+    if end < 0:
+        return None
+    return message[start:end]
+
+
+def _read_delta(message: str) -> Optional[str]:
+    """Return the top-level "delta" string of a server event without parsing the JSON, else None.
+
+    A JSON string without a backslash has no escapes, so its value runs up to the next quote;
+    values with escapes, or a "delta" key preceded by a '{' (a nested object), are left to json.loads.
+    """
+    key = message.find('"delta":', 1)
+    if key < 0 or message.find('{', 1, key) >= 0:
+        return None
+    start = key + 8
+    if message.startswith(' "', start):
+        start += 2
+    elif message.startswith('"', start):
+        start += 1
+    else:
+        return None
+    end = message.find('"', start)
+    if end < 0:
+        return None
+    delta = message[start:end]
+    if '\\' in delta:
+        return None
+    return delta
+
+
+def _event_id() -> str:
+    return "event_" + str(int(time.time() * 1000))
+
+
+def _render(template: str, payload, event_id: str) -> str:
+    if isinstance(payload, (bytes, bytearray)):
+        payload = base64.b64encode(payload).decode("ascii")
+    return template % (payload, event_id)
+
+
 class TurnDetectionMode(Enum):
     SERVER_VAD = "server_vad"
     MANUAL = "manual"
@@ -68,7 +153,8 @@ class OmniRealtimeClient:
         on_output_transcript: Optional[Callable[[str, bool], Awaitable[None]]] = None,
         on_connection_error: Optional[Callable[[str], Awaitable[None]]] = None,
         on_response_done: Optional[Callable[[], Awaitable[None]]] = None,
-        extra_event_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]]] = None
+        extra_event_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]]] = None,
+        audio_append_bytes: int = AUDIO_APPEND_BYTES
     ):
         self.base_url = base_url
         self.api_key = api_key
@@ -98,13 +184,35 @@ class OmniRealtimeClient:
         self._audio_in_buffer = False
         self._skip_until_next_response = False
 
-    async def connect(self, instructions: str, native_audio=True) -> None:
-        """Establish WebSocket connection with the Realtime API."""
+        # Outgoing events are serialized and written by a single sender task, in order
+        self.audio_append_bytes = audio_append_bytes
+        self._send_queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self._sender_task = None
+        self._send_error = None
+        self._audio_pending = bytearray()
+        self._audio_pending_since = None
+        self._audio_flush_timer = None
+        self.dropped_images = 0
+
+    async def open(self) -> None:
+        """Open the WebSocket connection without configuring the session.
+
+        Lets callers dial the Realtime API while the instructions are still being
+        prepared; connect() reuses the socket if it is already open.
+        """
+        if self.ws is not None:
+            return
         url = f"{self.base_url}?model={self.model}" if self.model != "free-model" else self.base_url
         headers = {
             "Authorization": f"Bearer {self.api_key}"
         } 
         self.ws = await websockets.connect(url, additional_headers=headers)
+        self._send_error = None
+        self._sender_task = asyncio.create_task(self._send_loop())
+
+    async def connect(self, instructions: str, native_audio=True) -> None:
+        """Establish WebSocket connection with the Realtime API."""
+        await self.open()
 
         # Set up default session configuration
         if self.turn_detection_mode == TurnDetectionMode.MANUAL:
@@ -196,10 +304,64 @@ class OmniRealtimeClient:
         else:
             raise ValueError(f"Invalid turn detection mode: {self.turn_detection_mode}")
 
+    async def _send_loop(self) -> None:
+        """Serialize queued events and write them to the socket, off the callers' path."""
+        try:
+            while True:
+                template, payload, event_id = await self._send_queue.get()
+                try:
+                    if template is None:
+                        message = json.dumps(payload)
+                    elif len(payload) >= OFFLOAD_ENCODE_BYTES:
+                        message = await asyncio.to_thread(_render, template, payload, event_id)
+                    else:
+                        message = _render(template, payload, event_id)
+                    await self.ws.send(message)
+                finally:
+                    self._send_queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Surfaced to the next caller of send_event/stream_audio/stream_image
+            self._send_error = e
+            logger.error(f"OmniRealtimeClient: sender stopped: {e}")
+
+    async def _enqueue(self, template, payload, event_id) -> None:
+        if self._send_error is not None:
+            raise self._send_error
+        await self._send_queue.put((template, payload, event_id))
+
+    def _take_audio(self) -> bytes:
+        payload = bytes(self._audio_pending)
+        self._audio_pending.clear()
+        self._audio_pending_since = None
+        if self._audio_flush_timer is not None:
+            self._audio_flush_timer.cancel()
+            self._audio_flush_timer = None
+        return payload
+
+    async def _flush_audio(self) -> None:
+        if not self._audio_pending:
+            return
+        await self._enqueue(_AUDIO_APPEND_TEMPLATE, self._take_audio(), _event_id())
+
+    def _flush_audio_due(self) -> None:
+        """Timer callback: send buffered audio that no later chunk has pushed out within AUDIO_APPEND_MAX_DELAY."""
+        self._audio_flush_timer = None
+        if not self._audio_pending or self._send_error is not None:
+            return
+        if self._send_queue.full():
+            # The sender is behind; retry once it has had time to drain
+            self._audio_flush_timer = asyncio.get_running_loop().call_later(AUDIO_APPEND_MAX_DELAY, self._flush_audio_due)
+            return
+        self._send_queue.put_nowait((_AUDIO_APPEND_TEMPLATE, self._take_audio(), _event_id()))
+
     async def send_event(self, event) -> None:
-        event['event_id'] = "event_" + str(int(time.time() * 1000))
+        event['event_id'] = _event_id()
         if self.ws:
-            await self.ws.send(json.dumps(event))
+            # Keep buffered audio ahead of anything sent after it
+            await self._flush_audio()
+            await self._enqueue(None, event, event['event_id'])
 
     async def update_session(self, config: Dict[str, Any]) -> None:
         """Update session configuration."""
@@ -210,46 +372,39 @@ class OmniRealtimeClient:
         await self.send_event(event)
 
     async def stream_audio(self, audio_chunk: bytes) -> None:
-        """Stream raw audio data to the API."""
+        """Stream raw audio data to the API, coalesced into audio_append_bytes sized events."""
         # only support 16bit 16kHz mono pcm
-        audio_b64 = base64.b64encode(audio_chunk).decode()
-
-        append_event = {
-            "type": "input_audio_buffer.append",
-            "audio": audio_b64
-        }
-        await self.send_event(append_event)
+        if not self.ws:
+            return
+        if not self._audio_pending and len(audio_chunk) >= self.audio_append_bytes:
+            await self._enqueue(_AUDIO_APPEND_TEMPLATE, bytes(audio_chunk), _event_id())
+            return
+        now = time.monotonic()
+        if self._audio_pending_since is None:
+            self._audio_pending_since = now
+            # The last chunk of an utterance may never be followed by another one
+            self._audio_flush_timer = asyncio.get_running_loop().call_later(AUDIO_APPEND_MAX_DELAY, self._flush_audio_due)
+        self._audio_pending += audio_chunk
+        if len(self._audio_pending) >= self.audio_append_bytes or now - self._audio_pending_since >= AUDIO_APPEND_MAX_DELAY:
+            await self._flush_audio()
 
     async def stream_image(self, image_b64: str) -> None:
         """Stream raw image data to the API."""
         if self._audio_in_buffer:
-            if "qwen" in self.model:
-                append_event = {
-                    "type": "input_image_buffer.append" ,
-                    "image": image_b64
-                }
-            elif "glm" in self.model:
-                append_event = {
-                    "type": "input_audio_buffer.append_video_frame",
-                    "video_frame": image_b64
-                }
-            elif "gpt" in self.model:
-                append_event = {
-                    "type": "conversation.item.create",
-                    "item": {
-                        "type": "message",
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "input_image",
-                                "image_url": "data:image/jpeg;base64," + image_b64
-                            }
-                        ]
-                    }
-                }
-            else:
+            template = next((t for key, t in _IMAGE_APPEND_TEMPLATES.items() if key in self.model), None)
+            if template is None:
                 raise ValueError(f"Model does not support video streaming: {self.model}")
-            await self.send_event(append_event)
+            if not self.ws:
+                return
+            if self._send_error is not None:
+                raise self._send_error
+            await self._flush_audio()
+            try:
+                # Frames are best effort: never hold up audio behind a full queue
+                self._send_queue.put_nowait((template, image_b64, _event_id()))
+            except asyncio.QueueFull:
+                self.dropped_images += 1
+                logger.debug("OmniRealtimeClient: send queue full, dropping image frame")
 
     async def create_response(self, instructions: str, skipped: bool = False) -> None:
         """Request a response from the API. Needed when using manual mode."""
@@ -287,94 +442,177 @@ class OmniRealtimeClient:
         self._current_response_id = None
         self._current_item_id = None
 
+    def _build_dispatch(self) -> Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]]:
+        """Map server event types to handlers for this provider.
+
+        Event types missing from the table are skipped without being parsed (see _sniff_type), and
+        deltas are read without parsing when possible (see _build_delta_dispatch).
+        extra_event_handlers run after the built-in handler for types that only update client state;
+        errors, deltas and transcripts are consumed by their built-in handlers, GLM text deltas included.
+        """
+        dispatch = {
+            "error": self._on_error,
+            "response.done": self._on_response_done,
+            "response.created": self._on_response_created,
+            "response.output_item.added": self._on_output_item_added,
+            "input_audio_buffer.speech_started": self._on_speech_started,
+            "input_audio_buffer.speech_stopped": self._on_speech_stopped,
+            "conversation.item.input_audio_transcription.completed": self._on_input_transcript_completed,
+        }
+        for event_type in ("response.audio.delta", "response.output_audio.delta"):
+            dispatch[event_type] = self._on_audio_delta
+        for event_type in ("response.audio_transcript.delta", "response.output_audio_transcript.delta"):
+            dispatch[event_type] = self._on_output_transcript_delta
+        for event_type in ("response.audio_transcript.done", "response.output_audio_transcript.done"):
+            dispatch[event_type] = self._on_output_transcript_done
+        # GLM repeats its text in the audio transcript, so text deltas are not forwarded
+        if "glm" not in self.model:
+            for event_type in _TEXT_DELTA_TYPES:
+                dispatch[event_type] = self._on_text_delta
+        for event_type, handler in self.extra_event_handlers.items():
+            builtin = dispatch.get(event_type)
+            if builtin is None:
+                if event_type not in _TEXT_DELTA_TYPES:
+                    dispatch[event_type] = self._gated(handler)
+            elif event_type in _STATE_EVENT_TYPES:
+                dispatch[event_type] = self._chained(builtin, self._gated(handler))
+        return dispatch
+
+    def _gated(self, handler):
+        async def call(event):
+            if not self._skip_until_next_response:
+                await handler(event)
+        return call
+
+    @staticmethod
+    def _chained(first, second):
+        async def call(event):
+            await first(event)
+            await second(event)
+        return call
+
+    async def _on_error(self, event) -> None:
+        logger.error(f"API Error: {event['error']}")
+        if '欠费' in event['error'] or 'standing' in event['error']:
+            if self.on_connection_error:
+                await self.on_connection_error(event['error'])
+            await self.close()
+
+    async def _on_response_done(self, event) -> None:
+        self._is_responding = False
+        self._current_response_id = None
+        self._current_item_id = None
+        self._skip_until_next_response = False
+        if self.on_response_done:
+            await self.on_response_done()
+
+    async def _on_response_created(self, event) -> None:
+        self._current_response_id = event.get("response", {}).get("id")
+        self._is_responding = True
+        self._is_first_text_chunk = self._is_first_transcript_chunk = True
+
+    async def _on_output_item_added(self, event) -> None:
+        self._current_item_id = event.get("item", {}).get("id")
+
+    async def _on_speech_started(self, event) -> None:
+        logger.info("Speech detected")
+        self._audio_in_buffer = True
+        if self._is_responding:
+            logger.info("Handling interruption")
+            await self.handle_interruption()
+
+    async def _on_speech_stopped(self, event) -> None:
+        logger.info("Speech ended")
+        if self.on_new_message:
+            await self.on_new_message()
+        self._audio_in_buffer = False
+
+    async def _on_input_transcript_completed(self, event) -> None:
+        self._print_input_transcript = True
+        if not self._skip_until_next_response and self.on_input_transcript:
+            await self.on_input_transcript(event.get("transcript", ""))
+
+    async def _on_text_delta(self, event) -> None:
+        await self._forward_text_delta(event["delta"])
+
+    async def _forward_text_delta(self, delta: str) -> None:
+        if not self._skip_until_next_response and self.on_text_delta:
+            await self.on_text_delta(delta, self._is_first_text_chunk)
+            self._is_first_text_chunk = False
+
+    async def _on_audio_delta(self, event) -> None:
+        await self._forward_audio_delta(event["delta"])
+
+    async def _forward_audio_delta(self, delta: str) -> None:
+        if not self._skip_until_next_response and self.on_audio_delta:
+            # a2b_base64 is the only copy; the consumer reads the bytes through a numpy view.
+            # Decoding into a reusable numpy buffer was measured slower: the str still has to be
+            # encoded to ascii first, and the vectorized decode needs temporaries of its own.
+            await self.on_audio_delta(binascii.a2b_base64(delta))
+
+    async def _on_output_transcript_done(self, event) -> None:
+        self._print_input_transcript = False
+        if not self._skip_until_next_response and self.on_output_transcript and self._is_first_transcript_chunk:
+            transcript = event.get("transcript", "")
+            if transcript:
+                await self.on_output_transcript(transcript, True)
+                self._is_first_transcript_chunk = False
+
+    async def _on_output_transcript_delta(self, event) -> None:
+        await self._forward_transcript_delta(event.get("delta", ""))
+
+    async def _forward_transcript_delta(self, delta: str) -> None:
+        if self._skip_until_next_response or not self.on_output_transcript:
+            return
+        if not self._print_input_transcript:
+            self._output_transcript_buffer += delta
+        else:
+            if self._output_transcript_buffer:
+                await self.on_output_transcript(self._output_transcript_buffer, self._is_first_transcript_chunk)
+                self._is_first_transcript_chunk = False
+                self._output_transcript_buffer = ""
+            await self.on_output_transcript(delta, self._is_first_transcript_chunk)
+            self._is_first_transcript_chunk = False
+
+    def _build_delta_dispatch(self, dispatch) -> Dict[str, Callable[[str], Awaitable[None]]]:
+        """Delta event types whose handler in the table only reads "delta", mapped to a handler taking that string."""
+        forwarders = {
+            self._on_text_delta: self._forward_text_delta,
+            self._on_audio_delta: self._forward_audio_delta,
+            self._on_output_transcript_delta: self._forward_transcript_delta,
+        }
+        return {event_type: forwarders[handler] for event_type, handler in dispatch.items() if handler in forwarders}
+
     async def handle_messages(self) -> None:
         try:
             if not self.ws:
                 logger.error("WebSocket connection is not established")
                 return
-                
+
+            dispatch = self._build_dispatch()
+            delta_dispatch = self._build_delta_dispatch(dispatch)
+            # Bound once: this loop runs for every server event
+            get_handler, get_delta_handler, loads = dispatch.get, delta_dispatch.get, json.loads
             async for message in self.ws:
-                event = json.loads(message)
-                event_type = event.get("type")
-                
-                # if event_type not in ["response.audio.delta", "response.audio_transcript.delta",  "response.output_audio.delta", "response.output_audio_transcript.delta"]:
-                #     # print(f"Received event: {event}")
-                #     print(f"Received event: {event_type}")
-                # else:
-                #     print(f"Event type: {event_type}")
-                if event_type == "error":
-                    logger.error(f"API Error: {event['error']}")
-                    if '欠费' in event['error'] or 'standing' in event['error']:
-                        if self.on_connection_error:
-                            await self.on_connection_error(event['error'])
-                        await self.close()
-                    continue
-                elif event_type == "response.done":
-                    self._is_responding = False
-                    self._current_response_id = None
-                    self._current_item_id = None
-                    self._skip_until_next_response = False
-                    if self.on_response_done:
-                        await self.on_response_done()
-                elif event_type == "response.created":
-                    self._current_response_id = event.get("response", {}).get("id")
-                    self._is_responding = True
-                    self._is_first_text_chunk = self._is_first_transcript_chunk = True
-                elif event_type == "response.output_item.added":
-                    self._current_item_id = event.get("item", {}).get("id")
-                # Handle interruptions
-                elif event_type == "input_audio_buffer.speech_started":
-                    logger.info("Speech detected")
-                    self._audio_in_buffer = True
-                    if self._is_responding:
-                        logger.info("Handling interruption")
-                        await self.handle_interruption()
-                elif event_type == "input_audio_buffer.speech_stopped":
-                    logger.info("Speech ended")
-                    if self.on_new_message:
-                        await self.on_new_message()
-                    self._audio_in_buffer = False
-                elif event_type == "conversation.item.input_audio_transcription.completed":
-                    self._print_input_transcript = True
-                elif event_type in ["response.audio_transcript.done", "response.output_audio_transcript.done"]:
-                    self._print_input_transcript = False
-
-                if not self._skip_until_next_response:
-                    if event_type in ["response.text.delta", "response.output_text.delta"]:
-                        if self.on_text_delta:
-                            if "glm" not in self.model:
-                                await self.on_text_delta(event["delta"], self._is_first_text_chunk)
-                                self._is_first_text_chunk = False
-                    elif event_type in ["response.audio.delta", "response.output_audio.delta"]:
-                        if self.on_audio_delta:
-                            audio_bytes = base64.b64decode(event["delta"])
-                            await self.on_audio_delta(audio_bytes)
-                    elif event_type == "conversation.item.input_audio_transcription.completed":
-                        transcript = event.get("transcript", "")
-                        if self.on_input_transcript:
-                            await self.on_input_transcript(transcript)
-                    elif event_type in ["response.audio_transcript.done", "response.output_audio_transcript.done"]:
-                        if self.on_output_transcript and self._is_first_transcript_chunk:
-                            transcript = event.get("transcript", "")
-                            if transcript:
-                                await self.on_output_transcript(transcript, True)
-                                self._is_first_transcript_chunk = False
-                    elif event_type in ["response.audio_transcript.delta", "response.output_audio_transcript.delta"]:
-                        if self.on_output_transcript:
-                            delta = event.get("delta", "")
-                            if not self._print_input_transcript:
-                                self._output_transcript_buffer += delta
-                            else:
-                                if self._output_transcript_buffer:
-                                    # logger.info(f"{self._output_transcript_buffer} is_first_chunk: True")
-                                    await self.on_output_transcript(self._output_transcript_buffer, self._is_first_transcript_chunk)
-                                    self._is_first_transcript_chunk = False
-                                    self._output_transcript_buffer = ""
-                                await self.on_output_transcript(delta, self._is_first_transcript_chunk)
-                                self._is_first_transcript_chunk = False
-                    
-                    elif event_type in self.extra_event_handlers:
-                        await self.extra_event_handlers[event_type](event)
+                sniffed = _sniff_type(message) if isinstance(message, str) else None
+                if sniffed is not None:
+                    # Text, transcript and audio deltas are most of the traffic: read the delta without parsing
+                    on_delta = get_delta_handler(sniffed)
+                    if on_delta is not None:
+                        delta = _read_delta(message)
+                        if delta is not None:
+                            await on_delta(delta)
+                            continue
+                    handler = get_handler(sniffed)
+                    if handler is None:
+                        continue
+                    event = loads(message)
+                else:
+                    event = loads(message)
+                    handler = get_handler(event.get("type"))
+                    if handler is None:
+                        continue
+                await handler(event)
 
         except websockets.exceptions.ConnectionClosedOK:
             logger.info("Connection closed as expected")
@@ -392,8 +630,31 @@ class OmniRealtimeClient:
             logger.error(f"Error in message handling: {str(e)}")
             raise e
 
+    async def _stop_sender(self) -> None:
+        """Give queued events a moment to go out, then stop the sender task."""
+        task, self._sender_task = self._sender_task, None
+        if task is None:
+            return
+        if not task.done():
+            try:
+                await self._flush_audio()
+                await asyncio.wait_for(self._send_queue.join(), timeout=1.0)
+            except Exception:
+                pass
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        # Drop whatever could not be sent
+        while not self._send_queue.empty():
+            self._send_queue.get_nowait()
+            self._send_queue.task_done()
+        self._take_audio()
+
     async def close(self) -> None:
         """Close the WebSocket connection."""
+        await self._stop_sender()
         if self.ws:
             try:
                 # 尝试关闭websocket连接
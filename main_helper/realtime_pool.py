@@ -0,0 +1,168 @@
+"""
+Realtime API 连接预热池
+热切换和新会话都要先与服务商完成 TCP/TLS/WebSocket 握手，网络差时这一步可能要几秒。
+预热池在后台提前打开连接，需要时直接取用，只剩下发送 session.update 一步：
+- 连接按 spec（地址、密钥、模型）区分，配置热重载后旧连接自动作废
+- 空闲连接超过 MAX_AGE 秒后关闭并替换，定期 ping 探活，失效的连接直接丢弃
+- 只有 keep_warm() 之后才会补充连接；idle() 之后现有连接保留到过期为止，不再补充
+与服务商无关：连接由调用方提供的工厂函数创建，只要求对象实现 open() / close() 并暴露 ws。
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _is_open(client):
+    ws = getattr(client, 'ws', None)
+    return ws is not None and getattr(ws, 'close_code', None) is None
+
+
+class RealtimeSessionPool:
+    """单个角色的 realtime 连接预热池"""
+
+    # 空闲连接的最长保留时间（秒），服务商通常会关闭长时间无数据的连接
+    MAX_AGE = 120.0
+    # 探活间隔与 ping 超时（秒）
+    PROBE_INTERVAL = 15.0
+    PING_TIMEOUT = 3.0
+    # 建连超时与失败重试退避（秒）
+    OPEN_TIMEOUT = 15.0
+    RETRY_BACKOFF_INITIAL = 1.0
+    RETRY_BACKOFF_MAX = 60.0
+
+    def __init__(self, lanlan_name, size=1):
+        self.lanlan_name = lanlan_name
+        self.size = size
+        self._idle = []  # [(client, spec, opened_at)]
+        self._spec = None
+        self._factory = None
+        self._keep_warm = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = set()
+        self.stats = {"claimed": 0, "missed": 0, "opened": 0, "expired": 0, "failed": 0}
+
+    def claim(self, spec):
+        """取出一个与 spec 匹配且仍然可用的连接，没有时返回 None"""
+        now = time.monotonic()
+        while self._idle:
+            client, client_spec, opened_at = self._idle.pop(0)
+            if client_spec == spec and _is_open(client) and now - opened_at < self.MAX_AGE:
+                self.stats["claimed"] += 1
+                self._wakeup.set()
+                return client
+            self.stats["expired"] += 1
+            self._discard(client)
+        self.stats["missed"] += 1
+        return None
+
+    def keep_warm(self, spec, factory):
+        """保持池中有 size 个按 spec 打开的连接（配置变化时丢弃旧连接）"""
+        self._spec, self._factory = spec, factory
+        self._keep_warm = True
+        self._ensure_task()
+        self._wakeup.set()
+
+    def idle(self):
+        """停止补充连接；已有的连接保留到过期，供紧接着的新会话使用"""
+        self._keep_warm = False
+        self._wakeup.set()
+
+    def health(self):
+        return dict(self.stats, idle=len(self._idle), keep_warm=self._keep_warm)
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._maintain())
+
+    def _discard(self, client):
+        task = asyncio.create_task(client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _expire(self):
+        now = time.monotonic()
+        kept = []
+        for entry in self._idle:
+            client, client_spec, opened_at = entry
+            if client_spec == self._spec and _is_open(client) and now - opened_at < self.MAX_AGE:
+                kept.append(entry)
+            else:
+                self.stats["expired"] += 1
+                self._discard(client)
+        self._idle = kept
+
+    async def _probe(self):
+        for entry in list(self._idle):
+            client = entry[0]
+            try:
+                pong = await client.ws.ping()
+                await asyncio.wait_for(pong, timeout=self.PING_TIMEOUT)
+            except Exception as e:
+                logger.info(f"{self.lanlan_name} 的预热连接探活失败，已丢弃: {e}")
+                if entry in self._idle:
+                    self._idle.remove(entry)
+                    self.stats["expired"] += 1
+                    self._discard(client)
+
+    async def _open_one(self):
+        spec, client = self._spec, self._factory()
+        try:
+            await asyncio.wait_for(client.open(), timeout=self.OPEN_TIMEOUT)
+        except BaseException:
+            # 建连失败、超时或预热池关闭：握手进行到一半的连接也要关闭
+            self._discard(client)
+            raise
+        if not self._keep_warm or spec != self._spec:
+            # 建连期间配置变化或已不需要预热
+            self._discard(client)
+            return
+        self._idle.append((client, spec, time.monotonic()))
+        self.stats["opened"] += 1
+        logger.info(f"{self.lanlan_name} 的realtime预热连接已就绪（空闲 {len(self._idle)} 个）")
+
+    async def _maintain(self):
+        backoff = 0.0
+        while True:
+            self._wakeup.clear()
+            self._expire()
+            if self._keep_warm and len(self._idle) < self.size:
+                try:
+                    await self._open_one()
+                    backoff = 0.0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    backoff = min(self.RETRY_BACKOFF_MAX, backoff * 2 or self.RETRY_BACKOFF_INITIAL)
+                    logger.warning(f"{self.lanlan_name} 的realtime预热连接建立失败，{backoff:.0f}秒后重试: {e}")
+                    await asyncio.sleep(backoff)
+                continue
+            if not self._idle and not self._keep_warm:
+                break
+            await self._probe()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.PROBE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def shutdown(self):
+        """关闭所有预热连接（服务器退出时调用）"""
+        self._keep_warm = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        idle, self._idle = self._idle, []
+        for client, _, _ in idle:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"💥 关闭预热连接时出错: {e}")
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
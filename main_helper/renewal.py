@@ -0,0 +1,147 @@
+"""
+realtime 会话热切换调度
+热切换是因为上下文在增长，而不是因为时间在流逝：安静的会话没必要频繁切换，繁忙的会话则要更早切换。
+调度器估计当前会话累计的上下文 token（输出文本、输入/输出语音、图像帧），按轮次平滑出每轮的增长量和轮次间隔。
+切换只能发生在轮次结束时：renew 后等待记忆整理、再在某一轮结束时开始预热、预热完成后的下一轮结束时切换。
+调度器据此算出从现在开始准备到完成切换要经过几轮，若再等一轮才开始准备就会在切换前超出预算，则现在开始。
+"""
+import math
+import time
+
+from main_helper.omni_offline_client import estimate_tokens
+
+
+class SessionRenewalScheduler:
+    """单个 realtime 会话的上下文增长估计与切换时机判断（时间源可注入，便于离线回放对话轨迹）"""
+
+    # 会话开始后新增上下文的 token 预算（不含初始提示词）
+    TOKEN_BUDGET = 8000
+    # 语音约 25 token/秒（16kHz 输入 / 24kHz 输出按同一估计）
+    AUDIO_TOKENS_PER_SECOND = 25
+    # 一帧 480p 截图的 token 估计
+    IMAGE_TOKENS = 300
+    # 每轮对话的固定开销（角色、分隔符等）
+    TURN_OVERHEAD_TOKENS = 8
+    # 标记 renew 后等待记忆服务器整理的时间（秒）
+    SUMMARY_DELAY = 10.0
+    # 预热 pending session 耗时的初始估计（秒），之后按实测值平滑
+    DEFAULT_PREP_SECONDS = 3.0
+    SAFETY_MARGIN = 5.0
+    # 按"平均值 + 该倍数的平均偏差"估计下一轮的增长量，长回复接连出现时也不会超出预算
+    TURN_TOKENS_DEVIATIONS = 2.0
+    # 会话至少运行这么久才考虑切换，避免频繁切换
+    MIN_UPTIME = 40.0
+    # 无论上下文多少，超过该时长也切换（服务商对单个会话时长有上限）
+    MAX_UPTIME = 20 * 60.0
+    # 文本会话不热切换（OmniOfflineClient 自行压缩历史），但每隔这么多轮或新增 TOKEN_BUDGET 个 token
+    # 仍发送 renew，让记忆服务器整理这段对话
+    TEXT_RENEW_TURNS = 20
+    # 速率、轮次间隔、准备耗时的指数平滑系数
+    SMOOTHING = 0.3
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.prep_seconds = self.DEFAULT_PREP_SECONDS
+        self.reset()
+
+    def reset(self):
+        """新会话（包括热切换后的会话）开始时调用"""
+        now = self._clock()
+        self.started_at = now
+        self.tokens = 0.0
+        self.turns = 0
+        self.audio_seconds = 0.0
+        self.rate = None  # token/秒
+        self.turn_interval = None  # 秒
+        self.turn_tokens = None  # 每轮增长的 token
+        self.turn_tokens_dev = 0.0
+        self._last_turn_at = now
+        self._tokens_at_last_turn = 0.0
+        self._renewed_turns = 0
+        self._renewed_tokens = 0.0
+
+    def add_text(self, text):
+        if text:
+            self.tokens += estimate_tokens(text)
+
+    def add_audio(self, seconds):
+        self.audio_seconds += seconds
+        self.tokens += seconds * self.AUDIO_TOKENS_PER_SECOND
+
+    def add_image(self):
+        self.tokens += self.IMAGE_TOKENS
+
+    def end_turn(self):
+        """一轮回复结束：更新增长速率和轮次间隔的估计"""
+        now = self._clock()
+        self.turns += 1
+        self.tokens += self.TURN_OVERHEAD_TOKENS
+        elapsed = now - self._last_turn_at
+        grown = self.tokens - self._tokens_at_last_turn
+        if self.turn_tokens is not None:
+            self.turn_tokens_dev = self._smooth(self.turn_tokens_dev, abs(grown - self.turn_tokens))
+        self.turn_tokens = self._smooth(self.turn_tokens, grown)
+        if elapsed > 0:
+            # 按墙钟时间计算速率，安静时段会拉低速率，从而推迟切换
+            self.rate = self._smooth(self.rate, grown / elapsed)
+            self.turn_interval = self._smooth(self.turn_interval, elapsed)
+        self._last_turn_at = now
+        self._tokens_at_last_turn = self.tokens
+
+    def record_prep(self, seconds):
+        """记录一次 pending session 预热的实际耗时"""
+        self.prep_seconds = self._smooth(self.prep_seconds, seconds)
+
+    def _smooth(self, old, new):
+        return new if old is None else old + self.SMOOTHING * (new - old)
+
+    def seconds_to_budget(self):
+        remaining = self.TOKEN_BUDGET - self.tokens
+        if remaining <= 0:
+            return 0.0
+        if not self.rate:
+            return float('inf')
+        return remaining / self.rate
+
+    def turns_until_swap(self):
+        """
+        现在开始准备时，切换发生在此后第几轮结束
+        等待记忆整理后要到某一轮结束时才开始预热，预热完成后要到下一轮结束时才切换，两步都对齐到轮次边界。
+        """
+        interval = self.turn_interval
+        if not interval:
+            return 2
+        wait = self.SUMMARY_DELAY + self.SAFETY_MARGIN
+        return math.ceil(wait / interval) + max(1, math.ceil(self.prep_seconds / interval))
+
+    def should_prepare(self):
+        uptime = self._clock() - self.started_at
+        if uptime < self.MIN_UPTIME:
+            return False
+        if uptime >= self.MAX_UPTIME or self.tokens >= self.TOKEN_BUDGET:
+            return True
+        if self.turn_tokens is None:
+            return False
+        # 下一次判断在一轮之后，所以按"再等一轮才开始准备"估计切换前的上下文
+        per_turn = self.turn_tokens + self.TURN_TOKENS_DEVIATIONS * self.turn_tokens_dev
+        return self.tokens + (self.turns_until_swap() + 1) * per_turn > self.TOKEN_BUDGET
+
+    def should_renew_memory(self):
+        """文本会话：距离上次 renew 的轮次或 token 是否达到阈值"""
+        return self.turns - self._renewed_turns >= self.TEXT_RENEW_TURNS or \
+            self.tokens - self._renewed_tokens >= self.TOKEN_BUDGET
+
+    def mark_memory_renewed(self):
+        self._renewed_turns, self._renewed_tokens = self.turns, self.tokens
+
+    def snapshot(self):
+        return {
+            "uptime": round(self._clock() - self.started_at, 1),
+            "tokens": int(self.tokens),
+            "turns": self.turns,
+            "audio_seconds": round(self.audio_seconds, 1),
+            "rate": round(self.rate or 0.0, 1),
+            "seconds_to_budget": round(min(self.seconds_to_budget(), 1e6), 1),
+            "turn_tokens": round(self.turn_tokens or 0.0, 1),
+            "turns_until_swap": self.turns_until_swap(),
+        }
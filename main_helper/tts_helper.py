@@ -3,7 +3,7 @@ TTS Helper模块
 负责处理TTS语音合成，支持自定义音色（阿里云CosyVoice）和默认音色（各core_api的原生TTS）
 """
 import numpy as np
-from librosa import resample
+from utils.audio import StreamingResampler
 import time
 import asyncio
 import json
@@ -16,294 +16,439 @@ import threading
 import io
 import wave
 import aiohttp
+from abc import ABC, abstractmethod
 from functools import partial
+from collections import deque
 logger = logging.getLogger(__name__)
 
+# worker 开始处理请求时通过响应通道发送的控制消息，会话管理器据此判断TTS已就绪
+TTS_READY = "__tts_ready__"
+# 经请求队列发给 worker 的重配置消息：(TTS_CONFIGURE, {"voice_id": ...})，常驻 worker 换音色时无需重启进程
+TTS_CONFIGURE = "__tts_configure__"
 
-def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice_id, free_mode=False):
+
+class RealtimeTTSConnection(ABC):
     """
-    StepFun实时TTS worker（用于默认音色）
-    使用阶跃星辰的实时TTS API（step-tts-mini）
-    
-    Args:
-        request_queue: 多进程请求队列，接收(speech_id, text)元组
-        response_queue: 多进程响应队列，发送音频数据
-        audio_api_key: API密钥
-        voice_id: 音色ID，默认使用"qingchunshaonv"
+    持久化的实时TTS WebSocket连接
+    每个worker只保持一条预热好的连接，语音之间通过服务商的 clear/commit 类事件复位，
+    仅在连接失败时按指数退避重连，避免每段语音都重新进行 TCP+TLS+会话配置。
+    子类实现 _handshake / _handle_event 以及每段语音的开始、追加文本、结束。
     """
-    import asyncio
-    
-    # 使用默认音色 "qingchunshaonv"
-    if not voice_id:
-        voice_id = "qingchunshaonv"
-    
-    async def async_worker():
-        """异步TTS worker主循环"""
-        if free_mode:
-            tts_url = "ws://47.100.209.206:9806" # 还在备案，之后会换成wss+域名
-        else:
-            tts_url = "wss://api.stepfun.com/v1/realtime/audio?model=step-tts-mini"
-        ws = None
-        current_speech_id = None
-        receive_task = None
-        session_id = None
-        session_ready = asyncio.Event()
-        
+    name = "RealtimeTTS"
+    # 重连退避（秒）
+    backoff_initial = 0.5
+    backoff_max = 10.0
+
+    def __init__(self, url, headers, response_queue):
+        self.url = url
+        self.headers = headers
+        self.response_queue = response_queue
+        self.ws = None
+        self.receive_task = None
+        # 24000Hz -> 48000Hz 流式重采样，每段新语音开始时重置
+        self.resampler = StreamingResampler(24000, 48000)
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return self.ws is not None and self.receive_task is not None and not self.receive_task.done()
+
+    async def ensure_connected(self):
+        """确保连接可用；处于退避窗口内时直接返回False，不阻塞请求处理"""
+        if self.connected:
+            return True
+        async with self._connect_lock:
+            if self.connected:
+                return True
+            loop = asyncio.get_running_loop()
+            if loop.time() < self._next_attempt:
+                return False
+            await self._drop()
+            try:
+                self.ws = await websockets.connect(self.url, additional_headers=self.headers)
+                await self._handshake()
+                self.receive_task = asyncio.create_task(self._receive_loop())
+                self._backoff = 0.0
+                logger.info(f"{self.name} 连接已就绪")
+                return True
+            except Exception as e:
+                self._backoff = min(self.backoff_max, self._backoff * 2 or self.backoff_initial)
+                self._next_attempt = loop.time() + self._backoff
+                logger.error(f"{self.name} 建立连接失败: {e}，{self._backoff:.1f}秒后重试")
+                await self._drop()
+                return False
+
+    async def prewarm(self):
+        """在第一段语音到来之前预先建立连接"""
+        await self.ensure_connected()
+
+    async def reconnect(self):
+        """主动丢弃当前连接并立即重建（用于服务端无法中途取消的场景）"""
+        await self._drop()
+        self._next_attempt = 0.0
+        return await self.ensure_connected()
+
+    async def _receive_loop(self):
         try:
-            # 连接WebSocket
-            headers = {"Authorization": f"Bearer {audio_api_key}"}
-            
-            ws = await websockets.connect(tts_url, additional_headers=headers)
-            
-            # 等待连接成功事件
-            async def wait_for_connection():
-                """等待连接成功"""
-                nonlocal session_id
+            async for message in self.ws:
                 try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "tts.connection.done":
-                            session_id = event.get("data", {}).get("session_id")
-                            session_ready.set()
-                            break
-                        elif event_type == "tts.response.error":
-                            logger.error(f"TTS服务器错误: {event}")
-                            break
+                    self._handle_event(json.loads(message))
                 except Exception as e:
-                    logger.error(f"等待连接时出错: {e}")
-            
-            # 等待连接成功
+                    logger.error(f"{self.name} 处理消息时出错: {e}")
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"{self.name} 连接已关闭，下次请求时重连")
+        except Exception as e:
+            logger.error(f"{self.name} 消息接收出错: {e}")
+        finally:
+            self._on_disconnected()
+
+    async def _recv_until(self, event_types, timeout):
+        """握手阶段：等待指定类型的事件，返回该事件；收到错误事件时抛出异常"""
+        async def wait():
+            async for message in self.ws:
+                event = json.loads(message)
+                event_type = event.get("type")
+                if event_type in event_types:
+                    return event
+                if event_type in ("error", "tts.response.error"):
+                    raise RuntimeError(f"TTS服务器错误: {event}")
+            raise RuntimeError("连接在握手期间被关闭")
+        return await asyncio.wait_for(wait(), timeout=timeout)
+
+    async def _send(self, event):
+        await self.ws.send(json.dumps(event))
+
+    async def _drop(self):
+        if self.receive_task and not self.receive_task.done():
+            self.receive_task.cancel()
             try:
-                await asyncio.wait_for(wait_for_connection(), timeout=5.0)
-            except asyncio.TimeoutError:
-                logger.error("等待连接超时")
-                return
-            
-            if not session_ready.is_set() or not session_id:
-                logger.error("连接未能正确建立")
-                return
-            
-            # 发送创建会话事件
-            create_event = {
-                "type": "tts.create",
-                "data": {
-                    "session_id": session_id,
-                    "voice_id": voice_id,
-                    "response_format": "wav",
-                    "sample_rate": 24000
-                }
+                await self.receive_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.receive_task = None
+        if self.ws:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+        self.ws = None
+        self._on_disconnected()
+
+    def _put_audio(self, pcm_bytes):
+        if pcm_bytes:
+            self.response_queue.put(self.resampler.process_int16(pcm_bytes))
+
+    def _put_audio_tail(self):
+        """一段语音合成结束：推出重采样滤波器中的尾音"""
+        tail = self.resampler.flush_int16()
+        if tail:
+            self.response_queue.put(tail)
+
+    async def close(self):
+        await self._drop()
+
+    async def configure(self, voice_id):
+        """更换音色：丢弃当前连接，按新配置重新握手"""
+        self._apply_voice(voice_id)
+        await self.reconnect()
+
+    # ---- 子类实现 ----
+    @abstractmethod
+    async def _handshake(self):
+        ...
+
+    @abstractmethod
+    def _handle_event(self, event):
+        ...
+
+    def _on_disconnected(self):
+        pass
+
+    @abstractmethod
+    def _apply_voice(self, voice_id):
+        ...
+
+    @abstractmethod
+    async def begin_utterance(self):
+        ...
+
+    @abstractmethod
+    async def send_text(self, text):
+        ...
+
+    @abstractmethod
+    async def finish_utterance(self):
+        ...
+
+
+class QwenTTSConnection(RealtimeTTSConnection):
+    """
+    Qwen实时TTS（server_commit 模式）
+    多次 append 文本，最后 commit 触发合成；新语音开始时 clear 未提交的文本，
+    并按 commit 顺序把每个 response 归属到对应的语音代数，丢弃被打断语音的剩余音频。
+    """
+    name = "Qwen实时TTS"
+
+    def __init__(self, url, headers, response_queue, voice_id):
+        super().__init__(url, headers, response_queue)
+        # 使用 SERVER_COMMIT 模式：多次 append 文本，最后手动 commit 触发合成
+        # 这样可以累积文本，避免"一个字一个字往外蹦"的问题
+        self.session_config = {
+            "mode": "server_commit",
+            "voice": voice_id,
+            "response_format": "pcm",
+            "sample_rate": 24000,
+            "channels": 1,
+            "bit_depth": 16
+        }
+        self.generation = 0
+        self.has_uncommitted_text = False
+        self.pending_commits = deque()  # 每次commit时的语音代数，与 response.created 一一对应
+        self.response_generation = {}
+        self.last_response_generation = None
+
+    def _apply_voice(self, voice_id):
+        self.session_config["voice"] = voice_id or "Cherry"
+
+    async def _handshake(self):
+        await self._send({
+            "type": "session.update",
+            "event_id": f"event_{int(time.time() * 1000)}",
+            "session": self.session_config
+        })
+        # Qwen TTS API 返回 session.updated 而不是 session.created
+        await self._recv_until(("session.created", "session.updated"), timeout=5.0)
+
+    def _on_disconnected(self):
+        self.has_uncommitted_text = False
+        self.pending_commits.clear()
+        self.response_generation.clear()
+        self.last_response_generation = None
+
+    def _handle_event(self, event):
+        event_type = event.get("type")
+        if event_type == "response.audio.delta":
+            response_id = event.get("response_id")
+            generation = self.response_generation.get(response_id, self.last_response_generation)
+            if generation is None or generation == self.generation:
+                self._put_audio(base64.b64decode(event.get("delta", "")))
+        elif event_type == "response.created":
+            response_id = event.get("response", {}).get("id") or event.get("response_id")
+            generation = self.pending_commits.popleft() if self.pending_commits else self.generation
+            self.response_generation[response_id] = generation
+            self.last_response_generation = generation
+        elif event_type == "response.done":
+            response_id = event.get("response", {}).get("id") or event.get("response_id")
+            generation = self.response_generation.pop(response_id, self.last_response_generation)
+            if generation is None or generation == self.generation:
+                self._put_audio_tail()
+        elif event_type == "error":
+            logger.error(f"TTS错误: {event}")
+
+    async def begin_utterance(self):
+        self.generation += 1
+        self.resampler.reset()
+        if self.connected and self.has_uncommitted_text:
+            try:
+                await self._send({
+                    "type": "input_text_buffer.clear",
+                    "event_id": f"event_{int(time.time() * 1000)}_clear"
+                })
+            except Exception as e:
+                logger.error(f"清空文本缓冲区失败: {e}")
+        self.has_uncommitted_text = False
+
+    async def send_text(self, text):
+        if not await self.ensure_connected():
+            return
+        # 追加文本到缓冲区（不立即提交，等待响应完成时的终止信号再 commit）
+        await self._send({
+            "type": "input_text_buffer.append",
+            "event_id": f"event_{int(time.time() * 1000)}",
+            "text": text
+        })
+        self.has_uncommitted_text = True
+
+    async def finish_utterance(self):
+        # 提交缓冲区完成当前合成（仅当之前有文本时）
+        if not self.connected or not self.has_uncommitted_text:
+            return
+        await self._send({
+            "type": "input_text_buffer.commit",
+            "event_id": f"event_{int(time.time() * 1000)}_interrupt_commit"
+        })
+        self.pending_commits.append(self.generation)
+        self.has_uncommitted_text = False
+
+
+class StepTTSConnection(RealtimeTTSConnection):
+    """
+    StepFun实时TTS
+    一段语音完整结束（收到 audio.done）后，在同一连接上重新 tts.create 开始下一段；
+    服务端不支持中途取消，因此语音被打断时丢弃旧连接并立即重建。
+    """
+    name = "StepFun实时TTS"
+
+    def __init__(self, url, headers, response_queue, voice_id):
+        super().__init__(url, headers, response_queue)
+        self.voice_id = voice_id
+        self.session_id = None
+        self.needs_create = False  # 上一段语音已结束，下一段需要重新 tts.create
+        self.in_progress = False   # 已发送文本但还未收到 audio.done
+
+    def _create_event(self):
+        return {
+            "type": "tts.create",
+            "data": {
+                "session_id": self.session_id,
+                "voice_id": self.voice_id,
+                "response_format": "wav",
+                "sample_rate": 24000
             }
-            await ws.send(json.dumps(create_event))
-            
-            # 等待会话创建成功
-            async def wait_for_session_ready():
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "tts.response.created":
-                            break
-                        elif event_type == "tts.response.error":
-                            logger.error(f"创建会话错误: {event}")
-                            break
-                except Exception as e:
-                    logger.error(f"等待会话创建时出错: {e}")
-            
+        }
+
+    def _apply_voice(self, voice_id):
+        self.voice_id = voice_id or "qingchunshaonv"
+
+    async def _handshake(self):
+        event = await self._recv_until(("tts.connection.done",), timeout=5.0)
+        self.session_id = event.get("data", {}).get("session_id")
+        if not self.session_id:
+            raise RuntimeError("连接未能正确建立")
+        await self._send(self._create_event())
+        try:
+            await self._recv_until(("tts.response.created",), timeout=3.0)
+        except asyncio.TimeoutError:
+            logger.warning("会话创建超时")
+        self.needs_create = False
+        self.in_progress = False
+
+    def _on_disconnected(self):
+        self.in_progress = False
+
+    def _handle_event(self, event):
+        event_type = event.get("type")
+        if event_type == "tts.response.audio.delta":
+            # StepFun 返回 BASE64 编码的完整音频（包含 wav header）
+            audio_b64 = event.get("data", {}).get("audio", "")
+            if audio_b64:
+                with io.BytesIO(base64.b64decode(audio_b64)) as wav_io:
+                    with wave.open(wav_io, 'rb') as wav_file:
+                        pcm_data = wav_file.readframes(wav_file.getnframes())
+                self._put_audio(pcm_data)
+        elif event_type == "tts.response.audio.done":
+            self.in_progress = False
+            self._put_audio_tail()
+        elif event_type == "tts.response.error":
+            logger.error(f"TTS错误: {event}")
+
+    async def begin_utterance(self):
+        self.resampler.reset()
+        if self.in_progress:
+            # 旧语音仍在合成，无法在同一连接上取消，直接换一条新连接
+            await self.reconnect()
+        elif self.connected and self.needs_create:
             try:
-                await asyncio.wait_for(wait_for_session_ready(), timeout=3.0)
-            except asyncio.TimeoutError:
-                logger.warning("会话创建超时")
-            
-            # 初始接收任务
-            async def receive_messages_initial():
-                """初始接收任务"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "tts.response.error":
-                            logger.error(f"TTS错误: {event}")
-                        elif event_type == "tts.response.audio.delta":
-                            try:
-                                # StepFun 返回 BASE64 编码的完整音频（包含 wav header）
-                                audio_b64 = event.get("data", {}).get("audio", "")
-                                if audio_b64:
-                                    audio_bytes = base64.b64decode(audio_b64)
-                                    # 使用 wave 模块读取 WAV 数据
-                                    with io.BytesIO(audio_bytes) as wav_io:
-                                        with wave.open(wav_io, 'rb') as wav_file:
-                                            # 读取音频数据
-                                            pcm_data = wav_file.readframes(wav_file.getnframes())
-                                    
-                                    # 转换为 numpy 数组
-                                    audio_array = np.frombuffer(pcm_data, dtype=np.int16)
-                                    # 重采样 24000Hz -> 48000Hz
-                                    resampled = np.repeat(audio_array, 48000 // 24000)
-                                    response_queue.put(resampled.tobytes())
-                            except Exception as e:
-                                logger.error(f"处理音频数据时出错: {e}")
-                except websockets.exceptions.ConnectionClosed:
-                    pass
-                except Exception as e:
-                    logger.error(f"消息接收出错: {e}")
-            
-            receive_task = asyncio.create_task(receive_messages_initial())
-            
-            # 主循环：处理请求队列
-            loop = asyncio.get_running_loop()
-            while True:
-                try:
-                    sid, tts_text = await loop.run_in_executor(None, request_queue.get)
-                except Exception:
-                    break
-                
+                await self._send(self._create_event())
+                self.needs_create = False
+            except Exception as e:
+                logger.error(f"创建TTS会话失败: {e}")
+                await self.reconnect()
+
+    async def send_text(self, text):
+        if not await self.ensure_connected():
+            return
+        await self._send({
+            "type": "tts.text.delta",
+            "data": {
+                "session_id": self.session_id,
+                "text": text
+            }
+        })
+        self.in_progress = True
+
+    async def finish_utterance(self):
+        if not self.connected or not self.in_progress:
+            return
+        await self._send({
+            "type": "tts.text.done",
+            "data": {"session_id": self.session_id}
+        })
+        self.needs_create = True
+
+
+async def _run_realtime_tts(connection, request_queue):
+    """实时TTS worker 主循环：预热连接，然后按 speech_id 复用同一条连接"""
+    loop = asyncio.get_running_loop()
+    current_speech_id = None
+    prewarm_task = asyncio.create_task(connection.prewarm())
+    # 预热结束（无论成功与否）即通知就绪：失败时会在第一段语音到来时重连
+    prewarm_task.add_done_callback(lambda _: connection.response_queue.put(TTS_READY))
+    try:
+        while True:
+            try:
+                sid, tts_text = await loop.run_in_executor(None, request_queue.get)
+            except Exception:
+                break
+
+            try:
+                if sid == TTS_CONFIGURE:
+                    current_speech_id = None
+                    await connection.configure(tts_text.get("voice_id"))
+                    continue
+
                 if sid is None:
-                    # 提交缓冲区完成当前合成
-                    if ws and session_id and current_speech_id is not None:
-                        try:
-                            done_event = {
-                                "type": "tts.text.done",
-                                "data": {"session_id": session_id}
-                            }
-                            await ws.send(json.dumps(done_event))
-                        except Exception as e:
-                            logger.error(f"完成生成失败: {e}")
+                    # 终止信号：提交当前语音
+                    if current_speech_id is not None:
+                        await connection.finish_utterance()
                     continue
-                
-                # 新的语音ID，重新建立连接
+
                 if current_speech_id != sid:
                     current_speech_id = sid
-                    if ws:
-                        try:
-                            await ws.close()
-                        except:
-                            pass
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
-                        try:
-                            await receive_task
-                        except asyncio.CancelledError:
-                            pass
-                    
-                    # 建立新连接
-                    try:
-                        ws = await websockets.connect(tts_url, additional_headers=headers)
-                        
-                        # 等待连接成功
-                        session_id = None
-                        session_ready.clear()
-                        
-                        async def wait_conn():
-                            nonlocal session_id
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    if event.get("type") == "tts.connection.done":
-                                        session_id = event.get("data", {}).get("session_id")
-                                        session_ready.set()
-                                        break
-                            except Exception:
-                                pass
-                        
-                        try:
-                            await asyncio.wait_for(wait_conn(), timeout=3.0)
-                        except asyncio.TimeoutError:
-                            logger.warning("新连接超时")
-                            continue
-                        
-                        if not session_id:
-                            continue
-                        
-                        # 创建会话
-                        await ws.send(json.dumps({
-                            "type": "tts.create",
-                            "data": {
-                                "session_id": session_id,
-                                "voice_id": voice_id,
-                                "response_format": "wav",
-                                "sample_rate": 24000
-                            }
-                        }))
-                        
-                        # 启动新的接收任务
-                        async def receive_messages():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    
-                                    if event_type == "tts.response.error":
-                                        logger.error(f"TTS错误: {event}")
-                                    elif event_type == "tts.response.audio.delta":
-                                        try:
-                                            audio_b64 = event.get("data", {}).get("audio", "")
-                                            if audio_b64:
-                                                audio_bytes = base64.b64decode(audio_b64)
-                                                # 使用 wave 模块读取 WAV 数据
-                                                with io.BytesIO(audio_bytes) as wav_io:
-                                                    with wave.open(wav_io, 'rb') as wav_file:
-                                                        # 读取音频数据
-                                                        pcm_data = wav_file.readframes(wav_file.getnframes())
-                                                
-                                                # 转换为 numpy 数组
-                                                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
-                                                # 重采样 24000Hz -> 48000Hz
-                                                resampled = np.repeat(audio_array, 48000 // 24000)
-                                                response_queue.put(resampled.tobytes())
-                                        except Exception as e:
-                                            logger.error(f"处理音频数据时出错: {e}")
-                            except websockets.exceptions.ConnectionClosed:
-                                pass
-                            except Exception as e:
-                                logger.error(f"消息接收出错: {e}")
-                        
-                        receive_task = asyncio.create_task(receive_messages())
-                        
-                    except Exception as e:
-                        logger.error(f"重新建立连接失败: {e}")
-                        continue
-                
+                    await connection.begin_utterance()
+
                 # 检查文本有效性
                 if not tts_text or not tts_text.strip():
                     continue
-                
-                if not ws or not session_id:
-                    continue
-                
-                # 发送文本
-                try:
-                    text_event = {
-                        "type": "tts.text.delta",
-                        "data": {
-                            "session_id": session_id,
-                            "text": tts_text
-                        }
-                    }
-                    await ws.send(json.dumps(text_event))
-                except Exception as e:
-                    logger.error(f"发送TTS文本失败: {e}")
-        
-        except Exception as e:
-            logger.error(f"StepFun实时TTS Worker错误: {e}")
-        finally:
-            # 清理资源
-            if receive_task and not receive_task.done():
-                receive_task.cancel()
-                try:
-                    await receive_task
-                except asyncio.CancelledError:
-                    pass
-            
-            if ws:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
-    
+                await connection.send_text(tts_text)
+            except websockets.exceptions.ConnectionClosed:
+                logger.warning(f"{connection.name} 连接已断开，将在下一次请求时重连")
+            except Exception as e:
+                logger.error(f"发送TTS请求失败: {e}")
+    finally:
+        if not prewarm_task.done():
+            prewarm_task.cancel()
+        await connection.close()
+
+
+def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice_id, free_mode=False):
+    """
+    StepFun实时TTS worker（用于默认音色）
+    使用阶跃星辰的实时TTS API（step-tts-mini）
+
+    Args:
+        request_queue: 多进程请求队列，接收(speech_id, text)元组
+        response_queue: 响应通道（TTSResponseChannel），put 音频数据
+        audio_api_key: API密钥
+        voice_id: 音色ID，默认使用"qingchunshaonv"
+    """
+    # 使用默认音色 "qingchunshaonv"
+    if not voice_id:
+        voice_id = "qingchunshaonv"
+
+    if free_mode:
+        tts_url = "ws://47.100.209.206:9806" # 还在备案，之后会换成wss+域名
+    else:
+        tts_url = "wss://api.stepfun.com/v1/realtime/audio?model=step-tts-mini"
+    headers = {"Authorization": f"Bearer {audio_api_key}"}
+
+    async def async_worker():
+        """异步TTS worker主循环"""
+        connection = StepTTSConnection(tts_url, headers, response_queue, voice_id)
+        await _run_realtime_tts(connection, request_queue)
+
     # 运行异步worker
     try:
         asyncio.run(async_worker())
@@ -315,232 +460,24 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
     """
     Qwen实时TTS worker（用于默认音色）
     使用阿里云的实时TTS API（qwen3-tts-flash-2025-09-18）
-    
+
     Args:
         request_queue: 多进程请求队列，接收(speech_id, text)元组
-        response_queue: 多进程响应队列，发送音频数据
+        response_queue: 响应通道（TTSResponseChannel），put 音频数据
         audio_api_key: API密钥
         voice_id: 音色ID，默认使用"Cherry"
     """
-    import asyncio
-
     if not voice_id:
         voice_id = "Cherry"
-    
+
+    tts_url = "wss://dashscope.aliyuncs.com/api-ws/v1/realtime?model=qwen3-tts-flash-realtime-2025-09-18"
+    headers = {"Authorization": f"Bearer {audio_api_key}"}
+
     async def async_worker():
         """异步TTS worker主循环"""
-        tts_url = "wss://dashscope.aliyuncs.com/api-ws/v1/realtime?model=qwen3-tts-flash-realtime-2025-09-18"
-        ws = None
-        current_speech_id = None
-        receive_task = None
-        session_ready = asyncio.Event()
-        
-        try:
-            # 连接WebSocket
-            headers = {"Authorization": f"Bearer {audio_api_key}"}
-            
-            # 配置会话消息模板（在重连时复用）
-            # 使用 SERVER_COMMIT 模式：多次 append 文本，最后手动 commit 触发合成
-            # 这样可以累积文本，避免"一个字一个字往外蹦"的问题
-            config_message = {
-                "type": "session.update",
-                "event_id": f"event_{int(time.time() * 1000)}",
-                "session": {
-                    "mode": "server_commit",
-                    "voice": voice_id,
-                    "response_format": "pcm",
-                    "sample_rate": 24000,
-                    "channels": 1,
-                    "bit_depth": 16
-                }
-            }
-            
-            ws = await websockets.connect(tts_url, additional_headers=headers)
-            
-            # 等待并处理初始消息
-            async def wait_for_session_ready():
-                """等待会话创建确认"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        # Qwen TTS API 返回 session.updated 而不是 session.created
-                        if event_type in ["session.created", "session.updated"]:
-                            session_ready.set()
-                            break
-                        elif event_type == "error":
-                            logger.error(f"TTS服务器错误: {event}")
-                            break
-                except Exception as e:
-                    logger.error(f"等待会话就绪时出错: {e}")
-            
-            # 发送配置
-            await ws.send(json.dumps(config_message))
-            
-            # 等待会话就绪（超时5秒）
-            try:
-                await asyncio.wait_for(wait_for_session_ready(), timeout=5.0)
-            except asyncio.TimeoutError:
-                logger.error("❌ 等待会话就绪超时")
-                return
-            
-            if not session_ready.is_set():
-                logger.error("❌ 会话未能正确初始化")
-                return
-            
-            # 初始接收任务（会在每次新 speech_id 时重新创建）
-            async def receive_messages_initial():
-                """初始接收任务"""
-                try:
-                    async for message in ws:
-                        event = json.loads(message)
-                        event_type = event.get("type")
-                        
-                        if event_type == "error":
-                            logger.error(f"TTS错误: {event}")
-                        elif event_type == "response.audio.delta":
-                            try:
-                                audio_bytes = base64.b64decode(event.get("delta", ""))
-                                audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                resampled = np.repeat(audio_array, 2)
-                                response_queue.put(resampled.tobytes())
-                            except Exception as e:
-                                logger.error(f"处理音频数据时出错: {e}")
-                except websockets.exceptions.ConnectionClosed:
-                    pass
-                except Exception as e:
-                    logger.error(f"消息接收出错: {e}")
-            
-            receive_task = asyncio.create_task(receive_messages_initial())
-            
-            # 主循环：处理请求队列
-            loop = asyncio.get_running_loop()
-            while True:
-                # 非阻塞检查队列
-                try:
-                    sid, tts_text = await loop.run_in_executor(None, request_queue.get)
-                except Exception:
-                    break
-                
-                if sid is None:
-                    # 提交缓冲区完成当前合成（仅当之前有文本时）
-                    if ws and session_ready.is_set() and current_speech_id is not None:
-                        try:
-                            await ws.send(json.dumps({
-                                "type": "input_text_buffer.commit",
-                                "event_id": f"event_{int(time.time() * 1000)}_interrupt_commit"
-                            }))
-                        except Exception as e:
-                            logger.error(f"提交缓冲区失败: {e}")
-                    continue
-                
-                # 新的语音ID，重新建立连接（类似 speech_synthesis_worker 的逻辑）
-                # 直接关闭旧连接，打断旧语音
-                if current_speech_id != sid:
-                    current_speech_id = sid
-                    if ws:
-                        try:
-                            await ws.close()
-                        except:
-                            pass
-                    if receive_task and not receive_task.done():
-                        receive_task.cancel()
-                        try:
-                            await receive_task
-                        except asyncio.CancelledError:
-                            pass
-                    
-                    # 建立新连接
-                    try:
-                        ws = await websockets.connect(tts_url, additional_headers=headers)
-                        await ws.send(json.dumps(config_message))
-                        
-                        # 等待 session.created
-                        session_ready.clear()
-                        
-                        async def wait_ready():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    # Qwen TTS API 返回 session.updated 而不是 session.created
-                                    if event_type in ["session.created", "session.updated"]:
-                                        session_ready.set()
-                                        break
-                                    elif event_type == "error":
-                                        logger.error(f"等待期间收到错误: {event}")
-                                        break
-                            except Exception as e:
-                                logger.error(f"wait_ready 异常: {e}")
-                        
-                        try:
-                            await asyncio.wait_for(wait_ready(), timeout=2.0)
-                        except asyncio.TimeoutError:
-                            logger.warning("新会话创建超时")
-                        
-                        # 启动新的接收任务
-                        async def receive_messages():
-                            try:
-                                async for message in ws:
-                                    event = json.loads(message)
-                                    event_type = event.get("type")
-                                    
-                                    if event_type == "error":
-                                        logger.error(f"TTS错误: {event}")
-                                    elif event_type == "response.audio.delta":
-                                        try:
-                                            audio_bytes = base64.b64decode(event.get("delta", ""))
-                                            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                            resampled = np.repeat(audio_array, 2)
-                                            response_queue.put(resampled.tobytes())
-                                        except Exception as e:
-                                            logger.error(f"处理音频数据时出错: {e}")
-                            except websockets.exceptions.ConnectionClosed:
-                                pass
-                            except Exception as e:
-                                logger.error(f"消息接收出错: {e}")
-                        
-                        receive_task = asyncio.create_task(receive_messages())
-                        
-                    except Exception as e:
-                        logger.error(f"重新建立连接失败: {e}")
-                        continue
-                
-                # 检查文本有效性
-                if not tts_text or not tts_text.strip():
-                    continue
-                
-                if not ws or not session_ready.is_set():
-                    continue
-                
-                # 追加文本到缓冲区（不立即提交，等待响应完成时的终止信号再 commit）
-                try:
-                    await ws.send(json.dumps({
-                        "type": "input_text_buffer.append",
-                        "event_id": f"event_{int(time.time() * 1000)}",
-                        "text": tts_text
-                    }))
-                except Exception as e:
-                    logger.error(f"发送TTS文本失败: {e}")
-        
-        except Exception as e:
-            logger.error(f"Qwen实时TTS Worker错误: {e}")
-        finally:
-            # 清理资源
-            if receive_task and not receive_task.done():
-                receive_task.cancel()
-                try:
-                    await receive_task
-                except asyncio.CancelledError:
-                    pass
-            
-            if ws:
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
-    
+        connection = QwenTTSConnection(tts_url, headers, response_queue, voice_id)
+        await _run_realtime_tts(connection, request_queue)
+
     # 运行异步worker
     try:
         asyncio.run(async_worker())
@@ -554,7 +491,7 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
     
     Args:
         request_queue: 多进程请求队列，接收(speech_id, text)元组
-        response_queue: 多进程响应队列，发送音频数据
+        response_queue: 响应通道（TTSResponseChannel），put 音频数据
         audio_api_key: API密钥
         voice_id: 音色ID
     """
@@ -566,16 +503,17 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
     class Callback(ResultCallback):
         def __init__(self, response_queue):
             self.response_queue = response_queue
-            self.cache = np.zeros(0).astype(np.float32)
+            # 流式重采样器自带跨chunk状态，收到数据即可转发，无需再攒够8000个采样点
+            self.resampler = StreamingResampler(24000, 48000)
             
         def on_open(self): 
-            pass
+            self.resampler.reset()
             
         def on_complete(self): 
-            if len(self.cache) > 0:
-                data = (resample(self.cache, orig_sr=24000, target_sr=48000) * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
-                self.response_queue.put(data)
-                self.cache = np.zeros(0).astype(np.float32)
+            # 正常结束：把滤波器中的尾音发出去，而不是直接丢弃
+            tail = self.resampler.flush_int16()
+            if tail:
+                self.response_queue.put(tail)
                 
         def on_error(self, message: str): 
             print(f"TTS Error: {message}")
@@ -587,17 +525,13 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
             pass
             
         def on_data(self, data: bytes) -> None:
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
-            self.cache = np.concatenate([self.cache, audio])
-            if len(self.cache) >= 8000:
-                data = self.cache[:8000]
-                data = (resample(data, orig_sr=24000, target_sr=48000) * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
-                self.response_queue.put(data)
-                self.cache = self.cache[8000:]
+            if data:
+                self.response_queue.put(self.resampler.process_int16(data))
             
     callback = Callback(response_queue)
     current_speech_id = None
     synthesizer = None
+    response_queue.put(TTS_READY)
     
     while True:
         # 非阻塞检查队列，优先处理打断
@@ -607,6 +541,18 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
 
         sid, tts_text = request_queue.get()
 
+        if sid == TTS_CONFIGURE:
+            # 换音色：下一段语音用新音色重新创建合成器
+            voice_id = tts_text.get("voice_id") or voice_id
+            if synthesizer is not None:
+                try:
+                    synthesizer.close()
+                except Exception:
+                    pass
+            synthesizer = None
+            current_speech_id = None
+            continue
+
         if sid is None:
             # 停止当前合成
             if synthesizer is not None:
@@ -660,7 +606,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
     
     Args:
         request_queue: 多进程请求队列，接收(speech_id, text)元组
-        response_queue: 多进程响应队列，发送音频数据
+        response_queue: 响应通道（TTSResponseChannel），put 音频数据
         audio_api_key: API密钥
         voice_id: 音色ID，默认使用"tongtong"（支持：tongtong, chuichui, xiaochen, jam, kazi, douji, luodo）
     """
@@ -672,9 +618,11 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
     
     async def async_worker():
         """异步TTS worker主循环"""
+        nonlocal voice_id
         tts_url = "https://open.bigmodel.cn/api/paas/v4/audio/speech"
         current_speech_id = None
         text_buffer = []  # 累积文本缓冲区
+        response_queue.put(TTS_READY)
         
         try:
             loop = asyncio.get_running_loop()
@@ -685,6 +633,10 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                 except Exception:
                     break
                 
+                if sid == TTS_CONFIGURE:
+                    voice_id = tts_text.get("voice_id") or "tongtong"
+                    continue
+                
                 # 新的语音ID，清空缓冲区并重新开始
                 if current_speech_id != sid and sid is not None:
                     current_speech_id = sid
@@ -721,6 +673,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                             # 使用缓冲区逐块读取，避免 "Chunk too big" 错误
                                             buffer = ""
                                             first_audio_received = False  # 用于调试第一个音频块
+                                            resampler = None  # 按返回的采样率在收到第一个音频块时创建
                                             async for chunk in resp.content.iter_any():
                                                 # 解码并添加到缓冲区
                                                 buffer += chunk.decode('utf-8')
@@ -760,32 +713,41 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                                                     # 从返回的 return_sample_rate 获取采样率
                                                                     sample_rate = delta.get('return_sample_rate', 24000)
                                                                     
-                                                                    # 转换为 float32 进行高质量重采样
-                                                                    audio_array = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
-                                                                    
+                                                                    pcm = audio_bytes
                                                                     # 对第一个音频块，裁剪掉开头的噪音部分（CogTTS有初始化噪音）
                                                                     if not first_audio_received:
                                                                         first_audio_received = True
+                                                                        pcm = np.frombuffer(audio_bytes, dtype=np.int16)
                                                                         # 裁剪掉前 1s 的音频（通常包含初始化噪音）
                                                                         trim_samples = int(sample_rate)
-                                                                        if len(audio_array) > trim_samples:
-                                                                            audio_array = audio_array[trim_samples:]
+                                                                        if len(pcm) > trim_samples:
+                                                                            pcm = pcm[trim_samples:].copy()
                                                                             logger.debug(f"裁剪第一个音频块的前 {trim_samples} 个采样点（{trim_samples/sample_rate:.2f}秒）")
+                                                                        else:
+                                                                            pcm = pcm.copy()
                                                                         # 对裁剪后的开头应用短淡入（10ms），平滑过渡
-                                                                        fade_samples = min(int(sample_rate * 0.01), len(audio_array))
+                                                                        fade_samples = min(int(sample_rate * 0.01), len(pcm))
                                                                         if fade_samples > 0:
                                                                             fade_curve = np.linspace(0.0, 1.0, fade_samples)
-                                                                            audio_array[:fade_samples] *= fade_curve
+                                                                            pcm[:fade_samples] = pcm[:fade_samples] * fade_curve
                                                                     
-                                                                    # 使用 librosa 进行高质量重采样
-                                                                    resampled = resample(audio_array, orig_sr=sample_rate, target_sr=48000)
-                                                                    # 转回 int16 格式
-                                                                    resampled_int16 = (resampled * 32768.0).clip(-32768, 32767).astype(np.int16)
-                                                                    response_queue.put(resampled_int16.tobytes())
+                                                                    # 流式重采样到 48000Hz（跨音频块保留滤波器状态）
+                                                                    if resampler is None or resampler.orig_sr != int(sample_rate):
+                                                                        if resampler is not None:
+                                                                            tail = resampler.flush_int16()
+                                                                            if tail:
+                                                                                response_queue.put(tail)
+                                                                        resampler = StreamingResampler(sample_rate, 48000)
+                                                                    response_queue.put(resampler.process_int16(pcm))
                                                         except json.JSONDecodeError as e:
                                                             logger.warning(f"解析SSE JSON失败: {e}")
                                                         except Exception as e:
                                                             logger.error(f"处理音频数据时出错: {e}")
+                                            # 本段语音结束：推出重采样滤波器中的尾音
+                                            if resampler is not None:
+                                                tail = resampler.flush_int16()
+                                                if tail:
+                                                    response_queue.put(tail)
                                         else:
                                             error_text = await resp.text()
                                             logger.error(f"CogTTS API错误 ({resp.status}): {error_text}")
@@ -817,11 +779,12 @@ def dummy_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
     
     Args:
         request_queue: 多进程请求队列，接收(speech_id, text)元组
-        response_queue: 多进程响应队列（不使用）
+        response_queue: 响应通道（不使用）
         audio_api_key: API密钥（不使用）
         voice_id: 音色ID（不使用）
     """
     logger.warning("TTS Worker 未启用，不会生成语音")
+    response_queue.put(TTS_READY)
     
     while True:
         try:
@@ -0,0 +1,200 @@
+"""
+常驻TTS worker 监管
+每个角色一个 TTS 子进程，跨会话复用：会话开始/结束不再重复创建进程、导入依赖和建立服务商连接。
+- 只换音色时通过 TTS_CONFIGURE 消息让 worker 就地重配置；服务商或密钥变化时才重启进程
+- 进程意外退出时按指数退避自动重启
+- health() 返回进程状态，供健康检查接口使用
+"""
+import asyncio
+import logging
+import time
+from functools import partial
+from multiprocessing import Process, Queue as MPQueue
+
+from main_helper.tts_helper import get_tts_worker, TTS_CONFIGURE
+from utils.shm_ring import TTSAudioReceiver
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_identity(worker):
+    """worker 函数的可比较标识；get_tts_worker 每次都会为 free 模式新建 partial，按其内容比较"""
+    if isinstance(worker, partial):
+        return worker.func, worker.args, tuple(sorted(worker.keywords.items()))
+    return worker
+
+
+class TTSWorkerSupervisor:
+    """
+    单个角色的常驻 TTS worker
+
+    音频通道（TTSAudioReceiver）在监管者的整个生命周期内保持不变，进程重启后仍写入同一个环形缓冲，
+    消费方（LLMSessionManager.tts_response_handler）无需重新绑定。
+    """
+
+    # 检查进程存活的间隔（秒）
+    WATCH_INTERVAL = 1.0
+    # 崩溃重启退避（秒）
+    RESTART_BACKOFF_INITIAL = 0.5
+    RESTART_BACKOFF_MAX = 30.0
+    # 进程稳定运行超过该秒数后重置退避
+    STABLE_AFTER = 60.0
+
+    def __init__(self, lanlan_name):
+        self.lanlan_name = lanlan_name
+        self.request_queue = None
+        self.audio = None
+        self.process = None
+        self.ready_event = asyncio.Event()
+        self.core_api_type = None
+        self.voice_id = None
+        self._worker = None
+        self._api_key = None
+        self.restarts = 0
+        self.started_at = None
+        self._backoff = 0.0
+        self._watchdog = None
+        self._closed = False
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    async def ensure(self, core_api_type, voice_id, api_key):
+        """
+        确保 worker 以给定配置运行
+        以实际运行的 worker 函数和它使用的密钥判断是否需要重启：两者都未变时直接复用，
+        只有音色变化时发送重配置消息（例如自定义音色下切换 core API 仍由同一个 CosyVoice worker 合成）。
+        """
+        self._closed = False
+        worker = get_tts_worker(core_api_type=core_api_type, has_custom_voice=bool(voice_id))
+        spec_changed = (_worker_identity(worker), api_key) != (_worker_identity(self._worker), self._api_key)
+        if self.is_alive() and not spec_changed:
+            if voice_id != self.voice_id:
+                logger.info(f"{self.lanlan_name} 的TTS音色切换为 {voice_id}")
+                self.request_queue.put((TTS_CONFIGURE, {"voice_id": voice_id}))
+                self.voice_id = voice_id
+            self.core_api_type = core_api_type
+            return
+        self.core_api_type, self.voice_id, self._worker, self._api_key = core_api_type, voice_id, worker, api_key
+        self._stop_process()
+        self._spawn()
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch())
+
+    def _spawn(self):
+        has_custom_voice = bool(self.voice_id)
+        if self.audio is None:
+            self.audio = TTSAudioReceiver()
+            self.audio.start()
+        else:
+            self.audio.clear()
+        self.ready_event.clear()
+        self.request_queue = MPQueue()
+        self.process = Process(
+            target=self._worker,
+            args=(self.request_queue, self.audio.channel(), self._api_key, self.voice_id),
+            daemon=True
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        tts_type = "自定义音色(CosyVoice)" if has_custom_voice else f"{self.core_api_type}默认TTS"
+        logger.info(f"{self.lanlan_name} 的TTS进程已启动（pid={self.process.pid}），使用: {tts_type}")
+
+    def _stop_process(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            if process.is_alive():
+                self.request_queue.put((None, None))
+                process.terminate()
+                process.join(timeout=2.0)
+                if process.is_alive():
+                    process.kill()
+                    process.join(timeout=1.0)
+        except Exception as e:
+            logger.error(f"💥 关闭TTS进程时出错: {e}")
+        self.ready_event.clear()
+
+    async def _watch(self):
+        """进程意外退出时自动重启"""
+        while not self._closed:
+            await asyncio.sleep(self.WATCH_INTERVAL)
+            if self._closed or self.process is None or self.process.is_alive():
+                continue
+            uptime = time.monotonic() - (self.started_at or 0)
+            if uptime > self.STABLE_AFTER:
+                self._backoff = 0.0
+            self._backoff = min(self.RESTART_BACKOFF_MAX, self._backoff * 2 or self.RESTART_BACKOFF_INITIAL)
+            logger.warning(f"{self.lanlan_name} 的TTS进程意外退出（exitcode={self.process.exitcode}），{self._backoff:.1f}秒后重启")
+            self.process = None
+            self.ready_event.clear()
+            await asyncio.sleep(self._backoff)
+            if self._closed:
+                break
+            try:
+                self._spawn()
+                self.restarts += 1
+            except Exception as e:
+                logger.error(f"💥 重启TTS进程失败: {e}")
+
+    async def wait_ready(self, poll_interval=0.5):
+        """等待 worker 的就绪握手（由音频消费方收到 TTS_READY 后调用 mark_ready）"""
+        while not self.ready_event.is_set():
+            if not self.is_alive():
+                raise RuntimeError("TTS进程在就绪前退出")
+            try:
+                await asyncio.wait_for(self.ready_event.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def mark_ready(self):
+        self.ready_event.set()
+
+    def interrupt(self):
+        """打断当前合成并丢弃未发送的请求和音频（会话结束时调用，进程保持运行）"""
+        if self.is_alive():
+            try:
+                while not self.request_queue.empty():
+                    self.request_queue.get_nowait()
+            except Exception:
+                pass
+            try:
+                self.request_queue.put((None, None))
+            except Exception as e:
+                logger.warning(f"⚠️ 发送TTS中断信号失败: {e}")
+        if self.audio is not None:
+            self.audio.clear()
+
+    def health(self):
+        alive = self.is_alive()
+        return {
+            "alive": alive,
+            "ready": alive and self.ready_event.is_set(),
+            "pid": self.process.pid if self.process is not None else None,
+            "provider": self.core_api_type,
+            "custom_voice": bool(self.voice_id),
+            "restarts": self.restarts,
+            "uptime": round(time.monotonic() - self.started_at, 1) if alive and self.started_at else 0.0,
+            "audio_dropped": self.audio.dropped if self.audio is not None else 0,
+        }
+
+    async def shutdown(self):
+        """停止监管并关闭进程、释放共享内存（服务器退出时调用）"""
+        self._closed = True
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            try:
+                await self._watchdog
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._watchdog = None
+        self._stop_process()
+        if self.audio is not None:
+            try:
+                if self.audio.dropped:
+                    logger.warning(f"TTS音频环形缓冲累计丢弃 {self.audio.dropped} 个音频块")
+                self.audio.close()
+            except Exception as e:
+                logger.error(f"💥 释放TTS音频缓冲时出错: {e}")
+            self.audio = None
@@ -19,6 +19,7 @@ from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, JSONResponse
 from utils.preferences import load_user_preferences, update_model_preferences, validate_model_preferences, move_model_to_top
 from utils.frontend_utils import find_models
+from utils.audio import parse_binary_stream_frame
 from multiprocessing import Process, Queue, Event
 import atexit
 import dashscope
@@ -26,10 +27,9 @@ from dashscope.audio.tts_v2 import VoiceEnrollmentService
 import requests
 import httpx
 import pathlib, wave
-from openai import AsyncOpenAI
+from utils.llm_client import get_async_openai
 from config import get_character_data, get_core_config, MAIN_SERVER_PORT, MODELS_WITH_EXTRA_BODY, load_characters, save_characters, TOOL_SERVER_PORT, CORE_CONFIG_PATH
 from config.prompts_sys import emotion_analysis_prompt
-import glob
 
 templates = Jinja2Templates(directory="./")
 
@@ -360,6 +360,21 @@ async def shutdown_event():
             if sync_process[k].is_alive():
                 sync_process[k].terminate()  # 如果超时，强制终止
     logger.info("同步连接器进程已停止")
+
+    # 关闭各角色的常驻TTS进程和realtime预热连接
+    for k in session_manager:
+        try:
+            await session_manager[k].tts_worker.shutdown()
+        except Exception as e:
+            logger.error(f"关闭 {k} 的TTS进程失败: {e}")
+        try:
+            await session_manager[k].realtime_pool.shutdown()
+        except Exception as e:
+            logger.error(f"关闭 {k} 的realtime预热连接失败: {e}")
+        try:
+            await session_manager[k].close_memory_client()
+        except Exception as e:
+            logger.error(f"关闭 {k} 的memory_server连接失败: {e}")
     
     # 向memory_server发送关闭信号
     try:
@@ -386,12 +401,21 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
 
     try:
         while True:
-            data = await websocket.receive_text()
+            raw = await websocket.receive()
+            if raw["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(raw.get("code", 1000))
             if session_id[lanlan_name] != this_session_id:
                 await session_manager[lanlan_name].send_status(f"切换至另一个终端...")
                 await websocket.close()
                 break
-            message = json.loads(data)
+            if raw.get("bytes") is not None:
+                # 二进制帧：麦克风PCM16（协议见 utils.audio.parse_binary_stream_frame）
+                message = parse_binary_stream_frame(raw["bytes"])
+                if message is None:
+                    logger.warning(f"收到无法解析的二进制帧，长度: {len(raw['bytes'])}")
+                    continue
+            else:
+                message = json.loads(raw.get("text") or "{}")
             action = message.get("action")
             # logger.debug(f"WebSocket received action: {action}") # Optional debug log
 
@@ -401,7 +425,9 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
                 if input_type in ['audio', 'screen', 'camera', 'text']:
                     # 传递input_mode参数，告知session manager使用何种模式
                     mode = 'text' if input_type == 'text' else 'audio'
-                    asyncio.create_task(session_manager[lanlan_name].start_session(websocket, message.get("new_session", False), mode))
+                    # 前端声明支持二进制音频帧时启用，否则沿用JSON数组格式
+                    binary_audio = message.get("audio_protocol") == "binary"
+                    asyncio.create_task(session_manager[lanlan_name].start_session(websocket, message.get("new_session", False), mode, binary_audio=binary_audio))
                 else:
                     await session_manager[lanlan_name].send_status(f"Invalid input type: {input_type}")
 
@@ -1094,10 +1120,9 @@ async def unregister_voice(name: str):
 async def get_recent_files():
     """获取 memory 目录下所有 recent*.json 文件名列表"""
     from utils.config_manager import get_config_manager
+    from utils.segment_log import list_snapshots
     cm = get_config_manager()
-    files = glob.glob(str(cm.memory_dir / 'recent*.json'))
-    file_names = [os.path.basename(f) for f in files]
-    return {"files": file_names}
+    return {"files": list_snapshots(cm.memory_dir)}
 
 @app.get('/api/memory/review_config')
 async def get_review_config():
@@ -1152,10 +1177,11 @@ async def get_recent_file(filename: str):
     file_path = str(cm.memory_dir / filename)
     if not (filename.startswith('recent') and filename.endswith('.json')):
         return JSONResponse({"success": False, "error": "文件名不合法"}, status_code=400)
-    if not os.path.exists(file_path):
+    # 近期记录由快照 + 追加日志组成，这里合并后返回，格式与旧版 json 文件一致
+    from utils.segment_log import read_materialized, snapshot_exists
+    if not snapshot_exists(file_path):
         return JSONResponse({"success": False, "error": "文件不存在"}, status_code=404)
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    content = json.dumps(read_materialized(file_path), ensure_ascii=False, indent=2)
     return {"content": content}
 
 @app.get("/api/live2d/model_config/{model_name}")
@@ -1464,7 +1490,6 @@ async def update_emotion_mapping(model_name: str, request: Request):
 
 @app.post('/api/memory/recent_file/save')
 async def save_recent_file(request: Request):
-    import os, json
     data = await request.json()
     filename = data.get('filename')
     chat = data.get('chat')
@@ -1491,8 +1516,9 @@ async def save_recent_file(request: Request):
             }
         })
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(arr, f, ensure_ascii=False, indent=2)
+        # 原子写入快照并清空追加日志，memory_server 会检测到文件变化并重新加载
+        from utils.segment_log import write_snapshot
+        write_snapshot(file_path, arr)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1519,8 +1545,8 @@ async def emotion_analysis(request: Request):
         if not model:
             return {"error": "模型名称未提供且配置中未设置默认模型"}
         
-        # 创建异步客户端
-        client = AsyncOpenAI(api_key=api_key, base_url=core_config['OPENROUTER_URL'])
+        # 复用异步客户端（共享连接池）
+        client = get_async_openai(core_config['OPENROUTER_URL'], api_key)
         
         # 构建请求消息
         messages = [
@@ -1673,6 +1699,14 @@ async def agent_health():
         return JSONResponse({"status": "down"}, status_code=502)
 
 
+@app.get('/api/tts/health/{lanlan_name}')
+async def tts_health(lanlan_name: str):
+    """常驻TTS进程的健康状态"""
+    if lanlan_name not in session_manager:
+        return JSONResponse({"success": False, "error": "lanlan not found"}, status_code=404)
+    return session_manager[lanlan_name].tts_health()
+
+
 @app.get('/api/agent/computer_use/availability')
 async def proxy_cu_availability():
     try:
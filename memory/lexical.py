@@ -0,0 +1,88 @@
+"""
+词法检索：CJK 友好的分词 + 增量 BM25 倒排索引
+中文/日文/韩文没有空格分词，这里按单字 + 相邻二元组切分，拉丁字母与数字按单词切分，
+无需引入 jieba 等分词依赖。
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[぀-ヿ㐀-䶿一-鿿가-힯]')
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+
+def tokenize(text):
+    """返回词项列表：拉丁单词、CJK 单字，以及相邻 CJK 字的二元组"""
+    tokens = _TOKEN_PATTERN.findall((text or '').lower())
+    bigrams = [a + b for a, b in zip(tokens, tokens[1:]) if _CJK_PATTERN.match(a) and _CJK_PATTERN.match(b)]
+    return tokens + bigrams
+
+
+class BM25Index:
+    """支持增删的内存 BM25 索引"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {doc_id: tf}
+        self._doc_len = {}
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, doc_id, text):
+        if doc_id in self._doc_len:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._postings[term][doc_id] = tf
+        length = sum(counts.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+
+    def remove(self, doc_id, text=None):
+        length = self._doc_len.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_len -= length
+        terms = set(tokenize(text)) if text is not None else list(self._postings)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting and posting.pop(doc_id, None) is not None and not posting:
+                del self._postings[term]
+
+    def search(self, query, k=10):
+        """返回 [(doc_id, score), ...]，按分数降序"""
+        n = len(self._doc_len)
+        if n == 0:
+            return []
+        avg_len = self._total_len / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: -x[1])[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    倒数排名融合（RRF）
+
+    Args:
+        rankings: 多个排好序的 key 列表
+        k: 平滑常数
+
+    Returns:
+        list: 按融合分数降序的 (key, score)
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: -x[1])
@@ -1,10 +1,11 @@
 from datetime import datetime
 from config import get_character_data, get_core_config, MODELS_WITH_EXTRA_BODY
-from langchain_openai import ChatOpenAI
+from utils.llm_client import get_chat_llm
 from langchain_core.messages import SystemMessage, messages_to_dict, messages_from_dict, HumanMessage, AIMessage
 import json
 import os
 
+from utils.segment_log import SegmentLogStore
 from config.prompts_sys import recent_history_manager_prompt, detailed_recent_history_manager_prompt, further_summarize_prompt, history_review_prompt
 
 class CompressedRecentHistoryManager:
@@ -15,30 +16,44 @@ class CompressedRecentHistoryManager:
         self.log_file_path = recent_log
         self.name_mapping = name_mapping
         self.user_histories = {}
+        # 磁盘存储：recent_{name}.json 快照 + recent_{name}.log 追加日志，旧的 json 文件直接作为快照使用
+        self.stores = {}
+        self._store_generations = {}
         for ln in self.log_file_path:
-            if os.path.exists(self.log_file_path[ln]):
-                with open(self.log_file_path[ln], encoding='utf-8') as f:
-                    self.user_histories[ln] = messages_from_dict(json.load(f))
-            else:
-                self.user_histories[ln] = []
+            self.stores[ln] = SegmentLogStore(self.log_file_path[ln])
+            self._sync_from_store(ln)
+
+    def _sync_from_store(self, lanlan_name):
+        """仅当存储被重新加载（如记忆浏览器修改了文件）时才重建内存中的消息对象"""
+        store = self.stores[lanlan_name]
+        data = store.get()
+        if self._store_generations.get(lanlan_name) != store.generation:
+            self.user_histories[lanlan_name] = messages_from_dict(data)
+            self._store_generations[lanlan_name] = store.generation
     
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
         core_config = get_core_config()
         api_key = core_config['OPENROUTER_API_KEY'] if core_config['OPENROUTER_API_KEY'] else None
-        return ChatOpenAI(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.3, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_llm(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.3, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
     
     def _get_review_llm(self):
         """动态获取审核LLM实例以支持配置热重载"""
         core_config = get_core_config()
         api_key = core_config['OPENROUTER_API_KEY'] if core_config['OPENROUTER_API_KEY'] else None
-        return ChatOpenAI(model=core_config['CORRECTION_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.1, extra_body={"enable_thinking": False} if core_config['CORRECTION_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_llm(model=core_config['CORRECTION_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.1, extra_body={"enable_thinking": False} if core_config['CORRECTION_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
 
-    async def update_history(self, new_messages, lanlan_name, detailed=False):
-        if os.path.exists(self.log_file_path[lanlan_name]):
-            with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                self.user_histories[lanlan_name] = messages_from_dict(json.load(f))
+    async def update_history(self, new_messages, lanlan_name, detailed=False, idempotency_key=None):
+        """
+        idempotency_key: 请求的幂等键，与本次更新写在同一条日志记录中；
+                         同一个键的更新已写入时直接跳过（请求在确认前失败或重启后重试）
+        """
+        if idempotency_key and self.stores[lanlan_name].has_applied(idempotency_key):
+            print(f"近期记录已包含该请求（Idempotency-Key={idempotency_key}），跳过")
+            return
+        self._sync_from_store(lanlan_name)
 
+        compressed_history = False
         try:
             self.user_histories[lanlan_name].extend(new_messages)
 
@@ -49,13 +64,16 @@ class CompressedRecentHistoryManager:
 
                 # 只保留最近的max_history_length条消息
                 self.user_histories[lanlan_name] = compressed + self.user_histories[lanlan_name][-self.max_history_length+1:]
+                compressed_history = True
         except Exception as e:
             print("Error when updating history: ", e)
             import traceback
             traceback.print_exc()
 
-        with open(self.log_file_path[lanlan_name], "w", encoding='utf-8') as f:
-            json.dump(messages_to_dict(self.user_histories[lanlan_name]), f, indent=2, ensure_ascii=False)
+        if compressed_history:
+            self.stores[lanlan_name].replace(messages_to_dict(self.user_histories[lanlan_name]), key=idempotency_key)
+        else:
+            self.stores[lanlan_name].append(messages_to_dict(new_messages), key=idempotency_key)
 
 
     # detailed: 保留尽可能多的细节
@@ -145,9 +163,7 @@ class CompressedRecentHistoryManager:
         return None
 
     def get_recent_history(self, lanlan_name):
-        if os.path.exists(self.log_file_path[lanlan_name]):
-            with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                self.user_histories[lanlan_name] = messages_from_dict(json.load(f))
+        self._sync_from_store(lanlan_name)
         return self.user_histories[lanlan_name]
 
     async def review_history(self, lanlan_name, cancel_event=None):
@@ -260,8 +276,7 @@ class CompressedRecentHistoryManager:
                 self.user_histories[lanlan_name] = corrected_messages
                 
                 # 保存到文件
-                with open(self.log_file_path[lanlan_name], "w", encoding='utf-8') as f:
-                    json.dump(messages_to_dict(corrected_messages), f, indent=2, ensure_ascii=False)
+                self.stores[lanlan_name].replace(messages_to_dict(corrected_messages))
                 
                 print(f"✅ {lanlan_name} 的记忆已修正并保存")
                 return True
@@ -280,3 +295,9 @@ class CompressedRecentHistoryManager:
         清除用户的聊天历史
         """
         self.user_histories[lanlan_name] = []
+        self.stores[lanlan_name].replace([])
+
+    def close(self):
+        """关闭所有存储，将日志压缩回快照"""
+        for store in self.stores.values():
+            store.close()
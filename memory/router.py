@@ -8,7 +8,7 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Dict, Any
 from langchain_core.messages import BaseMessage
 import json
-from langchain_openai import ChatOpenAI
+from utils.llm_client import get_chat_llm
 from config import get_core_config, ROUTER_MODEL
 
 class RouterState(TypedDict):
@@ -27,7 +27,7 @@ class MemoryQueryRouter:
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=ROUTER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'])
+        return get_chat_llm(model=ROUTER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'])
 
     def _build_graph(self):
         # 构建LangGraph流程图
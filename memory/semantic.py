@@ -1,45 +1,99 @@
-# from langchain_chroma import Chroma
-# ↑ 这个库引入了Chroma和onnx依赖，显著增大了一键包体积，暂时注释掉
+# 向量存储使用 memory.vectorstore.LocalVectorStore（纯 numpy 实现），
+# 不再依赖 langchain_chroma —— 它引入了Chroma和onnx依赖，显著增大了一键包体积
 from typing import List
 from langchain_core.documents import Document
 from datetime import datetime
 from memory.recent import CompressedRecentHistoryManager
 from config import get_character_data, get_core_config, SEMANTIC_MODEL, RERANKER_MODEL, MODELS_WITH_EXTRA_BODY
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import OpenAIEmbeddings
+from utils.llm_client import get_chat_llm
+from memory.vectorstore import LocalVectorStore
+from memory.lexical import reciprocal_rank_fusion
 from config.prompts_sys import semantic_manager_prompt
+import asyncio
 import json
+import re
+
+# 每个集合向量检索 / 词法检索各取的候选数
+VECTOR_CANDIDATES = 30
+LEXICAL_CANDIDATES = 30
+# 融合后交给 LLM 精排的候选数，以及精排提示词中记忆片段的总字符预算
+RERANK_CANDIDATES = 8
+RERANK_CHAR_BUDGET = 4000
+
+def _default_embeddings():
+    core_config = get_core_config()
+    return OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'])
+
 
 class SemanticMemory:
-    def __init__(self, recent_history_manager: CompressedRecentHistoryManager, persist_directory=None):
+    def __init__(self, recent_history_manager: CompressedRecentHistoryManager, persist_directory=None, embedding_function=None):
+        """
+        Args:
+            embedding_function: langchain Embeddings 实例，默认使用配置中的 SEMANTIC_MODEL；
+                                测试或离线环境可传入 memory.vectorstore.HashingEmbeddings
+        """
         # 通过get_character_data获取相关变量
         _, _, _, _, name_mapping, _, semantic_store, _, _, _ = get_character_data()
         self.original_memory = {}
         self.compressed_memory = {}
         if persist_directory is None:
             persist_directory = semantic_store
+        # 所有集合共用同一个嵌入实例，检索时查询只需嵌入一次
+        embedding_function = embedding_function or _default_embeddings()
         for i in persist_directory:
-            self.original_memory[i] = SemanticMemoryOriginal(persist_directory, i, name_mapping)
-            self.compressed_memory[i] = SemanticMemoryCompressed(persist_directory, i, recent_history_manager, name_mapping)
+            self.original_memory[i] = SemanticMemoryOriginal(persist_directory, i, name_mapping, embedding_function)
+            self.compressed_memory[i] = SemanticMemoryCompressed(persist_directory, i, recent_history_manager, name_mapping, embedding_function)
     
     def _get_reranker(self):
         """动态获取Reranker LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=RERANKER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.1, extra_body={"enable_thinking": False} if RERANKER_MODEL in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_llm(model=RERANKER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.1, extra_body={"enable_thinking": False} if RERANKER_MODEL in MODELS_WITH_EXTRA_BODY else None)
+
+    async def store_conversation(self, event_id, messages, lanlan_name, summary=None):
+        """
+        嵌入并存储一段对话。嵌入请求和向量写入是同步的，放到线程池中执行，不阻塞事件循环
+        summary: 已有的压缩摘要（如 time_manager 刚生成的），传入时不再重复调用 LLM 压缩
+        """
+        await asyncio.to_thread(self.original_memory[lanlan_name].store_conversation, event_id, messages)
+        await self.compressed_memory[lanlan_name].store_compressed_summary(event_id, messages, summary)
 
-    async def store_conversation(self, event_id, messages, lanlan_name):
-        self.original_memory[lanlan_name].store_conversation(event_id, messages)
-        await self.compressed_memory[lanlan_name].store_compressed_summary(event_id, messages)
+    def delete_event(self, event_id, lanlan_name):
+        """删除某次对话在原始和压缩记忆中的全部向量"""
+        for store in (self.original_memory[lanlan_name].vectorstore, self.compressed_memory[lanlan_name].vectorstore):
+            store.delete(store.get_ids({"event_id": event_id}))
 
     async def hybrid_search(self, query, lanlan_name, with_rerank=True, k=10):
-        # 从原始和压缩记忆中获取结果
-        original_results = self.original_memory[lanlan_name].retrieve_by_query(query, k)
-        compressed_results = self.compressed_memory[lanlan_name].retrieve_by_query(query, k)
-        combined = original_results + compressed_results
+        # 原始/压缩两个集合各做一次向量检索和 BM25 词法检索，四路结果用 RRF 融合，
+        # 只把融合后的前 RERANK_CANDIDATES 条交给 LLM 精排。
+        # 查询嵌入走异步接口（网络请求），四路索引扫描放到线程池并发执行，不阻塞事件循环
+        memories = (("origin", self.original_memory[lanlan_name]),
+                    ("compressed", self.compressed_memory[lanlan_name]))
+        embedders = {id(m.vectorstore.embedding_function): m.vectorstore.embedding_function for _, m in memories}
+        vectors = dict(zip(embedders, await asyncio.gather(*(e.aembed_query(query) for e in embedders.values()))))
+        collections, searches = [], []
+        for collection, memory in memories:
+            store = memory.vectorstore
+            collections += [collection, collection]
+            searches.append(asyncio.to_thread(store.similarity_search_by_vector_with_score,
+                                              vectors[id(store.embedding_function)], VECTOR_CANDIDATES))
+            searches.append(asyncio.to_thread(store.lexical_search_with_score, query, LEXICAL_CANDIDATES))
+
+        rankings = []
+        docs = {}
+        for collection, results in zip(collections, await asyncio.gather(*searches)):
+            ranking = []
+            for doc, _ in results:
+                key = (collection, doc.metadata.get("id"))
+                docs[key] = doc
+                ranking.append(key)
+            rankings.append(ranking)
+        fused = [docs[key] for key, _ in reciprocal_rank_fusion(rankings)]
 
         if with_rerank:
-            return await self.rerank_results(query, combined)
+            return await self.rerank_results(query, fused[:RERANK_CANDIDATES])
         else:
-            return combined
+            return fused[:k]
 
     async def query(self, query, lanlan_name):
         results_text = "\n".join([
@@ -48,10 +102,14 @@ class SemanticMemory:
         ])
         return f"""======{lanlan_name}尝试回忆=====\n{query}\n\n====={lanlan_name}的相关记忆=====\n{results_text}"""
 
-    async def rerank_results(self, query, results: list, k=5) -> list:
-        # 使用LLM重新排序结果
+    async def rerank_results(self, query, results: list, k=5, char_budget=RERANK_CHAR_BUDGET) -> list:
+        # 使用LLM重新排序结果；失败时退回到融合排序
+        if not results:
+            return []
+        # 按字符预算截断每个片段，控制提示词长度
+        per_doc = max(char_budget // len(results), 100)
         results_text = "\n\n".join([
-            f"记忆片段 {i + 1}:\n{doc.page_content}"
+            f"记忆片段 {i + 1}:\n{doc.page_content[:per_doc]}"
             for i, doc in enumerate(results)
         ])
 
@@ -67,27 +125,26 @@ class SemanticMemory:
                 continue
 
             try:
-                # 解析排序后的文档编号
-                reranked_indices = json.loads(response.content)
+                # 解析排序后的文档编号（提示词中编号从 1 开始），容忍列表前后的多余文字
+                match = re.search(r'\[[\d,\s]*\]', response.content)
+                reranked_indices = json.loads(match.group(0))
                 # 按新顺序排序结果
-                reranked_results = [results[idx] for idx in reranked_indices[:k] if 0 <= idx < len(results)]
+                reranked_results = [results[idx - 1] for idx in reranked_indices[:k] if 1 <= idx <= len(results)]
                 return reranked_results
             except Exception as e:
                 retries += 1
                 print('Rerank结果解析失败', e)
-        return []
+        return results[:k]
 
 
 class SemanticMemoryOriginal:
-    def __init__(self, persist_directory, lanlan_name, name_mapping):
-        core_config = get_core_config()
-        self.embeddings = OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'])
-        # self.vectorstore = Chroma(
-        #     collection_name="Origin",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
-        self.vectorstore = None
+    def __init__(self, persist_directory, lanlan_name, name_mapping, embedding_function=None):
+        self.embeddings = embedding_function or _default_embeddings()
+        self.vectorstore = LocalVectorStore(
+            persist_directory=persist_directory[lanlan_name],
+            collection_name="Origin",
+            embedding_function=self.embeddings
+        )
         self.lanlan_name = lanlan_name
         self.name_mapping = name_mapping
 
@@ -131,25 +188,25 @@ class SemanticMemoryOriginal:
 
 
 class SemanticMemoryCompressed:
-    def __init__(self, persist_directory, lanlan_name, recent_history_manager: CompressedRecentHistoryManager, name_mapping):
+    def __init__(self, persist_directory, lanlan_name, recent_history_manager: CompressedRecentHistoryManager, name_mapping, embedding_function=None):
         self.lanlan_name = lanlan_name
         self.name_mapping = name_mapping
-        core_config = get_core_config()
-        self.embeddings = OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'])
-        self.vectorstore = None
-        # self.vectorstore = Chroma(
-        #     collection_name="Compressed",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
+        self.embeddings = embedding_function or _default_embeddings()
+        self.vectorstore = LocalVectorStore(
+            persist_directory=persist_directory[lanlan_name],
+            collection_name="Compressed",
+            embedding_function=self.embeddings
+        )
         self.recent_history_manager = recent_history_manager
 
-    async def store_compressed_summary(self, event_id, messages):
+    async def store_compressed_summary(self, event_id, messages, summary=None):
         # 存储压缩摘要的嵌入
-        _, summary = await self.recent_history_manager.compress_history(messages, self.lanlan_name)
+        if summary is None:
+            _, summary = await self.recent_history_manager.compress_history(messages, self.lanlan_name)
         if not summary:
             return
-        self.vectorstore.add_texts(
+        await asyncio.to_thread(
+            self.vectorstore.add_texts,
             texts=[summary],
             metadatas=[{
                 "event_id": event_id,
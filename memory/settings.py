@@ -1,45 +1,88 @@
+import asyncio
 import json
-from langchain_openai import ChatOpenAI
+import os
+from collections import OrderedDict, defaultdict
+from utils.llm_client import get_chat_llm
 from config import get_core_config, SETTING_PROPOSER_MODEL, SETTING_VERIFIER_MODEL, get_character_data
-from config.prompts_sys import settings_extractor_prompt, settings_verifier_prompt
+from config.prompts_sys import settings_extractor_prompt, settings_incremental_extractor_prompt, settings_verifier_prompt
+
+# 每个角色记住提取进度的请求数量；同一请求重试时，已提取过的消息不会再次发给 proposer
+EXTRACTED_REQUESTS_LIMIT = 256
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
 
 
 class ImportantSettingsManager:
+    """
+    重要设定管理
+    设定常驻内存，写入时同步落盘（write-through）；settings_{name}.json 被外部修改（如记忆浏览器）时按文件签名自动重新加载。
+    """
+
     def __init__(self):
         self.settings = {}
-        self.settings_file = None
+        self.settings_file = {}
+        self._character_snapshot = None
+        self._file_signatures = {}
+        # 角色 -> {请求的幂等键: 该请求中已提取到第几条消息}
+        self._extracted = defaultdict(OrderedDict)
+        self._locks = defaultdict(asyncio.Lock)
+        # 内存中的设定或角色基础配置每变化一次加一，供 /new_dialog 快照判断是否需要重建
+        self.version = 0
     
     def _get_proposer(self):
         """动态获取Proposer LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=SETTING_PROPOSER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
+        return get_chat_llm(model=SETTING_PROPOSER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
     
     def _get_verifier(self):
         """动态获取Verifier LLM实例以支持配置热重载"""
         core_config = get_core_config()
-        return ChatOpenAI(model=SETTING_VERIFIER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
+        return get_chat_llm(model=SETTING_VERIFIER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
 
     def load_settings(self):
-        # It is important to update the settings with the latest character on-disk files
-        _, _, master_basic_config, lanlan_basic_config, name_mapping, _, _, _, setting_store, _ = get_character_data()
-        self.settings_file = setting_store
-        self.master_basic_config = master_basic_config
-        self.lanlan_basic_config = lanlan_basic_config
-        self.name_mapping = name_mapping
+        # It is important to update the settings with the latest character on-disk files.
+        # get_character_data() 返回缓存快照，快照对象不变时无需重建
+        character_data = get_character_data()
+        if character_data is not self._character_snapshot:
+            _, _, master_basic_config, lanlan_basic_config, name_mapping, _, _, _, setting_store, _ = character_data
+            self._character_snapshot = character_data
+            self.settings_file = setting_store
+            self.master_basic_config = master_basic_config
+            # 角色数据是只读快照，这里拷贝一份并去掉与设定无关的字段
+            self.lanlan_basic_config = {
+                name: {k: v for k, v in cfg.items() if k not in ('system_prompt', 'live2d', 'voice_id')}
+                for name, cfg in lanlan_basic_config.items()
+            }
+            self.name_mapping = name_mapping
+            self.version += 1
 
         for i in self.settings_file:
+            # 只有文件在内存之外被修改过才重新读取
+            signature = _file_signature(self.settings_file[i])
+            if i in self.settings and signature == self._file_signatures.get(i):
+                continue
             try:
-                self.lanlan_basic_config[i].pop('system_prompt', None)
-                self.lanlan_basic_config[i].pop('live2d', None)
-                self.lanlan_basic_config[i].pop('voice_id', None)
                 with open(self.settings_file[i], 'r', encoding='utf-8') as f:
                     self.settings[i] = json.load(f)
             except (FileNotFoundError, json.JSONDecodeError):
                 self.settings[i] = {i: {}, self.name_mapping['human']: {}}
+            self._file_signatures[i] = signature
+            self.version += 1
 
     def save_settings(self, lanlan_name):
-        with open(self.settings_file[lanlan_name], 'w', encoding='utf-8') as f:
+        path = self.settings_file[lanlan_name]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(self.settings[lanlan_name], f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._file_signatures[lanlan_name] = _file_signature(path)
+        self.version += 1
 
     async def detect_and_resolve_contradictions(self, old_settings, new_settings, lanlan_name):
         # 使用LLM检测矛盾并解决它们
@@ -67,7 +110,7 @@ class ImportantSettingsManager:
                 print("Setting resolver返回值解析失败。返回值：", response.content)
         return old_settings
 
-    async def extract_and_update_settings(self, messages, lanlan_name):
+    def _format_messages(self, messages, lanlan_name):
         name_mapping = self.name_mapping.copy()
         name_mapping['ai'] = lanlan_name
         lines = []
@@ -83,8 +126,27 @@ class ImportantSettingsManager:
             except Exception:
                 joined = str(getattr(msg, 'content', ''))
             lines.append(f"{name_mapping[msg.type]} | {joined}")
-        prompt = settings_extractor_prompt % ("\n".join(lines))
-        prompt = prompt.replace('{LANLAN_NAME}', lanlan_name)
+        return lines
+
+    def _extracted_count(self, request_key, lanlan_name):
+        """该请求中已经提取过的消息条数（按位置计，内容相同但来自不同请求的消息仍会被提取）"""
+        if request_key is None:
+            return 0
+        extracted = self._extracted[lanlan_name]
+        if request_key in extracted:
+            extracted.move_to_end(request_key)
+        return extracted.get(request_key, 0)
+
+    def _mark_extracted(self, request_key, count, lanlan_name):
+        if request_key is None:
+            return
+        extracted = self._extracted[lanlan_name]
+        extracted[request_key] = count
+        extracted.move_to_end(request_key)
+        while len(extracted) > EXTRACTED_REQUESTS_LIMIT:
+            extracted.popitem(last=False)
+
+    async def _propose(self, prompt):
         retries = 0
         new_settings = ""
         while retries < 3:
@@ -104,15 +166,98 @@ class ImportantSettingsManager:
                 print("Setting LLM返回的设定JSON解析失败。返回值：", response.content)
                 retries += 1
             break
+        return new_settings
+
+    @staticmethod
+    def _affected_settings(settings, text):
+        """已有设定中键名在对话里出现过的部分，作为 proposer 的上下文"""
+        affected = {}
+        for person, attrs in settings.items():
+            if not isinstance(attrs, dict):
+                continue
+            related = {k: v for k, v in attrs.items() if k in text}
+            if related:
+                affected[person] = related
+        return affected
+
+    @staticmethod
+    def _split_proposal(settings, proposal):
+        """把提议拆成新增的键和会修改已有值的键"""
+        added, changed = {}, {}
+        for person, attrs in proposal.items():
+            if not isinstance(attrs, dict):
+                continue
+            existing = settings.get(person, {})
+            for k, v in attrs.items():
+                if k not in existing:
+                    added.setdefault(person, {})[k] = v
+                elif existing[k] != v:
+                    changed.setdefault(person, {})[k] = v
+        return added, changed
+
+    async def extract_and_update_settings(self, messages, lanlan_name, incremental=True, request_key=None):
+        """
+        从对话中提取设定并合并
+
+        Args:
+            incremental: 增量模式只把未提取过的消息和相关的已有设定发给 proposer；
+                         提议只新增键时直接合并，改动已有键时才调用 verifier，且只校验被改动的键
+            request_key: 本批消息所属请求的幂等键，同一请求重试时跳过已经提取过的消息
+        """
+        self.load_settings()
+        if not incremental:
+            prompt = settings_extractor_prompt % ("\n".join(self._format_messages(messages, lanlan_name)))
+            prompt = prompt.replace('{LANLAN_NAME}', lanlan_name)
+            new_settings = await self._propose(prompt)
+            # 检测并解决矛盾
+            if len(new_settings)>0:
+                async with self._locks[lanlan_name]:
+                    self.load_settings()
+                    self.settings[lanlan_name] = await self.detect_and_resolve_contradictions(self.settings[lanlan_name], new_settings, lanlan_name)
+                    self.save_settings(lanlan_name)
+            return
+
+        start = self._extracted_count(request_key, lanlan_name)
+        fresh = self._format_messages(messages[start:], lanlan_name)
+        if not fresh:
+            return
+        dialog = "\n".join(fresh)
+        affected = self._affected_settings(self.settings[lanlan_name], dialog)
+        prompt = settings_incremental_extractor_prompt % (json.dumps(affected, ensure_ascii=False), dialog)
+        prompt = prompt.replace('{LANLAN_NAME}', lanlan_name)
+        new_settings = await self._propose(prompt)
+        if not isinstance(new_settings, dict):
+            return
+        # 只有合并并落盘成功后才把这些消息标记为已提取；中途失败（异常或 verifier 不可用）时重试会重新提取
+        if not new_settings:
+            self._mark_extracted(request_key, len(messages), lanlan_name)
+            return
 
-        # 检测并解决矛盾
-        if len(new_settings)>0:
+        async with self._locks[lanlan_name]:
             self.load_settings()
-            self.settings[lanlan_name] = await self.detect_and_resolve_contradictions(self.settings[lanlan_name], new_settings, lanlan_name)
-            self.save_settings(lanlan_name)
+            added, changed = self._split_proposal(self.settings[lanlan_name], new_settings)
+            verified = True
+            if changed:
+                old = {person: {k: self.settings[lanlan_name][person][k] for k in attrs} for person, attrs in changed.items()}
+                resolved = await self.detect_and_resolve_contradictions(old, changed, lanlan_name)
+                # verifier 失败时原样返回旧设定：本轮的改动不生效
+                verified = resolved is not old
+                changed = resolved if verified else {}
+                self.load_settings()
+            if added or changed:
+                settings = self.settings[lanlan_name]
+                for part in (added, changed):
+                    for person, attrs in part.items():
+                        if isinstance(attrs, dict):
+                            settings.setdefault(person, {}).update(attrs)
+                self.save_settings(lanlan_name)
+        if verified:
+            self._mark_extracted(request_key, len(messages), lanlan_name)
 
     def get_settings(self, lanlan_name):
         self.load_settings()
-        self.settings[lanlan_name][lanlan_name].update(self.lanlan_basic_config[lanlan_name])
-        self.settings[lanlan_name][self.name_mapping['human']].update(self.master_basic_config)
-        return self.settings[lanlan_name]
\ No newline at end of file
+        # 返回合并了角色基础配置的副本，不修改内存中的设定
+        settings = {k: dict(v) if isinstance(v, dict) else v for k, v in self.settings[lanlan_name].items()}
+        settings.setdefault(lanlan_name, {}).update(self.lanlan_basic_config[lanlan_name])
+        settings.setdefault(self.name_mapping['human'], {}).update(self.master_basic_config)
+        return settings
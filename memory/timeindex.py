@@ -1,8 +1,26 @@
 from langchain_community.chat_message_histories import SQLChatMessageHistory
-from langchain_core.messages import SystemMessage
-from sqlalchemy import create_engine, text
+from langchain_core.messages import SystemMessage, message_to_dict
+from sqlalchemy import create_engine, event, text
 from config import TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME, get_character_data
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
+
+# 已处理请求的 Idempotency-Key 表：与对话在同一个事务中写入，重启后重试的请求也不会重复存储
+PROCESSED_REQUESTS_TABLE = "processed_requests"
+# 幂等键保留天数（发件箱的重试窗口远小于此）
+PROCESSED_REQUEST_TTL_DAYS = 7
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # 每个新连接都设置：WAL 下读写互不阻塞，NORMAL 同步级别在 WAL 模式下仍能保证崩溃一致性
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 
 class TimeIndexedMemory:
     def __init__(self, recent_history_manager):
@@ -11,6 +29,7 @@ class TimeIndexedMemory:
         _, _, _, _, _, _, _, time_store, _, _ = get_character_data()
         for i in time_store:
             self.engine[i] = create_engine(f"sqlite:///{time_store[i]}")
+            event.listen(self.engine[i], "connect", _set_sqlite_pragmas)
 
             _ = SQLChatMessageHistory(
                 connection=self.engine[i],
@@ -35,40 +54,72 @@ class TimeIndexedMemory:
         with self.engine[lanlan_name].connect() as conn:
             result = conn.execute(text(f"PRAGMA table_info({TIME_ORIGINAL_TABLE_NAME})"))
             columns = result.fetchall()
-            for i in columns:
-                if i[1] == 'timestamp':
-                    return
+            has_timestamp = any(i[1] == 'timestamp' for i in columns)
+        if not has_timestamp:
             self.add_timestamp_column(lanlan_name)
+        self.create_indexes(lanlan_name)
 
-    async def store_conversation(self, event_id, messages, lanlan_name, timestamp=None):
-        if timestamp is None:
-            timestamp = datetime.now()
+    def create_indexes(self, lanlan_name):
+        # 可重复执行：按时间范围查询用 (timestamp, session_id)，按会话读取用 (session_id, id)
+        with self.engine[lanlan_name].begin() as conn:
+            for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_timestamp_session ON {table} (timestamp, session_id)"))
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_session_id ON {table} (session_id, id)"))
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PROCESSED_REQUESTS_TABLE} "
+                              f"(key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at DATETIME NOT NULL)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{PROCESSED_REQUESTS_TABLE}_created_at "
+                              f"ON {PROCESSED_REQUESTS_TABLE} (created_at)"))
+
+    def get_processed_result(self, lanlan_name, key):
+        """返回已处理请求的结果，未处理过时返回None"""
+        with self.engine[lanlan_name].connect() as conn:
+            row = conn.execute(
+                text(f"SELECT result FROM {PROCESSED_REQUESTS_TABLE} WHERE key = :key"), {"key": key}
+            ).fetchone()
+        return json.loads(row[0]) if row else None
 
-        origin_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_ORIGINAL_TABLE_NAME,
+    def _record_processed(self, conn, key, result, timestamp):
+        conn.execute(
+            text(f"INSERT OR REPLACE INTO {PROCESSED_REQUESTS_TABLE} (key, result, created_at) VALUES (:key, :result, :created_at)"),
+            {"key": key, "result": json.dumps(result, ensure_ascii=False), "created_at": timestamp}
+        )
+        conn.execute(
+            text(f"DELETE FROM {PROCESSED_REQUESTS_TABLE} WHERE created_at < :cutoff"),
+            {"cutoff": timestamp - timedelta(days=PROCESSED_REQUEST_TTL_DAYS)}
         )
 
-        compressed_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_COMPRESSED_TABLE_NAME,
+    def _insert_messages(self, conn, table_name, event_id, messages, timestamp):
+        # 与 SQLChatMessageHistory 的存储格式一致，但带上时间戳一次性批量写入
+        if not messages:
+            return
+        conn.execute(
+            text(f"INSERT INTO {table_name} (session_id, message, timestamp) VALUES (:session_id, :message, :timestamp)"),
+            [{"session_id": event_id, "message": json.dumps(message_to_dict(m)), "timestamp": timestamp} for m in messages]
         )
 
-        origin_history.add_messages(messages)
-        compressed_history.add_message(SystemMessage((await self.recent_history_manager.compress_history(messages, lanlan_name))[1]))
+    async def store_conversation(self, event_id, messages, lanlan_name, timestamp=None, idempotency_key=None):
+        """
+        压缩并存储一段对话，返回压缩摘要；指定 idempotency_key 时该键与对话在同一个事务中提交，
+        提交成功即视为已处理，之后带同一个键的重试不会再次写入
+        """
+        if timestamp is None:
+            timestamp = datetime.now()
 
-        with self.engine[lanlan_name].connect() as conn:
-            conn.execute(
-                text(f"UPDATE {TIME_ORIGINAL_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
-            )
-            conn.execute(
-                text(f"UPDATE {TIME_COMPRESSED_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
-            )
-            conn.commit()
+        try:
+            summary = (await self.recent_history_manager.compress_history(messages, lanlan_name))[1]
+        except Exception:
+            # 压缩失败时仍保留原始对话
+            with self.engine[lanlan_name].begin() as conn:
+                self._insert_messages(conn, TIME_ORIGINAL_TABLE_NAME, event_id, messages, timestamp)
+            raise
+
+        # 原始对话与摘要在同一个事务中写入
+        with self.engine[lanlan_name].begin() as conn:
+            self._insert_messages(conn, TIME_ORIGINAL_TABLE_NAME, event_id, messages, timestamp)
+            self._insert_messages(conn, TIME_COMPRESSED_TABLE_NAME, event_id, [SystemMessage(summary)], timestamp)
+            if idempotency_key:
+                self._record_processed(conn, idempotency_key, {"status": "processed"}, timestamp)
+        return summary
 
     def retrieve_summary_by_timeframe(self, lanlan_name, start_time, end_time):
         with self.engine[lanlan_name].connect() as conn:
@@ -0,0 +1,458 @@
+"""
+嵌入式本地向量索引（替代被注释掉的 Chroma，避免引入 onnx 等大依赖）
+
+磁盘布局（每个 collection 一个目录）：
+    meta.json    —— 维度、嵌入函数名称、索引训练信息
+    vectors.f32  —— 归一化后的向量，float32 行优先按行写入，读写都通过 np.memmap 映射
+    lists.i32    —— 每行向量所属的 IVF 聚类编号（未训练时为 -1），与 vectors.f32 按行对齐
+    centroids.npy —— IVF 聚类中心
+    docs.jsonl   —— 追加日志：{"op": "add", "id", "text", "metadata"} / {"op": "delete", "ids": [...]}
+
+向量数量较少时直接精确检索；超过 train_threshold 后训练 IVF（球面 k-means），
+查询时只扫描最相近的 nprobe 个聚类。删除使用墓碑标记，比例过高时自动压缩重写。
+同时在内存中维护同一批文档的 BM25 索引，供词法检索使用。
+
+vectors.f32 按容量几何增长（末尾可能有尚未使用的预留行），实际行数以 docs.jsonl 为准；
+内存中的墓碑和聚类分配也按容量几何增长，追加写的摊还成本与已有向量数无关。
+写入在后台线程执行（asyncio.to_thread），读写之间用锁保护。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from memory.lexical import BM25Index, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    确定性的本地哈希嵌入（特征哈希），不依赖网络和模型文件
+    以 memory.lexical.tokenize 的词项（单词、CJK 单字及二元组）为特征，适合测试和离线环境。
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    @property
+    def name(self):
+        return f"hashing-{self.dim}"
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in tokenize(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return vec.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _embedder_name(embedding_function):
+    name = getattr(embedding_function, 'name', None)
+    if isinstance(name, str):
+        return name
+    model = getattr(embedding_function, 'model', None)
+    return f"{type(embedding_function).__name__}:{model}" if model else type(embedding_function).__name__
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class LocalVectorStore:
+    """
+    按角色持久化的向量存储，接口与 langchain VectorStore 的常用部分一致
+    （add_texts / similarity_search / similarity_search_with_score / delete）
+
+    Args:
+        persist_directory: 角色的语义记忆目录
+        collection_name: 集合名（如 "Origin"、"Compressed"）
+        embedding_function: langchain Embeddings 实例
+        nprobe: 查询时扫描的聚类数，None 表示按聚类数自动选择（约 1/8）
+        train_threshold: 向量数达到该值后训练 IVF 索引
+    """
+
+    # 墓碑比例超过该值时压缩
+    COMPACT_RATIO = 0.25
+    COMPACT_MIN_DELETED = 1000
+    # 向量数增长到上次训练时的多少倍后重新训练
+    RETRAIN_GROWTH = 4
+    KMEANS_ITERS = 10
+    KMEANS_SAMPLE = 20000
+    CHUNK = 65536
+    # 向量文件和内存缓冲区的最小容量（行）
+    MIN_CAPACITY = 1024
+
+    def __init__(self, persist_directory, collection_name, embedding_function: Embeddings,
+                 nprobe=None, train_threshold=4096):
+        self.dir = Path(persist_directory) / collection_name
+        self.embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self._meta_path = self.dir / 'meta.json'
+        self._vectors_path = self.dir / 'vectors.f32'
+        self._lists_path = self.dir / 'lists.i32'
+        self._centroids_path = self.dir / 'centroids.npy'
+        self._docs_path = self.dir / 'docs.jsonl'
+        self._lock = threading.RLock()
+        self._reset_memory()
+        self._load()
+
+    # ---- 加载与持久化 ----
+    def _reset_memory(self):
+        self.dim = None
+        self.trained_count = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._row_of: Dict[str, int] = {}
+        # *_buf 为按容量分配的缓冲区，_deleted / _lists / _vectors 是其前 n 行的视图
+        self._deleted_buf = np.zeros(0, dtype=bool)
+        self._lists_buf = np.zeros(0, dtype=np.int32)
+        self._mm = None
+        self._deleted = self._deleted_buf
+        self._lists = self._lists_buf
+        self._vectors = None
+        self._centroids = None
+        self._inverted = None
+        self._bm25 = BM25Index()
+
+    def _write_meta(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = str(self._meta_path) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'embedder': _embedder_name(self.embedding_function),
+                       'trained_count': self.trained_count}, f)
+        os.replace(tmp, self._meta_path)
+
+    def _remove_files(self):
+        for p in (self._meta_path, self._vectors_path, self._lists_path, self._centroids_path, self._docs_path):
+            if p.exists():
+                p.unlink()
+
+    def _load(self):
+        if not self._meta_path.exists():
+            return
+        with open(self._meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('embedder') != _embedder_name(self.embedding_function):
+            # 换了嵌入模型，旧向量不可比较
+            logger.warning(f"嵌入函数已变更（{meta.get('embedder')} -> {_embedder_name(self.embedding_function)}），重建向量索引: {self.dir}")
+            self._remove_files()
+            return
+        self.dim = meta['dim']
+        self.trained_count = meta.get('trained_count', 0)
+
+        deleted_ids = set()
+        if self._docs_path.exists():
+            with open(self._docs_path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"跳过损坏的向量文档记录: {self._docs_path}")
+                        continue
+                    if record.get('op') == 'add':
+                        self._row_of[record['id']] = len(self._ids)
+                        self._ids.append(record['id'])
+                        self._texts.append(record.get('text', ''))
+                        self._metadatas.append(record.get('metadata') or {})
+                    elif record.get('op') == 'delete':
+                        deleted_ids.update(record.get('ids', []))
+
+        # 崩溃可能导致向量文件与文档日志行数不一致，以较短者为准
+        n = min(len(self._ids), self._count_rows())
+        del self._ids[n:], self._texts[n:], self._metadatas[n:]
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._reserve(n)
+        for doc_id in deleted_ids:
+            row = self._row_of.get(doc_id)
+            if row is not None:
+                self._deleted_buf[row] = True
+        for row, doc_id in enumerate(self._ids):
+            if not self._deleted_buf[row]:
+                self._bm25.add(doc_id, self._texts[row])
+        if self._centroids_path.exists():
+            self._centroids = np.load(self._centroids_path)
+        stored = np.fromfile(self._lists_path, dtype=np.int32) if self._lists_path.exists() else np.zeros(0, np.int32)
+        self._lists_buf[:min(n, len(stored))] = stored[:n]
+        if len(stored) != n:
+            # 与向量行数不一致（崩溃或旧版本的追加写），按实际行数重写，之后按行偏移写入
+            self._lists_buf[:n].tofile(self._lists_path)
+        self._set_views(n)
+
+    def _count_rows(self):
+        if self.dim is None or not self._vectors_path.exists():
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self.dim)
+
+    def _map_vectors(self):
+        """映射整个向量文件（包括预留行）"""
+        rows = self._count_rows()
+        self._mm = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dim)) if rows else None
+
+    def _reserve(self, n):
+        """保证缓冲区和向量文件至少能容纳 n 行；容量不足时按两倍增长，只有这时才重新映射向量文件"""
+        capacity = len(self._deleted_buf)
+        if n > capacity:
+            capacity = max(n, 2 * capacity, self.MIN_CAPACITY)
+            deleted = np.zeros(capacity, dtype=bool)
+            deleted[:len(self._deleted_buf)] = self._deleted_buf
+            lists = np.full(capacity, -1, dtype=np.int32)
+            lists[:len(self._lists_buf)] = self._lists_buf
+            self._deleted_buf, self._lists_buf = deleted, lists
+            self._deleted, self._lists = deleted[:len(self._ids)], lists[:len(self._ids)]
+        if self.dim is None or n == 0:
+            return
+        if self._mm is None:
+            self._map_vectors()
+        if self._mm is None or len(self._mm) < n:
+            rows = max(n, 2 * (len(self._mm) if self._mm is not None else 0), self.MIN_CAPACITY)
+            self._mm = self._vectors = None  # 先释放旧映射（Windows 下映射中的文件不能改变大小）
+            with open(self._vectors_path, 'ab') as f:
+                f.truncate(rows * 4 * self.dim)
+            self._map_vectors()
+
+    def _set_views(self, n):
+        self._deleted = self._deleted_buf[:n]
+        self._lists = self._lists_buf[:n]
+        self._vectors = self._mm[:n] if self._mm is not None else np.zeros((0, self.dim or 0), dtype=np.float32)
+        self._inverted = None
+
+    # ---- IVF ----
+    def _kmeans(self, data, nlist):
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERS):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+                else:
+                    centroids[c] = data[rng.integers(len(data))]
+            centroids = _normalize(centroids)
+        return centroids
+
+    def _assign(self, vectors):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.CHUNK):
+            block = np.asarray(vectors[start:start + self.CHUNK])
+            out[start:start + len(block)] = np.argmax(block @ self._centroids.T, axis=1)
+        return out
+
+    def _maybe_train(self):
+        n = len(self._ids)
+        if n < self.train_threshold:
+            return
+        if self._centroids is not None and n < self.trained_count * self.RETRAIN_GROWTH:
+            return
+        nlist = int(min(4096, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, min(n, self.KMEANS_SAMPLE), replace=False))
+        self._centroids = self._kmeans(np.asarray(self._vectors[sample_rows]), nlist)
+        np.save(self._centroids_path, self._centroids)
+        self._lists_buf[:n] = self._assign(self._vectors)
+        self._lists_buf[:n].tofile(self._lists_path)
+        self._set_views(n)
+        self.trained_count = n
+        self._write_meta()
+        logger.info(f"向量索引已训练: {self.dir}，{n} 条向量，{nlist} 个聚类")
+
+    def _inverted_lists(self):
+        if self._inverted is None:
+            order = np.argsort(self._lists, kind='stable').astype(np.int64)
+            bounds = np.searchsorted(self._lists[order], np.arange(len(self._centroids) + 1))
+            self._inverted = (order, bounds)
+        return self._inverted
+
+    # ---- 写入 ----
+    def add_texts(self, texts, metadatas=None, ids=None) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        vectors = _normalize(np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32))
+        with self._lock:
+            return self._add_vectors(vectors, texts, metadatas, ids)
+
+    def _add_vectors(self, vectors, texts, metadatas, ids):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._write_meta()
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: {vectors.shape[1]} != {self.dim}")
+
+        # 已存在的 id 视为更新：先删除旧的
+        existing = [i for i in ids if i in self._row_of and not self._deleted[self._row_of[i]]]
+        if existing:
+            self.delete(existing)
+
+        # 先写向量再写文档日志：加载时以文档日志的行数为准，多出的向量行视为预留行
+        n, m = len(self._ids), len(texts)
+        self._reserve(n + m)
+        self._mm[n:n + m] = vectors
+        self._mm.flush()
+        lists = self._assign(vectors) if self._centroids is not None else np.full(m, -1, dtype=np.int32)
+        self._lists_buf[n:n + m] = lists
+        with open(self._lists_path, 'r+b' if self._lists_path.exists() else 'wb') as f:
+            f.seek(n * 4)
+            f.write(lists.tobytes())
+        with open(self._docs_path, 'a', encoding='utf-8') as f:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                f.write(json.dumps({'op': 'add', 'id': doc_id, 'text': text, 'metadata': metadata}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self._bm25.add(doc_id, text)
+            self._row_of[doc_id] = len(self._ids)
+            self._ids.append(doc_id)
+            self._texts.append(text)
+            self._metadatas.append(metadata)
+        self._set_views(n + m)
+        self._maybe_train()
+        return ids
+
+    def delete(self, ids=None) -> bool:
+        with self._lock:
+            return self._delete(ids)
+
+    def _delete(self, ids):
+        rows = [self._row_of[i] for i in (ids or []) if i in self._row_of]
+        rows = [r for r in rows if not self._deleted[r]]
+        if not rows:
+            return False
+        with open(self._docs_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'op': 'delete', 'ids': [self._ids[r] for r in rows]}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._deleted[rows] = True
+        for r in rows:
+            self._bm25.remove(self._ids[r], self._texts[r])
+        deleted = int(self._deleted.sum())
+        if deleted >= self.COMPACT_MIN_DELETED and deleted > self.COMPACT_RATIO * len(self._ids):
+            self._compact()
+        return True
+
+    def get_ids(self, where: Optional[dict] = None) -> List[str]:
+        """按元数据等值条件查找文档id"""
+        where = where or {}
+        with self._lock:
+            return [doc_id for row, doc_id in enumerate(self._ids)
+                    if not self._deleted[row] and all(self._metadatas[row].get(k) == v for k, v in where.items())]
+
+    def compact(self):
+        """去除墓碑并重写所有文件"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(~self._deleted)
+        vectors = np.asarray(self._vectors[keep]) if len(keep) else np.zeros((0, self.dim), dtype=np.float32)
+        lists = self._lists[keep]
+        ids = [self._ids[r] for r in keep]
+        texts = [self._texts[r] for r in keep]
+        metadatas = [self._metadatas[r] for r in keep]
+        self._mm = self._vectors = None  # 释放 memmap 才能在 Windows 下替换文件
+
+        def _replace(path, write):
+            tmp = str(path) + '.tmp'
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+
+        _replace(self._vectors_path, lambda f: f.write(vectors.tobytes()))
+        _replace(self._lists_path, lambda f: f.write(lists.tobytes()))
+        tmp = str(self._docs_path) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                f.write(json.dumps({'op': 'add', 'id': doc_id, 'text': text, 'metadata': metadata}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._docs_path)
+
+        self._ids, self._texts, self._metadatas = ids, texts, metadatas
+        self._row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._deleted_buf = np.zeros(len(ids), dtype=bool)
+        self._lists_buf = lists
+        self._map_vectors()
+        self._set_views(len(ids))
+
+    # ---- 查询 ----
+    def _candidates(self, q):
+        n = len(self._ids)
+        if self._centroids is None or n < self.train_threshold:
+            return None
+        order, bounds = self._inverted_lists()
+        nprobe = self.nprobe or max(8, len(self._centroids) // 8)
+        probe = np.argsort(-(self._centroids @ q))[:nprobe]
+        rows = [order[bounds[c]:bounds[c + 1]] for c in probe]
+        # 尚未分配聚类的行（-1）排在最前面，始终参与检索
+        unassigned = order[:bounds[0]]
+        return np.sort(np.concatenate(rows + [unassigned]))
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4) -> List[Tuple[Document, float]]:
+        q = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        with self._lock:
+            return self._search(q, k)
+
+    def _search(self, q, k):
+        if not self._ids:
+            return []
+        rows = self._candidates(q)
+        if rows is None:
+            scores = np.empty(len(self._ids), dtype=np.float32)
+            for start in range(0, len(self._ids), self.CHUNK):
+                block = np.asarray(self._vectors[start:start + self.CHUNK])
+                scores[start:start + len(block)] = block @ q
+            rows = np.arange(len(self._ids))
+        else:
+            scores = np.asarray(self._vectors[rows]) @ q
+        alive = ~self._deleted[rows]
+        rows, scores = rows[alive], scores[alive]
+        if not len(rows):
+            return []
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._document(rows[i]), float(scores[i])) for i in top]
+
+    def _document(self, row):
+        return Document(page_content=self._texts[row], metadata=dict(self._metadatas[row], id=self._ids[row]))
+
+    def lexical_search_with_score(self, query, k=4) -> List[Tuple[Document, float]]:
+        """BM25 词法检索"""
+        with self._lock:
+            return [(self._document(self._row_of[doc_id]), score) for doc_id, score in self._bm25.search(query, k)]
+
+    def similarity_search_with_score(self, query, k=4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query, k=4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def __len__(self):
+        with self._lock:
+            return int(len(self._ids) - self._deleted.sum())
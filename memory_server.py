@@ -2,12 +2,16 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from memory import CompressedRecentHistoryManager, SemanticMemory, ImportantSettingsManager, TimeIndexedMemory
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
+from fastapi.responses import Response
+from collections import OrderedDict
+from typing import Optional
 import json
 import uvicorn
 from langchain_core.messages import convert_to_messages
 from uuid import uuid4
-from config import get_character_data, MEMORY_SERVER_PORT
+from config import get_character_data, MEMORY_SERVER_PORT, SETTINGS_EXTRACTION_ENABLED
+from utils.llm_client import get_client_pool_stats
 from pydantic import BaseModel
 import re
 import asyncio
@@ -36,6 +40,159 @@ enable_shutdown = False
 # 全局变量用于管理correction任务
 correction_tasks = {}  # {lanlan_name: asyncio.Task}
 correction_cancel_flags = {}  # {lanlan_name: asyncio.Event}
+# 幂等处理：已处理的 Idempotency-Key 与对话在同一个事务中写入时间索引库（持久化，重启后仍有效）；
+# 内存中只记录最近的（包括正在处理的）请求，重试的请求直接返回或等待首次结果
+IDEMPOTENCY_CACHE_SIZE = 1024
+idempotent_results = OrderedDict()  # {key: asyncio.Future}
+
+
+# 正则表达式：删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
+BRACKETS_PATTERN = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
+
+
+# ETag 前缀：每次进程启动不同，重启后调用方缓存的旧 ETag 不会误命中
+_ETAG_PREFIX = uuid4().hex[:8]
+
+
+def _json_fragment(text):
+    """text 编码为 JSON 字符串后去掉两端引号的部分；JSON 转义逐字符进行，片段可以直接拼接"""
+    return json.dumps(text, ensure_ascii=False)[1:-1]
+
+
+class DialogPromptSnapshot:
+    """
+    /new_dialog 提示词的按角色快照
+    输入（角色数据快照、设定版本、近期记忆列表）不变时直接复用已编码好的响应体；
+    近期记忆变化时只为新出现的消息做括号清洗和 JSON 转义，已有消息的结果按对象复用。
+    """
+
+    def __init__(self, lanlan_name):
+        self.lanlan_name = lanlan_name
+        self.version = 0
+        self.etag = None
+        self.body = b""
+        self._character = None
+        self._settings_version = None
+        self._history = None
+        self._history_len = 0
+        self._header = ""
+        self._name_mapping = {}
+        self._lines = {}  # {id(message): (message, 渲染并转义后的行)}，持有消息引用保证 id 不被复用
+
+    def _render(self, message):
+        if type(message.content) == str:
+            cleaned_content = BRACKETS_PATTERN.sub('', message.content).strip()
+            return f"{self._name_mapping[message.type]} | {cleaned_content}\n"
+        texts = [BRACKETS_PATTERN.sub('', j['text']).strip() for j in message.content if j['type'] == 'text']
+        return f"{self._name_mapping[message.type]} | " + "\n".join(texts) + "\n"
+
+    def refresh(self):
+        """按需重建快照，返回当前 ETag"""
+        lanlan_name = self.lanlan_name
+        character = get_character_data()
+        settings = settings_manager.get_settings(lanlan_name)
+        history = recent_history_manager.get_recent_history(lanlan_name)
+        header_stale = character is not self._character or settings_manager.version != self._settings_version
+        history_stale = history is not self._history or len(history) != self._history_len
+        if self.etag is not None and not header_stale and not history_stale:
+            return self.etag
+
+        if header_stale:
+            master_name, _, _, _, name_mapping, _, _, _, _, _ = character
+            self._name_mapping = dict(name_mapping, ai=lanlan_name)
+            header = f"\n========{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(settings, ensure_ascii=False)}\n\n"
+            header += f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
+            self._header = _json_fragment(header)
+            self._lines = {}
+            self._character = character
+            self._settings_version = settings_manager.version
+
+        lines = {}
+        parts = [self._header]
+        for message in history:
+            entry = self._lines.get(id(message))
+            if entry is None or entry[0] is not message:
+                entry = (message, _json_fragment(self._render(message)))
+            lines[id(message)] = entry
+            parts.append(entry[1])
+        self._lines = lines
+        self._history = history
+        self._history_len = len(history)
+
+        # 与直接返回 str 时 FastAPI 的 JSON 编码保持一致
+        body = ('"' + "".join(parts) + '"').encode("utf-8")
+        if body != self.body:
+            self.body = body
+            self.version += 1
+            self.etag = f'"{_ETAG_PREFIX}-{self.version}"'
+        return self.etag
+
+
+dialog_snapshots = {}  # {lanlan_name: DialogPromptSnapshot}
+
+
+def _dialog_snapshot(lanlan_name):
+    snapshot = dialog_snapshots.get(lanlan_name)
+    if snapshot is None:
+        snapshot = dialog_snapshots[lanlan_name] = DialogPromptSnapshot(lanlan_name)
+    return snapshot
+
+
+def _refresh_dialog_snapshot(lanlan_name):
+    """记忆更新后立即重建快照，使下一次 /new_dialog（会话启动、热切换）无需现算"""
+    try:
+        _dialog_snapshot(lanlan_name).refresh()
+    except Exception as e:
+        logger.warning(f"重建 {lanlan_name} 的 new_dialog 快照失败: {e}")
+
+
+async def _store_semantic(uid, input_history, lanlan_name, summary):
+    """
+    写入语义记忆（向量索引），复用 time_manager 刚生成的摘要，不再重复调用 LLM 压缩。
+    对话已在时间索引中提交，向量写入失败只记录日志，不让整个请求失败
+    """
+    try:
+        await semantic_manager.store_conversation(uid, input_history, lanlan_name, summary=summary)
+    except Exception as e:
+        logger.warning(f"写入 {lanlan_name} 的语义记忆失败: {e}")
+
+
+async def _run_idempotent(key: Optional[str], lanlan_name: str, handler):
+    """
+    同一个key只执行一次handler；失败的结果不缓存，允许重试
+    先查询 key 是否已提交，再执行任何有副作用的步骤。
+    handler 负责把 key 交给 time_manager.store_conversation，与对话一起提交后才返回（即确认）；
+    在此之前写入的近期记录也带着同一个 key，重试时不会重复追加
+    """
+    if not key:
+        return await handler()
+    future = idempotent_results.get(key)
+    if future is not None:
+        logger.info(f"重复请求（Idempotency-Key={key}），返回首次处理结果")
+        return await asyncio.shield(future)
+    try:
+        stored = time_manager.get_processed_result(lanlan_name, key)
+    except Exception as e:
+        logger.warning(f"查询幂等键失败，按新请求处理: {e}")
+        stored = None
+    if stored is not None:
+        logger.info(f"重复请求（Idempotency-Key={key}），该请求已在之前处理过")
+        return stored
+    future = asyncio.get_running_loop().create_future()
+    idempotent_results[key] = future
+    while len(idempotent_results) > IDEMPOTENCY_CACHE_SIZE:
+        idempotent_results.popitem(last=False)
+    try:
+        result = await handler()
+    except BaseException as e:
+        idempotent_results.pop(key, None)
+        future.set_exception(e)
+        future.exception()  # 已被记录，避免未取回异常的警告
+        raise
+    if isinstance(result, dict) and result.get("status") == "error":
+        idempotent_results.pop(key, None)
+    future.set_result(result)
+    return result
 
 @app.post("/shutdown")
 async def shutdown_memory_server():
@@ -57,7 +214,8 @@ async def shutdown_memory_server():
 async def shutdown_event_handler():
     """应用关闭时执行清理工作"""
     logger.info("Memory server正在关闭...")
-    # 这里可以添加任何需要的清理工作
+    # 将近期记录的追加日志压缩回快照
+    recent_history_manager.close()
     logger.info("Memory server已关闭")
 
 
@@ -73,7 +231,8 @@ async def _run_review_in_background(lanlan_name: str):
     
     try:
         # 直接异步调用review_history方法
-        await recent_history_manager.review_history(lanlan_name, cancel_event)
+        if await recent_history_manager.review_history(lanlan_name, cancel_event):
+            _refresh_dialog_snapshot(lanlan_name)
         logger.info(f"✅ {lanlan_name} 的记忆审阅任务完成")
     except asyncio.CancelledError:
         logger.info(f"⚠️ {lanlan_name} 的记忆审阅任务被取消")
@@ -88,18 +247,27 @@ async def _run_review_in_background(lanlan_name: str):
             correction_cancel_flags[lanlan_name].clear()
 
 @app.post("/process/{lanlan_name}")
-async def process_conversation(request: HistoryRequest, lanlan_name: str):
+async def process_conversation(request: HistoryRequest, lanlan_name: str,
+                               idempotency_key: Optional[str] = Header(None)):
+    return await _run_idempotent(idempotency_key, lanlan_name,
+                                 lambda: _process_conversation(request, lanlan_name, idempotency_key))
+
+
+async def _process_conversation(request: HistoryRequest, lanlan_name: str, idempotency_key: Optional[str] = None):
     global correction_tasks
     try:
         uid = str(uuid4())
         input_history = convert_to_messages(json.loads(request.input_history))
-        await recent_history_manager.update_history(input_history, lanlan_name)
+        await recent_history_manager.update_history(input_history, lanlan_name, idempotency_key=idempotency_key)
         """
-        下面屏蔽了两个模块，因为这两个模块需要消耗token，但当前版本实用性近乎于0。尤其是，Qwen与GPT等旗舰模型相比性能差距过大。
+        下面屏蔽了设置提取模块，因为它需要消耗token，但当前版本实用性近乎于0。尤其是，Qwen与GPT等旗舰模型相比性能差距过大。
         """
-        # await settings_manager.extract_and_update_settings(input_history, lanlan_name)
-        # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
-        await time_manager.store_conversation(uid, input_history, lanlan_name)
+        # 需要时设置 SETTINGS_EXTRACTION_ENABLED 打开；增量提取，重试同一请求时跳过已经提取过的消息
+        if SETTINGS_EXTRACTION_ENABLED:
+            await settings_manager.extract_and_update_settings(input_history, lanlan_name, request_key=idempotency_key)
+        summary = await time_manager.store_conversation(uid, input_history, lanlan_name, idempotency_key=idempotency_key)
+        await _store_semantic(uid, input_history, lanlan_name, summary)
+        _refresh_dialog_snapshot(lanlan_name)
         
         # 在后台启动review_history任务
         if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
@@ -121,15 +289,25 @@ async def process_conversation(request: HistoryRequest, lanlan_name: str):
         return {"status": "error", "message": str(e)}
 
 @app.post("/renew/{lanlan_name}")
-async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: str):
+async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: str,
+                                         idempotency_key: Optional[str] = Header(None)):
+    return await _run_idempotent(idempotency_key, lanlan_name,
+                                 lambda: _process_conversation_for_renew(request, lanlan_name, idempotency_key))
+
+
+async def _process_conversation_for_renew(request: HistoryRequest, lanlan_name: str,
+                                          idempotency_key: Optional[str] = None):
     global correction_tasks
     try:
         uid = str(uuid4())
         input_history = convert_to_messages(json.loads(request.input_history))
-        await recent_history_manager.update_history(input_history, lanlan_name, detailed=True)
-        # await settings_manager.extract_and_update_settings(input_history, lanlan_name)
-        # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
-        await time_manager.store_conversation(uid, input_history, lanlan_name)
+        await recent_history_manager.update_history(input_history, lanlan_name, detailed=True,
+                                                    idempotency_key=idempotency_key)
+        if SETTINGS_EXTRACTION_ENABLED:
+            await settings_manager.extract_and_update_settings(input_history, lanlan_name, request_key=idempotency_key)
+        summary = await time_manager.store_conversation(uid, input_history, lanlan_name, idempotency_key=idempotency_key)
+        await _store_semantic(uid, input_history, lanlan_name, summary)
+        _refresh_dialog_snapshot(lanlan_name)
         
         # 在后台启动review_history任务
         if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
@@ -152,6 +330,7 @@ async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: s
 def get_recent_history(lanlan_name: str):
     history = recent_history_manager.get_recent_history(lanlan_name)
     _, _, _, _, name_mapping, _, _, _, _, _ = get_character_data()
+    name_mapping = name_mapping.copy()
     name_mapping['ai'] = lanlan_name
     result = f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
     for i in history:
@@ -168,12 +347,18 @@ async def get_memory(query: str, lanlan_name:str):
     return await semantic_manager.query(query, lanlan_name)
 
 @app.get("/get_settings/{lanlan_name}")
-def get_settings(lanlan_name: str):
+async def get_settings(lanlan_name: str):
+    # 设定常驻内存，只做几次 stat，直接在事件循环上执行，避免高并发下线程池排队
     result = f"{lanlan_name}记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}"
     return result
 
+@app.get("/client_pool_stats")
+def client_pool_stats():
+    """LLM客户端注册表的复用统计"""
+    return get_client_pool_stats()
+
 @app.get("/new_dialog/{lanlan_name}")
-async def new_dialog(lanlan_name: str):
+async def new_dialog(lanlan_name: str, if_none_match: Optional[str] = Header(None)):
     global correction_tasks, correction_cancel_flags
     
     # 中断正在进行的correction任务
@@ -193,20 +378,13 @@ async def new_dialog(lanlan_name: str):
         except Exception as e:
             logger.warning(f"⚠️ 中断 {lanlan_name} 的correction任务时出现异常: {e}")
     
-    # 正则表达式：删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
-    brackets_pattern = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
-    master_name, _, _, _, name_mapping, _, _, _, _, _ = get_character_data()
-    name_mapping['ai'] = lanlan_name
-    result = f"\n========{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}\n\n"
-    result += f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
-    for i in recent_history_manager.get_recent_history(lanlan_name):
-        if type(i.content) == str:
-            cleaned_content = brackets_pattern.sub('', i.content).strip()
-            result += f"{name_mapping[i.type]} | {cleaned_content}\n"
-        else:
-            texts = [brackets_pattern.sub('', j['text']).strip() for j in i.content if j['type'] == 'text']
-            result += f"{name_mapping[i.type]} | " + "\n".join(texts) + "\n"
-    return result
+    snapshot = _dialog_snapshot(lanlan_name)
+    etag = snapshot.refresh()
+    headers = {"ETag": etag, "X-Prompt-Version": str(snapshot.version)}
+    # 调用方带上次的 ETag 时，内容未变则不再重复传输
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
 
 if __name__ == "__main__":
     import threading
@@ -4,6 +4,7 @@
 import asyncio
 import json
 from config import MONITOR_SERVER_PORT
+from utils.client_channel import ClientChannel, fan_out, OVERFLOW_BY_KIND
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, HTMLResponse
@@ -34,7 +35,15 @@ async def get_index(request: Request, lanlan_name: str):
     })
 
 
-# 存储所有连接的客户端
+def _encode(message):
+    return json.dumps(message, ensure_ascii=False)
+
+
+# 发送队列满时的处理策略（见 utils.client_channel）：by_kind、drop_oldest、coalesce 或 disconnect
+VIEWER_OVERFLOW_POLICY = OVERFLOW_BY_KIND
+SUBTITLE_OVERFLOW_POLICY = OVERFLOW_BY_KIND
+
+# 存储所有连接的客户端（ClientChannel）
 connected_clients = set()
 subtitle_clients = set()
 current_subtitle = ""
@@ -66,15 +75,15 @@ async def subtitle_websocket_endpoint(websocket: WebSocket):
     print(f"字幕客户端已连接: {websocket.client}")
 
     # 添加到字幕客户端集合
-    subtitle_clients.add(websocket)
+    channel = ClientChannel(websocket, subtitle_clients, overflow_policy=SUBTITLE_OVERFLOW_POLICY)
 
     try:
         # 发送当前字幕（如果有）
         if current_subtitle:
-            await websocket.send_json({
+            channel.send("text", _encode({
                 "type": "subtitle",
                 "text": current_subtitle
-            })
+            }), key="subtitle")
 
         # 保持连接
         while True:
@@ -82,7 +91,7 @@ async def subtitle_websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         print(f"字幕客户端已断开: {websocket.client}")
     finally:
-        subtitle_clients.discard(websocket)
+        channel.close()
 
 
 # 广播字幕到所有字幕客户端
@@ -94,16 +103,10 @@ async def broadcast_subtitle():
         # 给一个短暂的延迟让清空动画完成
         await asyncio.sleep(0.3)
 
-    clients = subtitle_clients.copy()
-    for client in clients:
-        try:
-            await client.send_json({
-                "type": "subtitle",
-                "text": current_subtitle
-            })
-        except Exception as e:
-            print(f"字幕广播错误: {e}")
-            subtitle_clients.discard(client)
+    fan_out(subtitle_clients, "text", _encode({
+        "type": "subtitle",
+        "text": current_subtitle
+    }), key="subtitle")
 
 
 # 清空字幕
@@ -111,15 +114,9 @@ async def clear_subtitle():
     global current_subtitle
     current_subtitle = ""
 
-    clients = subtitle_clients.copy()
-    for client in clients:
-        try:
-            await client.send_json({
-                "type": "clear"
-            })
-        except Exception as e:
-            print(f"清空字幕错误: {e}")
-            subtitle_clients.discard(client)
+    fan_out(subtitle_clients, "text", _encode({
+        "type": "clear"
+    }))
 
 # 主服务器连接端点
 @app.websocket("/sync/{lanlan_name}")
@@ -151,16 +148,10 @@ async def sync_endpoint(websocket: WebSocket, lanlan_name:str):
                         if is_japanese(current_subtitle):
                             translated_text = await translate_japanese_to_chinese(current_subtitle)
                             current_subtitle = translated_text
-                            clients = subtitle_clients.copy()
-                            for client in clients:
-                                try:
-                                    await client.send_json({
-                                        "type": "subtitle",
-                                        "text": translated_text
-                                    })
-                                except Exception as e:
-                                    print(f"翻译字幕广播错误: {e}")
-                                    subtitle_clients.discard(client)
+                            fan_out(subtitle_clients, "text", _encode({
+                                "type": "subtitle",
+                                "text": translated_text
+                            }), key="subtitle")
 
                     # 清空字幕区域，准备下一条
                     global should_clear_next
@@ -205,7 +196,7 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name:str):
     print(f"查看客户端已连接: {websocket.client}")
 
     # 添加到连接集合
-    connected_clients.add(websocket)
+    channel = ClientChannel(websocket, connected_clients, overflow_policy=VIEWER_OVERFLOW_POLICY)
 
     try:
         # 保持连接直到客户端断开
@@ -214,35 +205,17 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name:str):
     except WebSocketDisconnect:
         print(f"查看客户端已断开: {websocket.client}")
     finally:
-        connected_clients.remove(websocket)
+        channel.close()
 
 
-# 广播消息到所有客户端
+# 广播消息到所有客户端（只编码一次，各客户端的写任务负责实际发送）
 async def broadcast_message(message):
-    clients = connected_clients.copy()
-    for client in clients:
-        try:
-            await client.send_json(message)
-        except Exception as e:
-            print(f"广播错误: {e}")
-            try:
-                connected_clients.remove(client)
-            except:
-                pass
+    fan_out(connected_clients, "text", _encode(message))
 
 
 # 广播二进制数据到所有客户端
 async def broadcast_binary(data):
-    clients = connected_clients.copy()
-    for client in clients:
-        try:
-            await client.send_bytes(data)
-        except Exception as e:
-            print(f"二进制广播错误: {e}")
-            try:
-                connected_clients.remove(client)
-            except:
-                pass
+    fan_out(connected_clients, "bytes", bytes(data))
 
 
 # 定期清理断开的连接
@@ -254,13 +227,8 @@ async def startup_event():
 async def cleanup_disconnected_clients():
     while True:
         try:
-            # 检查并移除已断开的客户端
-            for client in list(connected_clients):
-                try:
-                    await client.send_json({"type": "heartbeat"})
-                except Exception as e:
-                    print("广播错误:", e)
-                    connected_clients.remove(client)
+            # 发送心跳，已断开的客户端会在写任务中发送失败并被移除
+            fan_out(connected_clients, "text", _encode({"type": "heartbeat"}), key="heartbeat")
             await asyncio.sleep(60)  # 每分钟检查一次
         except Exception as e:
             print(f"清理客户端错误: {e}")
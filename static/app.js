@@ -39,6 +39,13 @@ function init_app(){
     let isSwitchingMode = false; // 新增：模式切换标志
     let sessionStartedResolver = null; // 用于等待 session_started 消息
     
+    // 麦克风数据帧格式：start_session时声明支持二进制帧，服务端在session_started中确认
+    let binaryAudioInput = false;
+    let audioFrameSeq = 0;
+    const AUDIO_FRAME_VERSION = 1;
+    const AUDIO_STREAM_TYPE = 1;
+    const AUDIO_FRAME_HEADER_SIZE = 8;
+    
     // WebSocket心跳保活
     let heartbeatInterval = null;
     const HEARTBEAT_INTERVAL = 30000; // 30秒发送一次心跳
@@ -151,7 +158,8 @@ function init_app(){
                                     // 发送start session事件
                                     socket.send(JSON.stringify({
                                         action: 'start_session',
-                                        input_type: 'audio'
+                                        input_type: 'audio',
+                                        audio_protocol: 'binary'
                                     }));
                                     
                                     // 等待session真正启动成功
@@ -188,6 +196,8 @@ function init_app(){
                     }
                 } else if (response.type === 'session_started') {
                     console.log('收到session_started事件，模式:', response.input_mode);
+                    binaryAudioInput = response.audio_protocol === 'binary';
+                    audioFrameSeq = 0;
                     // 解析 session_started Promise
                     if (sessionStartedResolver) {
                         sessionStartedResolver(response.input_mode);
@@ -741,7 +751,8 @@ function init_app(){
             if (socket.readyState === WebSocket.OPEN) {
                 socket.send(JSON.stringify({
                     action: 'start_session',
-                    input_type: 'audio'
+                    input_type: 'audio',
+                    audio_protocol: 'binary'
                 }));
             } else {
                 throw new Error('WebSocket未连接');
@@ -1012,6 +1023,19 @@ function init_app(){
         }
     }
 
+    // 将PCM16数据打包为二进制帧：版本(u8) | 流类型(u8) | 采样率(u16) | 序号(u32) | PCM16（均为小端）
+    function encodeAudioFrame(pcmData, sampleRate) {
+        const frame = new ArrayBuffer(AUDIO_FRAME_HEADER_SIZE + pcmData.byteLength);
+        const view = new DataView(frame);
+        view.setUint8(0, AUDIO_FRAME_VERSION);
+        view.setUint8(1, AUDIO_STREAM_TYPE);
+        view.setUint16(2, sampleRate, true);
+        view.setUint32(4, audioFrameSeq, true);
+        audioFrameSeq = (audioFrameSeq + 1) >>> 0;
+        new Uint8Array(frame, AUDIO_FRAME_HEADER_SIZE).set(new Uint8Array(pcmData.buffer, pcmData.byteOffset, pcmData.byteLength));
+        return frame;
+    }
+
     // 使用AudioWorklet开始音频处理
     async function startAudioWorklet(stream) {
         isRecording = true;
@@ -1054,11 +1078,15 @@ function init_app(){
                 }
 
                 if (isRecording && socket.readyState === WebSocket.OPEN) {
-                    socket.send(JSON.stringify({
-                        action: 'stream_data',
-                        data: Array.from(audioData),
-                        input_type: 'audio'
-                    }));
+                    if (binaryAudioInput) {
+                        socket.send(encodeAudioFrame(audioData, 16000));
+                    } else {
+                        socket.send(JSON.stringify({
+                            action: 'stream_data',
+                            data: Array.from(audioData),
+                            input_type: 'audio'
+                        }));
+                    }
                 }
             };
 
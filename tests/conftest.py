@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共配置
+- 把 HOME 指向临时目录，配置管理器在其中创建 Documents/Xiao8，不会读写真实的用户配置和记忆
+- 未创建 config/api.py 时按开发文档的约定使用 config/api_template.py
+- 写入带占位 API Key 的 core_config.json，使各服务模块可以直接导入
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_home = tempfile.mkdtemp(prefix="xiao8-test-home-")
+os.environ["HOME"] = _home
+os.environ["USERPROFILE"] = _home
+
+if not os.path.exists(os.path.join(ROOT, "config", "api.py")):
+    # config/__init__.py 在导入时就会读取 config.api，必须在导入 config 包之前注册
+    _spec = importlib.util.spec_from_file_location("config.api", os.path.join(ROOT, "config", "api_template.py"))
+    _api = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_api)
+    sys.modules["config.api"] = _api
+
+# 写入一份带占位密钥的 core_config.json：各服务在导入时就会构造 API 客户端，空密钥会直接报错。
+# 测试中所有请求都发往本地模拟服务
+import json  # noqa: E402
+
+import config  # noqa: E402
+
+with open(config.CORE_CONFIG_PATH, "w", encoding="utf-8") as _f:
+    json.dump({"coreApi": "qwen", "coreApiKey": "test-key", "assistApi": "qwen"}, _f)
+config.invalidate_config_cache()
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""统计事件循环唤醒次数的测试工具：每次 select 返回即为事件循环的一次迭代"""
+import asyncio
+import selectors
+
+
+class CountingSelector(selectors.DefaultSelector):
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        events = super().select(timeout)
+        self.wakeups += 1
+        return events
+
+
+def new_counting_loop():
+    """返回 (loop, selector)，selector.wakeups 为该事件循环迄今的迭代次数"""
+    selector = CountingSelector()
+    return asyncio.SelectorEventLoop(selector), selector
+
+
+def run_counting(coro_factory):
+    """在新的计数事件循环中运行 coro_factory(selector)，返回其结果"""
+    loop, selector = new_counting_loop()
+    try:
+        return loop.run_until_complete(coro_factory(selector))
+    finally:
+        loop.close()
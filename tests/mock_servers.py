@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""测试用的本地模拟服务（只依赖标准库 asyncio）"""
+import asyncio
+import json
+
+
+class MockHTTPServer:
+    """
+    最小的 HTTP/1.1 keep-alive 服务器
+    handler(method, path, headers, body) -> (status, headers, body)，可以是协程；
+    connections 统计建立过的 TCP 连接数，requests 记录收到的请求。
+    """
+
+    def __init__(self, handler, delay=0.0):
+        self.handler = handler
+        self.delay = delay
+        self.connections = 0
+        self.requests = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests.append((method, path, headers, body))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                result = self.handler(method, path, headers, body)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                status, resp_headers, resp_body = result
+                if isinstance(resp_body, (dict, list)):
+                    resp_body = json.dumps(resp_body, ensure_ascii=False).encode("utf-8")
+                    resp_headers = {"Content-Type": "application/json", **resp_headers}
+                elif isinstance(resp_body, str):
+                    resp_body = resp_body.encode("utf-8")
+                out = [f"HTTP/1.1 {status} X"]
+                for k, v in {**resp_headers, "Content-Length": str(len(resp_body))}.items():
+                    out.append(f"{k}: {v}")
+                writer.write(("\r\n".join(out) + "\r\n\r\n").encode("latin-1") + resp_body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+def chat_completion(content):
+    """OpenAI 兼容的 chat.completions 响应体"""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "mock",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def chat_completion_stream(content, chunk_chars=8):
+    """OpenAI 兼容的流式 chat.completions 响应体（SSE），按 chunk_chars 个字符切分"""
+    events = []
+    for i in range(0, len(content), chunk_chars):
+        chunk = {
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "mock",
+            "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_chars]}, "finish_reason": None}],
+        }
+        events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    done = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    events.append(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n")
+    return "".join(events)
+
+
+def openai_handler(reply):
+    """reply(messages) -> str，返回处理 /chat/completions 的 handler"""
+    def handler(method, path, headers, body):
+        if path.endswith("/chat/completions"):
+            payload = json.loads(body)
+            return 200, {}, chat_completion(reply(payload["messages"]))
+        return 404, {}, {"error": "not found"}
+    return handler
+
+
+class MockWebSocketServer:
+    """
+    本地 WebSocket 服务器，handler(ws) 为处理单条连接的协程
+    connections 统计建立过的连接数；connect_delay 模拟握手后、开始处理前的延迟，
+    handshake_delay 模拟握手完成前的网络/TLS 延迟（客户端的 connect 会被阻塞）。
+    """
+
+    def __init__(self, handler, connect_delay=0.0, handshake_delay=0.0):
+        self.handler = handler
+        self.connect_delay = connect_delay
+        self.handshake_delay = handshake_delay
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        import websockets
+        self._server = await websockets.serve(self._serve, "127.0.0.1", 0, process_request=self._delay_handshake)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _delay_handshake(self, connection, request):
+        if self.handshake_delay:
+            await asyncio.sleep(self.handshake_delay)
+        return None
+
+    async def _serve(self, ws):
+        self.connections += 1
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+        try:
+            await self.handler(ws)
+        except Exception:
+            pass
+
+
+def qwen_tts_handler(chunk_bytes=4800, chunks_per_char=1, first_audio_delay=0.0):
+    """
+    模拟 Qwen 实时 TTS（server_commit 模式）：session.update -> session.updated；
+    commit 后按文本长度返回若干个 24kHz PCM16 音频块，每个 response 之间互不交错。
+    """
+    import base64
+
+    async def handler(ws):
+        text = []
+        response_no = 0
+        async for message in ws:
+            event = json.loads(message)
+            event_type = event.get("type")
+            if event_type == "session.update":
+                await ws.send(json.dumps({"type": "session.updated", "session": event["session"]}))
+            elif event_type == "input_text_buffer.append":
+                text.append(event["text"])
+            elif event_type == "input_text_buffer.clear":
+                text.clear()
+            elif event_type == "input_text_buffer.commit":
+                response_no += 1
+                response_id = f"resp_{response_no}"
+                n = max(1, len("".join(text)) * chunks_per_char)
+                text.clear()
+                await ws.send(json.dumps({"type": "response.created", "response": {"id": response_id}}))
+                if first_audio_delay:
+                    await asyncio.sleep(first_audio_delay)
+                pcm = (b"\x00\x10" * (chunk_bytes // 2))
+                for _ in range(n):
+                    await ws.send(json.dumps({"type": "response.audio.delta", "response_id": response_id,
+                                              "delta": base64.b64encode(pcm).decode()}))
+                await ws.send(json.dumps({"type": "response.done", "response": {"id": response_id}}))
+    return handler
+
+
+class MockMonitorServer:
+    """
+    模拟 monitor 的 /sync/{name} 与 /sync_binary/{name} 端点（aiohttp），记录 (到达时间, 帧) 供测试断言
+    """
+
+    def __init__(self):
+        self.text_frames = []
+        self.binary_frames = []
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/sync/{name}", self._sync)
+        app.router.add_get("/sync_binary/{name}", self._sync_binary)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _accept(self, request, frames, binary):
+        import time
+        from aiohttp import web
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if binary:
+                frames.append((time.perf_counter(), msg.data))
+            else:
+                frames.append((time.perf_counter(), json.loads(msg.data)))
+        return ws
+
+    async def _sync(self, request):
+        return await self._accept(request, self.text_frames, binary=False)
+
+    async def _sync_binary(self, request):
+        return await self._accept(request, self.binary_frames, binary=True)
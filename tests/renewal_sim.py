@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+热切换调度的离线回放
+用合成的对话轨迹驱动 SessionRenewalScheduler（注入假时钟），按 LLMSessionManager.handle_response_complete
+的流程模拟 renew -> 等待记忆整理 -> 后台预热 -> 下一轮结束时切换，统计切换次数、切换卡顿和上下文超出预算的时间。
+"""
+import random
+from dataclasses import dataclass
+
+from main_helper.renewal import SessionRenewalScheduler
+
+# 最终切换时用户需要等待的时间（旧会话停止、pending 会话接管）
+SWAP_STALL_SECONDS = 0.5
+# 旧策略：会话运行 40 秒后即开始准备
+FIXED_UPTIME = 40.0
+
+
+@dataclass
+class Turn:
+    gap: float          # 上一轮结束到用户开口的静默时长（秒）
+    speech: float       # 用户语音时长（秒）
+    reply_text: str     # 回复文本
+    reply_audio: float  # 回复语音时长（秒）
+
+
+@dataclass
+class ReplayResult:
+    swaps: int
+    stall_seconds: float
+    over_budget_seconds: float
+    peak_tokens: int
+    duration: float
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def synthetic_trace(minutes, gap, speech, reply_chars, seed=0):
+    """生成约 minutes 分钟的对话；gap / speech / reply_chars 为 (最小, 最大) 区间"""
+    rng = random.Random(seed)
+    turns, total = [], 0.0
+    while total < minutes * 60:
+        chars = rng.randint(*reply_chars)
+        turn = Turn(gap=rng.uniform(*gap), speech=rng.uniform(*speech),
+                    reply_text="好" * chars, reply_audio=chars / 4.0)
+        turns.append(turn)
+        total += turn.gap + turn.speech + turn.reply_audio
+    return turns
+
+
+def replay(trace, policy="adaptive", prep_seconds=3.0):
+    """policy: "adaptive" 使用调度器的预测，"fixed" 为改动前的固定运行时长规则"""
+    clock = FakeClock()
+    scheduler = SessionRenewalScheduler(clock=clock)
+    swaps, stall, over, peak = 0, 0.0, 0.0, 0
+    triggered_at = ready_at = None
+    for turn in trace:
+        clock.advance(turn.gap + turn.speech)
+        scheduler.add_audio(turn.speech)
+        clock.advance(turn.reply_audio)
+        scheduler.add_text(turn.reply_text)
+        scheduler.add_audio(turn.reply_audio)
+        scheduler.end_turn()
+        peak = max(peak, int(scheduler.tokens))
+        if scheduler.tokens > scheduler.TOKEN_BUDGET:
+            over += turn.gap + turn.speech + turn.reply_audio
+        now = clock()
+        if ready_at is not None and now >= ready_at:
+            # pending 会话已预热，本轮结束后切换
+            swaps += 1
+            stall += SWAP_STALL_SECONDS
+            clock.advance(SWAP_STALL_SECONDS)
+            scheduler.reset()
+            triggered_at = ready_at = None
+        elif triggered_at is None:
+            due = scheduler.should_prepare() if policy == "adaptive" else now - scheduler.started_at >= FIXED_UPTIME
+            if due:
+                triggered_at = now
+        elif ready_at is None and now - triggered_at >= scheduler.SUMMARY_DELAY:
+            ready_at = now + prep_seconds
+            scheduler.record_prep(prep_seconds)
+    return ReplayResult(swaps, stall, over, peak, clock())
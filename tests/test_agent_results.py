@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import multiprocessing
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+agent_server = pytest.importorskip("agent_server")
+
+from loop_probe import run_counting  # noqa: E402
+from mock_servers import MockHTTPServer  # noqa: E402
+
+Modules = agent_server.Modules
+
+
+@pytest.fixture(autouse=True)
+def fresh_modules(monkeypatch):
+    """每个测试使用独立的任务表、队列和后台任务状态"""
+    for name, value in {
+        "task_registry": {},
+        "result_queue": None,
+        "result_reader": None,
+        "notify_outbox": None,
+        "notify_task": None,
+        "http_client": None,
+        "scheduler_task": None,
+        "computer_use_queue": None,
+        "computer_use_running": False,
+        "active_computer_use_task_id": None,
+        "computer_use_idle": None,
+    }.items():
+        monkeypatch.setattr(Modules, name, value)
+    yield
+    if Modules.result_queue is not None:
+        Modules.result_queue.put(None)
+        if Modules.result_reader is not None:
+            Modules.result_reader.join(timeout=2)
+
+
+def _put_result_from_child(queue, task_id):
+    queue.put({"task_id": task_id, "success": True, "result": {"result": "done"},
+               "sent_at": time.perf_counter()})
+
+
+async def _stop(*tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if Modules.http_client is not None:
+        await Modules.http_client.aclose()
+
+
+def test_worker_result_updates_registry_and_notifies_main_server(monkeypatch):
+    notified = []
+
+    def handler(method, path, headers, body):
+        notified.append((time.perf_counter(), path, json.loads(body)))
+        return 200, {}, {"ok": True}
+
+    async def run(selector):
+        async with MockHTTPServer(handler) as server:
+            monkeypatch.setattr(agent_server, "MAIN_SERVER_PORT", server.port)
+            agent_server._ensure_result_reader()
+            sender = asyncio.create_task(agent_server._notify_sender_loop())
+            Modules.task_registry["t1"] = {"id": "t1", "status": "running", "params": {"query": "查天气"},
+                                           "lanlan_name": "test"}
+            start = time.perf_counter()
+            child = multiprocessing.get_context("fork").Process(
+                target=_put_result_from_child, args=(Modules.result_queue, "t1"))
+            child.start()
+            while not notified and time.perf_counter() - start < 5:
+                await asyncio.sleep(0.005)
+            child.join()
+            await _stop(sender)
+            return time.perf_counter() - start
+
+    run_counting(run)
+    assert Modules.task_registry["t1"]["status"] == "completed"
+    assert len(notified) == 1
+    _, path, payload = notified[0]
+    assert path == "/api/notify_task_result"
+    assert payload == {"text": "你的任务“查天气”已完成：done", "lanlan_name": "test"}
+
+
+def test_result_latency_is_not_bound_to_a_poll_interval():
+    """结果由阻塞读取线程直接交给事件循环，延迟远小于原来 100ms 的轮询周期"""
+    latencies = []
+
+    async def run(selector):
+        loop = asyncio.get_running_loop()
+        agent_server._ensure_result_reader()
+        ctx = multiprocessing.get_context("fork")
+        for i in range(20):
+            task_id = f"t{i}"
+            Modules.task_registry[task_id] = {"id": task_id, "status": "running", "params": {}}
+            done = loop.create_future()
+            original = agent_server._handle_result
+
+            def on_result(msg, done=done, original=original):
+                original(msg)
+                latencies.append(time.perf_counter() - msg["sent_at"])
+                done.set_result(None)
+
+            agent_server._handle_result = on_result
+            try:
+                child = ctx.Process(target=_put_result_from_child, args=(Modules.result_queue, task_id))
+                child.start()
+                await asyncio.wait_for(done, timeout=5)
+                child.join()
+            finally:
+                agent_server._handle_result = original
+            await asyncio.sleep(0.01)
+
+    run_counting(run)
+    latencies.sort()
+    p50, worst = latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000
+    print(f"task result latency: p50={p50:.2f}ms max={worst:.2f}ms")
+    assert p50 < 10
+    assert worst < 50
+
+
+def test_idle_server_does_not_wake_the_event_loop():
+    """空闲时结果读取线程、通知发送和 computer-use 调度都不会周期性唤醒事件循环"""
+    idle_seconds = 1.0
+
+    async def run(selector):
+        agent_server._ensure_result_reader()
+        tasks = [asyncio.create_task(agent_server._notify_sender_loop()),
+                 asyncio.create_task(agent_server._computer_use_scheduler_loop())]
+        await asyncio.sleep(0.05)
+        before, cpu_before = selector.wakeups, time.process_time()
+        await asyncio.sleep(idle_seconds)
+        wakeups, cpu = selector.wakeups - before, time.process_time() - cpu_before
+        await _stop(*tasks)
+        return wakeups, cpu
+
+    wakeups, cpu = run_counting(run)
+    print(f"idle for {idle_seconds:.0f}s: {wakeups} loop wakeups, {cpu * 1000:.2f}ms CPU "
+          f"(100ms result polling + 50ms scheduler polling would be ~30 wakeups)")
+    # 只有 sleep 本身的一次定时器唤醒
+    assert wakeups <= 3
+
+
+def test_computer_use_scheduler_runs_one_task_at_a_time(monkeypatch):
+    started = []
+
+    def fake_start(task_info):
+        started.append(task_info["task_id"])
+        Modules.computer_use_running = True
+        Modules.active_computer_use_task_id = task_info["task_id"]
+        agent_server._computer_use_idle_event().clear()
+
+    monkeypatch.setattr(agent_server, "_start_computer_use_process", fake_start)
+
+    async def run(selector):
+        scheduler = asyncio.create_task(agent_server._computer_use_scheduler_loop())
+        for i in range(2):
+            agent_server._spawn_task("computer_use", {"instruction": f"step {i}"})
+        await asyncio.sleep(0.05)
+        assert len(started) == 1
+        agent_server._handle_result({"task_id": started[0], "success": True, "result": {}})
+        await asyncio.sleep(0.05)
+        assert len(started) == 2
+        assert Modules.task_registry[started[0]]["status"] == "completed"
+        await _stop(scheduler)
+
+    run_counting(run)
+
+
+def test_finished_tasks_are_pruned_by_age_and_count(monkeypatch):
+    monkeypatch.setattr(agent_server, "TASK_REGISTRY_MAX_FINISHED", 3)
+    now = time.monotonic()
+    Modules.task_registry["old"] = {"status": "completed", "_finished_at": now - agent_server.TASK_REGISTRY_TTL - 1}
+    for i in range(5):
+        Modules.task_registry[f"done{i}"] = {"status": "completed", "_finished_at": now - 10 + i}
+    Modules.task_registry["running"] = {"status": "running"}
+    agent_server._prune_task_registry()
+    # 过期的先淘汰，其余超出上限的按完成时间从旧到新淘汰，运行中的任务不受影响
+    assert set(Modules.task_registry) == {"done2", "done3", "done4", "running"}
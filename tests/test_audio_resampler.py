@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from utils.audio import StreamingResampler
+
+RATES = [(24000, 48000), (48000, 16000), (44100, 16000), (22050, 48000)]
+
+
+def _tone(freq, sr, seconds=1.0, amplitude=0.5):
+    t = np.arange(int(sr * seconds)) / sr
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def _stream(resampler, signal, chunk):
+    parts = [resampler.process(signal[i:i + chunk]).copy() for i in range(0, len(signal), chunk)]
+    parts.append(resampler.flush().copy())
+    return np.concatenate(parts)
+
+
+def _band_power_db(signal, sr, lo, hi):
+    spectrum = np.abs(np.fft.rfft(signal * np.hanning(len(signal)))) ** 2
+    freqs = np.fft.rfftfreq(len(signal), 1.0 / sr)
+    band = spectrum[(freqs >= lo) & (freqs <= hi)].sum()
+    return 10 * np.log10(band / spectrum.sum() + 1e-30)
+
+
+@pytest.mark.parametrize("orig_sr,target_sr", RATES)
+def test_chunk_boundaries_do_not_change_output(orig_sr, target_sr):
+    signal = _tone(440, orig_sr, 0.5)
+    whole = _stream(StreamingResampler(orig_sr, target_sr), signal, len(signal))
+    for chunk in (160, 479, 1024):
+        chunked = _stream(StreamingResampler(orig_sr, target_sr), signal, chunk)
+        assert chunked.shape == whole.shape
+        assert np.max(np.abs(chunked - whole)) < 1e-5
+
+
+@pytest.mark.parametrize("orig_sr,target_sr", RATES)
+def test_flush_emits_the_filter_tail(orig_sr, target_sr):
+    resampler = StreamingResampler(orig_sr, target_sr)
+    signal = _tone(440, orig_sr, 0.2)
+    body = resampler.process(signal).copy()
+    tail = resampler.flush().copy()
+    ratio = target_sr / orig_sr
+    # 输出比输入延迟约 taps/2 个输入样点：body 的长度与输入对应，最后这段延迟中的信号要靠 flush 推出来
+    assert abs(len(body) - len(signal) * ratio) <= 1
+    assert abs(len(tail) - (resampler.taps_per_phase + 1) // 2 * ratio) <= 1
+    # 尾音里是真实的信号而不是静音
+    assert np.max(np.abs(tail[: len(tail) // 2])) > 0.1
+    # flush 之后状态已清空，下一段语音从静音开始
+    assert np.max(np.abs(resampler.process(np.zeros(64, dtype=np.float32)))) == 0.0
+
+
+def test_upsampling_keeps_tone_clean():
+    out = _stream(StreamingResampler(24000, 48000), _tone(1000, 24000), 480)
+    assert _band_power_db(out, 48000, 950, 1050) > -0.1
+    # 上采样产生的镜像（24kHz-1kHz=23kHz）被抑制
+    assert _band_power_db(out, 48000, 22500, 23500) < -70
+
+
+@pytest.mark.parametrize("orig_sr,target_sr,freq", [(48000, 16000, 12000), (48000, 16000, 14000),
+                                                    (44100, 16000, 12000), (44100, 16000, 14000)])
+def test_downsampling_suppresses_aliasing(orig_sr, target_sr, freq):
+    """高于目标奈奎斯特频率的音调不应折叠回通带"""
+    out = _stream(StreamingResampler(orig_sr, target_sr), _tone(freq, orig_sr), 960)
+    reference = _stream(StreamingResampler(orig_sr, target_sr), _tone(1000, orig_sr), 960)
+    # 去掉首尾的起振/收尾瞬态，只比较稳态
+    steady = slice(target_sr // 50, -target_sr // 50)
+    attenuation = 10 * np.log10(np.sum(out[steady] ** 2) / np.sum(reference[steady] ** 2))
+    assert attenuation < -80
+
+
+@pytest.mark.parametrize("orig_sr,target_sr", RATES)
+def test_process_int16_does_not_allocate_per_chunk(orig_sr, target_sr):
+    resampler = StreamingResampler(orig_sr, target_sr)
+    chunk = (np.random.default_rng(0).standard_normal(orig_sr // 50) * 3000).astype(np.int16).tobytes()
+    resampler.process_int16(chunk)  # 预热：按 chunk 长度分配缓冲区
+    out_bytes = len(resampler.process_int16(chunk))
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for _ in range(50):
+            resampler.process_int16(chunk)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 只允许返回的 bytes 对象和少量解释器开销
+    assert peak < out_bytes + 4096
+
+
+def test_latency_and_cpu_budget():
+    """20ms 的 chunk 处理耗时远小于 chunk 时长，且没有额外的算法延迟（输入一个 chunk 即输出对应长度）"""
+    results = {}
+    for orig_sr, target_sr in RATES:
+        resampler = StreamingResampler(orig_sr, target_sr)
+        chunk = (_tone(440, orig_sr, 0.02) * 32767).astype(np.int16).tobytes()
+        out = resampler.process_int16(chunk)
+        assert abs(len(out) // 2 - target_sr // 50) <= 1
+        n = 200
+        start = time.perf_counter()
+        for _ in range(n):
+            resampler.process_int16(chunk)
+        per_chunk = (time.perf_counter() - start) / n
+        results[(orig_sr, target_sr)] = per_chunk
+        assert per_chunk < 0.02 * 0.25
+    print({k: f"{v * 1e6:.0f}us/20ms" for k, v in results.items()})
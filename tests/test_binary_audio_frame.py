@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+import struct
+import time
+import types
+
+import numpy as np
+import pytest
+
+from utils.audio import BINARY_FRAME_HEADER, BINARY_FRAME_VERSION, parse_binary_stream_frame
+
+
+def _encode(pcm, sample_rate=16000, seq=0, version=BINARY_FRAME_VERSION, stream_type=1):
+    """与前端 static/app.js 的 encodeAudioFrame 相同的编码"""
+    return BINARY_FRAME_HEADER.pack(version, stream_type, sample_rate, seq) + pcm.astype('<i2').tobytes()
+
+
+def test_header_layout_matches_frontend():
+    assert BINARY_FRAME_HEADER.size == 8
+    frame = _encode(np.array([1, -1], dtype=np.int16), sample_rate=48000, seq=0x01020304)
+    assert frame[:8] == bytes([1, 1]) + struct.pack('<H', 48000) + bytes([4, 3, 2, 1])
+
+
+@pytest.mark.parametrize("sample_rate,seq", [(16000, 0), (48000, 7), (44100, 0xFFFFFFFF)])
+def test_round_trip_matches_json_path(sample_rate, seq):
+    samples = (np.random.default_rng(seq & 0xFF).standard_normal(512) * 8000).astype(np.int16)
+    message = parse_binary_stream_frame(_encode(samples, sample_rate, seq))
+    assert message["action"] == "stream_data"
+    assert message["input_type"] == "audio"
+    assert message["sample_rate"] == sample_rate
+    assert message["seq"] == seq
+    # 负载与 JSON 数组格式经 struct.pack 打包后的字节完全一致
+    json_data = samples.tolist()
+    assert bytes(message["data"]) == struct.pack(f'<{len(json_data)}h', *json_data)
+
+
+def test_payload_is_a_zero_copy_view():
+    frame = bytearray(_encode(np.arange(16, dtype=np.int16)))
+    message = parse_binary_stream_frame(frame)
+    assert isinstance(message["data"], memoryview)
+    frame[-2:] = b'\x00\x00'
+    assert bytes(message["data"][-2:]) == b'\x00\x00'
+
+
+@pytest.mark.parametrize("frame", [
+    b'',
+    b'\x01\x01\x80\x3e',  # 头部不完整
+    _encode(np.zeros(4, dtype=np.int16), version=2),
+    _encode(np.zeros(4, dtype=np.int16), stream_type=9),
+    _encode(np.zeros(4, dtype=np.int16)) + b'\x00',  # 负载不是整数个 PCM16 样点
+])
+def test_malformed_frames_are_rejected(frame):
+    assert parse_binary_stream_frame(frame) is None
+
+
+def test_empty_payload_is_accepted():
+    message = parse_binary_stream_frame(_encode(np.zeros(0, dtype=np.int16)))
+    assert bytes(message["data"]) == b''
+
+
+def test_prepare_binary_audio_resamples_and_tracks_seq():
+    core = pytest.importorskip("main_helper.core")
+    manager = types.SimpleNamespace(last_audio_seq=None, input_resamplers={})
+    prepare = core.LLMSessionManager._prepare_binary_audio
+
+    pcm = np.zeros(320, dtype=np.int16)
+    message = parse_binary_stream_frame(_encode(pcm, 16000, seq=5))
+    assert prepare(manager, message) == pcm.tobytes()
+    assert manager.last_audio_seq == 5
+
+    # 48kHz 的 20ms 帧被重采样为 16kHz 的 320 个样点
+    message = parse_binary_stream_frame(_encode(np.zeros(960, dtype=np.int16), 48000, seq=6))
+    assert len(prepare(manager, message)) == 320 * 2
+    assert manager.last_audio_seq == 6
+    assert 48000 in manager.input_resamplers
+
+
+def _cpu_per_audio_second(frames, parse, seconds):
+    """解析全部帧消耗的 CPU 时间，折算为每秒音频的毫秒数"""
+    t0 = time.process_time()
+    for frame in frames:
+        pcm = parse(frame)
+    elapsed = time.process_time() - t0
+    assert len(pcm) == 3200
+    return elapsed / seconds * 1000
+
+
+@pytest.mark.parametrize("seconds", [60, pytest.param(3600, marks=pytest.mark.slow)])
+def test_parse_cpu_per_second_of_audio(seconds):
+    """100ms 一帧的 16kHz 麦克风音频：二进制帧对比 JSON 整数数组（现有 JSON 路径）和 JSON + base64"""
+    rng = np.random.default_rng(0)
+    chunks = [(rng.standard_normal(1600) * 8000).astype(np.int16) for _ in range(seconds * 10)]
+    binary = [_encode(chunk, seq=i) for i, chunk in enumerate(chunks)]
+    json_list = [json.dumps({"action": "stream_data", "input_type": "audio", "data": chunk.tolist()})
+                 for chunk in chunks]
+    json_base64 = [json.dumps({"action": "stream_data", "input_type": "audio",
+                               "data": base64.b64encode(chunk.tobytes()).decode()}) for chunk in chunks]
+
+    def parse_binary(frame):
+        return bytes(parse_binary_stream_frame(frame)["data"])
+
+    def parse_json_list(message):
+        data = json.loads(message)["data"]
+        return struct.pack(f'<{len(data)}h', *data)
+
+    def parse_json_base64(message):
+        return base64.b64decode(json.loads(message)["data"])
+
+    assert parse_binary(binary[0]) == parse_json_list(json_list[0]) == parse_json_base64(json_base64[0])
+    cpu = {name: _cpu_per_audio_second(frames, parse, seconds) for name, frames, parse in (
+        ("binary", binary, parse_binary),
+        ("json list", json_list, parse_json_list),
+        ("json base64", json_base64, parse_json_base64),
+    )}
+    print(f"{seconds}s of audio, CPU per second of audio: "
+          + ", ".join(f"{name} {ms:.3f}ms" for name, ms in cpu.items()))
+    assert cpu["binary"] < cpu["json base64"] < cpu["json list"]
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+import pytest
+
+from utils import client_channel
+from utils.client_channel import ClientChannel, fan_out
+
+
+class FakeWebSocket:
+    """记录收到的帧；delay 模拟慢客户端，stall 模拟卡死的客户端"""
+
+    def __init__(self, name, delay=0.0, stall=False):
+        self.client = name
+        self.delay = delay
+        self.stall = stall
+        self.frames = []
+        self.closed = False
+
+    async def _send(self, kind, payload):
+        if self.stall:
+            await asyncio.Event().wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames.append((kind, payload))
+
+    async def send_text(self, payload):
+        await self._send("text", payload)
+
+    async def send_bytes(self, payload):
+        await self._send("bytes", payload)
+
+    async def close(self):
+        self.closed = True
+
+    def texts(self):
+        return [json.loads(p) for k, p in self.frames if k == "text"]
+
+
+async def _drain(channels, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while any(c.queue for c in channels if not c.closed) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    # 等最后一帧（已出队、正在发送）发送完成
+    await asyncio.sleep(0.2)
+
+
+def _text(message):
+    return json.dumps(message, ensure_ascii=False)
+
+
+async def _stalled_channel(maxsize, **kwargs):
+    """写任务取走第一帧后卡在发送上，之后入队的帧全部积压"""
+    ws = FakeWebSocket("stalled", stall=True)
+    channel = ClientChannel(ws, set(), maxsize=maxsize, **kwargs)
+    channel.send("text", _text({"type": "placeholder"}))
+    while channel.queue:
+        await asyncio.sleep(0)
+    return ws, channel
+
+
+def test_full_queue_drops_only_audio_frames():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=8)
+        for i in range(20):
+            channel.send("bytes", bytes([i]) * 4)
+            if i % 5 == 0:
+                channel.send("text", _text({"type": "turn end", "n": i}))
+        kinds = [frame[0] for frame in channel.queue]
+        # 控制消息全部保留，语音只保留最新的几帧
+        assert [json.loads(p)["n"] for k, p, _ in channel.queue if k == "text"] == [0, 5, 10, 15]
+        assert kinds.count("bytes") == 8 - 4
+        assert [p[0] for k, p, _ in channel.queue if k == "bytes"] == list(range(16, 20))
+        assert channel.stats["dropped_bytes"] == 20 - 4
+        assert not channel.closed
+        channel.close()
+    asyncio.run(run())
+
+
+def test_keyed_subtitles_keep_only_the_latest_and_stay_ordered():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=8)
+        for text in ("你", "你好", "你好呀"):
+            channel.send("text", _text({"type": "subtitle", "text": text}), key="subtitle")
+        channel.send("text", _text({"type": "clear"}))
+        channel.send("text", _text({"type": "subtitle", "text": "下一句"}), key="subtitle")
+        pending = [json.loads(p) for _, p, _ in channel.queue]
+        # 同 key 只保留最新一帧，并且排在其间入队的 clear 之后
+        assert pending == [{"type": "clear"}, {"type": "subtitle", "text": "下一句"}]
+        assert channel.stats["coalesced"] == 3
+        channel.close()
+    asyncio.run(run())
+
+
+def test_queue_full_of_control_messages_disconnects():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=4)
+        for i in range(4):
+            channel.send("text", _text({"type": "turn end", "n": i}))
+        # 语音帧在全是控制消息的队列前被丢弃，不会导致断开
+        assert channel.send("bytes", b"\x00" * 4) is False
+        assert not channel.closed
+        assert channel.send("text", _text({"type": "turn end", "n": 5})) is False
+        assert channel.closed
+        assert channel not in channel.clients
+        await asyncio.sleep(0)
+        assert ws.closed
+    asyncio.run(run())
+
+
+def _pending(channel):
+    return [json.loads(p)["n"] if k == "text" else p[0] for k, p, _ in channel.queue]
+
+
+def _mixed_burst(channel):
+    """依次入队：语音 0、控制 1、字幕 2、语音 3、字幕 4、控制 5"""
+    channel.send("bytes", bytes([0]))
+    channel.send("text", _text({"type": "turn end", "n": 1}))
+    channel.send("text", _text({"type": "subtitle", "n": 2}), key="subtitle")
+    channel.send("bytes", bytes([3]))
+    channel.send("text", _text({"type": "subtitle", "n": 4}), key="subtitle")
+    return channel.send("text", _text({"type": "turn end", "n": 5}))
+
+
+def test_default_policy_is_by_kind():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=4)
+        assert channel.overflow_policy == client_channel.OVERFLOW_BY_KIND
+        assert _mixed_burst(channel) is True
+        # 字幕合并；队列满时丢的是最旧的语音，控制消息全部保留
+        assert _pending(channel) == [1, 3, 4, 5]
+        assert channel.stats["coalesced"] == 1 and channel.stats["dropped_bytes"] == 1
+        channel.close()
+    asyncio.run(run())
+
+
+def test_drop_oldest_policy_drops_any_kind_and_never_coalesces():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=4, overflow_policy="drop_oldest")
+        assert _mixed_burst(channel) is True
+        assert _pending(channel) == [2, 3, 4, 5]
+        assert channel.stats == {"sent": 0, "dropped_bytes": 1, "dropped_text": 1, "coalesced": 0}
+        # 全是控制消息也只丢最旧的，不断开
+        for n in range(6, 12):
+            channel.send("text", _text({"type": "turn end", "n": n}))
+        assert _pending(channel) == [8, 9, 10, 11]
+        assert not channel.closed
+        channel.close()
+    asyncio.run(run())
+
+
+def test_coalesce_policy_merges_keyed_frames_then_drops_oldest():
+    async def run():
+        ws, channel = await _stalled_channel(maxsize=3, overflow_policy="coalesce")
+        assert _mixed_burst(channel) is True
+        # 字幕 2 被 4 取代；之后队列满时丢掉最旧的语音 0，再丢控制消息 1
+        assert _pending(channel) == [3, 4, 5]
+        assert channel.stats["coalesced"] == 1
+        assert channel.stats["dropped_bytes"] == 1 and channel.stats["dropped_text"] == 1
+        assert not channel.closed
+        channel.close()
+    asyncio.run(run())
+
+
+def test_disconnect_policy_closes_as_soon_as_the_queue_is_full():
+    async def run():
+        clients = set()
+        ws = FakeWebSocket("strict", stall=True)
+        channel = ClientChannel(ws, clients, maxsize=6, overflow_policy="disconnect")
+        channel.send("text", _text({"type": "placeholder"}))
+        while channel.queue:
+            await asyncio.sleep(0)
+        # 同 key 的字幕不合并，6 帧恰好填满队列；第 7 帧（即使是语音）到来时直接断开
+        assert _mixed_burst(channel) is True
+        assert _pending(channel) == [0, 1, 2, 3, 4, 5]
+        assert channel.send("bytes", bytes([6])) is False
+        assert channel.closed and not clients
+        await asyncio.sleep(0)
+        assert ws.closed
+    asyncio.run(run())
+
+
+def test_unknown_policy_is_rejected():
+    async def run():
+        with pytest.raises(ValueError):
+            ClientChannel(FakeWebSocket("x"), set(), overflow_policy="drop_newest")
+    asyncio.run(run())
+
+
+def test_stalled_send_times_out_and_disconnects():
+    async def run():
+        clients = set()
+        ws = FakeWebSocket("stalled", stall=True)
+        channel = ClientChannel(ws, clients, send_timeout=0.05)
+        channel.send("text", _text({"type": "heartbeat"}))
+        await asyncio.sleep(0.2)
+        assert channel.closed and ws.closed
+        assert not clients
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("viewers", [300])
+def test_broadcast_to_hundreds_of_viewers(viewers):
+    """
+    负载测试：几百个观看端，其中 10% 很慢、1% 卡死。以 50 帧/秒广播 2 秒语音并夹带字幕和控制消息：
+    正常观看端收到全部帧，慢观看端只丢语音，广播本身的耗时与慢客户端无关。
+    """
+    frames_per_second, seconds = 50, 2
+
+    async def run():
+        clients = set()
+        sockets = []
+        for i in range(viewers):
+            if i % 100 == 0:
+                ws = FakeWebSocket(f"stalled{i}", stall=True)
+            elif i % 10 == 0:
+                ws = FakeWebSocket(f"slow{i}", delay=0.1)
+            else:
+                ws = FakeWebSocket(f"viewer{i}")
+            sockets.append(ws)
+            ClientChannel(ws, clients, maxsize=32, send_timeout=1.0)
+        channels = list(clients)
+        fan_out_times = []
+        controls = 0
+        for n in range(frames_per_second * seconds):
+            start = time.perf_counter()
+            fan_out(clients, "bytes", n.to_bytes(4, "little") + bytes(1916))
+            if n % 10 == 0:
+                fan_out(clients, "text", _text({"type": "subtitle", "text": f"第{n}帧"}), key="subtitle")
+            if n % 25 == 0:
+                fan_out(clients, "text", _text({"type": "turn end", "n": n}))
+                controls += 1
+            fan_out_times.append(time.perf_counter() - start)
+            await asyncio.sleep(1 / frames_per_second)
+        fan_out(clients, "text", _text({"type": "turn end", "n": "last"}))
+        controls += 1
+        await _drain(channels, timeout=10)
+        return channels, fan_out_times, controls
+
+    channels, fan_out_times, controls = asyncio.run(run())
+    fan_out_times.sort()
+    p99 = fan_out_times[int(len(fan_out_times) * 0.99)] * 1000
+    total = frames_per_second * seconds
+    by_name = {c.websocket.client: c for c in channels}
+    fast = [c for name, c in by_name.items() if name.startswith("viewer")]
+    slow = [c for name, c in by_name.items() if name.startswith("slow")]
+    stalled = [c for name, c in by_name.items() if name.startswith("stalled")]
+    slow_audio = [sum(1 for k, _ in c.websocket.frames if k == "bytes") for c in slow]
+    print(f"{len(channels)} viewers: fan_out p99={p99:.2f}ms, "
+          f"slow viewers received {min(slow_audio)}-{max(slow_audio)}/{total} audio frames, "
+          f"stalled disconnected={sum(c.closed for c in stalled)}/{len(stalled)}")
+
+    for c in fast:
+        audio = [p for k, p in c.websocket.frames if k == "bytes"]
+        assert len(audio) == total
+        assert c.stats["dropped_bytes"] == 0
+    for c in slow:
+        # 慢客户端丢掉部分语音，但控制消息一条不少、顺序不变，最后收到的是最新的字幕
+        assert not c.closed
+        assert c.stats["dropped_bytes"] > 0
+        turn_ends = [m["n"] for m in c.websocket.texts() if m["type"] == "turn end"]
+        assert len(turn_ends) == controls
+        assert turn_ends[-1] == "last"
+        subtitles = [m["text"] for m in c.websocket.texts() if m["type"] == "subtitle"]
+        assert subtitles[-1] == f"第{total - 10}帧"
+    for c in stalled:
+        assert c.closed
+    # 广播只是入队：即使有慢客户端，300 个客户端的一次广播也远小于一帧的间隔
+    assert p99 < 1000 / frames_per_second / 2
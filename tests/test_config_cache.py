@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "core_config.json"
+    path.write_text(json.dumps({"coreApi": "qwen"}), encoding="utf-8")
+    yield path
+    config.invalidate_config_cache()
+
+
+def _counting_builder(path, calls):
+    def build():
+        calls.append(1)
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return build
+
+
+def test_snapshot_is_cached_until_file_changes(config_file):
+    calls = []
+    build = _counting_builder(config_file, calls)
+    first = config._cached_snapshot("test", str(config_file), build)
+    assert config._cached_snapshot("test", str(config_file), build) is first
+    assert len(calls) == 1
+
+    config_file.write_text(json.dumps({"coreApi": "glm", "extra": 1}), encoding="utf-8")
+    # 保证 mtime 变化（部分文件系统的时间精度较低）
+    st = os.stat(config_file)
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    second = config._cached_snapshot("test", str(config_file), build)
+    assert second == {"coreApi": "glm", "extra": 1}
+    assert len(calls) == 2
+
+
+def test_snapshot_is_read_only_but_copies_are_not(config_file):
+    snapshot = config._cached_snapshot("test", str(config_file), _counting_builder(config_file, []))
+    with pytest.raises(TypeError):
+        snapshot["coreApi"] = "x"
+    copied = snapshot.copy()
+    copied["coreApi"] = "x"
+    assert json.loads(json.dumps(snapshot)) == {"coreApi": "qwen"}
+
+
+def _calls_per_second(fn, seconds=0.3):
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(50):
+            fn()
+        calls += 50
+    return calls / (time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("accessor, uncached", [
+    (config.get_core_config, config._build_core_config),
+    (config.get_character_data, config._build_character_data),
+], ids=["get_core_config", "get_character_data"])
+def test_accessor_throughput_versus_uncached(accessor, uncached):
+    """微基准：真实配置文件上访问器的每秒调用次数，与改动前每次都重新解析文件（即 builder 本身）对比"""
+    accessor()
+    cached_rate = _calls_per_second(accessor)
+    uncached_rate = _calls_per_second(uncached)
+    ratio = cached_rate / uncached_rate
+    print(f"{accessor.__name__}: {cached_rate:,.0f} calls/s cached, {uncached_rate:,.0f} calls/s uncached ({ratio:.1f}x)")
+    assert ratio > 3
+
+
+def test_get_core_config_returns_shared_snapshot():
+    assert config.get_core_config() is config.get_core_config()
+
+
+def test_builder_that_writes_back_does_not_deadlock(config_file):
+    """首次运行时 builder 会创建默认配置并调用 invalidate_config_cache（持锁期间重入）"""
+    def build():
+        config.invalidate_config_cache()
+        return {"coreApi": "qwen"}
+
+    assert config._cached_snapshot("test", str(config_file), build) == {"coreApi": "qwen"}
+
+
+def test_character_data_on_first_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHARACTER_JSON_PATH", str(tmp_path / "characters.json"))
+    config.invalidate_config_cache()
+    try:
+        data = config.get_character_data()
+        assert (tmp_path / "characters.json").exists()
+        assert data[1]  # 默认猫娘
+    finally:
+        config.invalidate_config_cache()
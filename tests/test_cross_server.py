@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from main_helper import cross_server  # noqa: E402
+from mock_servers import MockHTTPServer, MockMonitorServer  # noqa: E402
+from utils.http_outbox import IDEMPOTENCY_HEADER  # noqa: E402
+
+LANLAN = "test_lanlan"
+
+
+class Connector:
+    """在后台线程中运行 sync_connector_process（与生产环境中的独立进程相同，拥有自己的事件循环）"""
+
+    def __init__(self, monitor_url):
+        self.queue = queue.Queue()
+        self.shutdown = threading.Event()
+        self.thread = threading.Thread(
+            target=cross_server.sync_connector_process,
+            args=(self.queue, self.shutdown, LANLAN, monitor_url, {"bullet": False, "monitor": True}),
+            daemon=True,
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put_json(self, data):
+        self.queue.put({"type": "json", "data": data})
+
+    def put_system(self, data):
+        self.queue.put({"type": "system", "data": data})
+
+    def put_user(self, text):
+        self.queue.put({"type": "user", "data": {"input_type": "transcript", "data": text}})
+
+    def stop(self):
+        self.shutdown.set()
+        self.thread.join(timeout=10)
+
+
+async def _wait_for(predicate, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.005)
+
+
+def test_forwarding_stays_fast_while_memory_server_is_slow(monkeypatch):
+    """memory_server 处理 /process 需要 2 秒（LLM 压缩），期间转发到 monitor 的延迟不受影响"""
+    memory_requests = []
+
+    def memory_handler(method, path, headers, body):
+        memory_requests.append((path, headers.get(IDEMPOTENCY_HEADER.lower()), body))
+        return 200, {}, {"status": "processed"}
+
+    async def run():
+        async with MockHTTPServer(memory_handler, delay=2.0) as memory, \
+                MockHTTPServer(lambda *a: (200, {}, {}), delay=2.0) as tool, \
+                MockMonitorServer() as monitor:
+            monkeypatch.setattr(cross_server, "MEMORY_SERVER_PORT", memory.port)
+            monkeypatch.setattr(cross_server, "TOOL_SERVER_PORT", tool.port)
+            connector = Connector(monitor.url).start()
+            try:
+                await _wait_for(lambda: monitor.text_frames)  # 连接建立后的首个心跳
+                connector.put_user("你好")
+                connector.put_json({"type": "gemini_response", "text": "你好呀", "isNewMessage": True})
+                connector.put_system("turn end")     # 触发对慢 tool_server 的分析请求
+                connector.put_system("session end")  # 触发对慢 memory_server 的 /process
+                await asyncio.sleep(0.05)
+
+                latencies = []
+                for i in range(50):
+                    sent_at = time.perf_counter()
+                    connector.put_json({"type": "gemini_response", "text": f"{i}", "isNewMessage": True,
+                                        "sent_at": sent_at})
+                    await _wait_for(lambda: any(f.get("sent_at") == sent_at for _, f in monitor.text_frames))
+                    arrived = next(t for t, f in monitor.text_frames if f.get("sent_at") == sent_at)
+                    latencies.append(arrived - sent_at)
+                    await asyncio.sleep(0.01)
+                # 此时 /process 仍在 memory_server 中处理
+                assert len(memory.requests) >= 1 and not memory_requests
+                await _wait_for(lambda: memory_requests, timeout=10)
+            finally:
+                connector.stop()
+            return latencies, memory_requests
+
+    latencies, memory_requests = asyncio.run(run())
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"forwarding latency with a 2s memory server: p50={p50:.2f}ms p99={p99:.2f}ms")
+    assert p99 < 100
+
+    path, key, body = memory_requests[0]
+    assert path == f"/process/{LANLAN}"
+    assert key
+    assert "你好呀" in json.loads(body)["input_history"]
+
+
+def test_memory_requests_are_retried_with_the_same_idempotency_key(monkeypatch):
+    attempts = []
+
+    def flaky(method, path, headers, body):
+        attempts.append(headers.get(IDEMPOTENCY_HEADER.lower()))
+        if len(attempts) < 3:
+            return 503, {}, {"status": "error"}
+        return 200, {}, {"status": "processed"}
+
+    monkeypatch.setattr("utils.http_outbox.RETRY_BACKOFF_BASE", 0.01)
+
+    async def run():
+        async with MockHTTPServer(flaky) as memory, MockMonitorServer() as monitor:
+            monkeypatch.setattr(cross_server, "MEMORY_SERVER_PORT", memory.port)
+            connector = Connector(monitor.url).start()
+            try:
+                await _wait_for(lambda: monitor.text_frames)
+                connector.put_user("在吗")
+                connector.put_json({"type": "gemini_response", "text": "在的", "isNewMessage": True})
+                connector.put_system("renew session")
+                await _wait_for(lambda: len(attempts) >= 3, timeout=10)
+            finally:
+                connector.stop()
+
+    asyncio.run(run())
+    assert len(attempts) == 3
+    assert len(set(attempts)) == 1 and attempts[0]
+
+
+def test_idle_connector_does_not_poll(monkeypatch):
+    """空闲时连接器的事件循环只在心跳定时器到期时唤醒，而不是每 10ms 轮询一次队列"""
+    from loop_probe import new_counting_loop
+
+    idle_seconds = 1.5
+    selectors = []
+
+    def counting_loop():
+        loop, selector = new_counting_loop()
+        selectors.append(selector)
+        return loop
+
+    monkeypatch.setattr(cross_server.asyncio, "new_event_loop", counting_loop)
+
+    async def run():
+        async with MockMonitorServer() as monitor:
+            connector = Connector(monitor.url).start()
+            try:
+                await _wait_for(lambda: monitor.text_frames)
+                connector.put_json({"type": "gemini_response", "text": "预热", "isNewMessage": True})
+                await _wait_for(lambda: len(monitor.text_frames) >= 2)
+                await asyncio.sleep(0.1)
+                frames_before, wakeups_before = len(monitor.text_frames), selectors[0].wakeups
+                cpu_before = time.process_time()
+                await asyncio.sleep(idle_seconds)
+                cpu = time.process_time() - cpu_before
+                wakeups = selectors[0].wakeups - wakeups_before
+                idle_frames = monitor.text_frames[frames_before:]
+            finally:
+                connector.stop()
+            return wakeups, cpu, idle_frames
+
+    wakeups, cpu, idle_frames = asyncio.run(run())
+    print(f"idle connector for {idle_seconds}s: {wakeups} loop wakeups, {cpu * 1000:.2f}ms process CPU, "
+          f"{len(idle_frames)} frames sent (10ms polling with a heartbeat per iteration would be ~150 of each)")
+    assert wakeups <= 5
+    # 心跳间隔为 5 秒，空闲 1.5 秒内不应发出任何帧
+    assert not idle_frames
+
+
+def test_backlog_of_one_reply_is_forwarded_in_order():
+    chunks = [f"第{i}段" for i in range(30)]
+
+    async def run():
+        async with MockMonitorServer() as monitor:
+            connector = Connector(monitor.url).start()
+            try:
+                await _wait_for(lambda: monitor.text_frames)
+                for i, chunk in enumerate(chunks):
+                    connector.put_json({"type": "gemini_response", "text": chunk, "isNewMessage": i == 0})
+                connector.put_json({"type": "gemini_response", "text": "下一条", "isNewMessage": True})
+                await _wait_for(lambda: any(f.get("text") == "下一条" for _, f in monitor.text_frames))
+            finally:
+                connector.stop()
+            return [f for _, f in monitor.text_frames if f.get("type") == "gemini_response"]
+
+    frames = asyncio.run(run())
+    print(f"{len(chunks)} queued chunks forwarded as {len(frames) - 1} frames")
+    # 积压的同一条回复可能被合并成更少的帧，但内容与顺序不变，新回复不会被并入
+    assert "".join(f["text"] for f in frames[:-1]) == "".join(chunks)
+    assert frames[-1]["text"] == "下一条"
+    assert len(frames) - 1 <= len(chunks)
+
+
+def test_rejected_memory_request_is_logged_and_dropped(monkeypatch, caplog):
+    """4xx（请求本身有误）不重试但记录错误；429 属于限流，与 5xx 一样重试"""
+    from utils.http_outbox import HttpOutbox
+
+    statuses = {"/process/bad": [422], "/process/limited": [429, 429, 200]}
+    attempts = []
+
+    def handler(method, path, headers, body):
+        attempts.append(path)
+        replies = statuses[path]
+        status = replies.pop(0) if len(replies) > 1 else replies[0]
+        return status, {}, {"detail": "invalid input_history"} if status == 422 else {"status": "processed"}
+
+    monkeypatch.setattr("utils.http_outbox.RETRY_BACKOFF_BASE", 0.01)
+
+    async def run():
+        async with MockHTTPServer(handler) as memory:
+            outbox = HttpOutbox()
+            bad_key = outbox.enqueue(f"{memory.url}/process/bad", {"input_history": "?"})
+            outbox.enqueue(f"{memory.url}/process/limited", {"input_history": "[]"})
+            await _wait_for(lambda: outbox.pending() == 0)
+            await outbox.close()
+            return bad_key
+
+    with caplog.at_level("ERROR", logger="utils.http_outbox"):
+        bad_key = asyncio.run(run())
+    assert attempts == ["/process/bad", "/process/limited", "/process/limited", "/process/limited"]
+    rejected = [r.getMessage() for r in caplog.records if "422" in r.getMessage()]
+    assert len(rejected) == 1
+    assert bad_key in rejected[0] and "invalid input_history" in rejected[0]
+
+
+def test_processing_error_reply_is_retried(monkeypatch):
+    """memory_server 处理出错时以 HTTP 200 返回 {"status": "error"}，发件箱应按退避重试而不是丢弃"""
+    from utils.http_outbox import HttpOutbox
+
+    attempts = []
+
+    def handler(method, path, headers, body):
+        attempts.append(headers.get(IDEMPOTENCY_HEADER.lower()))
+        if len(attempts) < 3:
+            return 200, {}, {"status": "error", "message": "LLM 压缩超时"}
+        return 200, {}, {"status": "processed"}
+
+    monkeypatch.setattr("utils.http_outbox.RETRY_BACKOFF_BASE", 0.01)
+
+    async def run():
+        async with MockHTTPServer(handler) as memory:
+            outbox = HttpOutbox()
+            key = outbox.enqueue(f"{memory.url}/process/{LANLAN}", {"input_history": "[]"})
+            await _wait_for(lambda: outbox.pending() == 0)
+            await outbox.close()
+            return key
+
+    key = asyncio.run(run())
+    assert attempts == [key] * 3
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import base64
+import time
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from utils import frame_filter  # noqa: E402
+from utils.frame_filter import FrameChangeDetector  # noqa: E402
+
+# 前端每 0.5 秒上传一帧，录制 60 秒
+FPS = 2
+SECONDS = 60
+
+
+def _screen(seed=0):
+    """1280x720 的“桌面”：若干窗口色块和文字行"""
+    rng = np.random.default_rng(seed)
+    screen = np.full((720, 1280, 3), 235, dtype=np.uint8)
+    for _ in range(8):
+        x, y = rng.integers(0, 1000), rng.integers(0, 500)
+        screen[y:y + 200, x:x + 260] = rng.integers(40, 220, size=3)
+    for row in range(40, 700, 24):
+        screen[row:row + 10, 60:60 + int(rng.integers(300, 1100))] = 30
+    return screen
+
+
+def _jpeg_b64(pixels, quality=85):
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _static_sequence():
+    """静止画面：大部分帧字节相同，偶尔有编码噪声和闪烁的光标"""
+    base = _screen()
+    rng = np.random.default_rng(1)
+    frames = []
+    for i in range(FPS * SECONDS):
+        pixels = base.copy()
+        if i % 2:
+            pixels[300:318, 400:402] = 0  # 光标
+        if i % 7 == 0:
+            noise = rng.integers(-2, 3, size=pixels.shape)
+            pixels = np.clip(pixels.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        frames.append(_jpeg_b64(pixels))
+    return frames
+
+
+def _dynamic_sequence():
+    """持续变化的画面：每帧换一个窗口布局（例如视频或快速滚动）"""
+    return [_jpeg_b64(_screen(seed=i)) for i in range(FPS * SECONDS)]
+
+
+def _baseline(img_b64):
+    """变化检测之前的处理方式：每帧完整解码、缩放到 480p 并重新编码"""
+    image = Image.open(BytesIO(base64.b64decode(img_b64)))
+    w, h = image.size
+    image = image.resize((int(w * 480 / h), 480), Image.Resampling.LANCZOS).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _run(frames):
+    detector = FrameChangeDetector()
+    uploaded = []
+    cpu_start = time.process_time()
+    for i, frame in enumerate(frames):
+        now = 100.0 + i / FPS
+        if detector.admit(now) and (out := detector.process(frame, now)) is not None:
+            uploaded.append(out)
+    cpu = time.process_time() - cpu_start
+    return detector.stats, uploaded, cpu / len(frames)
+
+
+def _run_baseline(frames):
+    cpu_start = time.process_time()
+    uploaded = [_baseline(frame) for frame in frames]
+    return sum(map(len, uploaded)), (time.process_time() - cpu_start) / len(frames)
+
+
+@pytest.mark.parametrize("name, sequence", [("static", _static_sequence), ("dynamic", _dynamic_sequence)])
+def test_frame_filter_cpu_and_uplink(name, sequence):
+    frames = sequence()
+    stats, uploaded, cpu = _run(frames)
+    baseline_bytes, baseline_cpu = _run_baseline(frames)
+    drop_rate = stats["dropped"] / stats["received"]
+    print(f"{name}: {len(frames)} frames, drop rate {drop_rate:.0%}, uplink {stats['bytes_out'] / 1024:.0f}KB "
+          f"vs {baseline_bytes / 1024:.0f}KB, CPU {cpu * 1000:.2f}ms/frame vs {baseline_cpu * 1000:.2f}ms/frame")
+    assert stats["received"] == len(frames)
+    assert stats["sent"] == len(uploaded)
+    if name == "static":
+        # 只有第一帧和之后每 FRAME_KEEPALIVE_INTERVAL 秒一次的保活帧
+        assert stats["sent"] == SECONDS // frame_filter.FRAME_KEEPALIVE_INTERVAL
+        assert drop_rate > 0.9
+        assert stats["bytes_out"] < baseline_bytes * 0.1
+        assert cpu < baseline_cpu * 0.5
+    else:
+        # 变化的画面不会被误丢
+        assert stats["sent"] == len(frames)
+        assert stats["bytes_out"] <= baseline_bytes * 1.05
+
+
+def test_change_after_static_period_is_uploaded():
+    base = _screen()
+    changed = base.copy()
+    changed[100:400, 200:700] = 0  # 打开一个新窗口
+    detector = FrameChangeDetector()
+    same, different = _jpeg_b64(base), _jpeg_b64(changed)
+    assert detector.admit(100.0) and detector.process(same, 100.0) is not None
+    # 距离上次上传不足 FRAME_MIN_INTERVAL：解码之前就丢弃
+    assert not detector.admit(100.2)
+    assert detector.admit(101.0) and detector.process(same, 101.0) is None
+    assert detector.admit(102.0) and detector.process(different, 102.0) is not None
+    assert not detector.busy
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import text
+
+pytest.importorskip("langchain_community")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from config import TIME_ORIGINAL_TABLE_NAME, get_character_data  # noqa: E402
+from memory.timeindex import TimeIndexedMemory  # noqa: E402
+
+LANLAN = get_character_data()[1]
+
+
+class StubRecentHistory:
+    def __init__(self):
+        self.compressed = 0
+
+    async def compress_history(self, messages, lanlan_name):
+        self.compressed += 1
+        return messages, "摘要"
+
+
+def _count_original(memory):
+    with memory.engine[LANLAN].connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {TIME_ORIGINAL_TABLE_NAME}")).scalar()
+
+
+def test_processed_key_survives_a_new_instance():
+    """幂等键与对话在同一个事务中写入，重建实例（即服务重启）后仍能查到"""
+    memory = TimeIndexedMemory(StubRecentHistory())
+    assert memory.get_processed_result(LANLAN, "key-restart") is None
+    asyncio.run(memory.store_conversation("e1", [HumanMessage("你好")], LANLAN, idempotency_key="key-restart"))
+
+    restarted = TimeIndexedMemory(StubRecentHistory())
+    assert restarted.get_processed_result(LANLAN, "key-restart") == {"status": "processed"}
+    assert restarted.get_processed_result(LANLAN, "other-key") is None
+
+
+def test_failed_compression_does_not_record_the_key():
+    class Failing(StubRecentHistory):
+        async def compress_history(self, messages, lanlan_name):
+            raise RuntimeError("LLM 不可用")
+
+    memory = TimeIndexedMemory(Failing())
+    with pytest.raises(RuntimeError):
+        asyncio.run(memory.store_conversation("e2", [HumanMessage("你好")], LANLAN, idempotency_key="key-failed"))
+    # 未确认的请求可以重试
+    assert memory.get_processed_result(LANLAN, "key-failed") is None
+
+
+@pytest.fixture
+def memory_server_app(monkeypatch):
+    """真实的 recent_history_manager 与 time_manager；LLM 压缩、语义写入和后台审阅替换为桩"""
+    pytest.importorskip("fastapi")
+    httpx = pytest.importorskip("httpx")
+    memory_server = pytest.importorskip("memory_server")
+
+    recent = StubRecentHistory()
+
+    async def no_review(lanlan_name):
+        pass
+
+    monkeypatch.setattr(memory_server.recent_history_manager, "compress_history", recent.compress_history)
+    monkeypatch.setattr(memory_server, "_run_review_in_background", no_review)
+    semantic = []
+
+    async def store_semantic(event_id, messages, lanlan_name, summary=None):
+        semantic.append(summary)
+
+    monkeypatch.setattr(memory_server.semantic_manager, "store_conversation", store_semantic)
+    extractions = []
+
+    async def extract_settings(messages, lanlan_name, incremental=True, request_key=None):
+        extractions.append(request_key)
+
+    monkeypatch.setattr(memory_server.settings_manager, "extract_and_update_settings", extract_settings)
+    recent.extractions = extractions
+    memory_server.recent_history_manager.clear_history(LANLAN)
+    memory_server.idempotent_results.clear()
+
+    async def post(key, text="明天提醒我买牛奶"):
+        history = json.dumps([
+            {"role": "user", "content": [{"type": "text", "text": text}]},
+            {"role": "assistant", "content": [{"type": "text", "text": "好的"}]},
+        ], ensure_ascii=False)
+        transport = httpx.ASGITransport(app=memory_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://memory") as client:
+            response = await client.post(f"/process/{LANLAN}", json={"input_history": history},
+                                         headers={"Idempotency-Key": key})
+            return response.json()
+
+    yield memory_server, post, recent, semantic
+    memory_server.recent_history_manager.clear_history(LANLAN)
+
+
+def _recent_texts(memory_server):
+    return [m.content if isinstance(m.content, str) else m.content[0]["text"]
+            for m in memory_server.recent_history_manager.user_histories[LANLAN]]
+
+
+def test_retry_after_restart_is_not_stored_twice(memory_server_app):
+    memory_server, post, recent, semantic = memory_server_app
+
+    before = _count_original(memory_server.time_manager)
+    assert asyncio.run(post("key-http")) == {"status": "processed"}
+    assert _count_original(memory_server.time_manager) == before + 2
+    assert _recent_texts(memory_server) == ["明天提醒我买牛奶", "好的"]
+    # 设定提取默认关闭
+    assert recent.extractions == []
+
+    # 模拟 memory_server 在确认送达前重启：内存中的记录丢失，近期记录从磁盘重新加载，发件箱用同一个键重试
+    memory_server.idempotent_results.clear()
+    memory_server.recent_history_manager.close()
+    memory_server.recent_history_manager.__init__()
+    assert asyncio.run(post("key-http")) == {"status": "processed"}
+    assert _count_original(memory_server.time_manager) == before + 2
+    assert _recent_texts(memory_server) == ["明天提醒我买牛奶", "好的"]
+    assert recent.compressed == 1
+    # 语义记忆复用时间索引生成的摘要，不再单独压缩
+    assert semantic == ["摘要"]
+
+
+def test_failure_before_commit_does_not_duplicate_recent_history(memory_server_app, monkeypatch):
+    """近期记录已写入、时间索引提交失败：重试时近期记录不重复追加，对话只在提交成功后确认一次"""
+    memory_server, post, recent, semantic = memory_server_app
+    store_conversation = memory_server.time_manager.store_conversation
+    failures = [RuntimeError("数据库被锁定")]
+
+    async def flaky_store(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await store_conversation(*args, **kwargs)
+
+    monkeypatch.setattr(memory_server.time_manager, "store_conversation", flaky_store)
+    before = _count_original(memory_server.time_manager)
+
+    assert asyncio.run(post("key-flaky"))["status"] == "error"
+    assert memory_server.time_manager.get_processed_result(LANLAN, "key-flaky") is None
+    assert _recent_texts(memory_server) == ["明天提醒我买牛奶", "好的"]
+
+    # 进程重启后近期记录（含已应用的幂等键）从快照+日志恢复，再经过一次压缩也仍然记得该键
+    memory_server.recent_history_manager.close()
+    memory_server.recent_history_manager.__init__()
+    assert asyncio.run(post("key-flaky")) == {"status": "processed"}
+    assert _count_original(memory_server.time_manager) == before + 2
+    assert _recent_texts(memory_server) == ["明天提醒我买牛奶", "好的"]
+
+    # 不同的键照常写入
+    assert asyncio.run(post("key-next", text="还有鸡蛋")) == {"status": "processed"}
+    assert _recent_texts(memory_server) == ["明天提醒我买牛奶", "好的", "还有鸡蛋", "好的"]
+
+
+def test_enabled_settings_extraction_receives_the_request_key(memory_server_app, monkeypatch):
+    """打开设定提取后，提取拿到请求的幂等键，重试时据此跳过已经提取过的消息"""
+    memory_server, post, recent, semantic = memory_server_app
+    monkeypatch.setattr(memory_server, "SETTINGS_EXTRACTION_ENABLED", True)
+
+    assert asyncio.run(post("key-settings")) == {"status": "processed"}
+    assert recent.extractions == ["key-settings"]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from utils import llm_client
+from mock_servers import MockHTTPServer, openai_handler
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    llm_client.clear_clients()
+    yield
+    llm_client.clear_clients()
+
+
+def test_connection_count_stays_flat_over_many_calls():
+    async def run():
+        async with MockHTTPServer(openai_handler(lambda messages: "ok")) as server:
+            for _ in range(1000):
+                llm = llm_client.get_chat_llm("mock", f"{server.url}/v1", "sk-test")
+                result = await llm.ainvoke("hi")
+                assert result.content == "ok"
+            return server.connections, len(server.requests)
+
+    connections, requests = asyncio.run(run())
+    assert requests == 1000
+    assert connections <= 2
+    assert llm_client.get_client_pool_stats()['size'] == 1
+
+
+def test_evicted_client_releases_its_connection_pool_after_the_grace_period(monkeypatch):
+    monkeypatch.setattr(llm_client, "MAX_CLIENTS", 2)
+    evictions = llm_client.get_client_pool_stats()['evictions']
+    first = llm_client.get_chat_llm("a", "http://127.0.0.1:9/v1", "sk")
+    http_client = first.http_client
+    http_async_client = first.http_async_client
+    llm_client.get_chat_llm("b", "http://127.0.0.1:9/v1", "sk")
+    llm_client.get_chat_llm("c", "http://127.0.0.1:9/v1", "sk")
+    # 淘汰后仍在宽限期内，连接池保持打开
+    assert not http_client.is_closed
+    assert llm_client.get_client_pool_stats()['evictions'] == evictions + 1
+    assert llm_client.get_client_pool_stats()['retired'] == 1
+
+    monkeypatch.setattr(llm_client, "RETIRE_GRACE", 0.0)
+    llm_client.get_chat_llm("c", "http://127.0.0.1:9/v1", "sk")
+    assert http_client.is_closed
+    assert http_async_client.is_closed
+    assert llm_client.get_client_pool_stats()['retired'] == 0
+
+
+def test_in_flight_request_survives_eviction_and_config_reload(monkeypatch):
+    """memory 压缩、rerank 等调用正在等待响应时，配置热重载或 LRU 淘汰不能关闭它们正在用的连接池"""
+    monkeypatch.setattr(llm_client, "MAX_CLIENTS", 1)
+    monkeypatch.setattr(llm_client, "RETIRE_GRACE", 0.2)
+
+    async def run():
+        async with MockHTTPServer(openai_handler(lambda messages: "ok"), delay=0.3) as server:
+            url = f"{server.url}/v1"
+            first = llm_client.get_chat_llm("a", url, "sk-test")
+            pending = asyncio.create_task(first.ainvoke("hi"))
+            await asyncio.sleep(0.05)
+            llm_client.get_chat_llm("b", url, "sk-test")  # LRU 淘汰 first
+            monkeypatch.setattr(llm_client, "_current_config", lambda: {"reloaded": True})
+            reloaded = llm_client.get_chat_llm("b", url, "sk-test")  # 配置快照变化
+            assert (await pending).content == "ok"
+            assert not first.http_async_client.is_closed
+
+            await asyncio.sleep(0.25)
+            llm_client.get_chat_llm("b", url, "sk-test")  # 宽限期已过，下一次取用时关闭
+            closing = set(llm_client._closing)
+            assert closing  # 异步关闭任务被持有，不会被垃圾回收
+            await asyncio.gather(*closing)
+            assert first.http_async_client.is_closed
+            assert (await reloaded.ainvoke("hi")).content == "ok"
+
+    asyncio.run(run())
+
+
+def test_clients_do_not_share_connection_pools():
+    a = llm_client.get_chat_llm("a", "http://127.0.0.1:9/v1", "sk")
+    b = llm_client.get_chat_llm("b", "http://127.0.0.1:9/v1", "sk")
+    assert a.http_client is not b.http_client
+    assert a.root_client._client is a.http_client
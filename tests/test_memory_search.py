@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+from urllib.parse import quote
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("langchain_openai")
+httpx = pytest.importorskip("httpx")
+memory_server = pytest.importorskip("memory_server")
+
+from config.prompts_sys import semantic_manager_prompt  # noqa: E402
+from memory import semantic  # noqa: E402
+from memory.semantic import SemanticMemory  # noqa: E402
+from memory.vectorstore import HashingEmbeddings  # noqa: E402
+from mock_servers import MockHTTPServer, openai_handler  # noqa: E402
+from utils import llm_client  # noqa: E402
+
+LANLAN = "小八"
+TOPICS = ["天气", "工作", "游戏", "电影", "做饭", "旅行", "音乐", "学习", "运动", "宠物"]
+
+
+class NoCompress:
+    async def compress_history(self, messages, lanlan_name):
+        return messages, ""
+
+
+@pytest.fixture
+def search_setup(tmp_path, monkeypatch):
+    """2000 条原始记忆 + 200 条摘要，其中只有少数几条提到“芒果”"""
+    manager = SemanticMemory(NoCompress(), persist_directory={LANLAN: str(tmp_path)},
+                             embedding_function=HashingEmbeddings())
+    texts = [f"主人 | 今天聊了{TOPICS[i % 10]}，第{i}次提到{TOPICS[(i * 7) % 10]}相关的事情，" + "顺便闲聊了很多。" * 5
+             for i in range(2000)]
+    texts[1234] = "主人 | 我最喜欢吃芒果，尤其是夏天的芒果冰。"
+    manager.original_memory[LANLAN].vectorstore.add_texts(texts)
+    summaries = [f"主人和{LANLAN}讨论了{TOPICS[i % 10]}。" for i in range(200)]
+    summaries[42] = "主人说最喜欢的水果是芒果。"
+    manager.compressed_memory[LANLAN].vectorstore.add_texts(summaries)
+    monkeypatch.setattr(memory_server, "semantic_manager", manager)
+    llm_client.clear_clients()
+    yield manager
+    llm_client.clear_clients()
+
+
+def _mock_reranker(prompts, reply="[1, 2]"):
+    def reply_fn(messages):
+        prompts.append(messages[-1]["content"])
+        return reply
+    return openai_handler(reply_fn)
+
+
+async def _search(query, rounds):
+    transport = httpx.ASGITransport(app=memory_server.app)
+    latencies, body = [], None
+    async with httpx.AsyncClient(transport=transport, base_url="http://memory") as client:
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            response = await client.get(f"/search_for_memory/{quote(LANLAN)}/{quote(query)}")
+            latencies.append(time.perf_counter() - t0)
+            body = response.json()
+    return sorted(latencies), body
+
+
+def test_search_sends_a_budgeted_top_n_to_the_reranker(search_setup, monkeypatch):
+    """/search_for_memory 只把融合后的前 RERANK_CANDIDATES 条、在字符预算内交给 LLM；对比把全部候选都交给 LLM"""
+    prompts = []
+
+    async def run():
+        async with MockHTTPServer(_mock_reranker(prompts), delay=0.02) as llm:
+            monkeypatch.setattr(search_setup, "_get_reranker",
+                                lambda: llm_client.get_chat_llm("mock", f"{llm.url}/v1", "sk-test"))
+            latencies, body = await _search("我喜欢吃什么水果", rounds=20)
+            # 对照：融合后的所有候选都送去精排、不做截断（改动前的做法）
+            all_candidates = await search_setup.hybrid_search("我喜欢吃什么水果", LANLAN, with_rerank=False, k=10 ** 6)
+            await search_setup.rerank_results("我喜欢吃什么水果", all_candidates, char_budget=10 ** 9)
+            return latencies, body, len(all_candidates)
+
+    latencies, body, candidates = asyncio.run(run())
+    budgeted, unbudgeted = prompts[:-1], prompts[-1]
+    p50, p95 = latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"/search_for_memory with a 20ms mock LLM: p50={p50:.1f}ms p95={p95:.1f}ms; "
+          f"rerank prompt {len(budgeted[0])} chars for {semantic.RERANK_CANDIDATES} candidates "
+          f"vs {len(unbudgeted)} chars for all {candidates}")
+
+    # 每次查询只调用一次 LLM，提示词长度有上限
+    assert len(budgeted) == 20
+    template = len(semantic_manager_prompt) + 200
+    assert all(len(p) <= template + semantic.RERANK_CHAR_BUDGET for p in budgeted)
+    assert len(budgeted[0]) * 3 < len(unbudgeted)
+    # 两个集合中提到芒果的记忆都进入了前两名
+    assert "芒果冰" in body and "最喜欢的水果是芒果" in body
+
+
+def test_search_falls_back_to_fused_order_when_rerank_output_is_unusable(search_setup, monkeypatch):
+    prompts = []
+
+    async def run():
+        async with MockHTTPServer(_mock_reranker(prompts, reply="抱歉，我无法排序")) as llm:
+            monkeypatch.setattr(search_setup, "_get_reranker",
+                                lambda: llm_client.get_chat_llm("mock", f"{llm.url}/v1", "sk-test"))
+            return await search_setup.hybrid_search("芒果", LANLAN)
+
+    results = asyncio.run(run())
+    assert len(prompts) == 3
+    assert any("芒果" in doc.page_content for doc in results[:2])
+
+
+def test_search_without_rerank_makes_no_llm_call(search_setup, monkeypatch):
+    monkeypatch.setattr(search_setup, "_get_reranker", lambda: pytest.fail("不应调用精排模型"))
+    t0 = time.perf_counter()
+    results = asyncio.run(search_setup.hybrid_search("芒果", LANLAN, with_rerank=False, k=5))
+    elapsed = (time.perf_counter() - t0) * 1000
+    print(f"hybrid search over 2200 memories without rerank: {elapsed:.1f}ms")
+    assert len(results) == 5
+    assert "芒果" in results[0].page_content
+
+
+def _embeddings_handler(calls, dim=256):
+    """OpenAI 兼容的 /v1/embeddings：返回与 HashingEmbeddings 相同的向量，便于与已入库的数据比对"""
+    hashing = HashingEmbeddings(dim)
+
+    def handler(method, path, headers, body):
+        texts = json.loads(body)["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        calls.append(texts)
+        data = [{"object": "embedding", "index": i, "embedding": hashing.embed_query(t)} for i, t in enumerate(texts)]
+        return 200, {"Content-Type": "application/json"}, json.dumps(
+            {"object": "list", "data": data, "model": "mock", "usage": {"prompt_tokens": 1, "total_tokens": 1}})
+    return handler
+
+
+def test_search_with_slow_embedder_does_not_block_the_loop(search_setup, monkeypatch):
+    """
+    查询嵌入是一次网络请求（这里 300ms），检索期间事件循环仍能及时响应其他任务。
+    若在事件循环上同步嵌入，同一循环中的模拟服务无法应答，请求会在 2 秒后超时失败
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    monkeypatch.setattr(search_setup, "_get_reranker", lambda: pytest.fail("不应调用精排模型"))
+    calls = []
+
+    async def run():
+        async with MockHTTPServer(_embeddings_handler(calls), delay=0.3) as server:
+            slow = OpenAIEmbeddings(base_url=f"{server.url}/v1", model="mock", api_key="sk-test",
+                                    check_embedding_ctx_length=False, timeout=2, max_retries=0)
+            for memory in (search_setup.original_memory[LANLAN], search_setup.compressed_memory[LANLAN]):
+                memory.vectorstore.embedding_function = slow
+
+            gaps = []
+            stop = asyncio.Event()
+
+            async def ticker():
+                last = time.perf_counter()
+                while not stop.is_set():
+                    await asyncio.sleep(0.005)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            tick = asyncio.create_task(ticker())
+            t0 = time.perf_counter()
+            results = await search_setup.hybrid_search("芒果", LANLAN, with_rerank=False, k=5)
+            elapsed = time.perf_counter() - t0
+            stop.set()
+            await tick
+            return results, elapsed, max(gaps)
+
+    results, elapsed, max_gap = asyncio.run(run())
+    print(f"hybrid search with a 300ms embedder: {elapsed * 1000:.0f}ms total, "
+          f"longest event loop stall {max_gap * 1000:.1f}ms")
+    # 两个集合共用一个嵌入实例，查询只嵌入一次
+    assert calls == [["芒果"]]
+    assert elapsed >= 0.3
+    assert max_gap < 0.1
+    assert "芒果" in results[0].page_content
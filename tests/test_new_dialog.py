@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+memory_server = pytest.importorskip("memory_server")
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage  # noqa: E402
+
+from config import get_character_data  # noqa: E402
+
+LANLAN = get_character_data()[1]
+
+
+def _reference_prompt(lanlan_name, history):
+    """改动前 /new_dialog 每次现算的提示词，作为快照内容的对照"""
+    brackets_pattern = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
+    master_name, _, _, _, name_mapping, _, _, _, _, _ = get_character_data()
+    name_mapping = dict(name_mapping, ai=lanlan_name)
+    result = f"\n========{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(memory_server.settings_manager.get_settings(lanlan_name), ensure_ascii=False)}\n\n"
+    result += f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
+    for i in history:
+        if type(i.content) == str:
+            cleaned_content = brackets_pattern.sub('', i.content).strip()
+            result += f"{name_mapping[i.type]} | {cleaned_content}\n"
+        else:
+            texts = [brackets_pattern.sub('', j['text']).strip() for j in i.content if j['type'] == 'text']
+            result += f"{name_mapping[i.type]} | " + "\n".join(texts) + "\n"
+    return result
+
+
+def _history(n, start=0):
+    messages = []
+    for i in range(start, start + n):
+        if i % 3 == 0:
+            messages.append(HumanMessage([{"type": "text", "text": f"[{i}]今天（周五）想吃{i}号【火锅】{{备注}}" + "闲聊" * 100}]))
+        elif i % 3 == 1:
+            messages.append(AIMessage(f"好呀<笑>，第{i}次(认真)回答" + "嗯" * 100))
+        else:
+            messages.append(SystemMessage(f"先前对话的备忘录: 第{i}条"))
+    return messages
+
+
+@pytest.fixture
+def history(monkeypatch):
+    state = SimpleNamespace(messages=_history(30))
+    monkeypatch.setattr(memory_server.recent_history_manager, "get_recent_history", lambda name: state.messages)
+    monkeypatch.setattr(memory_server, "dialog_snapshots", {})
+    return state
+
+
+async def _get(client, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return await client.get(f"/new_dialog/{LANLAN}", headers=headers)
+
+
+def test_etag_round_trip_and_invalidation(history):
+    async def run():
+        transport = httpx.ASGITransport(app=memory_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://memory") as client:
+            first = await _get(client)
+            assert first.status_code == 200
+            assert first.json() == _reference_prompt(LANLAN, history.messages)
+            etag = first.headers["ETag"]
+
+            unchanged = await _get(client, etag)
+            assert unchanged.status_code == 304 and unchanged.content == b""
+            assert unchanged.headers["ETag"] == etag
+
+            # /process 之后近期记忆变化：返回新内容和新的 ETag
+            history.messages = history.messages + _history(2, start=30)
+            changed = await _get(client, etag)
+            assert changed.status_code == 200 and changed.headers["ETag"] != etag
+            assert changed.json() == _reference_prompt(LANLAN, history.messages)
+            assert int(changed.headers["X-Prompt-Version"]) == int(first.headers["X-Prompt-Version"]) + 1
+
+            # 设定更新同样使快照失效
+            etag = changed.headers["ETag"]
+            memory_server.settings_manager.version += 1
+            same_content = await _get(client, etag)
+            assert same_content.status_code == 304  # 设定内容没变，重建后 ETag 相同
+            memory_server.settings_manager.settings[LANLAN].setdefault(LANLAN, {})["口头禅"] = "喵"
+            memory_server.settings_manager.version += 1
+            updated = await _get(client, etag)
+            assert updated.status_code == 200
+            assert "口头禅" in updated.json()
+            assert updated.json() == _reference_prompt(LANLAN, history.messages)
+            del memory_server.settings_manager.settings[LANLAN][LANLAN]["口头禅"]
+            memory_server.settings_manager.version += 1
+
+    asyncio.run(run())
+
+
+def test_session_manager_reuses_the_cached_prompt_on_304():
+    core = pytest.importorskip("main_helper.core")
+    manager = SimpleNamespace(_memory_prompt=None, _memory_prompt_etag=None)
+    accept = core.LLMSessionManager._accept_memory_prompt
+    headers = core.LLMSessionManager._memory_prompt_headers
+
+    assert headers(manager) == {}
+    first = SimpleNamespace(status_code=200, text='"提示词"', headers={"ETag": '"v1"'})
+    assert accept(manager, first) == '"提示词"'
+    assert headers(manager) == {"If-None-Match": '"v1"'}
+    not_modified = SimpleNamespace(status_code=304, text="", headers={"ETag": '"v1"'})
+    assert accept(manager, not_modified) == '"提示词"'
+
+
+def test_hot_swap_preparation_with_a_large_history(history):
+    """大量近期记忆下，对比每次现算、快照命中（304）和追加一条消息后的增量重建"""
+    history.messages = _history(3000)
+    rounds = 20
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        reference = _reference_prompt(LANLAN, history.messages)
+    recompute = (time.perf_counter() - t0) / rounds
+
+    async def run():
+        transport = httpx.ASGITransport(app=memory_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://memory") as client:
+            first = await _get(client)
+            assert first.json() == reference
+            etag = first.headers["ETag"]
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                assert (await _get(client, etag)).status_code == 304
+            hit = (time.perf_counter() - t0) / rounds
+            incremental = 0.0
+            for i in range(rounds):
+                history.messages = history.messages + _history(1, start=3000 + i)
+                t0 = time.perf_counter()
+                response = await _get(client, etag)
+                incremental += time.perf_counter() - t0
+                etag = response.headers["ETag"]
+            assert response.json() == _reference_prompt(LANLAN, history.messages)
+            return hit, incremental / rounds
+
+    hit, incremental = asyncio.run(run())
+    print(f"/new_dialog with 3000 messages: recompute {recompute * 1000:.1f}ms, "
+          f"304 hit {hit * 1000:.2f}ms, one new message {incremental * 1000:.1f}ms")
+    assert hit < recompute / 5
+    # 只清洗、转义新消息，其余部分直接拼接已编码的片段
+    assert incremental < recompute
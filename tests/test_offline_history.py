@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from main_helper import omni_offline_client  # noqa: E402
+from main_helper.omni_offline_client import OmniOfflineClient, estimate_tokens  # noqa: E402
+from mock_servers import MockHTTPServer, chat_completion_stream  # noqa: E402
+
+# 模拟服务商的 prefill 耗时（秒/token）：命中前缀缓存的 token 便宜得多，但不是免费的
+PREFILL_SECONDS_PER_TOKEN = 2e-6
+CACHED_SECONDS_PER_TOKEN = 0.2e-6
+INSTRUCTIONS = "你是一个温柔的猫娘助手，回答要简短自然。" * 20
+
+
+def _user_text(i):
+    return f"第{i}轮：今天的天气怎么样，顺便提醒我一下晚上要做的事情，还有明天的安排。" * 2
+
+
+def _reply_text(i):
+    return f"第{i}轮回复：今天天气晴朗，晚上记得给植物浇水，明天上午九点有一个会议，别忘了带上资料。" * 2
+
+
+class StreamingLLM:
+    """模拟流式 chat.completions：记录每个请求的大小和消息，按未命中前缀缓存的 token 数延迟首个 chunk"""
+
+    def __init__(self):
+        self.requests = []
+        self.summaries = 0
+        self._cached_prefix = []
+        self._tokens = {}
+
+    def _count(self, messages):
+        return sum(self._tokens.setdefault(content, estimate_tokens(content)) for _, content in messages)
+
+    async def __call__(self, method, path, headers, body):
+        payload = json.loads(body)
+        messages = [(m["role"], m["content"]) for m in payload["messages"]]
+        if "备忘录" in messages[-1][1] and messages[-1][0] == "user":
+            self.summaries += 1
+            return 200, {"Content-Type": "text/event-stream"}, chat_completion_stream("用户每天询问天气和日程安排。")
+        hit = 0
+        while hit < min(len(messages), len(self._cached_prefix)) and messages[hit] == self._cached_prefix[hit]:
+            hit += 1
+        tokens, missed = self._count(messages), self._count(messages[hit:])
+        # 上一个请求整体是本次请求的前缀时，服务商的 prompt cache 命中
+        self.requests.append({"bytes": len(body), "tokens": tokens, "cache_hit": hit == len(self._cached_prefix)})
+        self._cached_prefix = messages
+        await asyncio.sleep(missed * PREFILL_SECONDS_PER_TOKEN + (tokens - missed) * CACHED_SECONDS_PER_TOKEN)
+        n = len(self.requests)
+        return 200, {"Content-Type": "text/event-stream"}, chat_completion_stream(_reply_text(n))
+
+
+async def _session(budget, turns):
+    llm = StreamingLLM()
+    ttft = []
+    async with MockHTTPServer(llm) as server:
+        first_chunk = {}
+
+        async def on_text_delta(text, is_first):
+            if is_first:
+                first_chunk["at"] = time.perf_counter()
+
+        client = OmniOfflineClient(f"{server.url}/v1", "sk-test", model="mock", on_text_delta=on_text_delta,
+                                   history_token_budget=budget)
+        await client.connect(INSTRUCTIONS)
+        for i in range(turns):
+            start = time.perf_counter()
+            await client.stream_text(_user_text(i))
+            ttft.append(first_chunk.pop("at") - start)
+        await client.close()
+    return llm, ttft
+
+
+def _summary(name, llm, ttft):
+    last = llm.requests[-50:]
+    late_ttft = sorted(ttft[-50:])
+    cache_hits = sum(r["cache_hit"] for r in llm.requests[1:]) / (len(llm.requests) - 1)
+    print(f"{name}: last 50 turns avg request {sum(r['bytes'] for r in last) / len(last) / 1024:.0f}KB, "
+          f"~{max(r['tokens'] for r in last)} prompt tokens, TTFT p50={late_ttft[25] * 1000:.1f}ms, "
+          f"prefix-cache reuse on {cache_hits:.0%} of turns, {llm.summaries} summaries")
+    return late_ttft[25], cache_hits
+
+
+def test_token_estimate_never_loads_tiktoken(monkeypatch):
+    """估算在事件循环上调用，不能触发 tiktoken 的词表下载"""
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("今天天气怎么样") == 8
+    assert estimate_tokens("hello world, how are you?") == 7
+
+
+@pytest.mark.parametrize("turns", [150, pytest.param(500, marks=pytest.mark.slow)])
+def test_long_session_request_size_and_ttft(turns):
+    async def run():
+        return await _session(omni_offline_client.HISTORY_TOKEN_BUDGET, turns), await _session(10 ** 9, turns)
+
+    (bounded, bounded_ttft), (unbounded, unbounded_ttft) = asyncio.run(run())
+    bounded_p50, bounded_hits = _summary(f"{turns} turns, budgeted", bounded, bounded_ttft)
+    unbounded_p50, _ = _summary(f"{turns} turns, unbounded", unbounded, unbounded_ttft)
+
+    assert len(bounded.requests) == len(unbounded.requests) == turns
+    instruction_tokens = estimate_tokens(INSTRUCTIONS)
+    hard_limit = omni_offline_client.HISTORY_TOKEN_BUDGET * omni_offline_client.HISTORY_HARD_LIMIT
+    # 请求大小有上界，不随轮数线性增长
+    assert max(r["tokens"] for r in bounded.requests) < instruction_tokens + hard_limit + 200
+    assert unbounded.requests[-1]["bytes"] > bounded.requests[-1]["bytes"] * turns / 100
+    assert bounded.summaries > 0
+    # 两次压缩之间前缀保持不变，绝大多数轮次可以命中前缀缓存
+    assert bounded_hits > 0.9
+    assert bounded_p50 < unbounded_p50
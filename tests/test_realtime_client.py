@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from main_helper import omni_realtime_client  # noqa: E402
+from main_helper.omni_realtime_client import OmniRealtimeClient  # noqa: E402
+from mock_servers import MockWebSocketServer  # noqa: E402
+
+# 前端每 20ms 上传一块 16kHz 16bit 单声道 PCM
+CHUNK = b"\x01\x02" * 320
+
+
+class EventRecorder:
+    """记录客户端发来的事件及到达时间"""
+
+    def __init__(self):
+        self.events = []
+
+    async def __call__(self, ws):
+        async for message in ws:
+            self.events.append((time.perf_counter(), json.loads(message)))
+
+    def of_type(self, event_type):
+        return [(t, e) for t, e in self.events if e["type"] == event_type]
+
+
+async def _wait_for(predicate, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.002)
+
+
+async def _client(server):
+    client = OmniRealtimeClient(server.url, "sk-test", model="qwen-omni-realtime-mock")
+    await client.open()
+    return client
+
+
+def test_trailing_audio_is_flushed_without_another_chunk():
+    """一句话的最后一块音频之后不再有新的音频块，也要在 AUDIO_APPEND_MAX_DELAY 内发出"""
+    recorder = EventRecorder()
+
+    async def run():
+        async with MockWebSocketServer(recorder) as server:
+            client = await _client(server)
+            try:
+                sent_at = time.perf_counter()
+                await client.stream_audio(CHUNK)
+                await _wait_for(lambda: recorder.of_type("input_audio_buffer.append"))
+                arrived, event = recorder.of_type("input_audio_buffer.append")[0]
+                return arrived - sent_at, event
+            finally:
+                await client.close()
+
+    delay, event = asyncio.run(run())
+    print(f"trailing {len(CHUNK)}-byte chunk sent after {delay * 1000:.1f}ms")
+    assert base64.b64decode(event["audio"]) == CHUNK
+    assert omni_realtime_client.AUDIO_APPEND_MAX_DELAY * 0.8 <= delay < omni_realtime_client.AUDIO_APPEND_MAX_DELAY + 0.05
+
+
+def test_audio_is_coalesced_and_kept_ahead_of_later_events():
+    recorder = EventRecorder()
+
+    async def run():
+        async with MockWebSocketServer(recorder) as server:
+            client = await _client(server)
+            try:
+                for i in range(12):
+                    await client.stream_audio(bytes([i]) * len(CHUNK))
+                await client.send_event({"type": "input_audio_buffer.commit"})
+                await _wait_for(lambda: recorder.of_type("input_audio_buffer.commit"))
+                # 提交之后没有遗留的缓冲音频，定时器也不会再发出空事件
+                await asyncio.sleep(omni_realtime_client.AUDIO_APPEND_MAX_DELAY * 2)
+            finally:
+                await client.close()
+
+    asyncio.run(run())
+    events = [e for _, e in recorder.events]
+    assert [e["type"] for e in events] == ["input_audio_buffer.append"] * 3 + ["input_audio_buffer.commit"]
+    audio = b"".join(base64.b64decode(e["audio"]) for e in events[:3])
+    assert audio == b"".join(bytes([i]) * len(CHUNK) for i in range(12))
+    assert [len(base64.b64decode(e["audio"])) for e in events[:3]] == [3200, 3200, 1280]
+
+
+def test_event_loop_lag_under_audio_and_image_upload():
+    """50 个音频块/秒加上每秒 2 帧约 200KB 的图片，同时测量事件循环的调度延迟"""
+    recorder = EventRecorder()
+    image_b64 = base64.b64encode(os.urandom(150 * 1024)).decode("ascii")
+    seconds = 2.0
+
+    async def probe(lags, stop):
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async def run():
+        async with MockWebSocketServer(recorder) as server:
+            client = await _client(server)
+            client._audio_in_buffer = True  # 用户说话期间才上传图片
+            lags, stop = [], asyncio.Event()
+            probe_task = asyncio.create_task(probe(lags, stop))
+            try:
+                start = time.perf_counter()
+                tick = 0
+                while time.perf_counter() - start < seconds:
+                    await client.stream_audio(CHUNK)
+                    if tick % 25 == 0:
+                        await client.stream_image(image_b64)
+                    tick += 1
+                    await asyncio.sleep(0.02)
+                await client.send_event({"type": "input_audio_buffer.commit"})
+                await _wait_for(lambda: recorder.of_type("input_audio_buffer.commit"))
+            finally:
+                stop.set()
+                await probe_task
+                await client.close()
+            return lags, tick, client.dropped_images
+
+    lags, chunks, dropped = asyncio.run(run())
+    lags.sort()
+    p50, p99 = lags[len(lags) // 2] * 1000, lags[int(len(lags) * 0.99)] * 1000
+    appends = recorder.of_type("input_audio_buffer.append")
+    images = recorder.of_type("input_image_buffer.append")
+    print(f"loop lag with {chunks} audio chunks and {len(images)} images: p50={p50:.2f}ms p99={p99:.2f}ms, "
+          f"{len(appends)} append events, {dropped} images dropped")
+    assert sum(len(base64.b64decode(e["audio"])) for _, e in appends) == chunks * len(CHUNK)
+    assert len(appends) < chunks / 2
+    assert p99 < 20
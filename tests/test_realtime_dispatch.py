@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from main_helper.omni_realtime_client import OmniRealtimeClient, logger  # noqa: E402
+
+
+class LegacyClient(OmniRealtimeClient):
+    """改为查表分派之前的 handle_messages（if/elif 链，包括其中的日志），作为等价性对照"""
+
+    async def handle_messages(self) -> None:
+        async for message in self.ws:
+            event = json.loads(message)
+            event_type = event.get("type")
+            if event_type == "error":
+                logger.error(f"API Error: {event['error']}")
+                if '欠费' in event['error'] or 'standing' in event['error']:
+                    if self.on_connection_error:
+                        await self.on_connection_error(event['error'])
+                    await self.close()
+                continue
+            elif event_type == "response.done":
+                self._is_responding = False
+                self._current_response_id = None
+                self._current_item_id = None
+                self._skip_until_next_response = False
+                if self.on_response_done:
+                    await self.on_response_done()
+            elif event_type == "response.created":
+                self._current_response_id = event.get("response", {}).get("id")
+                self._is_responding = True
+                self._is_first_text_chunk = self._is_first_transcript_chunk = True
+            elif event_type == "response.output_item.added":
+                self._current_item_id = event.get("item", {}).get("id")
+            elif event_type == "input_audio_buffer.speech_started":
+                logger.info("Speech detected")
+                self._audio_in_buffer = True
+                if self._is_responding:
+                    logger.info("Handling interruption")
+                    await self.handle_interruption()
+            elif event_type == "input_audio_buffer.speech_stopped":
+                logger.info("Speech ended")
+                if self.on_new_message:
+                    await self.on_new_message()
+                self._audio_in_buffer = False
+            elif event_type == "conversation.item.input_audio_transcription.completed":
+                self._print_input_transcript = True
+            elif event_type in ["response.audio_transcript.done", "response.output_audio_transcript.done"]:
+                self._print_input_transcript = False
+
+            if not self._skip_until_next_response:
+                if event_type in ["response.text.delta", "response.output_text.delta"]:
+                    if self.on_text_delta:
+                        if "glm" not in self.model:
+                            await self.on_text_delta(event["delta"], self._is_first_text_chunk)
+                            self._is_first_text_chunk = False
+                elif event_type in ["response.audio.delta", "response.output_audio.delta"]:
+                    if self.on_audio_delta:
+                        await self.on_audio_delta(base64.b64decode(event["delta"]))
+                elif event_type == "conversation.item.input_audio_transcription.completed":
+                    if self.on_input_transcript:
+                        await self.on_input_transcript(event.get("transcript", ""))
+                elif event_type in ["response.audio_transcript.done", "response.output_audio_transcript.done"]:
+                    if self.on_output_transcript and self._is_first_transcript_chunk:
+                        transcript = event.get("transcript", "")
+                        if transcript:
+                            await self.on_output_transcript(transcript, True)
+                            self._is_first_transcript_chunk = False
+                elif event_type in ["response.audio_transcript.delta", "response.output_audio_transcript.delta"]:
+                    if self.on_output_transcript:
+                        delta = event.get("delta", "")
+                        if not self._print_input_transcript:
+                            self._output_transcript_buffer += delta
+                        else:
+                            if self._output_transcript_buffer:
+                                await self.on_output_transcript(self._output_transcript_buffer,
+                                                                self._is_first_transcript_chunk)
+                                self._is_first_transcript_chunk = False
+                                self._output_transcript_buffer = ""
+                            await self.on_output_transcript(delta, self._is_first_transcript_chunk)
+                            self._is_first_transcript_chunk = False
+                elif event_type in self.extra_event_handlers:
+                    await self.extra_event_handlers[event_type](event)
+
+
+class ReplaySocket:
+    """按顺序回放录制的服务端事件；可调用对象在回放到该位置时以客户端为参数执行（模拟客户端侧操作）"""
+
+    def __init__(self, client, trace):
+        self.client = client
+        self.trace = trace
+        self.sent = []
+
+    async def __aiter__(self):
+        for item in self.trace:
+            if callable(item):
+                await item(self.client)
+            else:
+                yield item
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self):
+        pass
+
+
+def _event(event_type, **fields):
+    return json.dumps({"type": event_type, **fields}, ensure_ascii=False)
+
+
+def _turn(n, audio_deltas=8, new_names=False, interrupt_at=None):
+    """一轮对话的服务端事件；new_names 使用 response.output_* 系列事件名"""
+    audio_type = "response.output_audio.delta" if new_names else "response.audio.delta"
+    transcript_type = "response.output_audio_transcript.delta" if new_names else "response.audio_transcript.delta"
+    text_type = "response.output_text.delta" if new_names else "response.text.delta"
+    trace = [
+        _event("input_audio_buffer.speech_started", audio_start_ms=n),
+        _event("input_audio_buffer.speech_stopped", audio_end_ms=n + 900),
+        _event("input_audio_buffer.committed", item_id=f"in_{n}"),
+        _event("conversation.item.created", item={"id": f"in_{n}", "type": "message", "role": "user"}),
+        _event("response.created", response={"id": f"resp_{n}", "status": "in_progress"}),
+        _event("response.output_item.added", item={"id": f"out_{n}", "type": "message"}),
+        _event("response.content_part.added", part={"type": "audio"}),
+        _event("rate_limits.updated", rate_limits=[]),
+    ]
+    for i in range(audio_deltas):
+        if i == 2:
+            # 用户的语音识别结果在回复开始后才到达，之前的转录增量先缓冲
+            trace.append(_event("conversation.item.input_audio_transcription.completed",
+                                item_id=f"in_{n}", transcript=f"第{n}句话"))
+        if interrupt_at == i:
+            trace.append(_event("input_audio_buffer.speech_started", audio_start_ms=n + 5000))
+        trace.append(_event(transcript_type, response_id=f"resp_{n}", delta=f"回复{n}-{i}"))
+        trace.append(_event(text_type, response_id=f"resp_{n}", delta=f"t{i}"))
+        pcm = bytes([(n + i) % 256]) * 960
+        trace.append(_event(audio_type, response_id=f"resp_{n}", delta=base64.b64encode(pcm).decode()))
+    trace += [
+        _event("response.audio.done", response_id=f"resp_{n}"),
+        _event("response.output_audio_transcript.done" if new_names else "response.audio_transcript.done",
+               response_id=f"resp_{n}", transcript=f"回复{n}完整"),
+        _event("response.content_part.done", part={"type": "audio"}),
+        _event("response.done", response={"id": f"resp_{n}", "status": "completed",
+                                          "output": [{"type": "message", "content": [{"type": "audio"}]}]}),
+    ]
+    return trace
+
+
+async def _skip_next(client):
+    await client.create_response("", skipped=True)
+
+
+def _trace():
+    trace = [_event("session.created", session={"id": "sess"}), _event("session.updated", session={"id": "sess"})]
+    for n in range(6):
+        trace += _turn(n, new_names=n % 2 == 1, interrupt_at=4 if n == 3 else None)
+    # create_response(skipped=True)：直到下一个 response.done 之前的事件都不转发
+    trace.append(_skip_next)
+    trace += _turn(6)
+    trace += _turn(7)
+    trace.append(_event("error", error={"message": "rate limited"}))
+    trace.append(_event("function_call.arguments", item={"type": "function_call"}, arguments="{}"))
+    return trace
+
+
+async def _replay(cls, model, trace, extra_types=()):
+    calls = []
+
+    def recorder(name):
+        async def record(*args):
+            calls.append((name, *args))
+        return record
+
+    extra = {t: recorder(f"extra:{t}") for t in extra_types}
+    client = cls("ws://unused", "sk-test", model=model, on_text_delta=recorder("text"),
+                 on_audio_delta=recorder("audio"), on_new_message=recorder("new_message"),
+                 on_input_transcript=recorder("input_transcript"), on_output_transcript=recorder("output_transcript"),
+                 on_connection_error=recorder("connection_error"), on_response_done=recorder("response_done"),
+                 extra_event_handlers=extra)
+    client.ws = ReplaySocket(client, trace)
+    sent = client.ws.sent
+    await client.handle_messages()
+    queued = []
+    while not client._send_queue.empty():
+        queued.append(client._send_queue.get_nowait()[1]["type"])
+    return calls, queued, sent
+
+
+EXTRA_TYPES = (
+    "response.done", "response.created", "input_audio_buffer.speech_stopped", "input_audio_buffer.committed",
+    "response.text.delta", "response.audio.delta", "error", "function_call.arguments", "rate_limits.updated",
+)
+
+
+@pytest.mark.parametrize("model", ["qwen3-omni-flash-realtime", "glm-realtime", "gpt-realtime"])
+@pytest.mark.parametrize("extra_types", [(), EXTRA_TYPES], ids=["no_extra", "extra_handlers"])
+def test_dispatch_table_matches_the_if_elif_chain(model, extra_types):
+    trace = _trace()
+    expected = asyncio.run(_replay(LegacyClient, model, trace, extra_types))
+    actual = asyncio.run(_replay(OmniRealtimeClient, model, trace, extra_types))
+    assert actual == expected
+    calls, queued, _ = actual
+    names = {call[0] for call in calls}
+    assert {"audio", "output_transcript", "input_transcript", "response_done", "new_message"} <= names
+    assert ("text" in names) == ("glm" not in model)
+    # 第 3 轮被打断，客户端发出 response.cancel
+    assert "response.cancel" in queued
+
+
+def test_only_events_that_need_it_are_parsed(monkeypatch):
+    """分派表里没有的事件不解析；文本、转录、语音增量直接从消息中读出 delta。if/elif 链每个事件都要解析"""
+    from main_helper import omni_realtime_client
+
+    trace = [item for item in _trace() if not callable(item)]
+    parsed = []
+    real_loads = json.loads
+
+    def counting_loads(message, *args, **kwargs):
+        parsed.append(real_loads(message)["type"])
+        return real_loads(message, *args, **kwargs)
+
+    monkeypatch.setattr(omni_realtime_client.json, "loads", counting_loads)
+    asyncio.run(_replay(OmniRealtimeClient, "qwen3-omni-flash-realtime", trace))
+    skipped = {"session.created", "session.updated", "input_audio_buffer.committed", "conversation.item.created",
+               "response.content_part.added", "rate_limits.updated", "response.audio.done",
+               "response.content_part.done", "function_call.arguments"}
+    deltas = {"response.text.delta", "response.output_text.delta", "response.audio.delta",
+              "response.output_audio.delta", "response.audio_transcript.delta",
+              "response.output_audio_transcript.delta"}
+    assert not (skipped | deltas) & set(parsed)
+    assert len(parsed) == sum(1 for m in trace if real_loads(m)["type"] not in skipped | deltas)
+
+
+@pytest.mark.parametrize("compact", [True, False], ids=["compact", "default_separators"])
+def test_escaped_and_nested_deltas_match_the_if_elif_chain(compact):
+    """带转义字符的增量、嵌套对象中的 delta 键都回退到 JSON 解析，结果与 if/elif 链一致"""
+    def event(event_type, **fields):
+        separators = (",", ":") if compact else (", ", ": ")
+        return json.dumps({"type": event_type, **fields}, ensure_ascii=False, separators=separators)
+
+    trace = [
+        event("response.created", response={"id": "resp"}),
+        event("conversation.item.input_audio_transcription.completed", transcript="你好"),
+        event("response.text.delta", delta='带"引号"的\n文本'),
+        event("response.text.delta", meta={"delta": "嵌套"}, delta="外层"),
+        event("response.audio_transcript.delta", delta="转义\t\u0041"),
+        event("response.audio_transcript.delta", delta="普通"),
+        event("response.text.delta", delta=""),
+        event("response.audio.delta", delta=base64.b64encode(b"\x01\x02" * 100).decode()),
+        event("response.done", response={"id": "resp"}),
+    ]
+    expected = asyncio.run(_replay(LegacyClient, "qwen3-omni-flash-realtime", trace))
+    actual = asyncio.run(_replay(OmniRealtimeClient, "qwen3-omni-flash-realtime", trace))
+    assert actual == expected
+    texts = [call[1] for call in actual[0] if call[0] == "text"]
+    assert texts == ['带"引号"的\n文本', "外层", ""]
+
+
+@pytest.mark.slow
+def test_replay_benchmark():
+    """回放 1000 轮对话（约 5 万个事件），比较两种分派方式的耗时"""
+    import gc
+
+    trace = [item for n in range(1000) for item in _turn(n, audio_deltas=12) if not callable(item)]
+
+    best = {LegacyClient: float("inf"), OmniRealtimeClient: float("inf")}
+    gc.disable()
+    try:
+        # 交替运行取最好成绩，减少机器负载波动的影响
+        for _ in range(7):
+            for cls in best:
+                start = time.perf_counter()
+                asyncio.run(_replay(cls, "qwen3-omni-flash-realtime", trace))
+                best[cls] = min(best[cls], time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    legacy, table = best[LegacyClient], best[OmniRealtimeClient]
+    print(f"replayed {len(trace)} events: if/elif chain {len(trace) / legacy:,.0f} events/s, "
+          f"dispatch table {len(trace) / table:,.0f} events/s")
+    assert table <= legacy
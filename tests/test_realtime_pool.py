@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from main_helper.omni_realtime_client import OmniRealtimeClient  # noqa: E402
+from main_helper.realtime_pool import RealtimeSessionPool  # noqa: E402
+from mock_servers import MockWebSocketServer  # noqa: E402
+
+HANDSHAKE = 0.3
+
+
+class RealtimeServer:
+    """模拟 Realtime API：保持连接直到客户端关闭，记录当前打开的连接，可以从服务端断开"""
+
+    def __init__(self):
+        self.open = set()
+        self.closed = 0
+
+    async def __call__(self, ws):
+        self.open.add(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.open.discard(ws)
+            self.closed += 1
+
+    async def drop_all(self):
+        for ws in list(self.open):
+            await ws.close()
+
+
+async def _wait_for(predicate, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def _pool(**overrides):
+    pool = RealtimeSessionPool("test_lanlan")
+    pool.RETRY_BACKOFF_INITIAL = 0.05
+    for name, value in overrides.items():
+        setattr(pool, name, value)
+    return pool
+
+
+def _factory(url):
+    return lambda: OmniRealtimeClient(url, "sk-test", model="qwen-omni-realtime-mock")
+
+
+def test_claim_returns_a_connected_session_without_waiting_for_the_handshake():
+    server = RealtimeServer()
+
+    async def run():
+        async with MockWebSocketServer(server, handshake_delay=HANDSHAKE) as mock:
+            spec, factory = (mock.url, "sk-test", "mock"), _factory(mock.url)
+            cold = factory()
+            start = time.perf_counter()
+            await cold.open()
+            cold_open = time.perf_counter() - start
+            await cold.close()
+
+            pool = _pool()
+            pool.keep_warm(spec, factory)
+            await _wait_for(lambda: pool.health()["idle"] == 1)
+            start = time.perf_counter()
+            client = pool.claim(spec)
+            claimed = time.perf_counter() - start
+            try:
+                assert client is not None and client.ws is not None
+                # 取走之后在后台补充一个新连接
+                await _wait_for(lambda: pool.health()["idle"] == 1)
+                await _wait_for(lambda: len(server.open) == 2)
+                return cold_open, claimed, pool.health()
+            finally:
+                await client.close()
+                await pool.shutdown()
+
+    cold_open, claimed, health = asyncio.run(run())
+    print(f"fresh open {cold_open * 1000:.0f}ms, claim from pool {claimed * 1000:.3f}ms")
+    assert cold_open >= HANDSHAKE
+    assert claimed < 0.01
+    assert health["claimed"] == 1 and health["opened"] == 2
+
+
+def test_spec_change_discards_stale_connections():
+    server = RealtimeServer()
+
+    async def run():
+        async with MockWebSocketServer(server) as mock:
+            factory = _factory(mock.url)
+            pool = _pool()
+            pool.keep_warm("old-spec", factory)
+            await _wait_for(lambda: pool.health()["idle"] == 1)
+            # 配置热重载：旧密钥的连接不能被新会话取走
+            assert pool.claim("new-spec") is None
+            assert pool.health()["expired"] == 1 and pool.health()["missed"] == 1
+            pool.keep_warm("new-spec", factory)
+            await _wait_for(lambda: pool.health()["idle"] == 1)
+            client = pool.claim("new-spec")
+            assert client is not None
+            await client.close()
+            await pool.shutdown()
+            await _wait_for(lambda: not server.open)
+
+    asyncio.run(run())
+
+
+def test_idle_connections_expire_and_are_replaced():
+    server = RealtimeServer()
+
+    async def run():
+        async with MockWebSocketServer(server) as mock:
+            pool = _pool(MAX_AGE=0.3, PROBE_INTERVAL=0.05)
+            pool.keep_warm("spec", _factory(mock.url))
+            await _wait_for(lambda: pool.health()["opened"] == 1)
+            await _wait_for(lambda: pool.health()["opened"] >= 3, timeout=3)
+            health = pool.health()
+            await pool.shutdown()
+            # 过期的连接都被关闭
+            await _wait_for(lambda: not server.open)
+            return health
+
+    health = asyncio.run(run())
+    assert health["expired"] >= 2 and health["claimed"] == 0
+
+
+def test_claim_skips_a_connection_that_aged_out_between_probes():
+    server = RealtimeServer()
+
+    async def run():
+        async with MockWebSocketServer(server) as mock:
+            pool = _pool(PROBE_INTERVAL=60.0)
+            pool.keep_warm("spec", _factory(mock.url))
+            await _wait_for(lambda: pool.health()["idle"] == 1)
+            pool.idle()
+            pool.MAX_AGE = 0.0
+            assert pool.claim("spec") is None
+            await pool.shutdown()
+            await _wait_for(lambda: not server.open)
+            return pool.health()
+
+    health = asyncio.run(run())
+    assert health["expired"] == 1 and health["missed"] == 1
+
+
+def test_connection_closed_by_the_server_is_not_handed_out():
+    server = RealtimeServer()
+
+    async def run():
+        async with MockWebSocketServer(server) as mock:
+            pool = _pool(PROBE_INTERVAL=0.05)
+            pool.keep_warm("spec", _factory(mock.url))
+            await _wait_for(lambda: pool.health()["opened"] == 1)
+            # 服务商主动断开空闲连接：探活发现后丢弃并重新建立
+            await server.drop_all()
+            await _wait_for(lambda: pool.health()["opened"] == 2)
+            client = pool.claim("spec")
+            assert client is not None and client.ws.close_code is None
+            await client.close()
+            await pool.shutdown()
+            return pool.health()
+
+    health = asyncio.run(run())
+    assert health["expired"] >= 1
+
+
+def test_idle_stops_refilling_and_failed_opens_back_off():
+    attempts = []
+
+    class Unreachable:
+        ws = None
+
+        async def open(self):
+            attempts.append(time.perf_counter())
+            raise ConnectionRefusedError("connection refused")
+
+        async def close(self):
+            pass
+
+    async def run():
+        pool = _pool()
+        pool.keep_warm("spec", Unreachable)
+        await _wait_for(lambda: len(attempts) >= 3)
+        pool.idle()
+        await asyncio.sleep(0.5)
+        count = len(attempts)
+        await asyncio.sleep(0.3)
+        assert len(attempts) == count
+        await pool.shutdown()
+        return pool.health()
+
+    health = asyncio.run(run())
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    assert health["failed"] == len(attempts) and health["idle"] == 0
+    # 失败后按指数退避重试
+    assert gaps[1] > gaps[0] * 1.5
+
+
+@pytest.mark.parametrize("failure", ["error", "timeout", "shutdown"])
+def test_failed_or_abandoned_opens_are_closed(failure):
+    """建连失败、超时或预热池关闭时，握手到一半的连接都会被关闭"""
+    opened, closed = [], []
+
+    class HalfOpen:
+        ws = None
+
+        async def open(self):
+            opened.append(self)
+            if failure == "error":
+                raise ConnectionResetError("connection reset")
+            await asyncio.sleep(10)
+
+        async def close(self):
+            closed.append(self)
+
+    async def run():
+        pool = _pool(OPEN_TIMEOUT=0.05)
+        pool.keep_warm("spec", HalfOpen)
+        await _wait_for(lambda: len(opened) >= (1 if failure == "shutdown" else 2))
+        await pool.shutdown()
+
+    asyncio.run(run())
+    assert closed == opened
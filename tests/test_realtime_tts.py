@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import queue
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from main_helper.tts_helper import QwenTTSConnection, RealtimeTTSConnection  # noqa: E402
+from mock_servers import MockWebSocketServer, qwen_tts_handler  # noqa: E402
+
+CHUNK_BYTES = 4800  # 24kHz PCM16 的 100ms
+
+
+async def _collect(response_queue, expected_bytes, timeout=5.0):
+    """从响应队列取音频，直到收够 expected_bytes；返回 (字节数, 首个音频块到达时间)"""
+    received, first_at = 0, None
+    deadline = time.perf_counter() + timeout
+    while received < expected_bytes and time.perf_counter() < deadline:
+        try:
+            chunk = response_queue.get_nowait()
+        except queue.Empty:
+            await asyncio.sleep(0.001)
+            continue
+        if first_at is None:
+            first_at = time.perf_counter()
+        received += len(chunk)
+    return received, first_at
+
+
+async def _speak(conn, text):
+    await conn.begin_utterance()
+    await conn.send_text(text)
+    await conn.finish_utterance()
+
+
+def _expected_output(chunks):
+    """24kHz -> 48kHz：输出字节数是输入的两倍，另加 flush 推出的滤波器尾音"""
+    resampler = QwenTTSConnection(None, None, None, None).resampler
+    return chunks * CHUNK_BYTES * 2 + ((resampler.taps_per_phase + 1) // 2) * 2 * 2
+
+
+def test_incomplete_connection_subclass_fails_on_construction():
+    class NoFinish(RealtimeTTSConnection):
+        async def _handshake(self):
+            pass
+
+        def _handle_event(self, event):
+            pass
+
+        def _apply_voice(self, voice_id):
+            pass
+
+        async def begin_utterance(self):
+            pass
+
+        async def send_text(self, text):
+            pass
+
+    with pytest.raises(TypeError, match="finish_utterance"):
+        NoFinish(None, None, None)
+
+
+def test_utterances_reuse_one_connection():
+    async def run():
+        async with MockWebSocketServer(qwen_tts_handler(CHUNK_BYTES)) as server:
+            responses = queue.Queue()
+            conn = QwenTTSConnection(server.url, {}, responses, "Cherry")
+            try:
+                for text in ("你好", "今天天气不错", "再见"):
+                    await _speak(conn, text)
+                    received, _ = await _collect(responses, _expected_output(len(text)))
+                    assert received == _expected_output(len(text))
+                assert server.connections == 1
+            finally:
+                await conn.close()
+    asyncio.run(run())
+
+
+def test_interrupted_utterance_audio_is_dropped():
+    async def run():
+        handler = qwen_tts_handler(CHUNK_BYTES, first_audio_delay=0.05)
+        async with MockWebSocketServer(handler) as server:
+            responses = queue.Queue()
+            conn = QwenTTSConnection(server.url, {}, responses, "Cherry")
+            try:
+                await _speak(conn, "这句话会被打断")
+                # 在第一段音频到达之前开始新语音：旧 response 的音频全部丢弃
+                await _speak(conn, "新的")
+                received, _ = await _collect(responses, _expected_output(2))
+                await asyncio.sleep(0.1)
+                assert received == _expected_output(2)
+                assert responses.empty()
+            finally:
+                await conn.close()
+    asyncio.run(run())
+
+
+def test_reconnects_after_server_drop():
+    async def run():
+        connections = []
+
+        async def handler(ws):
+            connections.append(ws)
+            await qwen_tts_handler(CHUNK_BYTES)(ws)
+
+        async with MockWebSocketServer(handler) as server:
+            responses = queue.Queue()
+            conn = QwenTTSConnection(server.url, {}, responses, "Cherry")
+            try:
+                await conn.prewarm()
+                await connections[0].close()
+                for _ in range(100):
+                    if not conn.connected:
+                        break
+                    await asyncio.sleep(0.01)
+                await _speak(conn, "你好")
+                received, _ = await _collect(responses, _expected_output(2))
+                assert received == _expected_output(2)
+                assert server.connections == 2
+            finally:
+                await conn.close()
+    asyncio.run(run())
+
+
+def test_time_to_first_audio_with_prewarmed_connection():
+    """模拟 150ms 的握手延迟：预热后的首包延迟不再包含建连和会话配置"""
+    connect_delay = 0.15
+
+    async def measure(prewarm):
+        async with MockWebSocketServer(qwen_tts_handler(CHUNK_BYTES), connect_delay=connect_delay) as server:
+            responses = queue.Queue()
+            conn = QwenTTSConnection(server.url, {}, responses, "Cherry")
+            try:
+                if prewarm:
+                    await conn.prewarm()
+                samples = []
+                for text in ("第一句", "第二句", "第三句"):
+                    start = time.perf_counter()
+                    await _speak(conn, text)
+                    _, first_at = await _collect(responses, _expected_output(len(text)))
+                    samples.append(first_at - start)
+                return samples
+            finally:
+                await conn.close()
+
+    cold = asyncio.run(measure(prewarm=False))
+    warm = asyncio.run(measure(prewarm=True))
+    print(f"time to first audio: cold={[f'{s * 1000:.1f}ms' for s in cold]} "
+          f"prewarmed={[f'{s * 1000:.1f}ms' for s in warm]}")
+    # 冷启动的第一句要付出握手延迟，之后的语音复用连接
+    assert cold[0] >= connect_delay
+    assert max(cold[1:]) < connect_delay
+    assert max(warm) < connect_delay
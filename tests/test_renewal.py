@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import queue
+
+import pytest
+
+from main_helper.renewal import SessionRenewalScheduler
+from renewal_sim import FakeClock, replay, synthetic_trace
+
+BUSY = dict(gap=(1.0, 5.0), speech=(3.0, 8.0), reply_chars=(60, 160))
+QUIET = dict(gap=(60.0, 240.0), speech=(1.5, 4.0), reply_chars=(15, 40))
+
+
+CHATTY = dict(gap=(1.0, 3.0), speech=(2.0, 4.0), reply_chars=(10, 40))
+SEEDS = range(5)
+
+
+@pytest.mark.parametrize("name, shape", [("busy", BUSY), ("chatty", CHATTY), ("quiet", QUIET)])
+def test_replay_synthetic_traces(name, shape):
+    """30 分钟的对话轨迹：比较按上下文预测的调度与改动前每 40 秒切换一次的规则"""
+    results = {"adaptive": [], "fixed uptime": []}
+    for seed in SEEDS:
+        trace = synthetic_trace(30, seed=seed, **shape)
+        results["adaptive"].append(replay(trace, "adaptive"))
+        results["fixed uptime"].append(replay(trace, "fixed"))
+    for policy, runs in results.items():
+        print(f"{name} x{len(runs)} {policy}: {sum(r.swaps for r in runs)} swaps, "
+              f"{sum(r.stall_seconds for r in runs):.1f}s stalled, "
+              f"{sum(r.over_budget_seconds for r in runs):.0f}s over budget, "
+              f"peak {max(r.peak_tokens for r in runs)} tokens")
+    budget = SessionRenewalScheduler.TOKEN_BUDGET
+    for adaptive, fixed in zip(results["adaptive"], results["fixed uptime"]):
+        assert adaptive.swaps < fixed.swaps
+        # 预算是软上限：连续几轮超长回复时允许略微超出
+        assert adaptive.peak_tokens <= budget * 1.05
+        assert adaptive.over_budget_seconds <= adaptive.duration * 0.02
+    if name == "quiet":
+        # 安静的会话不需要为了时间流逝而切换
+        assert all(r.swaps <= 2 for r in results["adaptive"])
+
+
+def test_prediction_starts_earlier_when_context_grows_faster():
+    def first_trigger(tokens_per_turn, turn_seconds):
+        clock = FakeClock()
+        scheduler = SessionRenewalScheduler(clock=clock)
+        while not scheduler.should_prepare():
+            clock.advance(turn_seconds)
+            scheduler.tokens += tokens_per_turn
+            scheduler.end_turn()
+        return clock(), scheduler.tokens
+
+    slow_at, slow_tokens = first_trigger(40, 5)
+    fast_at, fast_tokens = first_trigger(400, 5)
+    assert fast_at < slow_at
+    # 增长快时需要留出更多余量，触发时的上下文更小
+    assert fast_tokens < slow_tokens <= SessionRenewalScheduler.TOKEN_BUDGET
+    assert fast_at >= SessionRenewalScheduler.MIN_UPTIME
+
+
+def test_text_session_renews_memory_every_few_turns():
+    pytest.importorskip("langchain_openai")
+    core = pytest.importorskip("main_helper.core")
+    from config import get_character_data
+    from main_helper.omni_offline_client import OmniOfflineClient
+
+    async def run():
+        sync_queue = queue.Queue()
+        manager = core.LLMSessionManager(sync_queue, get_character_data()[1], "prompt")
+        manager.session = OmniOfflineClient("http://127.0.0.1:9/v1", "sk-test", model="mock")
+        manager.session_start_time = manager.renewal.started_at
+        turns = SessionRenewalScheduler.TEXT_RENEW_TURNS
+        for _ in range(turns * 2 + 1):
+            manager.renewal.add_text("你好")
+            await manager.handle_response_complete()
+        messages = []
+        while not sync_queue.empty():
+            messages.append(sync_queue.get_nowait()["data"])
+        return messages, manager.is_preparing_new_session
+
+    messages, preparing = asyncio.run(run())
+    # 文本会话不热切换，但每 TEXT_RENEW_TURNS 轮仍把对话交给记忆服务器
+    assert messages.count("renew session") == 2
+    assert messages.count("turn end") == SessionRenewalScheduler.TEXT_RENEW_TURNS * 2 + 1
+    assert not preparing
+
+
+def test_text_session_renews_memory_on_token_growth():
+    clock = FakeClock()
+    scheduler = SessionRenewalScheduler(clock=clock)
+    scheduler.add_text("长" * (SessionRenewalScheduler.TOKEN_BUDGET + 10))
+    scheduler.end_turn()
+    assert scheduler.should_renew_memory()
+    scheduler.mark_memory_renewed()
+    assert not scheduler.should_renew_memory()
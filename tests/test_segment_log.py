@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+近期记录分段日志存储测试：崩溃残行恢复、旧 recent_*.json 迁移、压缩，
+以及记忆浏览器接口能看到尚未压缩的新角色记录
+"""
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from utils import segment_log
+from utils.segment_log import SegmentLogStore, log_path_for, read_materialized
+
+
+def _msg(text, kind="human"):
+    return {"type": kind, "data": {"content": text}}
+
+
+def test_new_store_writes_snapshot_immediately(tmp_path):
+    path = tmp_path / "recent_新角色.json"
+    store = SegmentLogStore(path)
+    assert path.exists()
+    assert json.loads(path.read_text(encoding="utf-8")) == []
+
+    store.append([_msg("你好")])
+    # 压缩前快照仍是空的，但合并读取能看到日志里的新记录
+    assert json.loads(path.read_text(encoding="utf-8")) == []
+    assert read_materialized(path) == [_msg("你好")]
+    store.close()
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "recent_a.json"
+    store = SegmentLogStore(path, compact_records=1000)
+    store.append([_msg("一")])
+    store.append([_msg("二")])
+    store.flush()
+    store._close_log()
+    # 模拟写到一半时崩溃：最后一行只写了一部分
+    with open(log_path_for(path), "a", encoding="utf-8") as f:
+        f.write('{"op": "append", "messages": [{"type": "hu')
+
+    reopened = SegmentLogStore(path, compact_records=1000)
+    assert reopened.get() == [_msg("一"), _msg("二")]
+    assert reopened._records == 2
+
+    # 残行之后继续追加的记录不受影响
+    reopened.append([_msg("三")])
+    reopened._close_log()
+    assert read_materialized(path) == [_msg("一"), _msg("二"), _msg("三")]
+
+
+def test_legacy_json_is_used_as_initial_snapshot(tmp_path):
+    path = tmp_path / "recent_旧角色.json"
+    legacy = [_msg("旧消息"), _msg("旧回复", "ai")]
+    path.write_text(json.dumps(legacy, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    store = SegmentLogStore(path)
+    assert store.get() == legacy
+    assert not os.path.exists(log_path_for(path))
+
+    store.append([_msg("新消息")])
+    store.close()
+    assert json.loads(path.read_text(encoding="utf-8")) == legacy + [_msg("新消息")]
+    assert os.path.getsize(log_path_for(path)) == 0
+
+
+def test_log_without_snapshot_is_compacted_on_open(tmp_path):
+    """只剩日志（创建快照前崩溃）时，打开即合并生成快照"""
+    path = tmp_path / "recent_b.json"
+    with open(log_path_for(path), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "append", "messages": [_msg("孤儿")]}, ensure_ascii=False) + "\n")
+
+    store = SegmentLogStore(path)
+    assert store.get() == [_msg("孤儿")]
+    assert json.loads(path.read_text(encoding="utf-8")) == [_msg("孤儿")]
+    assert os.path.getsize(log_path_for(path)) == 0
+    store.close()
+
+
+def test_compaction_by_record_count_and_size(tmp_path):
+    path = tmp_path / "recent_c.json"
+    store = SegmentLogStore(path, compact_records=4)
+    for i in range(3):
+        store.append([_msg(str(i))])
+    assert json.loads(path.read_text(encoding="utf-8")) == []
+    store.append([_msg("3")])
+    # 第 4 条记录触发压缩：快照包含全部消息，日志被清空
+    assert json.loads(path.read_text(encoding="utf-8")) == [_msg(str(i)) for i in range(4)]
+    assert os.path.getsize(log_path_for(path)) == 0
+    assert store._records == 0
+
+    store.replace([_msg("替换")])
+    store.close()
+    assert json.loads(path.read_text(encoding="utf-8")) == [_msg("替换")]
+
+    big = tmp_path / "recent_d.json"
+    store = SegmentLogStore(big, compact_records=1000, compact_bytes=2048)
+    for _ in range(20):
+        store.append([_msg("x" * 200)])
+    assert os.path.getsize(log_path_for(big)) < 2048
+    assert len(json.loads(big.read_text(encoding="utf-8"))) >= 8
+    assert SegmentLogStore(big).get() == store.get()
+    store.close()
+
+
+def test_external_snapshot_edit_is_reloaded(tmp_path):
+    path = tmp_path / "recent_e.json"
+    store = SegmentLogStore(path)
+    store.append([_msg("原始")])
+    generation = store.generation
+    segment_log.write_snapshot(path, [_msg("浏览器修改")])
+    assert store.get() == [_msg("浏览器修改")]
+    assert store.generation == generation + 1
+    store.close()
+
+
+@pytest.fixture
+def memory_browser(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    main_server = pytest.importorskip("main_server")
+    from utils import config_manager
+    monkeypatch.setattr(config_manager, "get_config_manager", lambda: SimpleNamespace(memory_dir=tmp_path))
+    return main_server
+
+
+def test_memory_browser_sees_uncompacted_new_character(tmp_path, memory_browser):
+    store = SegmentLogStore(tmp_path / "recent_新角色.json")
+    store.append([_msg("刚说的话")])
+
+    files = asyncio.run(memory_browser.get_recent_files())["files"]
+    assert "recent_新角色.json" in files
+    result = asyncio.run(memory_browser.get_recent_file("recent_新角色.json"))
+    assert json.loads(result["content"]) == [_msg("刚说的话")]
+    store.close()
+
+
+def test_memory_browser_lists_log_only_record(tmp_path, memory_browser):
+    with open(tmp_path / "recent_孤儿.log", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "append", "messages": [_msg("孤儿")]}, ensure_ascii=False) + "\n")
+
+    assert asyncio.run(memory_browser.get_recent_files())["files"] == ["recent_孤儿.json"]
+    result = asyncio.run(memory_browser.get_recent_file("recent_孤儿.json"))
+    assert json.loads(result["content"]) == [_msg("孤儿")]
+    missing = asyncio.run(memory_browser.get_recent_file("recent_无.json"))
+    assert missing.status_code == 404
+
+
+def test_applied_keys_survive_compaction_and_reopen(tmp_path, monkeypatch):
+    monkeypatch.setattr(segment_log, "APPLIED_KEYS_LIMIT", 3)
+    path = tmp_path / "recent_f.json"
+    store = SegmentLogStore(path, compact_records=2)
+    store.append([_msg("一")], key="k1")
+    assert store.has_applied("k1") and not store.has_applied("k2")
+    store.append([_msg("二")], key="k2")  # 触发压缩
+    assert os.path.getsize(log_path_for(path)) > 0
+    store.replace([_msg("三")], key="k3")
+    store.append([_msg("四")], key="k4")
+    store.close()
+
+    reopened = SegmentLogStore(path)
+    # 只保留最近 APPLIED_KEYS_LIMIT 个键；快照格式保持与旧版相同
+    assert [k for k in ("k1", "k2", "k3", "k4") if reopened.has_applied(k)] == ["k2", "k3", "k4"]
+    assert json.loads(path.read_text(encoding="utf-8")) == [_msg("三"), _msg("四")]
+    assert read_materialized(path) == [_msg("三"), _msg("四")]
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import queue
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+core = pytest.importorskip("main_helper.core")
+
+from config import get_character_data, get_core_config  # noqa: E402
+from main_helper import tts_supervisor  # noqa: E402
+from main_helper.tts_helper import TTS_READY  # noqa: E402
+from mock_servers import MockHTTPServer, MockWebSocketServer  # noqa: E402
+
+LANLAN = get_character_data()[1]
+# 每个启动步骤的模拟耗时（秒）
+STEP = 0.3
+
+
+def _slow_tts_worker(request_queue, response_queue, api_key, voice_id):
+    """模拟导入依赖、连接服务商需要 STEP 秒的 TTS 子进程"""
+    time.sleep(STEP)
+    response_queue.put(TTS_READY)
+    while True:
+        request_queue.get()
+
+
+class RealtimeRecorder:
+    """模拟 Realtime API：记录收到的事件和连接的关闭"""
+
+    def __init__(self):
+        self.events = []
+        self.closed = 0
+
+    async def __call__(self, ws):
+        try:
+            async for message in ws:
+                self.events.append(json.loads(message))
+        finally:
+            self.closed += 1
+
+
+def _memory_handler(method, path, headers, body):
+    return 200, {}, json.dumps("\n====近期记忆====\n", ensure_ascii=False)
+
+
+@pytest.fixture
+def patched_config(monkeypatch):
+    monkeypatch.setattr(tts_supervisor, "get_tts_worker", lambda **kwargs: _slow_tts_worker)
+
+    def use(realtime_url):
+        config = dict(get_core_config(), CORE_URL=realtime_url, CORE_MODEL="qwen-omni-realtime-mock")
+        monkeypatch.setattr(core, "get_core_config", lambda: config)
+    return use
+
+
+async def _shutdown(manager):
+    await manager.end_session(by_server=True)
+    await manager.realtime_pool.shutdown()
+    await manager.tts_worker.shutdown()
+    await manager.close_memory_client()
+
+
+def test_session_start_runs_warm_up_steps_concurrently(patched_config):
+    """记忆提示词、TTS 就绪握手、realtime 建连各需 STEP 秒，并行后总耗时接近单个步骤而不是三者之和"""
+    recorder = RealtimeRecorder()
+
+    async def run():
+        async with MockHTTPServer(_memory_handler, delay=STEP) as memory, \
+                MockWebSocketServer(recorder, handshake_delay=STEP) as realtime:
+            patched_config(realtime.url)
+            manager = core.LLMSessionManager(queue.Queue(), LANLAN, "测试角色设定")
+            manager.memory_server_port = memory.port
+            manager.voice_id = "custom-voice"  # 自定义音色：语音模式也需要 TTS
+            try:
+                start = time.perf_counter()
+                await manager.start_session(None, new=True, input_mode="audio")
+                elapsed = time.perf_counter() - start
+                assert manager.is_active and manager.session_ready and manager.tts_ready
+                await asyncio.sleep(0.05)
+                return elapsed, dict(manager.last_session_start_timings)
+            finally:
+                await _shutdown(manager)
+
+    elapsed, timings = asyncio.run(run())
+    steps = {name: timings[name] for name in ("memory_prompt", "tts", "realtime_ws")}
+    print(f"time to session ready: {elapsed * 1000:.0f}ms "
+          f"({', '.join(f'{k}={v * 1000:.0f}ms' for k, v in timings.items())}; "
+          f"sequential would be >= {sum(steps.values()) * 1000:.0f}ms)")
+    assert all(v >= STEP * 0.9 for v in steps.values())
+    assert elapsed < sum(steps.values()) * 0.6
+    # 会话配置在记忆提示词取回之后发送，包含记忆内容
+    update = next(e for e in recorder.events if e["type"] == "session.update")
+    assert "近期记忆" in update["session"]["instructions"]
+
+
+def test_startup_deadline_fails_fast_and_closes_the_opened_socket(patched_config, monkeypatch):
+    recorder = RealtimeRecorder()
+    monkeypatch.setattr(core.LLMSessionManager, "SESSION_START_TIMEOUT", 0.5)
+
+    async def run():
+        async with MockHTTPServer(_memory_handler, delay=5.0) as memory, \
+                MockWebSocketServer(recorder) as realtime:
+            patched_config(realtime.url)
+            manager = core.LLMSessionManager(queue.Queue(), LANLAN, "测试角色设定")
+            manager.memory_server_port = memory.port
+            try:
+                start = time.perf_counter()
+                await manager.start_session(None, new=True, input_mode="audio")
+                elapsed = time.perf_counter() - start
+                await asyncio.sleep(0.1)
+                return elapsed, manager.is_active, manager.session_start_failure_count, manager.session
+            finally:
+                await _shutdown(manager)
+
+    elapsed, active, failures, session = asyncio.run(run())
+    assert elapsed < 1.0
+    assert not active and failures == 1 and session is None
+    # 已经并行建立的 realtime 连接随失败一起关闭，没有发出会话配置
+    assert recorder.closed == 1
+    assert not any(e["type"] == "session.update" for e in recorder.events)
+
+
+def test_memory_prompt_requests_reuse_one_connection():
+    """会话管理器持有长连接客户端，多次启动会话取记忆提示词不会每次重新建立 TCP 连接"""
+    async def run():
+        async with MockHTTPServer(_memory_handler) as memory:
+            manager = core.LLMSessionManager(queue.Queue(), LANLAN, "测试角色设定")
+            manager.memory_server_port = memory.port
+            try:
+                for _ in range(3):
+                    assert "近期记忆" in await manager._fetch_memory_prompt()
+            finally:
+                await manager.close_memory_client()
+            return memory.connections, len(memory.requests)
+
+    connections, requests = asyncio.run(run())
+    assert requests == 3 and connections == 1
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from config import get_character_data  # noqa: E402
+from memory import settings as settings_module  # noqa: E402
+from memory.settings import ImportantSettingsManager  # noqa: E402
+
+LANLAN = get_character_data()[1]
+MASTER = get_character_data()[0]
+
+
+class ScriptedLLM:
+    """按顺序返回预设回复；回复为异常实例时抛出"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(content=reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False))
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    data = list(get_character_data())
+    data[8] = {name: str(tmp_path / f"settings_{name}.json") for name in data[8]}
+    snapshot = tuple(data)
+    monkeypatch.setattr(settings_module, "get_character_data", lambda: snapshot)
+    # 仓库中的 verifier 提示词为空，测试使用一个最简模板
+    monkeypatch.setattr(settings_module, "settings_verifier_prompt", "旧设定：%s\n新设定：%s")
+    manager = ImportantSettingsManager()
+    manager.load_settings()
+    manager.settings[LANLAN] = {LANLAN: {}, MASTER: {"城市": "上海"}}
+    manager.save_settings(LANLAN)
+    return manager
+
+
+def _dialog(text):
+    return [HumanMessage([{"type": "text", "text": text}]), AIMessage([{"type": "text", "text": "记住啦"}])]
+
+
+def _use(manager, monkeypatch, proposer, verifier=None):
+    monkeypatch.setattr(manager, "_get_proposer", lambda: proposer)
+    monkeypatch.setattr(manager, "_get_verifier", lambda: verifier or ScriptedLLM(RuntimeError("不应调用")))
+
+
+def test_messages_are_marked_seen_only_after_a_successful_save(manager, monkeypatch):
+    proposer = ScriptedLLM({MASTER: {"爱好": "爬山"}})
+    _use(manager, monkeypatch, proposer)
+    real_save = manager.save_settings
+
+    def failing_save(lanlan_name):
+        raise OSError("磁盘已满")
+
+    monkeypatch.setattr(manager, "save_settings", failing_save)
+    with pytest.raises(OSError):
+        asyncio.run(manager.extract_and_update_settings(_dialog("我周末喜欢去爬山"), LANLAN, request_key="req-1"))
+
+    # 保存失败：消息没有被标记为已提取，同一请求重试时重新提取并成功合并
+    monkeypatch.setattr(manager, "save_settings", real_save)
+    asyncio.run(manager.extract_and_update_settings(_dialog("我周末喜欢去爬山"), LANLAN, request_key="req-1"))
+    assert len(proposer.prompts) == 2
+    assert manager.get_settings(LANLAN)[MASTER]["爱好"] == "爬山"
+
+    # 成功之后同一请求再次重试，消息不会再发给 proposer
+    asyncio.run(manager.extract_and_update_settings(_dialog("我周末喜欢去爬山"), LANLAN, request_key="req-1"))
+    assert len(proposer.prompts) == 2
+
+
+def test_same_phrase_in_a_later_request_is_extracted_again(manager, monkeypatch):
+    """去重按请求和消息位置，而不是按文本：之后在新的对话里说了同样的话仍会发给 proposer"""
+    proposer = ScriptedLLM({})
+    _use(manager, monkeypatch, proposer)
+    asyncio.run(manager.extract_and_update_settings(_dialog("我换工作了"), LANLAN, request_key="req-1"))
+    asyncio.run(manager.extract_and_update_settings(_dialog("我换工作了"), LANLAN, request_key="req-2"))
+    assert len(proposer.prompts) == 2
+
+    # 同一请求的重试只发送上次之后追加的消息
+    longer = _dialog("我换工作了") + _dialog("新公司在杭州")
+    asyncio.run(manager.extract_and_update_settings(longer, LANLAN, request_key="req-2"))
+    assert len(proposer.prompts) == 3
+    assert "新公司在杭州" in proposer.prompts[-1] and "我换工作了" not in proposer.prompts[-1]
+
+
+def test_failed_verification_keeps_messages_for_the_next_extraction(manager, monkeypatch):
+    proposer = ScriptedLLM({MASTER: {"城市": "北京"}})
+    _use(manager, monkeypatch, proposer, ScriptedLLM(RuntimeError("verifier 不可用")))
+    asyncio.run(manager.extract_and_update_settings(_dialog("我搬到北京了"), LANLAN))
+    assert manager.get_settings(LANLAN)[MASTER]["城市"] == "上海"
+
+    verifier = ScriptedLLM({MASTER: {"城市": "北京"}})
+    _use(manager, monkeypatch, proposer, verifier)
+    asyncio.run(manager.extract_and_update_settings(_dialog("我搬到北京了"), LANLAN))
+    assert len(proposer.prompts) == 2 and len(verifier.prompts) == 1
+    assert manager.get_settings(LANLAN)[MASTER]["城市"] == "北京"
+    with open(manager.settings_file[LANLAN], encoding="utf-8") as f:
+        assert json.load(f)[MASTER]["城市"] == "北京"
+
+
+def test_unparsable_proposal_is_retried_next_time(manager, monkeypatch):
+    proposer = ScriptedLLM("不是JSON", {MASTER: {"宠物": "猫"}})
+    _use(manager, monkeypatch, proposer)
+    asyncio.run(manager.extract_and_update_settings(_dialog("我养了一只猫"), LANLAN))
+    assert "宠物" not in manager.get_settings(LANLAN)[MASTER]
+    asyncio.run(manager.extract_and_update_settings(_dialog("我养了一只猫"), LANLAN))
+    assert manager.get_settings(LANLAN)[MASTER]["宠物"] == "猫"
+
+
+class RereadingSettingsManager(ImportantSettingsManager):
+    """改动前的行为：每次 get_settings 都重新构建角色数据并重新读取所有 settings_{name}.json"""
+
+    def load_settings(self):
+        self._character_snapshot = None
+        self._file_signatures = {}
+        super().load_settings()
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+@pytest.mark.slow
+def test_get_settings_and_new_dialog_latency_under_load(manager, monkeypatch):
+    """50 个并发客户端交替请求 /get_settings 与 /new_dialog，对比常驻内存的设定与每次重读磁盘"""
+    httpx = pytest.importorskip("httpx")
+    memory_server = pytest.importorskip("memory_server")
+    history = [m for i in range(15) for m in _dialog(f"第{i}件事")]
+    monkeypatch.setattr(memory_server.recent_history_manager, "get_recent_history", lambda name: history)
+    manager.settings[LANLAN][MASTER].update({f"偏好{i}": f"内容{i}" * 10 for i in range(200)})
+    manager.save_settings(LANLAN)
+    legacy = RereadingSettingsManager()
+    legacy.load_settings()
+    clients, rounds = 50, 40
+
+    async def load(settings_manager):
+        monkeypatch.setattr(memory_server, "settings_manager", settings_manager)
+        monkeypatch.setattr(memory_server, "dialog_snapshots", {})
+        latencies = {"/get_settings": [], "/new_dialog": []}
+        transport = httpx.ASGITransport(app=memory_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://memory") as client:
+            expected = (await client.get(f"/get_settings/{LANLAN}")).json()
+            assert "内容199" in expected
+
+            async def worker(n):
+                for i in range(rounds):
+                    path = "/get_settings" if (n + i) % 2 else "/new_dialog"
+                    t0 = time.perf_counter()
+                    response = await client.get(f"{path}/{LANLAN}")
+                    latencies[path].append(time.perf_counter() - t0)
+                    assert response.status_code == 200
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(worker(n) for n in range(clients)))
+            return latencies, time.perf_counter() - t0
+
+    results = {}
+    for name, settings_manager in (("reread", legacy), ("in-memory", manager)):
+        latencies, elapsed = asyncio.run(load(settings_manager))
+        results[name] = latencies
+        for path, samples in latencies.items():
+            print(f"{name:>9} {path:<14} p50 {_percentile(samples, 0.5) * 1000:.2f}ms "
+                  f"p99 {_percentile(samples, 0.99) * 1000:.2f}ms")
+        print(f"{name:>9} {clients * rounds / elapsed:.0f} req/s")
+
+    for path in ("/get_settings", "/new_dialog"):
+        assert _percentile(results["in-memory"][path], 0.5) < _percentile(results["reread"][path], 0.5)
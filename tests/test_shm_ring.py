@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import multiprocessing
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from utils.shm_ring import AudioRingBuffer, TTSAudioReceiver
+
+TIMESTAMP = struct.Struct('<d')
+CHUNK_INTERVAL = 0.02  # 每 20ms 一块音频，与 TTS 流式输出的节奏相近
+CHUNKS = 100
+
+
+def _produce(response_queue, chunks=CHUNKS, payload_size=1920):
+    """模拟 TTS worker：负载开头写入发送时刻，消费端据此计算端到端延迟"""
+    padding = bytes(payload_size - TIMESTAMP.size)
+    for _ in range(chunks):
+        response_queue.put(TIMESTAMP.pack(time.perf_counter()) + padding)
+        time.sleep(CHUNK_INTERVAL)
+    response_queue.put("__done__")
+
+
+def _start_producer(response_queue):
+    ctx = multiprocessing.get_context("fork")
+    process = ctx.Process(target=_produce, args=(response_queue,), daemon=True)
+    process.start()
+    return process
+
+
+async def _receive_with_ring():
+    receiver = TTSAudioReceiver(capacity=1 << 20)
+    receiver.start()
+    latencies = []
+    process = _start_producer(receiver.channel())
+    try:
+        done = False
+        while not done:
+            for item in await receiver.get():
+                if item == "__done__":
+                    done = True
+                else:
+                    latencies.append(time.perf_counter() - TIMESTAMP.unpack_from(item)[0])
+    finally:
+        process.join(timeout=5)
+        receiver.close()
+    return latencies
+
+
+async def _receive_with_polling():
+    """改动前的做法：multiprocessing.Queue + empty() + sleep(0.01) 轮询"""
+    response_queue = multiprocessing.get_context("fork").Queue()
+    latencies = []
+    process = _start_producer(response_queue)
+    try:
+        done = False
+        while not done:
+            while not response_queue.empty():
+                item = response_queue.get()
+                if item == "__done__":
+                    done = True
+                else:
+                    latencies.append(time.perf_counter() - TIMESTAMP.unpack_from(item)[0])
+            await asyncio.sleep(0.01)
+    finally:
+        process.join(timeout=5)
+    return latencies
+
+
+def test_ring_round_trip_and_wraparound():
+    ring = AudioRingBuffer(capacity=4096)
+    try:
+        sent, received = [], []
+        for i in range(200):
+            payload = bytes([i % 256]) * (100 + i % 300)
+            assert ring.write(payload, timeout=0)
+            sent.append(payload)
+            if i % 3 == 0:
+                received.extend(ring.read_all())
+        received.extend(ring.read_all())
+        assert received == sent
+        assert ring.dropped == 0
+    finally:
+        ring.close()
+
+
+def test_full_ring_drops_after_timeout():
+    ring = AudioRingBuffer(capacity=4096)
+    try:
+        while ring.write(bytes(1000), timeout=0):
+            pass
+        assert ring.dropped == 1
+        ring.read_all()
+        assert ring.write(bytes(1000), timeout=0)
+    finally:
+        ring.close()
+
+
+def test_controls_are_delivered_in_put_order():
+    async def run():
+        receiver = TTSAudioReceiver(capacity=1 << 16)
+        receiver.start()
+        channel = receiver.channel()
+        try:
+            # 控制消息在两段音频之间放入：即使消费端在音频全部写完之后才读取，也不能被排到所有音频之后
+            channel.put(b'a1')
+            channel.put(b'a2')
+            channel.put(("__tts_ready__", 1))
+            channel.put(b'b1')
+            channel.put(("__tts_ready__", 2))
+            items = []
+            while len(items) < 5:
+                items.extend(await asyncio.wait_for(receiver.get(), timeout=1.0))
+            assert items == [b'a1', b'a2', ("__tts_ready__", 1), b'b1', ("__tts_ready__", 2)]
+        finally:
+            channel.close()
+            receiver.close()
+    asyncio.run(run())
+
+
+def test_audio_written_after_an_undelivered_control_waits_for_it():
+    """控制消息的帧还在管道里时，生产者之后写入的音频已经在环形缓冲中，不能先于控制消息交付"""
+    receiver = TTSAudioReceiver(capacity=1 << 16)  # 不启动唤醒线程，逐帧手动接收
+    channel = receiver.channel()
+    try:
+        channel.put(b'a1')
+        channel.put("control")
+        channel.put(b'b1')
+        # 还没有收到任何帧：环形缓冲里的音频都不可见
+        assert receiver._collect() == []
+        receiver._recv_frame()
+        assert receiver._collect() == [b'a1']
+        receiver._recv_frame()
+        assert receiver._collect() == ["control"]
+        receiver._recv_frame()
+        assert receiver._collect() == [b'b1']
+    finally:
+        channel.close()
+        receiver.close()
+
+
+def test_clear_drops_audio_but_keeps_controls():
+    async def run():
+        receiver = TTSAudioReceiver(capacity=1 << 16)
+        receiver.start()
+        channel = receiver.channel()
+        try:
+            channel.put(b'old')
+            channel.put("control")
+            await asyncio.sleep(0.05)
+            receiver.clear()
+            channel.put(b'new')
+            items = []
+            while len(items) < 2:
+                items.extend(await asyncio.wait_for(receiver.get(), timeout=1.0))
+            assert items == ["control", b'new']
+        finally:
+            channel.close()
+            receiver.close()
+    asyncio.run(run())
+
+
+def test_latency_and_jitter_versus_polling():
+    ring = asyncio.run(_receive_with_ring())
+    polling = asyncio.run(_receive_with_polling())
+    assert len(ring) == len(polling) == CHUNKS
+    ring_ms, polling_ms = np.array(ring) * 1000, np.array(polling) * 1000
+    print(f"ring:    p50={np.percentile(ring_ms, 50):.2f}ms p99={np.percentile(ring_ms, 99):.2f}ms "
+          f"jitter(std)={ring_ms.std():.2f}ms")
+    print(f"polling: p50={np.percentile(polling_ms, 50):.2f}ms p99={np.percentile(polling_ms, 99):.2f}ms "
+          f"jitter(std)={polling_ms.std():.2f}ms")
+    # 轮询的平均延迟约为半个轮询周期（5ms），环形缓冲由管道唤醒，不受轮询周期限制
+    assert np.percentile(ring_ms, 50) < np.percentile(polling_ms, 50)
+    assert np.percentile(ring_ms, 99) < 10.0
+
+
+def _idle_cpu(wait, seconds=1.0):
+    async def run():
+        start = time.process_time()
+        await wait(seconds)
+        return time.process_time() - start
+    return asyncio.run(run())
+
+
+def test_idle_cpu_versus_polling():
+    async def ring_idle(seconds):
+        receiver = TTSAudioReceiver(capacity=1 << 16)
+        receiver.start()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(receiver.get(), timeout=seconds)
+        finally:
+            receiver.close()
+
+    async def polling_idle(seconds):
+        response_queue = multiprocessing.get_context("fork").Queue()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            while not response_queue.empty():
+                response_queue.get()
+            await asyncio.sleep(0.01)
+
+    ring_cpu = _idle_cpu(ring_idle)
+    polling_cpu = _idle_cpu(polling_idle)
+    print(f"idle CPU over 1s: ring={ring_cpu * 1000:.2f}ms polling={polling_cpu * 1000:.2f}ms")
+    # 空闲时后台线程阻塞在管道上，事件循环没有任何定时唤醒
+    assert ring_cpu < 0.005
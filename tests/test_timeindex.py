@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from langchain_community.chat_message_histories import SQLChatMessageHistory  # noqa: E402
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+import memory.timeindex as timeindex  # noqa: E402
+from config import TIME_ORIGINAL_TABLE_NAME, get_character_data  # noqa: E402
+
+LANLAN = "bench"
+START = datetime(2024, 1, 1)
+
+
+class StubRecentHistory:
+    async def compress_history(self, messages, lanlan_name):
+        return messages, "摘要"
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    """使用独立数据库文件的 TimeIndexedMemory，不影响其他测试共用的角色数据"""
+    data = list(get_character_data())
+    data[7] = {LANLAN: str(tmp_path / "time_indexed_bench")}
+    monkeypatch.setattr(timeindex, "get_character_data", lambda: tuple(data))
+    instance = timeindex.TimeIndexedMemory(StubRecentHistory())
+    yield instance
+    instance.engine[LANLAN].dispose()
+
+
+def _seed(memory, rows, messages_per_session=10):
+    """以原始 SQL 批量灌入 rows 条消息，时间戳每条间隔一分钟"""
+    path = memory.engine[LANLAN].url.database
+    conn = sqlite3.connect(path)
+    batch = []
+    for i in range(rows):
+        ts = str(START + timedelta(minutes=i))
+        batch.append((f"s{i // messages_per_session}", '{"type": "human", "data": {"content": "x"}}', ts))
+        if len(batch) == 50000:
+            conn.executemany(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message, timestamp) VALUES (?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message, timestamp) VALUES (?, ?, ?)", batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def test_migration_is_idempotent_and_enables_wal(memory):
+    memory.check_table_schema(LANLAN)
+    memory.check_table_schema(LANLAN)
+    with memory.engine[LANLAN].connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        indexes = {row[1] for row in conn.execute(text(f"PRAGMA index_list({TIME_ORIGINAL_TABLE_NAME})"))}
+        plan = " ".join(str(row) for row in conn.execute(
+            text(f"EXPLAIN QUERY PLAN SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} "
+                 f"WHERE timestamp BETWEEN :a AND :b"), {"a": START, "b": START}))
+    assert f"ix_{TIME_ORIGINAL_TABLE_NAME}_timestamp_session" in indexes
+    assert f"ix_{TIME_ORIGINAL_TABLE_NAME}_session_id" in indexes
+    assert "USING" in plan and "INDEX" in plan
+
+
+def test_store_conversation_writes_messages_and_timestamps_together(memory):
+    messages = [HumanMessage("今天天气怎么样"), AIMessage("晴天")]
+    ts = datetime(2024, 5, 1, 12, 0)
+    asyncio.run(memory.store_conversation("e1", messages, LANLAN, timestamp=ts))
+    original = memory.retrieve_original_by_timeframe(LANLAN, ts - timedelta(seconds=1), ts + timedelta(seconds=1))
+    summary = memory.retrieve_summary_by_timeframe(LANLAN, ts - timedelta(seconds=1), ts + timedelta(seconds=1))
+    assert [row[0] for row in original] == ["e1", "e1"]
+    assert len(summary) == 1
+    # 与 SQLChatMessageHistory 的存储格式一致，原有的读取方式不受影响
+    history = SQLChatMessageHistory(connection=memory.engine[LANLAN], session_id="e1",
+                                    table_name=TIME_ORIGINAL_TABLE_NAME)
+    assert [m.content for m in history.messages] == ["今天天气怎么样", "晴天"]
+
+
+def _legacy_store(memory, event_id, messages, timestamp):
+    """改动前的写入方式：逐条 add_message，再用 UPDATE 补时间戳"""
+    history = SQLChatMessageHistory(connection=memory.engine[LANLAN], session_id=event_id,
+                                    table_name=TIME_ORIGINAL_TABLE_NAME)
+    for message in messages:
+        history.add_message(message)
+    with memory.engine[LANLAN].begin() as conn:
+        conn.execute(text(f"UPDATE {TIME_ORIGINAL_TABLE_NAME} SET timestamp = :ts WHERE session_id = :sid"),
+                     {"ts": timestamp, "sid": event_id})
+
+
+def _benchmark(memory, rows):
+    _seed(memory, rows)
+    window = timedelta(hours=6)
+    rng_span = rows - 6 * 60
+    queries = [START + timedelta(minutes=(i * 7919) % rng_span) for i in range(50)]
+
+    indexed = []
+    for start in queries:
+        t0 = time.perf_counter()
+        result = memory.retrieve_original_by_timeframe(LANLAN, start, start + window)
+        indexed.append(time.perf_counter() - t0)
+        assert len(result) == 6 * 60 + 1
+
+    # 同一个库上强制全表扫描，作为没有时间戳索引时的对照
+    full_scan = []
+    with memory.engine[LANLAN].connect() as conn:
+        for start in queries[:5]:
+            t0 = time.perf_counter()
+            conn.execute(text(f"SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} NOT INDEXED "
+                              f"WHERE timestamp BETWEEN :a AND :b"), {"a": start, "b": start + window}).fetchall()
+            full_scan.append(time.perf_counter() - t0)
+
+    messages = [HumanMessage(f"消息{i}") if i % 2 == 0 else AIMessage(f"回复{i}") for i in range(20)]
+    sessions = 30
+    t0 = time.perf_counter()
+    for i in range(sessions):
+        _legacy_store(memory, f"legacy{i}", messages, datetime.now())
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for i in range(sessions):
+        asyncio.run(memory.store_conversation(f"batched{i}", messages, LANLAN))
+    batched = time.perf_counter() - t0
+
+    p50, p95 = _percentile(indexed, 0.5) * 1000, _percentile(indexed, 0.95) * 1000
+    scan = _percentile(full_scan, 0.5) * 1000
+    print(f"{rows} rows: 6h timeframe query p50={p50:.2f}ms p95={p95:.2f}ms (full scan {scan:.1f}ms); "
+          f"insert {sessions * len(messages) / batched:.0f} msg/s batched vs "
+          f"{sessions * len(messages) / legacy:.0f} msg/s row-by-row")
+    return p95, scan, batched, legacy
+
+
+def test_timeframe_query_and_insert_benchmark(memory):
+    p95, scan, batched, legacy = _benchmark(memory, 100_000)
+    assert p95 < scan
+    assert batched < legacy
+
+
+@pytest.mark.slow
+def test_timeframe_query_and_insert_benchmark_1m(memory):
+    p95, scan, batched, legacy = _benchmark(memory, 1_000_000)
+    assert p95 < scan / 5
+    assert batched < legacy
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import time
+from functools import partial
+
+import pytest
+
+tts_supervisor = pytest.importorskip("main_helper.tts_supervisor")
+
+from main_helper.tts_helper import TTS_CONFIGURE, TTS_READY  # noqa: E402
+
+
+def _idle_worker(request_queue, response_queue, api_key, voice_id, free_mode=False):
+    while True:
+        request_queue.get()
+
+
+def _custom_voice_worker(request_queue, response_queue, api_key, voice_id):
+    _idle_worker(request_queue, response_queue, api_key, voice_id)
+
+
+def _fake_get_tts_worker(core_api_type='qwen', has_custom_voice=False):
+    # 与 tts_helper.get_tts_worker 相同的分派方式：自定义音色共用一个 worker，free 模式每次新建 partial
+    if has_custom_voice:
+        return _custom_voice_worker
+    if core_api_type == 'free':
+        return partial(_idle_worker, free_mode=True)
+    return _idle_worker
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    monkeypatch.setattr(tts_supervisor, "get_tts_worker", _fake_get_tts_worker)
+    sup = tts_supervisor.TTSWorkerSupervisor("test_lanlan")
+    yield sup
+    asyncio.run(sup.shutdown())
+
+
+def _ensure(sup, *args):
+    asyncio.run(sup.ensure(*args))
+    return sup.process.pid
+
+
+def test_switching_core_api_keeps_the_custom_voice_worker(supervisor):
+    """自定义音色始终由同一个 worker 用音频密钥合成，切换 core API 不应重启进程"""
+    pid = _ensure(supervisor, "qwen", "voice-a", "audio-key")
+    sent = []
+    put = supervisor.request_queue.put
+    supervisor.request_queue.put = lambda item: (sent.append(item), put(item))
+    assert _ensure(supervisor, "step", "voice-a", "audio-key") == pid
+    assert _ensure(supervisor, "glm", "voice-b", "audio-key") == pid
+    assert sent == [(TTS_CONFIGURE, {"voice_id": "voice-b"})]
+    assert supervisor.health()["provider"] == "glm"
+
+
+def test_free_mode_worker_is_reused_across_calls(supervisor):
+    pid = _ensure(supervisor, "free", None, "free-key")
+    assert _ensure(supervisor, "free", None, "free-key") == pid
+
+
+def test_worker_or_key_change_restarts(supervisor):
+    pid = _ensure(supervisor, "qwen", None, "core-key")
+    # 实际使用的密钥变化
+    changed_key = _ensure(supervisor, "qwen", None, "other-key")
+    assert changed_key != pid
+    # 默认 TTS -> 自定义音色：worker 函数变化
+    custom = _ensure(supervisor, "qwen", "voice-a", "other-key")
+    assert custom != changed_key
+    # 同一 worker 换成 free 模式的 partial
+    free = _ensure(supervisor, "free", None, "other-key")
+    assert free != custom
+
+
+# 模拟 worker 启动成本：加载依赖占用的内存和建立服务商连接的耗时
+STUB_WORKER_MEMORY = 32 * 1024 * 1024
+STUB_WORKER_SETUP = 0.05
+
+
+def _stub_tts_worker(request_queue, response_queue, api_key, voice_id):
+    """启动时分配内存并等待一段时间，然后发出就绪握手；打断信号 (None, None) 只清空当前合成"""
+    state = bytearray(STUB_WORKER_MEMORY)
+    state[::4096] = b"\x01" * len(state[::4096])
+    time.sleep(STUB_WORKER_SETUP)
+    response_queue.put(TTS_READY)
+    while True:
+        request_queue.get()
+
+
+def _rss_mb(pid="self"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def _session(sup):
+    """与 LLMSessionManager._start_tts_worker / end_session 相同的调用顺序，返回就绪耗时和子进程 RSS"""
+    t0 = time.perf_counter()
+    await sup.ensure("qwen", None, "core-key")
+    audio = sup.audio
+
+    async def consume():
+        while True:
+            for data in await audio.get():
+                if data == TTS_READY:
+                    sup.mark_ready()
+
+    consumer = asyncio.create_task(consume())
+    await sup.wait_ready()
+    ready = time.perf_counter() - t0
+    child_rss = _rss_mb(sup.process.pid)
+    sup.interrupt()
+    consumer.cancel()
+    return ready, child_rss, sup.process.pid
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="需要 /proc 读取 RSS")
+@pytest.mark.parametrize("cycles", [5, pytest.param(50, marks=pytest.mark.slow)])
+def test_session_cycles_time_to_ready_and_rss(monkeypatch, cycles):
+    """K 次会话开始/结束：常驻 worker 对比每个会话新建进程"""
+    monkeypatch.setattr(tts_supervisor, "get_tts_worker", lambda **kwargs: _stub_tts_worker)
+
+    async def supervised():
+        sup = tts_supervisor.TTSWorkerSupervisor("test_lanlan")
+        try:
+            return [await _session(sup) for _ in range(cycles)]
+        finally:
+            await sup.shutdown()
+
+    async def spawn_per_session():
+        results = []
+        for _ in range(cycles):
+            sup = tts_supervisor.TTSWorkerSupervisor("test_lanlan")
+            try:
+                results.append(await _session(sup))
+            finally:
+                await sup.shutdown()
+        return results
+
+    report = {}
+    for name, run in (("spawn per session", spawn_per_session), ("supervised", supervised)):
+        parent_before = _rss_mb()
+        results = asyncio.run(run())
+        ready = sorted(r[0] for r in results[1:])
+        report[name] = results
+        print(f"{name}: {cycles} cycles, {len({r[2] for r in results})} worker processes, "
+              f"first ready {results[0][0] * 1000:.1f}ms, later p50 {ready[len(ready) // 2] * 1000:.2f}ms, "
+              f"child RSS {max(r[1] for r in results):.0f}MB "
+              f"({sum(dict((r[2], r[1]) for r in results).values()):.0f}MB across all started workers), "
+              f"parent RSS {parent_before:.0f}MB -> {_rss_mb():.0f}MB")
+
+    assert len({r[2] for r in report["supervised"]}) == 1
+    assert len({r[2] for r in report["spawn per session"]}) == cycles
+    # 复用的会话不再等待进程启动
+    assert max(r[0] for r in report["supervised"][1:]) < STUB_WORKER_SETUP
+    assert min(r[0] for r in report["spawn per session"]) >= STUB_WORKER_SETUP
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from memory import vectorstore  # noqa: E402
+from memory.semantic import SemanticMemory  # noqa: E402
+from memory.vectorstore import HashingEmbeddings, LocalVectorStore  # noqa: E402
+
+
+class ArrayEmbeddings:
+    """把文本 "i" 映射为预先生成的第 i 个向量，用于构造大规模基准数据"""
+
+    def __init__(self, data):
+        self.data = data
+        self.name = f"array-{data.shape[1]}"
+
+    def embed_documents(self, texts):
+        return self.data[[int(t) for t in texts]]
+
+    def embed_query(self, text):
+        return self.data[int(text)]
+
+
+def _clustered(n, dim=64, clusters=1024, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    data = centers[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def test_add_search_delete_and_reload(tmp_path):
+    store = LocalVectorStore(tmp_path, "Origin", HashingEmbeddings())
+    ids = store.add_texts(["主人喜欢喝拿铁", "明天要去爬山", "猫咪叫小白"],
+                          metadatas=[{"event_id": "e1"}, {"event_id": "e2"}, {"event_id": "e2"}])
+    assert store.similarity_search("拿铁", k=1)[0].page_content == "主人喜欢喝拿铁"
+    assert store.delete(store.get_ids({"event_id": "e2"}))
+    assert len(store) == 1
+
+    reloaded = LocalVectorStore(tmp_path, "Origin", HashingEmbeddings())
+    assert len(reloaded) == 1
+    assert reloaded.get_ids() == [ids[0]]
+    # 预留行不算作数据，之后的写入紧接在最后一条之后
+    reloaded.add_texts(["周末看电影"])
+    assert [d.page_content for d in LocalVectorStore(tmp_path, "Origin", HashingEmbeddings()).similarity_search("看电影", k=1)] \
+        == ["周末看电影"]
+
+
+def test_delete_is_fsynced(tmp_path, monkeypatch):
+    store = LocalVectorStore(tmp_path, "Origin", HashingEmbeddings())
+    ids = store.add_texts(["一", "二"])
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(vectorstore.os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+    store.delete([ids[0]])
+    assert synced
+
+
+def test_appends_grow_capacity_geometrically(tmp_path, monkeypatch):
+    n = 5000
+    data = _clustered(n, dim=32)
+    store = LocalVectorStore(tmp_path, "Origin", ArrayEmbeddings(data))
+    remaps = []
+    real_map = store._map_vectors
+    monkeypatch.setattr(store, "_map_vectors", lambda: (remaps.append(1), real_map()))
+    for i in range(n):
+        store.add_texts([str(i)], ids=[str(i)])
+    # 单条追加 5000 次只重新映射 O(log n) 次，而不是每次都拼接数组、重建 memmap
+    assert len(remaps) <= int(np.ceil(np.log2(n / LocalVectorStore.MIN_CAPACITY))) + 2
+    assert len(store) == n
+    assert os.path.getsize(store._vectors_path) >= n * 4 * 32
+    reloaded = LocalVectorStore(tmp_path, "Origin", ArrayEmbeddings(data))
+    assert len(reloaded) == n
+    np.testing.assert_allclose(reloaded._vectors, data, atol=1e-6)
+    assert reloaded.similarity_search("4321", k=1)[0].metadata["id"] == "4321"
+
+
+def test_update_and_compaction_keep_rows_aligned(tmp_path, monkeypatch):
+    monkeypatch.setattr(LocalVectorStore, "COMPACT_MIN_DELETED", 10)
+    data = _clustered(200, dim=16)
+    store = LocalVectorStore(tmp_path, "Origin", ArrayEmbeddings(data))
+    store.add_texts([str(i) for i in range(200)], ids=[f"d{i}" for i in range(200)])
+    store.delete([f"d{i}" for i in range(0, 200, 2)])  # 触发压缩
+    assert len(store) == 100 and len(store._ids) == 100
+    for i in (1, 51, 199):
+        assert store.similarity_search(str(i), k=1)[0].metadata["id"] == f"d{i}"
+    # 同一 id 再次写入视为更新
+    store.add_texts(["0"], ids=["d1"])
+    assert store.similarity_search("0", k=1)[0].metadata["id"] == "d1"
+    assert len(LocalVectorStore(tmp_path, "Origin", ArrayEmbeddings(data))) == 100
+
+
+def _benchmark(tmp_path, n, queries=200):
+    data = _clustered(n + queries)
+    base, query_vectors = data[:n], data[n:]
+    store = LocalVectorStore(tmp_path, "Origin", ArrayEmbeddings(data))
+    t0 = time.perf_counter()
+    for start in range(0, n, 10000):
+        store.add_texts([str(i) for i in range(start, min(n, start + 10000))],
+                        ids=[str(i) for i in range(start, min(n, start + 10000))])
+    build = time.perf_counter() - t0
+
+    hits, latencies = 0, []
+    for q in query_vectors:
+        exact = set(np.argpartition(-(base @ q), 10)[:10].tolist())
+        t0 = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(q, k=10)
+        latencies.append(time.perf_counter() - t0)
+        hits += len(exact & {int(doc.metadata["id"]) for doc, _ in found})
+    recall = hits / (10 * queries)
+    p95 = sorted(latencies)[int(len(latencies) * 0.95)] * 1000
+    print(f"{n} vectors: recall@10={recall:.3f} p95={p95:.2f}ms (build {build:.1f}s, "
+          f"{len(store._centroids) if store._centroids is not None else 0} lists)")
+    return recall, p95
+
+
+@pytest.mark.parametrize("n", [10_000, 100_000])
+def test_recall_and_latency_benchmark(tmp_path, n):
+    recall, p95 = _benchmark(tmp_path, n)
+    assert recall >= 0.9
+    assert p95 < 50
+
+
+@pytest.mark.slow
+def test_recall_and_latency_benchmark_1m(tmp_path):
+    recall, p95 = _benchmark(tmp_path, 1_000_000)
+    assert recall >= 0.9
+    assert p95 < 100
+
+
+def test_semantic_memory_stores_with_a_given_summary_off_the_event_loop(tmp_path):
+    class NoCompress:
+        async def compress_history(self, messages, lanlan_name):
+            raise AssertionError("已传入摘要，不应再次压缩")
+
+    class ThreadRecordingEmbeddings(HashingEmbeddings):
+        threads = set()
+
+        def embed_documents(self, texts):
+            self.threads.add(threading.get_ident())
+            return super().embed_documents(texts)
+
+    embeddings = ThreadRecordingEmbeddings()
+    semantic = SemanticMemory(NoCompress(), persist_directory={"小八": str(tmp_path)}, embedding_function=embeddings)
+
+    async def run():
+        await semantic.store_conversation("e1", [HumanMessage([{"type": "text", "text": "我最喜欢的水果是芒果"}]),
+                                                 AIMessage([{"type": "text", "text": "记住啦"}])],
+                                          "小八", summary="主人最喜欢芒果")
+        return threading.get_ident(), await semantic.hybrid_search("芒果", "小八", with_rerank=False)
+
+    loop_thread, results = asyncio.run(run())
+    assert loop_thread not in embeddings.threads
+    contents = [doc.page_content for doc in results]
+    assert "主人最喜欢芒果" in contents
+    assert any("芒果" in c and "我最喜欢" in c for c in contents)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import ctypes
+import multiprocessing as mp
+import os
+import signal
+import time
+import urllib.request
+
+import pytest
+
+from mock_servers import MockHTTPServer, openai_handler
+from utils.worker_pool import WorkerPool
+
+INIT_DELAY = 0.1  # 模拟 worker 启动时重量级 import 的耗时
+
+
+def _init():
+    time.sleep(INIT_DELAY)
+    return {"pid": os.getpid(), "inits": 1, "handled": 0}
+
+
+def _handle(state, payload):
+    state["handled"] += 1
+    if payload.get("ignore_term"):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if payload.get("sleep"):
+        time.sleep(payload["sleep"])
+    if payload.get("fail"):
+        raise RuntimeError("boom")
+    return {"pid": state["pid"], "handled": state["handled"], "echo": payload.get("n")}
+
+
+def _one_shot(queue, task_id, payload):
+    """改动前的做法：每个任务一个新进程，每次都要重新初始化"""
+    state = _init()
+    queue.put({"task_id": task_id, "success": True, "result": _handle(state, payload)})
+
+
+class _Harness:
+    """在事件循环中读取结果队列并转交 WorkerPool.on_result，记录结果和失败回调"""
+
+    def __init__(self, size=2, **kwargs):
+        self.results = {}
+        self.failures = {}
+        self.started = []
+        self.queue = mp.Queue()
+        self.pool = WorkerPool(size, _handle, self.queue, initializer=_init,
+                               on_start=lambda tid, pid: self.started.append(tid),
+                               on_failure=lambda tid, err: self.failures.__setitem__(tid, err), **kwargs)
+
+    async def pump(self, expected, timeout=10.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self.results) + len(self.failures) < expected:
+            remaining = deadline - loop.time()
+            assert remaining > 0, "timed out waiting for results"
+            try:
+                msg = await loop.run_in_executor(None, self.queue.get, True, min(remaining, 0.2))
+            except Exception:
+                continue
+            if self.pool.on_result(msg):
+                self.results[msg["task_id"]] = msg
+
+
+def test_initializer_runs_once_per_worker():
+    async def run():
+        h = _Harness(size=2)
+        h.pool.start()
+        try:
+            for i in range(10):
+                h.pool.submit(f"t{i}", {"n": i})
+            await h.pump(10)
+        finally:
+            h.pool.shutdown()
+        pids = {msg["result"]["pid"] for msg in h.results.values()}
+        assert len(pids) == 2
+        # 同一个 worker 的状态在任务之间保留
+        assert max(msg["result"]["handled"] for msg in h.results.values()) >= 5
+        assert [msg["result"]["echo"] for _, msg in sorted(h.results.items(), key=lambda kv: int(kv[0][1:]))] \
+            == list(range(10))
+        assert h.pool.get_stats()["completed"] == 10
+    asyncio.run(run())
+
+
+def test_worker_is_recycled_after_max_tasks():
+    async def run():
+        h = _Harness(size=1, max_tasks_per_worker=3)
+        h.pool.start()
+        try:
+            for i in range(7):
+                h.pool.submit(f"t{i}", {"n": i})
+            await h.pump(7)
+        finally:
+            h.pool.shutdown()
+        assert len({msg["result"]["pid"] for msg in h.results.values()}) == 3
+        assert max(msg["result"]["handled"] for msg in h.results.values()) == 3
+        assert h.pool.get_stats()["recycled"] == 2
+    asyncio.run(run())
+
+
+def test_task_error_is_reported_and_worker_survives():
+    async def run():
+        h = _Harness(size=1)
+        h.pool.start()
+        try:
+            h.pool.submit("bad", {"fail": True})
+            h.pool.submit("good", {"n": 1})
+            await h.pump(2)
+        finally:
+            h.pool.shutdown()
+        assert h.results["bad"]["success"] is False
+        assert "boom" in h.results["bad"]["error"]
+        assert h.results["good"]["result"]["handled"] == 2
+    asyncio.run(run())
+
+
+def test_timeout_kills_only_that_worker():
+    async def run():
+        h = _Harness(size=2, task_timeout=0.5)
+        h.pool.start()
+        try:
+            h.pool.submit("slow", {"sleep": 10})
+            h.pool.submit("fast", {"n": 1})
+            await h.pump(2)
+            # 超时的 worker 被替换，池仍然有两个可用的 worker
+            h.pool.submit("after", {"n": 2})
+            await h.pump(3)
+        finally:
+            h.pool.shutdown()
+        assert "timed out" in h.failures["slow"]
+        assert set(h.results) == {"fast", "after"}
+        stats = h.pool.get_stats()
+        assert stats["timeouts"] == 1
+        assert stats["alive"] == 0  # shutdown 之后
+    asyncio.run(run())
+
+
+def test_killing_a_hung_worker_does_not_block_the_loop():
+    """超时的 worker 忽略 SIGTERM：等待它退出并 kill 的过程不占用事件循环"""
+    async def run():
+        h = _Harness(size=1, task_timeout=0.3)
+        h.pool.start()
+        gaps = []
+
+        async def ticker():
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        try:
+            h.pool.submit("hung", {"ignore_term": True, "sleep": 10})
+            await h.pump(1)
+            h.pool.submit("after", {"n": 1})
+            await h.pump(2)
+        finally:
+            tick.cancel()
+            h.pool.shutdown()
+        assert "timed out" in h.failures["hung"]
+        assert h.results["after"]["success"]
+        return max(gaps)
+
+    worst_gap = asyncio.run(run())
+    print(f"longest event loop stall while reaping a hung worker: {worst_gap * 1000:.0f}ms")
+    assert worst_gap < 0.5
+
+
+def test_cancel_all_fails_running_and_pending_tasks():
+    async def run():
+        h = _Harness(size=1)
+        h.pool.start()
+        try:
+            h.pool.submit("running", {"sleep": 10})
+            h.pool.submit("pending", {"n": 1})
+            await asyncio.sleep(0.3)
+            h.pool.cancel_all()
+            assert h.failures == {"running": "cancelled", "pending": "cancelled"}
+            assert h.pool.get_stats()["alive"] == 1
+            h.pool.submit("next", {"n": 2})
+            await h.pump(3)
+        finally:
+            h.pool.shutdown()
+        assert h.results["next"]["success"]
+    asyncio.run(run())
+
+
+def test_pool_throughput_versus_process_per_task():
+    tasks = 12
+
+    async def pooled():
+        h = _Harness(size=2)
+        h.pool.start()
+        await asyncio.sleep(INIT_DELAY * 2)  # 预热在服务启动时完成，不计入任务耗时
+        try:
+            start = time.perf_counter()
+            for i in range(tasks):
+                h.pool.submit(f"t{i}", {"n": i})
+            await h.pump(tasks)
+            return time.perf_counter() - start
+        finally:
+            h.pool.shutdown()
+
+    def per_task():
+        queue = mp.Queue()
+        start = time.perf_counter()
+        procs = []
+        for i in range(tasks):
+            # 与改动前一样同一时刻最多两个并发任务
+            if len(procs) >= 2:
+                procs.pop(0).join()
+            p = mp.Process(target=_one_shot, args=(queue, f"t{i}", {"n": i}), daemon=True)
+            p.start()
+            procs.append(p)
+        results = [queue.get(timeout=10) for _ in range(tasks)]
+        for p in procs:
+            p.join()
+        assert len(results) == tasks
+        return time.perf_counter() - start
+
+    pool_seconds = asyncio.run(pooled())
+    spawn_seconds = per_task()
+    print(f"{tasks} tasks: pool={pool_seconds * 1000:.0f}ms process-per-task={spawn_seconds * 1000:.0f}ms")
+    assert pool_seconds < spawn_seconds
+
+
+# 模拟每个任务在 worker 中残留的内存（langchain / MCP 客户端的缓存等）
+RETAINED_PER_TASK = bytes(range(256)) * 512
+
+
+def _rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _llm_init():
+    """
+    worker 从父进程 fork，继承了父进程堆中已经释放但仍然驻留的内存，
+    之后的分配会复用这些页面而不增加 RSS；先把它们归还给系统，任务残留的内存才会体现在 RSS 上
+    """
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    return _init()
+
+
+def _llm_task(state, payload):
+    """请求模拟 LLM 并在 worker 状态中残留一些内存；返回开始执行的时刻和执行后的 RSS"""
+    started = time.monotonic()
+    request = urllib.request.Request(payload["url"] + "/chat/completions", method="POST",
+                                     data=b'{"messages": [{"role": "user", "content": "hi"}]}',
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+    state.setdefault("cache", []).append(bytearray(RETAINED_PER_TASK))
+    return {"pid": state["pid"], "started": started, "rss": _rss_mb()}
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="需要 /proc 读取 RSS")
+def test_start_latency_and_worker_rss_over_1000_tasks():
+    """1000 个任务按固定间隔到达，模拟 LLM 每次响应 10ms；对比开启和关闭 worker 回收"""
+    tasks, interval = 1000, 0.006
+
+    async def run(max_tasks_per_worker):
+        async with MockHTTPServer(openai_handler(lambda messages: "好的"), delay=0.01) as llm:
+            h = _Harness(size=4, max_tasks_per_worker=max_tasks_per_worker)
+            h.pool.handler, h.pool.initializer = _llm_task, _llm_init
+            h.pool.start()
+            await asyncio.sleep(INIT_DELAY * 2)
+            submitted = {}
+
+            async def submit():
+                for i in range(tasks):
+                    submitted[f"t{i}"] = time.monotonic()
+                    h.pool.submit(f"t{i}", {"url": llm.url})
+                    await asyncio.sleep(interval)
+
+            try:
+                await asyncio.gather(submit(), h.pump(tasks, timeout=120))
+            finally:
+                h.pool.shutdown()
+        assert not h.failures and all(msg["success"] for msg in h.results.values())
+        ordered = [h.results[f"t{i}"]["result"] for i in range(tasks)]
+        latency = sorted(r["started"] - submitted[f"t{i}"] for i, r in enumerate(ordered))
+        by_pid = {}
+        for r in ordered:
+            by_pid.setdefault(r["pid"], []).append(r["rss"])
+        first_rss = max(rss[0] for rss in by_pid.values())
+        last_rss = max(rss[-1] for rss in by_pid.values())
+        # worker 从父进程 fork，RSS 的基数取决于父进程；按每个 worker 自己的增长比较
+        growth = max(rss[-1] - rss[0] for rss in by_pid.values())
+        return latency, first_rss, last_rss, growth, len(by_pid), h.pool.get_stats()["recycled"]
+
+    results = {}
+    for name, max_tasks in (("no recycling", None), ("recycle after 100", 100)):
+        latency, first_rss, last_rss, growth, workers, recycled = asyncio.run(run(max_tasks))
+        results[name] = growth
+        pct = {q: latency[min(tasks - 1, int(tasks * q))] * 1000 for q in (0.5, 0.95, 0.99)}
+        print(f"{name}: start latency p50 {pct[0.5]:.2f}ms p95 {pct[0.95]:.2f}ms p99 {pct[0.99]:.2f}ms "
+              f"max {latency[-1] * 1000:.1f}ms; worker RSS {first_rss:.0f}MB -> {last_rss:.0f}MB "
+              f"(at most +{growth:.0f}MB per worker); "
+              f"{workers} worker processes, {recycled} recycled")
+        if max_tasks:
+            assert recycled >= tasks // max_tasks - 4
+    # 不回收时每个 worker 残留约 250 个任务的内存，回收后最多 100 个
+    assert results["recycle after 100"] < results["no recycling"]
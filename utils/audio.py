@@ -1,4 +1,5 @@
 import base64
+import struct
 import wave
 import io
 from openai import OpenAI
@@ -38,3 +39,189 @@ def pcm_to_wav(pcm_data, sample_rate=16000, channels=1, sample_width=2):
 
     wav_buffer.seek(0)  # 重要：将指针重置到开始位置
     return wav_buffer.getvalue(), wav_buffer
+
+
+class StreamingResampler:
+    """
+    流式多相(polyphase) FIR 重采样器
+    跨 chunk 保留滤波器状态，chunk 边界处没有爆音；每个 chunk 的计算量只与 chunk 长度成正比，
+    工作缓冲区预先分配（仅在遇到更大的 chunk 时扩容一次）。
+
+    用法：
+        resampler = StreamingResampler(24000, 48000)
+        out = resampler.process_int16(pcm_bytes)   # bytes -> bytes
+        resampler.reset()                           # 新一段语音开始时清空状态
+    """
+
+    def __init__(self, orig_sr, target_sr, taps_per_phase=32, rolloff=0.94, kaiser_beta=8.6):
+        from math import gcd, ceil
+        g = gcd(int(orig_sr), int(target_sr))
+        self.orig_sr = int(orig_sr)
+        self.target_sr = int(target_sr)
+        self.up = self.target_sr // g
+        self.down = self.orig_sr // g
+        # 降采样时截止频率按比例降低，滤波器（以输入样点计）需要相应加长才能保持同样的过渡带和阻带衰减
+        taps_per_phase = int(ceil(taps_per_phase * max(1.0, self.down / self.up)))
+        self.taps_per_phase = taps_per_phase
+
+        # 在上采样后的采样率下设计低通滤波器，截止频率取两者中较低的奈奎斯特频率
+        num_taps = self.up * taps_per_phase
+        cutoff = rolloff * 0.5 / max(self.up, self.down)
+        n = np.arange(num_taps) - (num_taps - 1) / 2.0
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, kaiser_beta)
+        h *= self.up / h.sum()
+        # 拆分为 up 个相位，每个相位的系数按时间反序存放，便于直接与输入窗口做点积
+        phases = h.reshape(taps_per_phase, self.up).T
+        self._phases = np.ascontiguousarray(phases[:, ::-1], dtype=np.float32)
+
+        # 第 k 个输出样点位于上采样域的 offset + k*down。k 与 k+up 使用同一个相位、输入位置相差 down，
+        # 所以输出按 k mod up 分成 up 组，每组的输入窗口是一个步长为 down 的视图，可以直接做矩阵-向量乘法。
+        # 预先算好每组第一个样点相对 offset 的位置 j*down
+        self._group_pos = [j * self.down for j in range(self.up)]
+
+        self._history_len = taps_per_phase - 1
+        # 滤波器群延迟约为 taps_per_phase/2 个输入样点，flush 时补零把这部分尾音推出来
+        self._flush_len = (taps_per_phase + 1) // 2
+        self._capacity = 0
+        self._ensure_capacity(4096)
+        self._offset = 0  # 下一个输出样点相对当前 chunk 起点的位置（单位：1/up 个输入样点）
+        self.reset()
+
+    def reset(self):
+        """清空滤波器状态（被打断、丢弃当前语音时调用；正常结束时用 flush）"""
+        self._buf[:self._history_len] = 0.0
+        self._offset = 0
+
+    def _ensure_capacity(self, n):
+        """按 chunk 长度预分配所有工作缓冲区，只在遇到更长的 chunk 时扩容"""
+        if n <= self._capacity:
+            return
+        hl = self._history_len
+        buf = np.zeros(hl + n, dtype=np.float32)
+        if self._capacity:
+            buf[:hl] = self._buf[:hl]
+        self._buf = buf
+        # 输入窗口视图只在扩容时创建一次，之后每个 chunk 直接切片
+        self._windows = np.lib.stride_tricks.sliding_window_view(buf, self.taps_per_phase)
+        max_out = (n * self.up) // self.down + self.up + 1
+        self._out = np.zeros(max_out, dtype=np.float32)
+        self._out16 = np.zeros(max_out, dtype=np.int16)
+        self._capacity = n
+
+    def process(self, samples):
+        """
+        重采样一段 float32 音频（取值范围 [-1, 1]）
+
+        Returns:
+            np.ndarray: 重采样后的 float32 数组（内部缓冲区的视图，下次调用前有效）
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        n = samples.shape[0]
+        if n == 0:
+            return self._out[:0]
+        self._ensure_capacity(n)
+        self._buf[self._history_len:self._history_len + n] = samples
+        return self._filter(n)
+
+    def _filter(self, n):
+        """对已写入 _buf[history_len:history_len+n] 的 n 个输入样点做重采样，不分配新的数组"""
+        hl = self._history_len
+        buf = self._buf
+        windows = self._windows
+
+        if self.down == 1:
+            # 整数倍上采样：每个输入样点产生 up 个输出样点，一次矩阵乘法完成
+            count = n * self.up
+            out = self._out[:count]
+            np.matmul(windows[:n], self._phases.T, out=out.reshape(n, self.up))
+        else:
+            total = n * self.up
+            count = max(0, -(-(total - self._offset) // self.down))
+            out = self._out[:count]
+            up, down = self.up, self.down
+            for j in range(min(up, count)):
+                start, phase = divmod(self._offset + self._group_pos[j], up)
+                m = (count - j + up - 1) // up
+                np.matmul(windows[start:start + (m - 1) * down + 1:down], self._phases[phase], out=out[j::up])
+            self._offset = self._offset + count * self.down - total
+
+        # 保留最后 taps_per_phase-1 个输入样点作为下一个 chunk 的历史
+        buf[:hl] = buf[n:n + hl]
+        return out
+
+    def flush(self):
+        """
+        一段语音正常结束时调用：补零推出滤波器中剩余的尾音（约 taps_per_phase/2 个输入样点），然后清空状态
+
+        Returns:
+            np.ndarray: 尾音的 float32 数组（内部缓冲区的视图，下次调用前有效）
+        """
+        n = self._flush_len
+        hl = self._history_len
+        self._buf[hl:hl + n] = 0.0
+        out = self._filter(n)
+        self.reset()
+        return out
+
+    def _to_int16(self, out):
+        out *= np.float32(32768.0)
+        # np.clip 每次调用都会分配临时对象，拆成 minimum/maximum 原地完成
+        np.minimum(out, np.float32(32767.0), out=out)
+        np.maximum(out, np.float32(-32768.0), out=out)
+        out16 = self._out16[:out.shape[0]]
+        np.copyto(out16, out, casting='unsafe')
+        return out16.tobytes()
+
+    def process_int16(self, pcm_bytes):
+        """
+        重采样 PCM16 字节流，返回 PCM16 字节流
+        输入通过 frombuffer 视图直接换算写入内部缓冲区，输出在预分配的缓冲区中完成缩放和截断，
+        整个过程只有返回 bytes 时的一次拷贝。
+        """
+        pcm = np.frombuffer(pcm_bytes, dtype=np.int16)
+        n = pcm.shape[0]
+        if n == 0:
+            return b''
+        self._ensure_capacity(n)
+        hl = self._history_len
+        samples = self._buf[hl:hl + n]
+        np.copyto(samples, pcm, casting='unsafe')
+        samples *= np.float32(1.0 / 32768.0)
+        return self._to_int16(self._filter(n))
+
+    def flush_int16(self):
+        """flush 的 PCM16 版本"""
+        return self._to_int16(self.flush())
+
+
+# ---- 麦克风输入的二进制 WebSocket 帧 ----
+# 帧格式（小端）：版本(uint8) | 流类型(uint8) | 采样率(uint16) | 序号(uint32) | PCM16 负载
+# 在 start_session 时通过 audio_protocol='binary' 协商，JSON 数组格式作为兼容回退继续保留
+BINARY_FRAME_VERSION = 1
+BINARY_FRAME_HEADER = struct.Struct('<BBHI')
+BINARY_STREAM_TYPES = {1: 'audio'}
+
+
+def parse_binary_stream_frame(frame):
+    """
+    解析一个二进制输入帧
+
+    Returns:
+        dict: 与 JSON stream_data 消息同构的字典，data 为 PCM16 的 memoryview；格式不合法时返回 None
+    """
+    if len(frame) < BINARY_FRAME_HEADER.size:
+        return None
+    version, stream_type, sample_rate, seq = BINARY_FRAME_HEADER.unpack_from(frame)
+    input_type = BINARY_STREAM_TYPES.get(stream_type)
+    if version != BINARY_FRAME_VERSION or input_type is None:
+        return None
+    payload = memoryview(frame)[BINARY_FRAME_HEADER.size:]
+    if len(payload) % 2:
+        return None
+    return {
+        "action": "stream_data",
+        "input_type": input_type,
+        "data": payload,
+        "sample_rate": sample_rate,
+        "seq": seq,
+    }
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+monitor 观看端 / 字幕端的发送通道
+每个客户端一个有界队列 + 独立的写任务，广播只负责入队：慢客户端只会让自己的队列积压，
+不会拖慢其他客户端和 /sync 的读取。
+
+溢出策略按通道配置（overflow_policy），默认 by_kind，即按帧的种类处理，而不是一刀切：
+- 带 key 的帧（字幕）：同一个 key 只保留最新一帧，旧的待发帧直接移除（任何时候都如此，不只是队列满时）
+- bytes 帧（语音）：队列满时丢弃最旧的一帧语音，晚到的语音对观看端已经没有意义
+- 其他 text 帧（turn end、user_activity 等控制消息）：从不丢弃
+只有队列里全是不能丢的控制消息时才断开该客户端，作为最后手段。
+
+其他可选策略：
+- drop_oldest：不合并，队列满时丢弃最旧的一帧（不论种类），从不断开
+- coalesce：同 key 的帧合并，队列满时丢弃最旧的一帧（不论种类），从不断开
+- disconnect：不合并，队列满时直接断开，适合不能漏收任何一帧的客户端
+"""
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 每个客户端发送队列的最大长度
+CLIENT_QUEUE_SIZE = 256
+# 单次发送超过该秒数视为客户端卡死，直接断开
+CLIENT_SEND_TIMEOUT = 5.0
+
+OVERFLOW_BY_KIND = "by_kind"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (OVERFLOW_BY_KIND, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+# 这些策略下同 key 的待发帧只保留最新一帧
+_COALESCING_POLICIES = (OVERFLOW_BY_KIND, OVERFLOW_COALESCE)
+
+
+class ClientChannel:
+    """单个客户端的发送通道：有界队列 + 独立的写任务"""
+
+    def __init__(self, websocket, clients, maxsize=CLIENT_QUEUE_SIZE, send_timeout=CLIENT_SEND_TIMEOUT,
+                 overflow_policy=OVERFLOW_BY_KIND):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow_policy}")
+        self.websocket = websocket
+        self.clients = clients
+        self.maxsize = maxsize
+        self.send_timeout = send_timeout
+        self.overflow_policy = overflow_policy
+        self.queue = deque()
+        self.stats = {"sent": 0, "dropped_bytes": 0, "dropped_text": 0, "coalesced": 0}
+        self.closed = False
+        self._bytes_queued = 0
+        self._ready = asyncio.Event()
+        self.clients.add(self)
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def dropped(self):
+        return self.stats["dropped_bytes"] + self.stats["dropped_text"] + self.stats["coalesced"]
+
+    def send(self, kind, payload, key=None):
+        """
+        入队一帧（不阻塞）
+
+        Args:
+            kind: "text" 或 "bytes"，payload 为已编码好的 str / bytes，在所有客户端间共享
+            key: 合并键，by_kind / coalesce 策略下同一个键只保留最新一帧（用于字幕）
+        """
+        if self.closed:
+            return False
+        if key is not None and self.overflow_policy in _COALESCING_POLICIES:
+            self._remove_keyed(key)
+        if len(self.queue) >= self.maxsize:
+            if self.overflow_policy == OVERFLOW_DISCONNECT:
+                logger.warning(f"客户端发送队列已满，断开: {self.websocket.client}")
+                self.close()
+                return False
+            if self.overflow_policy != OVERFLOW_BY_KIND:
+                self._drop_oldest()
+            elif self._bytes_queued:
+                self._drop_oldest_bytes()
+            elif kind == "bytes":
+                # 队列里全是控制消息：丢掉这一帧语音本身
+                self.stats["dropped_bytes"] += 1
+                return False
+            else:
+                logger.warning(f"客户端发送队列已满且全部为控制消息，断开: {self.websocket.client}")
+                self.close()
+                return False
+        self.queue.append((kind, payload, key))
+        if kind == "bytes":
+            self._bytes_queued += 1
+        self._ready.set()
+        return True
+
+    def _remove_keyed(self, key):
+        """移除同 key 的待发帧；新帧排到队尾，保证它不会越过其间入队的其他消息（如字幕的 clear）"""
+        for i, frame in enumerate(self.queue):
+            if frame[2] == key:
+                del self.queue[i]
+                if frame[0] == "bytes":
+                    self._bytes_queued -= 1
+                self.stats["coalesced"] += 1
+                return
+
+    def _drop_oldest(self):
+        frame = self.queue.popleft()
+        if frame[0] == "bytes":
+            self._bytes_queued -= 1
+            self.stats["dropped_bytes"] += 1
+        else:
+            self.stats["dropped_text"] += 1
+
+    def _drop_oldest_bytes(self):
+        for i, frame in enumerate(self.queue):
+            if frame[0] == "bytes":
+                del self.queue[i]
+                self._bytes_queued -= 1
+                self.stats["dropped_bytes"] += 1
+                return
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                kind, payload, _ = self.queue.popleft()
+                if kind == "bytes":
+                    self._bytes_queued -= 1
+                    await asyncio.wait_for(self.websocket.send_bytes(payload), timeout=self.send_timeout)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(payload), timeout=self.send_timeout)
+                self.stats["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info(f"客户端发送错误，断开: {e!r}")
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.clients.discard(self)
+        self.queue.clear()
+        self._bytes_queued = 0
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        asyncio.create_task(self._close_websocket())
+
+    async def _close_websocket(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+def fan_out(clients, kind, payload, key=None):
+    """把一帧放入所有客户端的发送队列"""
+    for client in list(clients):
+        client.send(kind, payload, key)
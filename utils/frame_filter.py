@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+屏幕/摄像头帧的变化检测与缩放
+前端按固定频率上传 JPEG 帧，画面静止时大部分帧与上一帧相同。这里在完整解码和缩放之前先做廉价的变化检测：
+- 原始 base64 完全相同的帧直接丢弃（不解码）
+- 其余帧用 JPEG draft 模式按 1/8 比例解码成小灰度图，与上一次上传的帧比较，变化像素比例低于阈值则丢弃
+- 只有确实变化的帧才完整解码、缩放到 480p 并重新编码
+画面长时间静止时每隔 FRAME_KEEPALIVE_INTERVAL 秒仍上传一帧；两次上传之间至少间隔 FRAME_MIN_INTERVAL 秒。
+解码和缩放在有界线程池中执行，不占用事件循环。
+"""
+import base64
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# 变化像素比例阈值：灰度差超过 FRAME_PIXEL_DELTA 的像素占比低于该值视为静止帧
+FRAME_CHANGE_THRESHOLD = 0.01
+FRAME_PIXEL_DELTA = 10
+# 两次上传的最小间隔（秒）
+FRAME_MIN_INTERVAL = 0.5
+# 画面静止时的最长上传间隔（秒）
+FRAME_KEEPALIVE_INTERVAL = 10.0
+# 变化检测用的缩略图边长
+FRAME_THUMB_SIZE = 64
+# 上传给模型的帧高度
+FRAME_TARGET_HEIGHT = 480
+# 帧处理线程数
+FRAME_WORKERS = 2
+
+_frame_pool = None
+
+
+def get_frame_pool():
+    """所有会话共用的帧处理线程池"""
+    global _frame_pool
+    if _frame_pool is None:
+        _frame_pool = ThreadPoolExecutor(max_workers=FRAME_WORKERS, thread_name_prefix="frame")
+    return _frame_pool
+
+
+def _thumbnail(img_bytes):
+    image = Image.open(BytesIO(img_bytes))
+    # JPEG 在解码时按 1/2、1/4、1/8 缩小，远比完整解码再缩放便宜
+    image.draft('L', (FRAME_THUMB_SIZE, FRAME_THUMB_SIZE))
+    image = image.convert('L').resize((FRAME_THUMB_SIZE, FRAME_THUMB_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(image, dtype=np.int16)
+
+
+def _resize_to_target(img_bytes):
+    image = Image.open(BytesIO(img_bytes))
+    w, h = image.size
+    if h <= FRAME_TARGET_HEIGHT and image.format == 'JPEG':
+        # 已经不超过目标尺寸，原样上传，省去重新编码
+        return img_bytes
+    new_h = FRAME_TARGET_HEIGHT
+    new_w = int(w * (new_h / h))
+    image = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class FrameChangeDetector:
+    """
+    单个输入源（screen / camera）的帧过滤器
+    同一时间最多只有一帧在处理，处理期间到达的帧直接丢弃，线程池中的任务数因此有上限。
+    """
+
+    def __init__(self, threshold=FRAME_CHANGE_THRESHOLD, min_interval=FRAME_MIN_INTERVAL,
+                 keepalive_interval=FRAME_KEEPALIVE_INTERVAL):
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.keepalive_interval = keepalive_interval
+        self.busy = False
+        self._last_digest = None
+        self._last_thumb = None
+        self._last_sent = 0.0
+        self.stats = {"received": 0, "sent": 0, "dropped": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def admit(self, now=None):
+        """在解码前判断是否处理这一帧：上一帧仍在处理或距离上次上传太近时丢弃"""
+        now = time.monotonic() if now is None else now
+        self.stats["received"] += 1
+        if self.busy or now - self._last_sent < self.min_interval:
+            self.stats["dropped"] += 1
+            return False
+        self.busy = True
+        return True
+
+    def process(self, img_b64, now=None):
+        """
+        在线程池中调用：返回需要上传的 base64 JPEG，静止帧返回 None
+        调用前必须先 admit() 成功，结束后自动释放 busy 标记。
+        """
+        try:
+            now = time.monotonic() if now is None else now
+            self.stats["bytes_in"] += len(img_b64)
+            keepalive_due = now - self._last_sent >= self.keepalive_interval
+
+            digest = hashlib.blake2b(img_b64.encode('ascii'), digest_size=16).digest()
+            if digest == self._last_digest and not keepalive_due:
+                self.stats["dropped"] += 1
+                return None
+
+            img_bytes = base64.b64decode(img_b64)
+            thumb = _thumbnail(img_bytes)
+            if self._last_thumb is not None and not keepalive_due and thumb.shape == self._last_thumb.shape:
+                changed = np.count_nonzero(np.abs(thumb - self._last_thumb) > FRAME_PIXEL_DELTA) / thumb.size
+                if changed < self.threshold:
+                    self._last_digest = digest
+                    self.stats["dropped"] += 1
+                    return None
+
+            resized_b64 = base64.b64encode(_resize_to_target(img_bytes)).decode('ascii')
+            self._last_digest = digest
+            self._last_thumb = thumb
+            self._last_sent = now
+            self.stats["sent"] += 1
+            self.stats["bytes_out"] += len(resized_b64)
+            return resized_b64
+        finally:
+            self.busy = False
+
+    def reset(self):
+        """新会话开始时调用，保证第一帧一定上传"""
+        self._last_digest = None
+        self._last_thumb = None
+        self._last_sent = 0.0
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+持久化的 HTTP 重试发件箱
+用于 cross_server 同步进程向 memory_server 提交对话（/renew、/process）：
+- 请求先追加写入磁盘上的 outbox_*.jsonl，再由后台任务按顺序发送，发送成功后才从文件中移除，
+  进程崩溃或 memory_server 暂时不可用时，重启后会继续投递
+- 每条请求带有固定的 Idempotency-Key，重试不会导致对话被重复存储
+- 所有请求共用一个 aiohttp.ClientSession（连接池），每个端点单独设置超时
+- 发送在后台进行，调用方（同步进程的转发循环）不会被慢请求阻塞
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# 最多重试次数，超过后放弃该请求
+DEFAULT_MAX_ATTEMPTS = 8
+# 重试退避（秒）：base * 2^attempt，上限 max
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30.0
+# 这些 4xx 表示服务端暂时无法处理（超时、限流），与 5xx 一样重试
+RETRYABLE_4XX = frozenset({408, 429})
+
+
+class HttpOutbox:
+    """
+    顺序投递的持久化发件箱
+
+    Args:
+        path: 持久化文件路径，None 表示仅保存在内存中
+        max_attempts: 单条请求最多尝试次数
+    """
+
+    def __init__(self, path=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = str(path) if path else None
+        self.max_attempts = max_attempts
+        self._entries = deque()
+        self._session = None
+        self._sender = None
+        self._wakeup = None
+        self._background = set()
+        self._load()
+
+    # ---- 持久化 ----
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # 崩溃时可能留下写了一半的最后一行
+                        logger.warning(f"跳过损坏的发件箱记录: {self.path}")
+        except Exception as e:
+            logger.error(f"读取发件箱失败 {self.path}: {e}")
+        if self._entries:
+            logger.info(f"发件箱中有 {len(self._entries)} 条未投递的请求，将继续发送")
+
+    def _append_to_disk(self, entry):
+        if not self.path:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_disk(self):
+        if not self.path:
+            return
+        if not self._entries:
+            # 截断而非删除，避免 Windows 下文件被占用时出错
+            if os.path.exists(self.path):
+                with open(self.path, 'w', encoding='utf-8'):
+                    pass
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # ---- 对外接口 ----
+    def start(self):
+        """在事件循环中启动后台发送任务（会先投递上次遗留的请求）"""
+        self._ensure_started()
+        if self._entries:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_loop())
+
+    def enqueue(self, url, payload, timeout=60.0, idempotency_key=None):
+        """
+        持久化并排队一个 POST 请求（不等待发送结果）
+
+        Returns:
+            str: 该请求的 Idempotency-Key
+        """
+        entry = {
+            'key': idempotency_key or str(uuid.uuid4()),
+            'url': url,
+            'json': payload,
+            'timeout': timeout,
+            'attempts': 0,
+            'created': time.time(),
+        }
+        try:
+            self._append_to_disk(entry)
+        except Exception as e:
+            logger.error(f"写入发件箱失败，仅保存在内存中: {e}")
+        self._entries.append(entry)
+        self._ensure_started()
+        self._wakeup.set()
+        return entry['key']
+
+    def post_nowait(self, url, payload, timeout=1.0):
+        """尽力而为地发送一个 POST 请求：不持久化、不重试，也不阻塞调用方"""
+        self._ensure_started()
+        task = asyncio.create_task(self._post_once(url, payload, timeout))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def pending(self):
+        return len(self._entries)
+
+    async def _post_once(self, url, payload, timeout):
+        try:
+            async with self._session.post(url, json=payload,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                await resp.read()
+        except Exception as e:
+            logger.debug(f"POST {url} 失败: {e}")
+
+    # ---- 后台发送 ----
+    async def _deliver(self, entry):
+        """发送一条请求；网络错误、5xx、408、429 或返回 {"status": "error"} 时抛出异常以便重试"""
+        async with self._session.post(
+                entry['url'], json=entry['json'],
+                headers={IDEMPOTENCY_HEADER: entry['key']},
+                timeout=aiohttp.ClientTimeout(total=entry.get('timeout', 60.0))) as resp:
+            if resp.status >= 500 or resp.status in RETRYABLE_4XX:
+                raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+            if resp.status >= 400:
+                # 请求本身被拒绝（参数非法、路由不存在等），重试也不会成功：丢弃但必须留下记录
+                detail = (await resp.text())[:500]
+                logger.error(f"请求 {entry['url']} 被拒绝（HTTP {resp.status}，Idempotency-Key={entry['key']}），"
+                             f"不再重试: {detail}")
+                return
+            try:
+                body = await resp.json(content_type=None)
+            except Exception:
+                body = None
+            if isinstance(body, dict) and body.get('status') == 'error':
+                # memory_server 处理时出错（如 LLM 压缩超时）会以 HTTP 200 返回该结果并释放幂等键，
+                # 多为暂时性故障，重试才不会丢失这段对话
+                raise RuntimeError(f"💥 Conversation processing error: {body.get('message')}")
+
+    async def _send_loop(self):
+        while True:
+            if not self._entries:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 按顺序投递：同一角色的 /renew 与 /process 不能乱序
+            entry = self._entries[0]
+            try:
+                await self._deliver(entry)
+                done = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                entry['attempts'] = entry.get('attempts', 0) + 1
+                done = entry['attempts'] >= self.max_attempts
+                if done:
+                    logger.error(f"请求 {entry['url']} 重试 {entry['attempts']} 次后仍失败，放弃: {e}")
+                else:
+                    delay = min(RETRY_BACKOFF_BASE * (2 ** entry['attempts']), RETRY_BACKOFF_MAX)
+                    logger.warning(f"请求 {entry['url']} 失败（第 {entry['attempts']} 次），{delay:.1f}s 后重试: {e}")
+            if done:
+                self._entries.popleft()
+            try:
+                self._rewrite_disk()
+            except Exception as e:
+                logger.error(f"更新发件箱文件失败: {e}")
+            if not done:
+                await asyncio.sleep(delay)
+
+    async def close(self, drain_timeout=5.0):
+        """关闭前尽量把剩余请求发出去，未发出的保留在磁盘上，下次启动时继续投递"""
+        if self._sender is not None and self._entries:
+            deadline = time.monotonic() + drain_timeout
+            while self._entries and time.monotonic() < deadline and not self._sender.done():
+                await asyncio.sleep(0.05)
+        if self._sender is not None:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except (asyncio.CancelledError, Exception):
+                pass
+        for task in list(self._background):
+            task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 客户端注册表
+按 (base_url, api_key, model, 参数) 复用 ChatOpenAI / AsyncOpenAI 实例，
+避免每次调用都新建客户端、丢弃 HTTP 连接池并重新进行 TLS 握手。
+核心配置快照（get_core_config）发生变化时清空注册表，保持热重载语义。
+每个 ChatOpenAI 使用注册表自己创建的 httpx 客户端（langchain 默认的 httpx 客户端是进程内共享的，不能单独关闭），
+客户端被淘汰（配置变化或 LRU）时不会立即关闭连接池：其他协程可能仍在等待用它发出的请求，
+淘汰的客户端先进入待关闭列表，超过 RETIRE_GRACE 秒后再关闭。
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 注册表中最多保留的客户端数量（LRU 淘汰）
+MAX_CLIENTS = 32
+# 被淘汰的客户端延迟关闭的秒数，与 openai 客户端的默认请求超时一致，进行中的请求可以正常完成
+RETIRE_GRACE = 600.0
+
+_clients = OrderedDict()  # {key: (client, [需要关闭的资源])}
+_retired = []  # [(淘汰时刻, entry)]，到期后关闭
+_closing = set()  # 正在执行的异步关闭任务，保持引用直到完成
+_lock = threading.Lock()
+_config_snapshot = None
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'config_resets': 0}
+
+
+def _current_config():
+    from config import get_core_config
+    return get_core_config()
+
+
+def _close_resource(resource):
+    """关闭一个 httpx / openai 客户端；异步客户端在当前事件循环中关闭，没有事件循环时同步执行"""
+    close = getattr(resource, 'aclose', None) or getattr(resource, 'close', None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            try:
+                task = asyncio.get_running_loop().create_task(result)
+            except RuntimeError:
+                asyncio.run(result)
+            else:
+                _closing.add(task)
+                task.add_done_callback(_closing.discard)
+    except Exception as e:
+        logger.debug(f"关闭LLM客户端失败: {e}")
+
+
+def _close_client(entry):
+    """释放被淘汰的客户端持有的连接池"""
+    _, resources = entry
+    for resource in resources:
+        _close_resource(resource)
+
+
+def _retire_locked(entry):
+    """淘汰一个客户端：RETIRE_GRACE 秒后才关闭，期间仍持有它的调用方可以继续使用"""
+    _stats['evictions'] += 1
+    _retired.append((time.monotonic(), entry))
+
+
+def _sweep_retired_locked():
+    """关闭淘汰时间已超过 RETIRE_GRACE 的客户端"""
+    now = time.monotonic()
+    while _retired and now - _retired[0][0] >= RETIRE_GRACE:
+        _, entry = _retired.pop(0)
+        _close_client(entry)
+
+
+def _check_config_locked():
+    """配置快照变化（对象身份不同）时淘汰全部客户端"""
+    global _config_snapshot
+    snapshot = _current_config()
+    if snapshot is not _config_snapshot:
+        if _config_snapshot is not None and _clients:
+            _stats['config_resets'] += 1
+            for entry in _clients.values():
+                _retire_locked(entry)
+            _clients.clear()
+        _config_snapshot = snapshot
+
+
+def _get_or_create(key, factory):
+    """factory 返回 (client, resources)，resources 为淘汰时需要关闭的对象"""
+    with _lock:
+        _check_config_locked()
+        _sweep_retired_locked()
+        entry = _clients.get(key)
+        if entry is not None:
+            _clients.move_to_end(key)
+            _stats['hits'] += 1
+            return entry[0]
+        _stats['misses'] += 1
+        entry = factory()
+        _clients[key] = entry
+        while len(_clients) > MAX_CLIENTS:
+            _, old = _clients.popitem(last=False)
+            _retire_locked(old)
+        _sweep_retired_locked()
+        return entry[0]
+
+
+def _freeze_kwargs(kwargs):
+    return json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def get_chat_llm(model, base_url, api_key, temperature=None, extra_body=None, **kwargs):
+    """
+    获取（或复用）一个 langchain ChatOpenAI 实例
+
+    Args:
+        model: 模型名
+        base_url: OpenAI兼容接口地址
+        api_key: API Key
+        temperature: 采样温度
+        extra_body: 额外请求体，如 {"enable_thinking": False}
+        **kwargs: 其他 ChatOpenAI 构造参数
+    """
+    key = ('chat', base_url, api_key, model, temperature, _freeze_kwargs(extra_body), _freeze_kwargs(kwargs))
+
+    def factory():
+        import httpx
+        from langchain_openai import ChatOpenAI
+        from openai import DEFAULT_TIMEOUT
+        http_client = httpx.Client(timeout=DEFAULT_TIMEOUT)
+        http_async_client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT)
+        params = dict(model=model, base_url=base_url, api_key=api_key, extra_body=extra_body,
+                      http_client=http_client, http_async_client=http_async_client, **kwargs)
+        if temperature is not None:
+            params['temperature'] = temperature
+        return ChatOpenAI(**params), [http_client, http_async_client]
+
+    return _get_or_create(key, factory)
+
+
+def get_async_openai(base_url, api_key):
+    """获取（或复用）一个 openai.AsyncOpenAI 客户端"""
+    key = ('async_openai', base_url, api_key)
+
+    def factory():
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        return client, [client]
+
+    return _get_or_create(key, factory)
+
+
+def get_client_pool_stats():
+    """返回注册表统计信息：命中、未命中、淘汰次数及当前客户端列表"""
+    with _lock:
+        return {
+            **_stats,
+            'size': len(_clients),
+            'retired': len(_retired),
+            'max_size': MAX_CLIENTS,
+            'clients': [
+                {'kind': key[0], 'base_url': key[1], 'model': key[3] if key[0] == 'chat' else None}
+                for key in _clients
+            ],
+        }
+
+
+def clear_clients():
+    """清空注册表并立即关闭全部客户端，包括仍在宽限期内的（例如进程退出前）"""
+    with _lock:
+        for entry in _clients.values():
+            _close_client(entry)
+        _stats['evictions'] += len(_clients)
+        _clients.clear()
+        for _, entry in _retired:
+            _close_client(entry)
+        _retired.clear()
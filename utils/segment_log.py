@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+追加写分段日志存储
+用于近期对话记录（recent_*.json）：每次更新只向 .log 追加一行 JSON，
+定期压缩（compaction）回 recent_*.json 快照，避免每轮都整体读写 JSON 文件。
+
+磁盘布局：
+    recent_{name}.json  —— 快照，格式与旧版完全相同（messages_to_dict 的列表），
+                           旧文件即为初始快照，无需额外迁移
+    recent_{name}.log   —— 追加日志，每行一条记录：
+                           {"op": "append", "messages": [...]}
+                           {"op": "replace", "messages": [...]}
+                           记录可带 "key"（请求的幂等键），压缩后最近的幂等键以
+                           {"op": "keys", "keys": [...]} 保留在新日志的第一行
+"""
+import json
+import os
+import time
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 日志记录条数达到该值时压缩回快照
+DEFAULT_COMPACT_RECORDS = 64
+# 日志文件大小达到该值时压缩回快照（字节）
+DEFAULT_COMPACT_BYTES = 512 * 1024
+# 攒够多少条记录或间隔多少秒执行一次 fsync
+DEFAULT_FSYNC_RECORDS = 8
+DEFAULT_FSYNC_INTERVAL = 1.0
+# 记住最近多少个已应用的幂等键
+APPLIED_KEYS_LIMIT = 256
+
+
+def log_path_for(snapshot_path):
+    """由快照路径 recent_xxx.json 推导日志路径 recent_xxx.log"""
+    base, ext = os.path.splitext(str(snapshot_path))
+    return base + '.log'
+
+
+def _replay(snapshot_path, log_path):
+    """读取快照并重放日志，返回 (消息字典列表, 有效日志记录数, 已应用的幂等键列表)"""
+    messages = []
+    keys = []
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, encoding='utf-8') as f:
+            messages = json.load(f)
+
+    records = 0
+    if os.path.exists(log_path):
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的最后一行，直接忽略
+                    logger.warning(f"跳过损坏的日志记录: {log_path}")
+                    continue
+                op = record.get('op')
+                if op == 'keys':
+                    keys.extend(record.get('keys', []))
+                    continue
+                if op == 'append':
+                    messages.extend(record.get('messages', []))
+                elif op == 'replace':
+                    messages = list(record.get('messages', []))
+                else:
+                    continue
+                if record.get('key'):
+                    keys.append(record['key'])
+                records += 1
+    return messages, records, keys
+
+
+def read_materialized(snapshot_path):
+    """
+    读取快照+日志合并后的完整内容（供记忆浏览器等只读场景使用）
+
+    Returns:
+        list: messages_to_dict 格式的消息列表
+    """
+    messages, _, _ = _replay(str(snapshot_path), log_path_for(snapshot_path))
+    return messages
+
+
+def list_snapshots(directory, pattern='recent*.json'):
+    """
+    列出目录下的近期记录快照文件名
+    只有日志、尚未生成快照的记录也会以对应的 .json 名称列出
+    """
+    directory = Path(directory)
+    names = {p.name for p in directory.glob(pattern)}
+    log_pattern = os.path.splitext(pattern)[0] + '.log'
+    for p in directory.glob(log_pattern):
+        names.add(p.stem + '.json')
+    return sorted(names)
+
+
+def snapshot_exists(snapshot_path):
+    """快照或其日志任一存在即视为该记录存在"""
+    return os.path.exists(snapshot_path) or os.path.exists(log_path_for(snapshot_path))
+
+
+def write_snapshot(snapshot_path, messages, indent=2, keys=None):
+    """
+    原子地写入快照并清空对应的日志
+    先写临时文件再 os.replace，避免写到一半崩溃导致文件损坏
+    keys: 需要在新日志中保留的幂等键
+    """
+    snapshot_path = str(snapshot_path)
+    Path(snapshot_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(messages, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+    # 截断而非删除：其他进程可能仍以追加模式打开着日志（Windows 下无法删除已打开的文件）
+    log_path = log_path_for(snapshot_path)
+    if keys or os.path.exists(log_path):
+        with open(log_path, 'w', encoding='utf-8') as f:
+            if keys:
+                f.write(json.dumps({'op': 'keys', 'keys': list(keys)}, ensure_ascii=False) + '\n')
+
+
+class SegmentLogStore:
+    """
+    单个角色的近期记录存储：内存中保存完整列表，磁盘上为快照+追加日志
+
+    读取直接返回内存数据；若快照被外部修改（如记忆浏览器保存），会在下次访问时自动重新加载。
+    """
+
+    def __init__(self, snapshot_path,
+                 compact_records=DEFAULT_COMPACT_RECORDS,
+                 compact_bytes=DEFAULT_COMPACT_BYTES,
+                 fsync_records=DEFAULT_FSYNC_RECORDS,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.snapshot_path = str(snapshot_path)
+        self.log_path = log_path_for(self.snapshot_path)
+        self.compact_records = compact_records
+        self.compact_bytes = compact_bytes
+        self.fsync_records = fsync_records
+        self.fsync_interval = fsync_interval
+
+        self._messages = []
+        self._records = 0
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self._log_file = None
+        self._signature = None
+        self._applied = OrderedDict()
+        # 每次从磁盘重新加载时递增，调用方可据此判断是否需要重建缓存
+        self.generation = 0
+        self._load()
+        if self._signature is None:
+            # 新角色（或只剩日志的崩溃现场）立即落一份快照，
+            # 使按 recent*.json 浏览的接口从一开始就能看到该角色
+            self.compact()
+
+    def _stat_signature(self):
+        """快照文件的 (inode, mtime, size)，用于检测外部修改"""
+        try:
+            st = os.stat(self.snapshot_path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        self._close_log()
+        try:
+            self._messages, self._records, keys = _replay(self.snapshot_path, self.log_path)
+        except Exception as e:
+            logger.error(f"读取近期记录失败 {self.snapshot_path}: {e}")
+            self._messages, self._records, keys = [], 0, []
+        self._applied = OrderedDict()
+        for key in keys:
+            self._remember(key)
+        self._signature = self._stat_signature()
+        self.generation += 1
+
+    def _refresh_if_stale(self):
+        if self._stat_signature() != self._signature:
+            logger.info(f"检测到近期记录被外部修改，重新加载: {self.snapshot_path}")
+            self._load()
+
+    def _open_log(self):
+        if self._log_file is None:
+            Path(self.log_path).parent.mkdir(parents=True, exist_ok=True)
+            torn = False
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path):
+                with open(self.log_path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b'\n'
+            self._log_file = open(self.log_path, 'a', encoding='utf-8')
+            if torn:
+                # 上次崩溃留下的残行没有换行符，先补上，避免新记录被拼接到残行后一并丢弃
+                self._log_file.write('\n')
+        return self._log_file
+
+    def _close_log(self):
+        if self._log_file is not None:
+            try:
+                self._sync()
+                self._log_file.close()
+            except Exception as e:
+                logger.warning(f"关闭日志文件失败 {self.log_path}: {e}")
+            self._log_file = None
+
+    def _sync(self):
+        if self._log_file is not None and self._unsynced:
+            self._log_file.flush()
+            os.fsync(self._log_file.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+
+    def _remember(self, key):
+        self._applied[key] = None
+        self._applied.move_to_end(key)
+        while len(self._applied) > APPLIED_KEYS_LIMIT:
+            self._applied.popitem(last=False)
+
+    def _write_record(self, op, messages, key=None):
+        record = {'op': op, 'messages': messages}
+        if key:
+            record['key'] = key
+            self._remember(key)
+        f = self._open_log()
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        # 每条都 flush，保证其他进程（记忆浏览器）能立即读到；fsync 批量进行
+        f.flush()
+        self._records += 1
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_records
+                or time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._sync()
+        if self._records >= self.compact_records or f.tell() >= self.compact_bytes:
+            self.compact()
+
+    def get(self):
+        """返回当前完整消息字典列表（请勿原地修改）"""
+        self._refresh_if_stale()
+        return self._messages
+
+    def has_applied(self, key):
+        """幂等键为 key 的更新是否已经写入（与该更新记录在同一行中落盘）"""
+        self._refresh_if_stale()
+        return key in self._applied
+
+    def append(self, messages, key=None):
+        """追加消息；key 为该次更新的幂等键，随记录一起写入"""
+        if not messages and not key:
+            return
+        self._refresh_if_stale()
+        messages = list(messages)
+        self._messages.extend(messages)
+        self._write_record('append', messages, key)
+
+    def replace(self, messages, key=None):
+        """用新列表整体替换当前消息"""
+        self._refresh_if_stale()
+        self._messages = list(messages)
+        self._write_record('replace', self._messages, key)
+
+    def compact(self):
+        """将内存中的完整内容写回快照，并清空日志"""
+        self._close_log()
+        write_snapshot(self.snapshot_path, self._messages, keys=list(self._applied))
+        self._records = 0
+        self._signature = self._stat_signature()
+
+    def flush(self):
+        """立即 fsync 尚未落盘的日志记录"""
+        self._sync()
+
+    def close(self):
+        """关闭前压缩，使快照保持最新"""
+        if self._records:
+            self.compact()
+        else:
+            self._close_log()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+TTS worker -> 会话管理器 的音频通道
+音频负载通过 multiprocessing.shared_memory 上的单生产者/单消费者环形缓冲传递（不经过 pickle），
+每写入一块音频通过管道发送一个唤醒帧；消费端用一个线程阻塞读取管道并桥接到 asyncio，
+不再需要 empty() + sleep(0.01) 轮询。非音频的控制消息（数量很少）序列化后直接经同一管道发送。
+音频与控制消息走不同的通道，为保持 worker 放入的顺序，每个帧都附带发送时环形缓冲的 write_pos：
+消费端只读到已收到的帧中最大的 write_pos 为止，控制消息之前只交付其 write_pos 之前的音频。
+这样生产者在某条控制消息之后写入的音频，不会在该控制消息的帧到达之前被交付。
+
+环形缓冲布局：
+    [0:8)   write_pos (uint64，只由生产者写)
+    [8:16)  read_pos  (uint64，只由消费者写)
+    [16:24) dropped   (uint64，缓冲区满时丢弃的块数)
+    [64:)   数据区，每条记录为 uint32 长度 + 负载；尾部放不下时写入 WRAP 标记并回到开头
+"""
+import asyncio
+import logging
+import pickle
+import struct
+import threading
+import time
+from collections import deque
+from multiprocessing import Pipe
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEADER_SIZE = 64
+RECORD_HEADER = struct.Struct('<I')
+# 管道帧：发送时的 write_pos (uint64)，控制消息帧之后再跟 pickle 负载
+FRAME_HEADER = struct.Struct('<Q')
+WRAP_MARKER = 0xFFFFFFFF
+# 默认 4MB，约为 48kHz/16bit 单声道 40 秒音频
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+# 缓冲区满时生产者最多等待的秒数，超时后丢弃该音频块
+DEFAULT_WRITE_TIMEOUT = 1.0
+
+
+class AudioRingBuffer:
+    """基于共享内存的 SPSC 环形缓冲"""
+
+    def __init__(self, name=None, capacity=DEFAULT_CAPACITY, create=True):
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+            self.shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        else:
+            # 子进程与父进程共用同一个资源追踪器，只由创建方负责 unlink
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.capacity = self.shm.size - HEADER_SIZE
+        self._owner = create
+        # 计数器用对齐的 uint64 视图读写，保证单次存取不会被撕裂
+        self._counters = np.ndarray((3,), dtype=np.uint64, buffer=self.shm.buf[:24])
+        self._data = self.shm.buf[HEADER_SIZE:]
+
+    # ---- 生产者 ----
+    def write(self, payload, timeout=DEFAULT_WRITE_TIMEOUT):
+        """写入一块数据；缓冲区满时等待消费者读取，超时仍无空间则丢弃并返回False"""
+        size = len(payload)
+        need = RECORD_HEADER.size + size
+        if need > self.capacity // 2:
+            raise ValueError(f"音频块过大: {size} bytes")
+        write_pos = int(self._counters[0])
+        offset = write_pos % self.capacity
+        tail = self.capacity - offset
+        pad = tail if tail < need else 0
+        deadline = None
+        while write_pos + pad + need - int(self._counters[1]) > self.capacity:
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                self._counters[2] += 1
+                return False
+            time.sleep(0.002)
+        if pad:
+            if tail >= RECORD_HEADER.size:
+                RECORD_HEADER.pack_into(self._data, offset, WRAP_MARKER)
+            offset = 0
+        RECORD_HEADER.pack_into(self._data, offset, size)
+        self._data[offset + RECORD_HEADER.size:offset + need] = payload
+        # 先写数据，最后发布新的 write_pos
+        self._counters[0] = write_pos + pad + need
+        return True
+
+    # ---- 消费者 ----
+    @property
+    def write_pos(self):
+        return int(self._counters[0])
+
+    def read_all(self, until=None):
+        """读出当前所有可读的数据块；指定 until 时只读到该位置（此前某一时刻的 write_pos）为止"""
+        chunks = []
+        write_pos = int(self._counters[0])
+        if until is not None:
+            write_pos = min(write_pos, until)
+        read_pos = int(self._counters[1])
+        while read_pos < write_pos:
+            offset = read_pos % self.capacity
+            tail = self.capacity - offset
+            if tail < RECORD_HEADER.size:
+                read_pos += tail
+                continue
+            size, = RECORD_HEADER.unpack_from(self._data, offset)
+            if size == WRAP_MARKER:
+                read_pos += tail
+                continue
+            start = offset + RECORD_HEADER.size
+            chunks.append(bytes(self._data[start:start + size]))
+            read_pos += RECORD_HEADER.size + size
+        self._counters[1] = read_pos
+        return chunks
+
+    def clear(self):
+        """丢弃所有未读数据（消费者调用，用于打断）"""
+        self._counters[1] = self._counters[0]
+
+    @property
+    def dropped(self):
+        return int(self._counters[2])
+
+    def close(self):
+        # 释放对共享内存的引用后才能关闭
+        self._counters = None
+        self._data.release()
+        self.shm.close()
+        if self._owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class TTSResponseChannel:
+    """
+    TTS worker 一侧使用的响应通道，接口与 multiprocessing.Queue.put 兼容：
+    bytes 音频写入共享内存环形缓冲并发送唤醒信号，其他对象作为控制消息经管道发送。
+    可以直接作为 Process 参数传给子进程。
+    """
+
+    def __init__(self, ring_name, wake_conn):
+        self.ring_name = ring_name
+        self.wake_conn = wake_conn
+        self._ring = None
+
+    def __getstate__(self):
+        return {'ring_name': self.ring_name, 'wake_conn': self.wake_conn}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ring = None
+
+    def put(self, item):
+        if self._ring is None:
+            self._ring = AudioRingBuffer(name=self.ring_name, create=False)
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            if self._ring.write(item):
+                self.wake_conn.send_bytes(FRAME_HEADER.pack(self._ring.write_pos))
+            else:
+                logger.warning("TTS音频环形缓冲已满，丢弃一个音频块")
+        else:
+            # 记录此刻的 write_pos：消费端在交付这条控制消息之前，只交付在它之前写入的音频
+            self.wake_conn.send_bytes(FRAME_HEADER.pack(self._ring.write_pos) + pickle.dumps(item))
+
+    def close(self):
+        """释放对共享内存的映射（不会 unlink，环形缓冲由接收端负责销毁）"""
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+
+class TTSAudioReceiver:
+    """
+    会话管理器一侧：持有环形缓冲和唤醒管道
+    后台线程阻塞等待唤醒信号，通过 call_soon_threadsafe 唤醒 asyncio 中的消费者。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.ring = AudioRingBuffer(capacity=capacity)
+        self._wake_recv, self._wake_send = Pipe(duplex=False)
+        self._controls = deque()
+        # 已收到的帧中最大的 write_pos，消费端不会读到它之后的音频（只由唤醒线程写）
+        self._seen_pos = 0
+        self._event = None
+        self._loop = None
+        self._thread = None
+        self._closed = False
+
+    def channel(self):
+        """生成传给 worker 进程的响应通道"""
+        return TTSResponseChannel(self.ring.name, self._wake_send)
+
+    def start(self):
+        """在事件循环中启动唤醒桥接线程"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._thread = threading.Thread(target=self._wake_loop, daemon=True)
+        self._thread.start()
+
+    def _recv_frame(self):
+        frame = self._wake_recv.recv_bytes()
+        if len(frame) < FRAME_HEADER.size:
+            # close() 发出的退出信号
+            return
+        write_pos, = FRAME_HEADER.unpack_from(frame)
+        if len(frame) > FRAME_HEADER.size:
+            try:
+                self._controls.append((write_pos, pickle.loads(frame[FRAME_HEADER.size:])))
+            except Exception as e:
+                logger.warning(f"无法解析TTS控制消息: {e}")
+        # 先登记控制消息再推进可读位置，消费端看到新位置时一定也能看到此前的控制消息
+        if write_pos > self._seen_pos:
+            self._seen_pos = write_pos
+
+    def _wake_loop(self):
+        while not self._closed:
+            try:
+                self._recv_frame()
+                # 合并同一时刻积压的多个唤醒信号
+                while self._wake_recv.poll():
+                    self._recv_frame()
+            except (EOFError, OSError):
+                break
+            if self._closed:
+                break
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                break
+
+    def _collect(self):
+        """按 worker 放入的顺序取出音频和控制消息"""
+        # 先取可读位置再取控制消息：之后才到达的控制消息的 write_pos 不小于该位置，顺序不会颠倒
+        seen_pos = self._seen_pos
+        items = []
+        while self._controls:
+            write_pos, control = self._controls.popleft()
+            items.extend(self.ring.read_all(until=write_pos))
+            items.append(control)
+        items.extend(self.ring.read_all(until=seen_pos))
+        return items
+
+    async def get(self):
+        """等待并返回一批消息：音频为 bytes，控制消息为 worker 放入的原始对象"""
+        while True:
+            items = self._collect()
+            if items:
+                return items
+            self._event.clear()
+            # clear 之后再检查一次，避免错过在两步之间写入的数据
+            items = self._collect()
+            if items:
+                return items
+            await self._event.wait()
+
+    def clear(self):
+        """丢弃尚未发送的音频（打断时使用）"""
+        self.ring.clear()
+
+    @property
+    def dropped(self):
+        return self.ring.dropped
+
+    def close(self):
+        self._closed = True
+        try:
+            # 发送一个信号让桥接线程退出阻塞
+            self._wake_send.send_bytes(b'')
+        except Exception:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        for conn in (self._wake_recv, self._wake_send):
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.ring.close()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+预先启动（prefork）的任务进程池
+每个 worker 进程启动时执行一次 initializer（完成重量级 import 和对象构造），之后循环处理任务，
+避免每个任务都重新启动解释器、重新导入 langchain / MCP 客户端。
+
+- 每个 worker 有独立的任务队列，父进程始终知道哪个 worker 在执行哪个任务，便于超时和取消时精确终止
+- 结果写入调用方提供的共享结果队列，消息中带有 _worker 字段，由调用方转交 WorkerPool.on_result
+- 可选：worker 处理 N 个任务后自动退出并由新进程替换，限制内存增长
+- 所有父进程侧方法都必须在事件循环线程中调用
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def _pool_worker_main(worker_id, inbox, result_queue, initializer, handler, max_tasks):
+    """worker 进程入口"""
+    try:
+        state = initializer() if initializer else None
+    except Exception as e:
+        logger.error(f"worker {worker_id} 初始化失败: {e}")
+        state = None
+    done = 0
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        task_id, payload = item
+        try:
+            msg = {"task_id": task_id, "success": True, "result": handler(state, payload)}
+        except Exception as e:
+            msg = {"task_id": task_id, "success": False, "error": str(e)}
+        done += 1
+        recycle = bool(max_tasks and done >= max_tasks)
+        msg["_worker"] = worker_id
+        msg["_recycle"] = recycle
+        result_queue.put(msg)
+        if recycle:
+            break
+
+
+class _Worker:
+    __slots__ = ("id", "proc", "inbox", "task_id", "timer")
+
+    def __init__(self, worker_id, proc, inbox):
+        self.id = worker_id
+        self.proc = proc
+        self.inbox = inbox
+        self.task_id = None
+        self.timer = None
+
+
+class WorkerPool:
+    """
+    固定大小的任务进程池
+
+    Args:
+        size: worker 进程数
+        handler: handler(state, payload) -> result，在 worker 进程中执行（需可 pickle 的顶层函数）
+        result_queue: 结果队列（multiprocessing.Queue）
+        initializer: initializer() -> state，worker 启动时执行一次
+        max_tasks_per_worker: 每个 worker 处理多少个任务后回收，None 表示不回收
+        task_timeout: 单个任务超时秒数，超时后终止该 worker 并替换，None 表示不限
+        on_start: on_start(task_id, pid)，任务被分派给 worker 时调用
+        on_failure: on_failure(task_id, error)，任务因超时/取消失败时调用
+    """
+
+    def __init__(self, size, handler, result_queue, initializer=None,
+                 max_tasks_per_worker=None, task_timeout=None, on_start=None, on_failure=None):
+        self.size = size
+        self.handler = handler
+        self.result_queue = result_queue
+        self.initializer = initializer
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.task_timeout = task_timeout
+        self.on_start = on_start
+        self.on_failure = on_failure
+        self._workers = {}
+        self._idle = deque()
+        self._pending = deque()
+        self._ids = itertools.count(1)
+        self._reapers = set()  # 正在后台线程中等待退出的 worker
+        self._closed = False
+        self.stats = {"submitted": 0, "completed": 0, "timeouts": 0, "cancelled": 0, "recycled": 0, "crashed": 0}
+
+    # ---- worker 管理 ----
+    def _spawn_worker(self):
+        worker_id = next(self._ids)
+        inbox = mp.Queue()
+        proc = mp.Process(
+            target=_pool_worker_main,
+            args=(worker_id, inbox, self.result_queue, self.initializer, self.handler, self.max_tasks_per_worker),
+            daemon=True,
+        )
+        proc.start()
+        worker = _Worker(worker_id, proc, inbox)
+        self._workers[worker_id] = worker
+        self._idle.append(worker_id)
+        return worker
+
+    def _retire(self, worker, kill=False):
+        """移除一个 worker；kill=True 时强制终止"""
+        self._workers.pop(worker.id, None)
+        try:
+            self._idle.remove(worker.id)
+        except ValueError:
+            pass
+        if worker.timer is not None:
+            worker.timer.cancel()
+            worker.timer = None
+        try:
+            if kill and worker.proc.is_alive():
+                worker.proc.terminate()
+        except Exception as e:
+            logger.warning(f"终止worker {worker.id} 失败: {e}")
+        # join 最多阻塞 1 秒（卡死的 worker 还要再 kill），在事件循环中时交给线程执行
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._reap(worker)
+            return
+        task = loop.create_task(asyncio.to_thread(self._reap, worker))
+        self._reapers.add(task)
+        task.add_done_callback(self._reapers.discard)
+
+    @staticmethod
+    def _reap(worker):
+        try:
+            worker.proc.join(timeout=1.0)
+            if worker.proc.is_alive():
+                worker.proc.kill()
+                worker.proc.join(timeout=1.0)
+        except Exception as e:
+            logger.warning(f"回收worker {worker.id} 失败: {e}")
+        try:
+            worker.inbox.close()
+        except Exception:
+            pass
+
+    def _replace(self, worker, kill=False):
+        self._retire(worker, kill=kill)
+        if not self._closed:
+            self._spawn_worker()
+
+    def start(self):
+        """预先启动全部 worker"""
+        while len(self._workers) < self.size:
+            self._spawn_worker()
+
+    # ---- 任务调度 ----
+    def submit(self, task_id, payload):
+        """提交任务；没有空闲 worker 时排队"""
+        self.stats["submitted"] += 1
+        self._pending.append((task_id, payload))
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._pending and self._idle:
+            worker = self._workers[self._idle.popleft()]
+            if not worker.proc.is_alive():
+                self.stats["crashed"] += 1
+                self._replace(worker)
+                continue
+            task_id, payload = self._pending.popleft()
+            worker.task_id = task_id
+            worker.inbox.put((task_id, payload))
+            if self.task_timeout:
+                worker.timer = asyncio.get_running_loop().call_later(
+                    self.task_timeout, self._expire, worker.id, task_id)
+            self._callback(self.on_start, task_id, worker.proc.pid)
+
+    def _expire(self, worker_id, task_id):
+        worker = self._workers.get(worker_id)
+        if worker is None or worker.task_id != task_id:
+            return
+        self.stats["timeouts"] += 1
+        worker.timer = None
+        self._replace(worker, kill=True)
+        self._callback(self.on_failure, task_id, f"task timed out after {self.task_timeout}s")
+        self._dispatch()
+
+    @staticmethod
+    def _callback(callback, *args):
+        if callback is not None:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"WorkerPool 回调出错: {e}")
+
+    def on_result(self, msg):
+        """
+        处理 worker 发回的结果消息中的池状态
+
+        Returns:
+            bool: 结果是否有效（来自已被终止的 worker 的迟到结果返回 False）
+        """
+        worker = self._workers.get(msg.get("_worker"))
+        if worker is None or worker.task_id != msg.get("task_id"):
+            return False
+        self.stats["completed"] += 1
+        if worker.timer is not None:
+            worker.timer.cancel()
+            worker.timer = None
+        worker.task_id = None
+        if msg.get("_recycle"):
+            self.stats["recycled"] += 1
+            self._replace(worker)
+        else:
+            self._idle.append(worker.id)
+        self._dispatch()
+        return True
+
+    def cancel_all(self):
+        """取消所有排队和正在执行的任务（终止忙碌的 worker 并替换）"""
+        for task_id, _ in self._pending:
+            self.stats["cancelled"] += 1
+            self._callback(self.on_failure, task_id, "cancelled")
+        self._pending.clear()
+        for worker in list(self._workers.values()):
+            if worker.task_id is not None:
+                task_id = worker.task_id
+                self.stats["cancelled"] += 1
+                self._replace(worker, kill=True)
+                self._callback(self.on_failure, task_id, "cancelled")
+
+    def shutdown(self):
+        """关闭进程池"""
+        self._closed = True
+        self._pending.clear()
+        for worker in list(self._workers.values()):
+            try:
+                worker.inbox.put_nowait(None)
+            except Exception:
+                pass
+            self._retire(worker, kill=worker.task_id is not None)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "size": self.size,
+            "alive": len(self._workers),
+            "idle": len(self._idle),
+            "busy": sum(1 for w in self._workers.values() if w.task_id is not None),
+            "pending": len(self._pending),
+        }